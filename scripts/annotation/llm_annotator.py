@@ -0,0 +1,328 @@
+"""
+Anotador LLM junior para el proyecto Nadia.
+
+Etiqueta mensajes con la taxonomía de prompts/llm_annotator_prompt.md y
+propone la respuesta ideal de Nadia. La salida tiene el formato que
+consume LLMAnnotationQualityChecker (scripts/validation/llm_quality_checker.py).
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional
+
+# Agregar el directorio raíz al path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from scripts.llm.batch import BatchJobRunner, BatchProvider
+from scripts.llm.budget import TokenBudget
+from scripts.llm.client import resolve_api_key
+from scripts.llm.router import create_client
+from scripts.llm.streaming import IncrementalJSONParser, annotation_parser
+from scripts.patterns.context import ConversationContext
+from scripts.patterns.corpus import is_nadia
+from scripts.validation.llm_quality_checker import StreamingReview
+from scripts.validation.review_queue import ReviewQueue
+
+REQUIRED_LABELS = ('primary_intent', 'message_tone', 'safety_level')
+
+
+class LLMAnnotator:
+    """
+    Anota mensajes individuales usando el cliente LLM compartido
+    (concurrencia, rate limiting, reintentos y caché de respuestas).
+    """
+
+    STAGE = 'annotation'
+
+    def __init__(self, config: Dict, api_key: Optional[str] = None,
+                 budget: Optional[TokenBudget] = None,
+                 reviewer: Optional[StreamingReview] = None):
+        self.config = config
+        self.api_key = api_key
+        # Revisión incremental: cada anotación válida pasa al reporte a medida que llega
+        self.reviewer = reviewer
+        self.budget = budget if budget is not None else TokenBudget.from_config(config.get('budget'))
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        prompt_path = Path(config.get('prompt_path', 'prompts/llm_annotator_prompt.md'))
+        self.system_prompt = prompt_path.read_text(encoding='utf-8')
+
+        self.stats = {
+            'requested': 0,
+            'annotated': 0,
+            'failed_requests': 0,
+            'invalid_json': 0,
+            'aborted': 0,
+            'budget_rejected': 0,
+        }
+
+    def build_request(self, message: Dict,
+                      context: Optional[ConversationContext] = None) -> Dict:
+        """Arma el request LLM para un mensaje (con el contexto previo acotado, si hay)."""
+        previous = context.render() if context is not None else ''
+        user_prompt = (
+            f"message_id: {message['message_id']}\n"
+            + (f"Contexto previo:\n{previous}\n\n" if previous else '') +
+            f"Mensaje: \"{message['text']}\"\n\n"
+            "Devuelve SOLO el JSON con el formato indicado."
+        )
+        return {
+            'custom_id': str(message['message_id']),
+            'system': self.system_prompt,
+            'messages': [{'role': 'user', 'content': user_prompt}],
+            'max_tokens': self.config.get('max_tokens_per_message', 400),
+            'metadata': {'original_text': message['text']},
+        }
+
+    def build_requests(self, messages: Iterable[Dict]) -> Iterator[Dict]:
+        """
+        Un request por mensaje del usuario: los turnos de Nadia no se anotan,
+        pero con la sección `context` entran en la ventana de turnos
+        anteriores de su conversación. Los mensajes de una conversación
+        llegan contiguos (como los entrega iter_messages).
+        """
+        context_config = self.config.get('context')
+        context, conversation_id = None, object()
+        for message in messages:
+            if message.get('conversation_id') != conversation_id:
+                conversation_id = message.get('conversation_id')
+                context = ConversationContext.from_config(context_config)
+            if not message.get('text'):
+                continue
+            if not is_nadia(message):
+                yield self.build_request(message, context)
+            if context is not None:
+                context.push(message)
+
+    @staticmethod
+    def parse_annotation(text: str, message_id: str,
+                         original_text: str = 'N/A') -> Optional[Dict]:
+        """Extrae y valida el JSON de anotación de la respuesta del modelo."""
+        if not text:
+            return None
+        start, end = text.find('{'), text.rfind('}')
+        if not 0 <= start < end:
+            return None
+        try:
+            data = json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            return None
+        return LLMAnnotator.build_annotation(data, message_id, original_text)
+
+    @staticmethod
+    def build_annotation(data, message_id: str, original_text: str = 'N/A') -> Optional[Dict]:
+        """Valida las etiquetas requeridas y arma el item de salida."""
+        annotations = data.get('annotations') if isinstance(data, dict) else None
+        if not isinstance(annotations, dict) or not all(
+            annotations.get(label) for label in REQUIRED_LABELS
+        ):
+            return None
+
+        return {
+            'message_id': message_id,
+            'original_text': original_text,
+            'annotations': annotations,
+            'ideal_nadia_response': data.get('ideal_nadia_response') or {},
+        }
+
+    def _track(self, requests: Iterable[Dict], metadata_by_id: Dict) -> Iterator[Dict]:
+        for request in requests:
+            metadata_by_id[request['custom_id']] = request['metadata']
+            self.stats['requested'] += 1
+            yield request
+
+    def _write_result(self, result: Dict, metadata_by_id: Dict, f, first: bool,
+                      parser: Optional[IncrementalJSONParser] = None) -> bool:
+        """Escribe un resultado en el arreglo JSON. Devuelve True si escribió."""
+        metadata = metadata_by_id.pop(result['custom_id'], {})
+        if result.get('budget_exceeded'):
+            self.stats['budget_rejected'] += 1
+            return False
+        if result.get('error'):
+            self.stats['failed_requests'] += 1
+            self.logger.error(f"{result['custom_id']}: {result['error']}")
+            return False
+        if result.get('aborted'):
+            self.stats['aborted'] += 1
+            return False
+
+        original_text = metadata.get('original_text', 'N/A')
+        if parser is not None:
+            item = self.build_annotation(parser.records[0], result['custom_id'], original_text)
+        else:
+            item = self.parse_annotation(result['text'], result['custom_id'], original_text)
+        if item is None:
+            self.stats['invalid_json'] += 1
+            self.logger.warning(f"{result['custom_id']}: anotación inválida")
+            return False
+
+        item['_llm'] = {
+            'model': result.get('model'),
+            'usage': result.get('usage'),
+            'cached': result.get('cached', False),
+        }
+        f.write(('' if first else ',\n') + json.dumps(item, ensure_ascii=False))
+        self.stats['annotated'] += 1
+        if self.reviewer is not None:
+            self.reviewer.add(item)
+        return True
+
+    async def annotate_async(self, messages: Iterable[Dict], output_path: Path) -> Dict:
+        """
+        Anota los mensajes y escribe un arreglo JSON de forma incremental
+        (compatible con LLMAnnotationQualityChecker.load_annotations).
+        """
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        metadata_by_id = {}
+        parsers = {}
+
+        # Streaming: se corta la anotación apenas la respuesta ideal cae en
+        # una mención prohibida o el JSON se rompe
+        streaming = self.config.get('streaming') or {}
+        consumer_factory = None
+        if streaming.get('enabled'):
+            def consumer_factory(request):
+                parser = annotation_parser(streaming.get('forbidden_patterns'),
+                                           streaming.get('max_preamble_chars', 200))
+                parsers[request['custom_id']] = parser
+                return parser
+
+        async with create_client(self.config, api_key=self.api_key,
+                                 budget=self.budget, stage=self.STAGE) as client:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write('[\n')
+                first = True
+                requests = self._track(self.build_requests(messages), metadata_by_id)
+                async for result in client.complete_many(requests, consumer_factory):
+                    parser = parsers.pop(result['custom_id'], None)
+                    if self._write_result(result, metadata_by_id, f, first, parser):
+                        first = False
+                f.write('\n]\n')
+
+            client_stats = client.get_stats()
+
+        self.logger.info(
+            f"Anotados {self.stats['annotated']}/{self.stats['requested']} mensajes "
+            f"({client_stats['cache_hits']} desde caché, {self.stats['aborted']} streams abortados)"
+        )
+        return {
+            'output_file': str(output_path),
+            'statistics': dict(self.stats),
+            'client': client_stats,
+            'budget': self.budget.get_report(),
+        }
+
+    def annotate_batch(self, messages: Iterable[Dict], output_path: Path,
+                       batch_provider: Optional[BatchProvider] = None) -> Dict:
+        """Modo batch: un job offline con todos los mensajes, resultados por custom_id."""
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        metadata_by_id = {}
+        runner = BatchJobRunner.from_config(self.config, api_key=self.api_key,
+                                            batch_provider=batch_provider,
+                                            budget=self.budget, stage=self.STAGE)
+
+        with runner, open(output_path, 'w', encoding='utf-8') as f:
+            f.write('[\n')
+            first = True
+            requests = self._track(self.build_requests(messages), metadata_by_id)
+            for result in runner.run(requests, name=output_path.stem):
+                if self._write_result(result, metadata_by_id, f, first):
+                    first = False
+            f.write('\n]\n')
+            batch_stats = runner.get_stats()
+
+        self.logger.info(
+            f"Anotados {self.stats['annotated']}/{self.stats['requested']} mensajes "
+            f"en {batch_stats['jobs']} job(s) batch ({batch_stats['cache_hits']} desde caché)"
+        )
+        return {
+            'output_file': str(output_path),
+            'statistics': dict(self.stats),
+            'client': batch_stats,
+            'budget': self.budget.get_report(),
+        }
+
+    def annotate(self, messages: Iterable[Dict], output_path: Path) -> Dict:
+        """Punto de entrada síncrono (`mode`: interactive | batch)."""
+        if self.config.get('mode', 'interactive') == 'batch':
+            result = self.annotate_batch(messages, output_path)
+        else:
+            result = asyncio.run(self.annotate_async(messages, output_path))
+        if self.reviewer is not None:
+            result['review'] = self.reviewer.finish()
+        return result
+
+
+def iter_messages(path: Path) -> Iterator[Dict]:
+    """
+    Lee mensajes a anotar desde JSON (lista de conversaciones o de mensajes)
+    o JSONL (una conversación por línea, como produce SyntheticGenerator).
+    """
+    def expand(record: Dict) -> Iterator[Dict]:
+        if 'messages' in record:
+            for message in record['messages']:
+                yield {'conversation_id': record.get('conversation_id'), **message}
+        else:
+            yield record
+
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.suffix == '.jsonl':
+            for line in f:
+                if line.strip():
+                    yield from expand(json.loads(line))
+        else:
+            data = json.load(f)
+            for record in (data if isinstance(data, list) else [data]):
+                yield from expand(record)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Anotador LLM para el proyecto Nadia')
+    parser.add_argument('--input', '-i', required=True, help='Mensajes o conversaciones (JSON/JSONL)')
+    parser.add_argument('--output', '-o', default=None, help='Archivo JSON de anotaciones')
+    parser.add_argument('--config', default='config/annotation_config.json')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    output = Path(args.output or
+                  f"data/labeled/llm_annotations_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    review = config.get('review') or {}
+    reviewer = None
+    if review.get('enabled'):
+        queue = ReviewQueue(review['queue_path']) if review.get('queue_path') else None
+        reviewer = StreamingReview(output_dir=review.get('output_dir') or
+                                   output.with_name(f"{output.stem}_review"),
+                                   top_k=review.get('top_k', 200),
+                                   report_every=review.get('report_every'), queue=queue)
+    annotator = LLMAnnotator(config, api_key=resolve_api_key(config['provider'], config.get('api_keys')),
+                             reviewer=reviewer)
+    try:
+        result = annotator.annotate(iter_messages(Path(args.input)), output)
+    finally:
+        if reviewer is not None and reviewer.queue is not None:
+            reviewer.queue.close()
+
+    print(f"✅ Anotaciones guardadas en: {result['output_file']}")
+    print(f"📊 {result['statistics']['annotated']} anotados, "
+          f"{result['statistics']['failed_requests']} fallidos, "
+          f"{result['client']['cache_hits']} desde caché")
+    if result.get('review'):
+        print(f"🔎 {result['review']['messages_needing_review']} para revisión: "
+              f"{result['review']['report_file']}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
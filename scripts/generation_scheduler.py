@@ -0,0 +1,286 @@
+"""
+Planificador de generación guiado por las cuotas de cobertura de la taxonomía
+(docs/SUCCESS_METRICS.MD).
+"""
+
+import logging
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+DIMENSIONS = ['primary_intent', 'safety_level', 'rapport_stage', 'profile_id']
+
+# Niveles de conversación: se cuentan una vez por conversación, no por mensaje
+CONVERSATION_LEVEL_DIMENSIONS = ('profile_id',)
+
+SAFETY_LEVEL_1_PLUS = ['LEVEL_1_FLIRT_SAFE', 'LEVEL_2_BORDERLINE', 'LEVEL_3_INAPPROPRIATE']
+
+# Traducción de docs/SUCCESS_METRICS.MD. `labels` ausente = cada etiqueta por separado.
+# El tope del 40% es por intención: LEVEL_0_SAFE es la mayoría esperada de safety_level
+DEFAULT_QUOTAS = [
+    {'dimension': 'primary_intent', 'max_share': 0.40},
+    {'dimension': 'primary_intent', 'labels': ['OTHER'], 'max_share': 0.05},
+    {'dimension': 'safety_level', 'labels': SAFETY_LEVEL_1_PLUS, 'min_share': 0.05},
+    {'dimension': 'safety_level', 'labels': ['LEVEL_3_INAPPROPRIATE'], 'min_count': 10},
+]
+
+QUOTA_KINDS = ('min_count', 'min_share', 'max_share')
+
+
+def extract_labels(record: Dict, dimensions: Iterable[str] = DIMENSIONS) -> Dict[str, List[str]]:
+    """
+    Etiquetas de una conversación aceptada, por dimensión. Usa las etiquetas
+    por mensaje del usuario si el modelo las devolvió; si no, las etiquetas
+    objetivo con las que se condicionó el prompt (metadata).
+    """
+    metadata = record.get('metadata') or {}
+    user_messages = [m for m in record.get('messages', [])
+                     if isinstance(m, dict) and m.get('author', m.get('role')) in ('user', None)]
+    labels = {}
+    for dimension in dimensions:
+        if dimension in CONVERSATION_LEVEL_DIMENSIONS:
+            value = record.get(dimension) or metadata.get(dimension)
+            labels[dimension] = [value] if value else []
+            continue
+        values = []
+        for message in user_messages:
+            value = message.get(dimension) or (message.get('annotations') or {}).get(dimension)
+            if value:
+                values.append(value)
+        if not values and metadata.get(dimension):
+            values = [metadata[dimension]]
+        labels[dimension] = values
+    return labels
+
+
+class QuotaScheduler:
+    """
+    Elige el siguiente prompt a emitir para cumplir las cuotas con la menor
+    cantidad de llamadas.
+
+    Cada prompt tiene un rendimiento esperado por (dimensión, etiqueta):
+    unidades por request, con un prior tomado de sus etiquetas objetivo
+    (prompt['metadata']) que se corrige con lo observado. Los requests en
+    vuelo se cuentan por su rendimiento esperado para no sobregenerar con
+    concurrencia alta.
+
+    Configuración (sección `synthetic_generation.scheduler`):
+        quotas, dimensions, min_total, prior_weight
+    """
+
+    def __init__(self, prompts: List[Dict], config: Optional[Dict] = None,
+                 max_requests: Optional[int] = None):
+        config = config or {}
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.dimensions = list(config.get('dimensions', DIMENSIONS))
+        self.quotas = list(config.get('quotas', DEFAULT_QUOTAS))
+        self.min_total = int(config.get('min_total', 0))
+        self.prior_weight = float(config.get('prior_weight', 1.0))
+        self.max_requests = max_requests
+
+        for quota in self.quotas:
+            kinds = [kind for kind in QUOTA_KINDS if kind in quota]
+            if len(kinds) != 1:
+                raise ValueError(f"Cuota inválida (debe tener una de {QUOTA_KINDS}): {quota}")
+
+        self.prompts = list(prompts)
+        self.prompt_index = {p.get('prompt_id', f"prompt_{i}"): i for i, p in enumerate(self.prompts)}
+        n_prompts = len(self.prompts)
+
+        self.slots = {}
+        self.counts = np.zeros(0)
+        self.in_flight = np.zeros(0)
+        self.prior = np.zeros((n_prompts, 0))
+        self.observed_units = np.zeros((n_prompts, 0))
+        self.observed_requests = np.zeros(n_prompts)
+        self.issued = np.zeros(n_prompts, dtype=int)
+        self.accepted = 0
+        self.rejected = 0
+        self._quota_rows = None
+
+        for quota in self.quotas:
+            dimensions = self.dimensions if quota['dimension'] == '*' else [quota['dimension']]
+            for dimension in dimensions:
+                for label in quota.get('labels', []):
+                    self._slot(dimension, label)
+        for i, prompt in enumerate(self.prompts):
+            targets = prompt.get('metadata') or {}
+            for dimension in self.dimensions:
+                if targets.get(dimension):
+                    slot = self._slot(dimension, targets[dimension])
+                    self.prior[i, slot] = 1.0
+
+    # --- slots (dimensión, etiqueta) -------------------------------------
+
+    def _slot(self, dimension: str, label: str) -> int:
+        key = (dimension, label)
+        if key not in self.slots:
+            self.slots[key] = len(self.slots)
+            self.counts = np.append(self.counts, 0.0)
+            self.in_flight = np.append(self.in_flight, 0.0)
+            pad = np.zeros((len(self.prompts), 1))
+            self.prior = np.hstack([self.prior, pad])
+            self.observed_units = np.hstack([self.observed_units, pad])
+            self._quota_rows = None
+        return self.slots[key]
+
+    def _build_quota_rows(self) -> None:
+        """
+        Expande las cuotas a filas: pertenencia (R x S), dimensión de cada
+        fila, tipo y valor. Las cuotas sin `labels` generan una fila por
+        etiqueta conocida de la dimensión.
+        """
+        n_slots = len(self.slots)
+        dim_index = {d: k for k, d in enumerate(self.dimensions)}
+        self._slot_dims = np.zeros((n_slots, len(self.dimensions)))
+        for (dimension, _), slot in self.slots.items():
+            if dimension in dim_index:
+                self._slot_dims[slot, dim_index[dimension]] = 1.0
+
+        rows, row_dims, kinds, values = [], [], [], []
+        for quota in self.quotas:
+            kind = next(k for k in QUOTA_KINDS if k in quota)
+            dimensions = self.dimensions if quota['dimension'] == '*' else [quota['dimension']]
+            for dimension in dimensions:
+                if dimension not in dim_index:
+                    continue
+                if quota.get('labels'):
+                    groups = [[self.slots[(dimension, label)] for label in quota['labels']]]
+                else:
+                    groups = [[slot] for (d, _), slot in self.slots.items() if d == dimension]
+                for group in groups:
+                    row = np.zeros(n_slots)
+                    row[group] = 1.0
+                    rows.append(row)
+                    row_dims.append(dim_index[dimension])
+                    kinds.append(QUOTA_KINDS.index(kind))
+                    values.append(float(quota[kind]))
+
+        self._quota_rows = np.array(rows).reshape(len(rows), n_slots)
+        self._row_dims = np.array(row_dims, dtype=int)
+        self._row_kinds = np.array(kinds, dtype=int)
+        self._row_values = np.array(values)
+
+    def _deficit(self, counts: np.ndarray) -> np.ndarray:
+        """
+        Déficit total de cuotas para una o varias distribuciones (N x S):
+        unidades faltantes para mínimos + unidades sobrantes para máximos.
+        """
+        if self._quota_rows is None:
+            self._build_quota_rows()
+        counts = np.atleast_2d(counts)
+        group = counts @ self._quota_rows.T
+        totals = (counts @ self._slot_dims)[:, self._row_dims]
+        target = np.where(self._row_kinds == 0, self._row_values, self._row_values * totals)
+        violation = np.where(self._row_kinds == 2, group - target, target - group)
+        return np.clip(violation, 0, None).sum(axis=1)
+
+    # --- rendimiento esperado y elección ----------------------------------
+
+    def expected_yield(self) -> np.ndarray:
+        """Unidades esperadas por request para cada prompt (P x S)."""
+        weight = self.prior_weight
+        return (weight * self.prior + self.observed_units) / (weight + self.observed_requests)[:, None]
+
+    def satisfied(self) -> bool:
+        total = self.accepted
+        return total >= self.min_total and float(self._deficit(self.counts)[0]) <= 1e-9
+
+    def budget_left(self) -> bool:
+        return self.max_requests is None or int(self.issued.sum()) < self.max_requests
+
+    def should_pause(self) -> bool:
+        """
+        True si no conviene emitir más por ahora: cuotas cumplidas, sin
+        presupuesto, o lo observado más lo esperado en vuelo ya alcanza.
+        """
+        if not self.budget_left() or self.satisfied():
+            return True
+        in_flight_requests = int(self.issued.sum()) - self.accepted - self.rejected
+        projected_total = self.accepted + in_flight_requests
+        return (in_flight_requests > 0 and projected_total >= self.min_total and
+                float(self._deficit(self.counts + self.in_flight)[0]) <= 1e-9)
+
+    def has_work(self) -> bool:
+        return bool(self.prompts) and self.budget_left() and not self.satisfied()
+
+    def next_prompt(self) -> Optional[Dict]:
+        """Prompt que minimiza el déficit esperado tras emitirlo; None si hay que pausar."""
+        if not self.prompts or self.should_pause():
+            return None
+        yields = self.expected_yield()
+        scores = self._deficit(self.counts + self.in_flight + yields)
+        # Desempate: el prompt menos usado (explora plantillas sin historial)
+        choice = int(np.lexsort((self.issued, np.round(scores, 9)))[0])
+        self.issued[choice] += 1
+        self.in_flight += yields[choice]
+        return self.prompts[choice]
+
+    def observe(self, prompt_id: str, record: Optional[Dict]) -> None:
+        """
+        Registra el resultado de un request emitido. `record` None significa
+        que la salida no se aceptó (error, JSON inválido, duplicado, abortada).
+        """
+        i = self.prompt_index.get(prompt_id)
+        if i is None:
+            return
+        self.in_flight = np.clip(self.in_flight - self.expected_yield()[i], 0, None)
+        self.observed_requests[i] += 1
+        if record is None:
+            self.rejected += 1
+        else:
+            self.accepted += 1
+        if self.accepted + self.rejected >= int(self.issued.sum()):
+            # Sin requests en vuelo: descartar el error acumulado de la estimación
+            self.in_flight[:] = 0.0
+        if record is None:
+            return
+
+        for dimension, values in extract_labels(record, self.dimensions).items():
+            for value in values:
+                slot = self._slot(dimension, value)  # puede ampliar los arreglos
+                self.counts[slot] += 1
+                self.observed_units[i, slot] += 1
+
+    # --- reporte ---------------------------------------------------------
+
+    def distribution(self) -> Dict[str, Dict[str, int]]:
+        result = {dimension: {} for dimension in self.dimensions}
+        for (dimension, label), slot in self.slots.items():
+            if self.counts[slot] and dimension in result:
+                result[dimension][label] = int(self.counts[slot])
+        return result
+
+    def quota_status(self) -> List[Dict]:
+        """Estado de cada cuota con su valor actual, para el reporte del pipeline."""
+        distribution = self.distribution()
+        status = []
+        for quota in self.quotas:
+            kind = next(k for k in QUOTA_KINDS if k in quota)
+            dimensions = self.dimensions if quota['dimension'] == '*' else [quota['dimension']]
+            for dimension in dimensions:
+                counts = distribution.get(dimension, {})
+                total = sum(counts.values())
+                groups = ([quota['labels']] if quota.get('labels')
+                          else [[label] for label in counts])
+                for labels in groups:
+                    value = sum(counts.get(label, 0) for label in labels)
+                    if kind != 'min_count':
+                        value = value / total if total else 0.0
+                    met = value >= quota[kind] if kind.startswith('min') else value <= quota[kind]
+                    status.append({'dimension': dimension, 'labels': labels, kind: quota[kind],
+                                   'value': round(value, 4), 'met': bool(met)})
+        return status
+
+    def get_report(self) -> Dict:
+        return {
+            'satisfied': self.satisfied(),
+            'requests_issued': int(self.issued.sum()),
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'requests_by_prompt': {
+                prompt_id: int(self.issued[i]) for prompt_id, i in self.prompt_index.items()
+            },
+            'distribution': self.distribution(),
+            'quotas': self.quota_status(),
+        }
@@ -0,0 +1,498 @@
+"""
+Modo batch offline para generación y anotación masiva (OpenAI, Anthropic
+o un proveedor local basado en archivos).
+"""
+
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import httpx
+
+from scripts.llm.budget import BudgetExceeded, TokenBudget, TokenCounter
+from scripts.llm.cache import ResponseCache
+from scripts.llm.client import LLMClientError
+from scripts.llm.mock_server import CANNED_CONVERSATION, completion_body
+from scripts.llm.providers import ProviderAdapter, get_adapter
+
+BATCH_DEFAULTS = {
+    'provider': None,              # por defecto el mismo proveedor de la etapa
+    'poll_interval_seconds': 30,
+    'max_wait_hours': 24,
+    'max_requests_per_file': 50000,
+    'work_dir': 'outputs/checkpoints/batches',
+}
+
+TERMINAL_STATES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+class BatchProvider(ABC):
+    """Interfaz de un proveedor de jobs batch."""
+
+    name = 'base'
+
+    def format_line(self, custom_id: str, payload: Dict, adapter: ProviderAdapter) -> Dict:
+        """Línea del archivo de entrada para un request."""
+        return {'custom_id': custom_id, 'method': 'POST', 'url': adapter.path, 'body': payload}
+
+    @abstractmethod
+    def submit(self, input_path: Path) -> str:
+        """Envía el archivo y devuelve el id del job."""
+
+    @abstractmethod
+    def status(self, job_id: str) -> str:
+        """Estado normalizado: 'in_progress' o uno de TERMINAL_STATES."""
+
+    @abstractmethod
+    def iter_results(self, job_id: str) -> Iterator[Tuple[str, Optional[Dict], Optional[str]]]:
+        """Itera (custom_id, body de respuesta o None, error o None)."""
+
+    def close(self) -> None:
+        """Libera las conexiones del proveedor."""
+
+
+class OpenAIBatchProvider(BatchProvider):
+    """Batch API de OpenAI: sube el JSONL a /v1/files y crea /v1/batches."""
+
+    name = 'openai'
+
+    def __init__(self, api_key: Optional[str], base_url: Optional[str] = None,
+                 endpoint: str = '/v1/chat/completions', timeout: float = 120.0):
+        self.base_url = (base_url or 'https://api.openai.com').rstrip('/')
+        self.endpoint = endpoint
+        self.http = httpx.Client(
+            timeout=timeout,
+            headers={'Authorization': f"Bearer {api_key}"} if api_key else {}
+        )
+        self._output_files = {}
+
+    def close(self) -> None:
+        self.http.close()
+
+    def submit(self, input_path: Path) -> str:
+        with open(input_path, 'rb') as f:
+            upload = self.http.post(
+                f"{self.base_url}/v1/files",
+                data={'purpose': 'batch'},
+                files={'file': (input_path.name, f, 'application/jsonl')}
+            )
+        upload.raise_for_status()
+        response = self.http.post(f"{self.base_url}/v1/batches", json={
+            'input_file_id': upload.json()['id'],
+            'endpoint': self.endpoint,
+            'completion_window': '24h',
+        })
+        response.raise_for_status()
+        return response.json()['id']
+
+    def status(self, job_id: str) -> str:
+        response = self.http.get(f"{self.base_url}/v1/batches/{job_id}")
+        response.raise_for_status()
+        data = response.json()
+        self._output_files[job_id] = (data.get('output_file_id'), data.get('error_file_id'))
+        state = data.get('status')
+        return state if state in TERMINAL_STATES else 'in_progress'
+
+    def iter_results(self, job_id: str):
+        for file_id in self._output_files.get(job_id, (None, None)):
+            if not file_id:
+                continue
+            with self.http.stream('GET', f"{self.base_url}/v1/files/{file_id}/content") as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if line.strip():
+                        yield parse_openai_result_line(json.loads(line))
+
+
+class AnthropicBatchProvider(BatchProvider):
+    """Message Batches API de Anthropic."""
+
+    name = 'anthropic'
+    api_version = '2023-06-01'
+
+    def __init__(self, api_key: Optional[str], base_url: Optional[str] = None,
+                 timeout: float = 120.0):
+        self.base_url = (base_url or 'https://api.anthropic.com').rstrip('/')
+        headers = {'anthropic-version': self.api_version}
+        if api_key:
+            headers['x-api-key'] = api_key
+        self.http = httpx.Client(timeout=timeout, headers=headers)
+        self._results_urls = {}
+
+    def close(self) -> None:
+        self.http.close()
+
+    def format_line(self, custom_id: str, payload: Dict, adapter: ProviderAdapter) -> Dict:
+        return {'custom_id': custom_id, 'params': payload}
+
+    def submit(self, input_path: Path) -> str:
+        with open(input_path, 'r', encoding='utf-8') as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        response = self.http.post(f"{self.base_url}/v1/messages/batches",
+                                  json={'requests': requests})
+        response.raise_for_status()
+        return response.json()['id']
+
+    def status(self, job_id: str) -> str:
+        response = self.http.get(f"{self.base_url}/v1/messages/batches/{job_id}")
+        response.raise_for_status()
+        data = response.json()
+        self._results_urls[job_id] = data.get('results_url')
+        return 'completed' if data.get('processing_status') == 'ended' else 'in_progress'
+
+    def iter_results(self, job_id: str):
+        url = self._results_urls.get(job_id)
+        if not url:
+            return
+        with self.http.stream('GET', url) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                result = data.get('result') or {}
+                if result.get('type') == 'succeeded':
+                    yield data['custom_id'], result.get('message'), None
+                else:
+                    error = result.get('error') or {}
+                    yield data['custom_id'], None, f"{result.get('type')}: {error.get('message', error)}"
+
+
+class LocalBatchProvider(BatchProvider):
+    """
+    Stand-in local basado en archivos. Procesa el JSONL en un hilo de fondo
+    con `responder(custom_id, body) -> texto` y escribe la salida con el
+    formato de la Batch API de OpenAI. Sirve para probar el flujo completo
+    (escritura, envío, polling y lectura) sin red.
+    """
+
+    name = 'local'
+
+    def __init__(self, work_dir: str = BATCH_DEFAULTS['work_dir'],
+                 responder: Optional[Callable[[str, Dict], str]] = None,
+                 delay_seconds: float = 0.0):
+        self.work_dir = Path(work_dir)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.responder = responder or (
+            lambda custom_id, body: json.dumps(CANNED_CONVERSATION, ensure_ascii=False)
+        )
+        self.delay_seconds = delay_seconds
+        self._threads = {}
+
+    def _output_path(self, job_id: str) -> Path:
+        return self.work_dir / f"{job_id}_output.jsonl"
+
+    def _process(self, job_id: str, input_path: Path) -> None:
+        if self.delay_seconds:
+            time.sleep(self.delay_seconds)
+        partial = self._output_path(job_id).with_suffix('.partial')
+        with open(input_path, 'r', encoding='utf-8') as src, \
+                open(partial, 'w', encoding='utf-8') as dst:
+            for index, line in enumerate(src):
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                try:
+                    text = self.responder(entry['custom_id'], entry['body'])
+                    output = {
+                        'id': f"{job_id}-{index}",
+                        'custom_id': entry['custom_id'],
+                        'response': {
+                            'status_code': 200,
+                            'body': completion_body(entry['url'], entry['body'], text, index),
+                        },
+                        'error': None,
+                    }
+                except Exception as e:
+                    output = {
+                        'id': f"{job_id}-{index}",
+                        'custom_id': entry['custom_id'],
+                        'response': None,
+                        'error': {'message': str(e)},
+                    }
+                dst.write(json.dumps(output, ensure_ascii=False) + '\n')
+        # El rename hace visible la salida completa de forma atómica
+        partial.replace(self._output_path(job_id))
+
+    def submit(self, input_path: Path) -> str:
+        job_id = f"local_batch_{input_path.stem}_{int(time.time() * 1000)}"
+        thread = threading.Thread(target=self._process, args=(job_id, input_path), daemon=True)
+        self._threads[job_id] = thread
+        thread.start()
+        return job_id
+
+    def status(self, job_id: str) -> str:
+        if self._output_path(job_id).exists():
+            return 'completed'
+        thread = self._threads.get(job_id)
+        if thread is not None and not thread.is_alive():
+            return 'failed'
+        return 'in_progress'
+
+    def iter_results(self, job_id: str):
+        with open(self._output_path(job_id), 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield parse_openai_result_line(json.loads(line))
+
+
+def parse_openai_result_line(data: Dict) -> Tuple[str, Optional[Dict], Optional[str]]:
+    """Normaliza una línea de salida con formato OpenAI Batch."""
+    response = data.get('response') or {}
+    if data.get('error') or response.get('status_code', 200) >= 400:
+        error = data.get('error') or response.get('body', {}).get('error') or {}
+        return data['custom_id'], None, str(error.get('message', error))
+    return data['custom_id'], response.get('body'), None
+
+
+def get_batch_provider(name: str, api_key: Optional[str] = None,
+                       base_url: Optional[str] = None,
+                       work_dir: str = BATCH_DEFAULTS['work_dir'],
+                       endpoint: str = '/v1/chat/completions') -> BatchProvider:
+    if name == 'openai':
+        return OpenAIBatchProvider(api_key, base_url, endpoint=endpoint)
+    if name == 'anthropic':
+        return AnthropicBatchProvider(api_key, base_url)
+    if name == 'local':
+        return LocalBatchProvider(work_dir)
+    raise ValueError(f"Proveedor batch no soportado: {name}")
+
+
+class BatchJobRunner:
+    """
+    Orquesta un job batch: escribe el JSONL, lo envía, consulta el estado y
+    entrega resultados normalizados (mismo formato que AsyncLLMClient).
+
+    Los requests ya cacheados no se envían; los resultados nuevos se
+    guardan en la caché al leerlos.
+
+    Con `budget` cada request reserva su peor caso (a precio batch) al
+    entrar al archivo. Si no entra, el archivo en curso se envía antes para
+    liquidar sus reservas; si aun así no entra, la corrida se detiene.
+    """
+
+    def __init__(self, adapter: ProviderAdapter, batch_provider: BatchProvider,
+                 config: Optional[Dict] = None, cache: Optional[ResponseCache] = None,
+                 defaults: Optional[Dict] = None, budget: Optional[TokenBudget] = None,
+                 stage: str = 'llm'):
+        self.adapter = adapter
+        self.batch_provider = batch_provider
+        self.config = {**BATCH_DEFAULTS, **(config or {})}
+        self.defaults = defaults or {}
+        self.cache = cache
+        self.budget = budget
+        self.stage = stage
+        self._owns_cache = False
+        self._owns_provider = False
+        self.token_counter = TokenCounter(adapter.model)
+        self._reservations = {}
+        self.work_dir = Path(self.config['work_dir'])
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.stats = {'submitted': 0, 'succeeded': 0, 'failed': 0, 'cache_hits': 0,
+                      'jobs': 0, 'input_tokens': 0, 'output_tokens': 0, 'budget_rejected': 0}
+
+    @classmethod
+    def from_config(cls, config: Dict, api_key: Optional[str] = None,
+                    batch_provider: Optional[BatchProvider] = None,
+                    budget: Optional[TokenBudget] = None, stage: str = 'llm') -> 'BatchJobRunner':
+        """
+        Construye el runner desde la configuración de una etapa
+        (synthetic_generation o annotation_config) y su subsección `batch`.
+        """
+        batch_config = {**BATCH_DEFAULTS, **config.get('batch', {})}
+        adapter = get_adapter(config.get('provider', 'openai'), config.get('model'),
+                              api_key=api_key, base_url=config.get('api_base_url'))
+        owns_provider = batch_provider is None
+        if owns_provider:
+            batch_provider = get_batch_provider(
+                batch_config.get('provider') or adapter.name, api_key=api_key,
+                base_url=config.get('api_base_url'), work_dir=batch_config['work_dir'],
+                endpoint=adapter.path
+            )
+        runner = cls(adapter, batch_provider, config=batch_config,
+                     cache=ResponseCache.from_config(config.get('cache')), defaults=config,
+                     budget=budget, stage=stage)
+        # Lo que se construyó aquí lo libera close()
+        runner._owns_cache = True
+        runner._owns_provider = owns_provider
+        return runner
+
+    def _prepare(self, request: Dict) -> Dict:
+        prepared = dict(request)
+        prepared.setdefault('temperature', self.defaults.get('temperature'))
+        limit = self.defaults.get('max_tokens_per_conversation')
+        prepared.setdefault('max_tokens', limit)
+        if limit and prepared['max_tokens'] and int(prepared['max_tokens']) > int(limit):
+            prepared['max_tokens'] = int(limit)
+        return prepared
+
+    def _reserve_budget(self, request: Dict) -> Optional[Dict]:
+        """Reserva el peor caso del request; None si hay que liquidar el archivo en curso."""
+        try:
+            return self.budget.reserve(
+                self.stage, request.get('model', self.adapter.model),
+                self.token_counter.count_request(request), int(request.get('max_tokens') or 0),
+                batch=True
+            )
+        except BudgetExceeded:
+            self.stats['budget_rejected'] += 1
+            raise
+
+    def _settle_budget(self, custom_id: str, usage: Optional[Dict]) -> None:
+        reservation = self._reservations.pop(custom_id, None)
+        if reservation is not None:
+            self.budget.settle(reservation, usage)
+
+    def write_batch_file(self, requests: Iterable[Dict], path: Path) -> Dict[str, Optional[str]]:
+        """
+        Escribe el archivo de entrada. Devuelve {custom_id: cache_key} de los
+        requests escritos para poder guardar sus resultados en la caché.
+        """
+        keys = {}
+        with open(path, 'w', encoding='utf-8') as f:
+            for request in requests:
+                line = self.batch_provider.format_line(
+                    request['custom_id'], self.adapter.build_payload(request), self.adapter
+                )
+                f.write(json.dumps(line, ensure_ascii=False) + '\n')
+                keys[request['custom_id']] = request.get('_cache_key')
+        return keys
+
+    def wait(self, job_id: str) -> str:
+        """Consulta el estado hasta que el job termina o se agota max_wait_hours."""
+        deadline = time.monotonic() + float(self.config['max_wait_hours']) * 3600
+        interval = float(self.config['poll_interval_seconds'])
+        while True:
+            state = self.batch_provider.status(job_id)
+            if state in TERMINAL_STATES:
+                return state
+            if time.monotonic() >= deadline:
+                raise LLMClientError(f"Job batch {job_id} sin terminar tras {self.config['max_wait_hours']}h")
+            self.logger.info(f"Job {job_id}: {state}, próxima consulta en {interval:.0f}s")
+            time.sleep(interval)
+
+    def _write_manifest(self, name: str, job_id: str, input_path: Path, count: int,
+                        state: str) -> None:
+        manifest = {
+            'job_id': job_id,
+            'provider': self.batch_provider.name,
+            'input_file': str(input_path),
+            'requests': count,
+            'state': state,
+            'updated_at': datetime.now().isoformat(),
+        }
+        with open(self.work_dir / f"{name}_manifest.json", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+    def _run_chunk(self, name: str, chunk: List[Dict]) -> Iterator[Dict]:
+        input_path = self.work_dir / f"{name}_input.jsonl"
+        cache_keys = self.write_batch_file(chunk, input_path)
+
+        job_id = self.batch_provider.submit(input_path)
+        self.stats['jobs'] += 1
+        self.stats['submitted'] += len(chunk)
+        self._write_manifest(name, job_id, input_path, len(chunk), 'submitted')
+        self.logger.info(f"Job batch {job_id} enviado con {len(chunk)} requests")
+
+        state = self.wait(job_id)
+        self._write_manifest(name, job_id, input_path, len(chunk), state)
+
+        seen = set()
+        for custom_id, body, error in self.batch_provider.iter_results(job_id):
+            seen.add(custom_id)
+            if error or body is None:
+                self.stats['failed'] += 1
+                self._settle_budget(custom_id, None)
+                yield {'custom_id': custom_id, 'text': None, 'error': error or 'sin respuesta'}
+                continue
+
+            text, usage = self.adapter.parse_response(body)
+            self.stats['succeeded'] += 1
+            self.stats['input_tokens'] += usage['input_tokens']
+            self.stats['output_tokens'] += usage['output_tokens']
+            self._settle_budget(custom_id, usage)
+            result = {
+                'custom_id': custom_id, 'text': text, 'usage': usage,
+                'provider': self.adapter.name, 'model': body.get('model') or self.adapter.model,
+                'cached': False,
+            }
+            key = cache_keys.get(custom_id)
+            if self.cache is not None and key is not None:
+                self.cache.put(key, {k: result[k] for k in ('text', 'usage', 'provider', 'model')})
+            yield result
+
+        # Requests que el proveedor no devolvió (job fallido o expirado)
+        for custom_id in cache_keys.keys() - seen:
+            self.stats['failed'] += 1
+            self._settle_budget(custom_id, None)
+            yield {'custom_id': custom_id, 'text': None, 'error': f"job {state}: sin resultado"}
+
+    def run(self, requests: Iterable[Dict], name: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Ejecuta los requests en uno o más jobs (hasta max_requests_per_file
+        por archivo) y entrega los resultados a medida que se leen. Si el
+        presupuesto se agota, el request rechazado vuelve con
+        'budget_exceeded' y no se toman más del iterable.
+        """
+        name = name or f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        max_per_file = int(self.config['max_requests_per_file'])
+        chunk, part = [], 0
+
+        for request in requests:
+            request = self._prepare(request)
+            if self.cache is not None:
+                key, cached = self.cache.lookup(self.adapter.name, self.adapter.model, request)
+                if cached is not None:
+                    self.stats['cache_hits'] += 1
+                    yield {**cached, 'custom_id': request['custom_id'], 'cached': True}
+                    continue
+                request['_cache_key'] = key
+
+            if self.budget is not None:
+                try:
+                    reservation = self._reserve_budget(request)
+                    if reservation is None and chunk:
+                        yield from self._run_chunk(f"{name}_part{part:03d}", chunk)
+                        chunk, part = [], part + 1
+                        reservation = self._reserve_budget(request)
+                    if reservation is None:
+                        # Reservas de otra etapa aún abiertas: no hay nada que liquidar aquí
+                        raise BudgetExceeded('presupuesto reservado por requests en vuelo')
+                except BudgetExceeded as e:
+                    yield {'custom_id': request['custom_id'], 'text': None, 'error': str(e),
+                           'budget_exceeded': True}
+                    break
+                self._reservations[request['custom_id']] = reservation
+
+            chunk.append(request)
+            if len(chunk) >= max_per_file:
+                yield from self._run_chunk(f"{name}_part{part:03d}", chunk)
+                chunk, part = [], part + 1
+
+        if chunk:
+            yield from self._run_chunk(f"{name}_part{part:03d}", chunk)
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        if self.cache is not None:
+            stats['cache'] = self.cache.get_stats()
+        return stats
+
+    def close(self) -> None:
+        if self.cache is not None and self._owns_cache:
+            self.cache.close()
+        if self._owns_provider:
+            self.batch_provider.close()
+
+    def __enter__(self) -> 'BatchJobRunner':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,226 @@
+"""
+Contabilidad de tokens y tope de gasto por corrida del pipeline.
+"""
+
+import logging
+from typing import Dict, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# USD por millón de tokens (entrada, salida). Precios de lista; se pueden
+# sobreescribir o completar con `budget.pricing` en el config
+DEFAULT_PRICING = {
+    'gpt-4': (30.0, 60.0),
+    'gpt-4-turbo': (10.0, 30.0),
+    'gpt-4o': (2.5, 10.0),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-3.5-turbo': (0.50, 1.50),
+    'claude-3-opus': (15.0, 75.0),
+    'claude-3-5-sonnet': (3.0, 15.0),
+    'claude-3-sonnet': (3.0, 15.0),
+    'claude-3-haiku': (0.25, 1.25),
+}
+
+BUDGET_DEFAULTS = {
+    'max_run_tokens': None,
+    'max_run_cost_usd': None,
+    'batch_discount': 0.5,   # los jobs batch cuestan la mitad en ambos proveedores
+    'pricing': {},
+}
+
+# Tokens extra por mensaje en el formato de chat (rol y separadores)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class BudgetExceeded(Exception):
+    """El presupuesto de la corrida no alcanza para el siguiente request."""
+
+
+class TokenCounter:
+    """
+    Conteo local de tokens de un prompt. Usa tiktoken si está instalado
+    (cl100k_base para modelos que no conoce, p.ej. Claude); si no, la
+    aproximación de ~4 caracteres por token.
+    """
+
+    def __init__(self, model: Optional[str] = None):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model or '')
+            except KeyError:
+                self.encoding = tiktoken.get_encoding('cl100k_base')
+        self.method = 'tiktoken' if self.encoding is not None else 'chars/4'
+
+    def count(self, text: Optional[str]) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return max(1, len(text) // 4)
+
+    def count_request(self, request: Dict) -> int:
+        """Tokens de entrada de un request (system + mensajes)."""
+        messages = request.get('messages', [])
+        tokens = self.count(request.get('system'))
+        tokens += sum(self.count(str(m.get('content', ''))) for m in messages)
+        return max(1, tokens + MESSAGE_OVERHEAD_TOKENS * len(messages))
+
+
+def _empty_counters() -> Dict:
+    return {'requests': 0, 'input_tokens': 0, 'output_tokens': 0,
+            'estimated_input_tokens': 0, 'cost_usd': 0.0}
+
+
+class TokenBudget:
+    """
+    Contador de tokens y costo de una corrida, compartido por todas las
+    etapas que llaman a un LLM.
+
+    Args:
+        max_run_tokens: tope de tokens (entrada + salida) de la corrida; None = sin tope
+        max_run_cost_usd: tope de costo en USD; None = sin tope
+        pricing: {modelo: {'input': usd/M, 'output': usd/M}} que completa DEFAULT_PRICING
+        batch_discount: factor de precio para resultados de jobs batch
+    """
+
+    def __init__(self, max_run_tokens: Optional[int] = None,
+                 max_run_cost_usd: Optional[float] = None,
+                 pricing: Optional[Dict] = None, batch_discount: float = 0.5):
+        self.max_run_tokens = max_run_tokens
+        self.max_run_cost_usd = max_run_cost_usd
+        self.batch_discount = batch_discount
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.pricing = dict(DEFAULT_PRICING)
+        for model, prices in (pricing or {}).items():
+            self.pricing[model] = (float(prices['input']), float(prices['output']))
+        self._unpriced = set()
+
+        self.totals = _empty_counters()
+        self.by_stage = {}
+        self.reserved_tokens = 0
+        self.reserved_cost = 0.0
+        self.in_flight = 0
+        self.stop_reason = None
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> 'TokenBudget':
+        """Construye el contador desde la sección `budget` (sin topes si falta)."""
+        config = {**BUDGET_DEFAULTS, **(config or {})}
+        return cls(
+            max_run_tokens=config['max_run_tokens'],
+            max_run_cost_usd=config['max_run_cost_usd'],
+            pricing=config['pricing'],
+            batch_discount=float(config['batch_discount']),
+        )
+
+    @property
+    def stopped(self) -> bool:
+        return self.stop_reason is not None
+
+    def prices(self, model: Optional[str]) -> Tuple[float, float]:
+        """USD por token (entrada, salida); prefijo más largo que coincida con el modelo."""
+        model = model or ''
+        matches = [name for name in self.pricing if model.startswith(name)]
+        if not matches:
+            if model not in self._unpriced:
+                self._unpriced.add(model)
+                self.logger.warning(f"Sin precio para el modelo '{model}': se contabiliza a costo 0")
+            return 0.0, 0.0
+        input_price, output_price = self.pricing[max(matches, key=len)]
+        return input_price / 1e6, output_price / 1e6
+
+    def cost(self, model: Optional[str], input_tokens: int, output_tokens: int,
+             batch: bool = False) -> float:
+        input_price, output_price = self.prices(model)
+        cost = input_tokens * input_price + output_tokens * output_price
+        return cost * self.batch_discount if batch else cost
+
+    def _fits(self, tokens: int, cost: float) -> bool:
+        if self.max_run_tokens is not None and \
+                self.totals['input_tokens'] + self.totals['output_tokens'] + \
+                self.reserved_tokens + tokens > self.max_run_tokens:
+            return False
+        if self.max_run_cost_usd is not None and \
+                self.totals['cost_usd'] + self.reserved_cost + cost > self.max_run_cost_usd:
+            return False
+        return True
+
+    def reserve(self, stage: str, model: Optional[str], input_tokens: int,
+                max_output_tokens: int, batch: bool = False) -> Optional[Dict]:
+        """
+        Reserva el peor caso de un request. Devuelve la reserva, o None si
+        no entra mientras haya requests en vuelo (el llamador espera a que
+        se liquiden y reintenta).
+
+        Raises:
+            BudgetExceeded: no entra ni sin requests en vuelo, o la corrida
+                ya se detuvo
+        """
+        if self.stopped:
+            raise BudgetExceeded(self.stop_reason)
+        tokens = input_tokens + max_output_tokens
+        cost = self.cost(model, input_tokens, max_output_tokens, batch)
+        if not self._fits(tokens, cost):
+            if self.in_flight:
+                return None
+            spent = self.totals['input_tokens'] + self.totals['output_tokens']
+            self.stop_reason = (
+                f"presupuesto agotado en {stage}: {spent} tokens / "
+                f"${self.totals['cost_usd']:.4f} gastados, el siguiente request "
+                f"puede usar hasta {tokens} tokens / ${cost:.4f}"
+            )
+            self.logger.warning(f"Corrida detenida: {self.stop_reason}")
+            raise BudgetExceeded(self.stop_reason)
+
+        self.reserved_tokens += tokens
+        self.reserved_cost += cost
+        self.in_flight += 1
+        return {'stage': stage, 'model': model, 'tokens': tokens, 'cost': cost,
+                'estimated_input_tokens': input_tokens, 'batch': batch}
+
+    def settle(self, reservation: Dict, usage: Optional[Dict] = None) -> None:
+        """Libera la reserva y registra el uso reportado (None si el request falló)."""
+        self.reserved_tokens -= reservation['tokens']
+        self.reserved_cost -= reservation['cost']
+        self.in_flight -= 1
+        if usage is not None:
+            self.record(reservation['stage'], reservation['model'], usage,
+                        batch=reservation['batch'],
+                        estimated_input_tokens=reservation['estimated_input_tokens'])
+
+    def record(self, stage: str, model: Optional[str], usage: Dict, batch: bool = False,
+               estimated_input_tokens: int = 0) -> None:
+        """Suma el uso de un request a los totales de la corrida, la etapa y el modelo."""
+        input_tokens = int(usage.get('input_tokens') or 0)
+        output_tokens = int(usage.get('output_tokens') or 0)
+        cost = self.cost(model, input_tokens, output_tokens, batch)
+        stage_counters = self.by_stage.setdefault(stage, {})
+        for counters in (self.totals, stage_counters.setdefault(model or '?', _empty_counters())):
+            counters['requests'] += 1
+            counters['input_tokens'] += input_tokens
+            counters['output_tokens'] += output_tokens
+            counters['estimated_input_tokens'] += estimated_input_tokens
+            counters['cost_usd'] += cost
+
+    def get_report(self) -> Dict:
+        """Totales y costo de la corrida para el reporte del pipeline."""
+        spent = self.totals['input_tokens'] + self.totals['output_tokens']
+        report = {
+            **self.totals,
+            'total_tokens': spent,
+            'limits': {'max_run_tokens': self.max_run_tokens,
+                       'max_run_cost_usd': self.max_run_cost_usd},
+            'by_stage': self.by_stage,
+            'stopped': self.stopped,
+            'stop_reason': self.stop_reason,
+        }
+        if self.max_run_tokens is not None:
+            report['remaining_tokens'] = max(0, self.max_run_tokens - spent)
+        if self.max_run_cost_usd is not None:
+            report['remaining_cost_usd'] = max(0.0, self.max_run_cost_usd - self.totals['cost_usd'])
+        return report
@@ -0,0 +1,218 @@
+"""
+Caché persistente de respuestas LLM (SQLite), indexada por un hash del
+proveedor, el modelo, los parámetros de generación y el prompt normalizado.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+CACHE_MODES = ('on', 'off', 'deterministic_only')
+
+# Parámetros del request que cambian la salida del modelo
+GENERATION_PARAMS = ('temperature', 'seed', 'max_tokens')
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_prompt(request: Dict) -> str:
+    """Serialización canónica del prompt: espacios colapsados, orden estable."""
+    def clean(text) -> str:
+        return _WHITESPACE.sub(' ', str(text or '')).strip()
+
+    messages = [
+        {'role': m.get('role', 'user'), 'content': clean(m.get('content'))}
+        for m in request.get('messages', [])
+    ]
+    return json.dumps(
+        {'system': clean(request.get('system')), 'messages': messages},
+        ensure_ascii=False, sort_keys=True
+    )
+
+
+def make_cache_key(provider: str, model: str, request: Dict) -> str:
+    """Hash SHA-256 de proveedor, modelo, parámetros de generación y prompt normalizado."""
+    parts = {
+        'provider': provider,
+        'model': request.get('model') or model,
+        'prompt': normalize_prompt(request),
+    }
+    parts.update({param: request.get(param) for param in GENERATION_PARAMS})
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+
+
+class ResponseCache:
+    """
+    Caché de respuestas en SQLite con expiración por TTL y tope de entradas
+    (se desalojan las de acceso más antiguo).
+
+    Args:
+        path: archivo SQLite (por defecto en outputs/checkpoints/)
+        ttl_seconds: antigüedad máxima de una entrada (None = sin TTL)
+        max_entries: número máximo de entradas (None = sin tope)
+        mode: 'on', 'off' o 'deterministic_only' (solo requests con temperatura 0)
+    """
+
+    EVICT_EVERY = 500  # escrituras entre pasadas de desalojo
+
+    def __init__(self, path: str = 'outputs/checkpoints/llm_cache.sqlite',
+                 ttl_seconds: Optional[float] = None,
+                 max_entries: Optional[int] = None,
+                 mode: str = 'on'):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Modo de caché inválido: {mode}. Opciones: {CACHE_MODES}")
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.mode = mode
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'bypassed': 0, 'evicted': 0}
+        self._writes_since_evict = 0
+
+        self.conn = None
+        if self.mode != 'off':
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.conn = sqlite3.connect(str(self.path))
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                ' key TEXT PRIMARY KEY,'
+                ' response TEXT NOT NULL,'
+                ' created_at REAL NOT NULL,'
+                ' last_access REAL NOT NULL,'
+                ' hits INTEGER NOT NULL DEFAULT 0)'
+            )
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)'
+            )
+            self.conn.commit()
+            self.evict()
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> Optional['ResponseCache']:
+        """Construye la caché desde la sección `cache` del config (o None si está apagada)."""
+        if not config or not config.get('enabled', True) or config.get('mode') == 'off':
+            return None
+        ttl_days = config.get('ttl_days')
+        return cls(
+            path=config.get('path', 'outputs/checkpoints/llm_cache.sqlite'),
+            ttl_seconds=ttl_days * 86400 if ttl_days else None,
+            max_entries=config.get('max_entries'),
+            mode=config.get('mode', 'on'),
+        )
+
+    def applies_to(self, request: Dict) -> bool:
+        """Indica si el request participa de la caché según el modo."""
+        if self.mode == 'off':
+            return False
+        if self.mode == 'deterministic_only':
+            return not (request.get('temperature') or 0) > 0
+        return True
+
+    def get(self, key: str) -> Optional[Dict]:
+        if self.conn is None:
+            return None
+        row = self.conn.execute(
+            'SELECT response, created_at FROM responses WHERE key = ?', (key,)
+        ).fetchone()
+        now = time.time()
+        if row is None or (self.ttl_seconds and now - row[1] > self.ttl_seconds):
+            self.stats['misses'] += 1
+            return None
+
+        self.conn.execute(
+            'UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?', (now, key)
+        )
+        self.conn.commit()
+        self.stats['hits'] += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, response: Dict) -> None:
+        if self.conn is None:
+            return
+        now = time.time()
+        self.conn.execute(
+            'INSERT OR REPLACE INTO responses (key, response, created_at, last_access, hits) '
+            'VALUES (?, ?, ?, ?, 0)',
+            (key, json.dumps(response, ensure_ascii=False), now, now)
+        )
+        self.conn.commit()
+        self.stats['writes'] += 1
+
+        self._writes_since_evict += 1
+        if self._writes_since_evict >= self.EVICT_EVERY:
+            self.evict()
+
+    def lookup(self, provider: str, model: str, request: Dict):
+        """
+        Devuelve (key, respuesta_cacheada). key es None si el request no
+        participa de la caché (modo off o temperatura > 0 en deterministic_only).
+        """
+        if not self.applies_to(request):
+            self.stats['bypassed'] += 1
+            return None, None
+        key = make_cache_key(provider, model, request)
+        return key, self.get(key)
+
+    def evict(self) -> int:
+        """Elimina entradas expiradas y, si hace falta, las menos usadas recientemente."""
+        if self.conn is None:
+            return 0
+        self._writes_since_evict = 0
+        removed = 0
+
+        if self.ttl_seconds:
+            cursor = self.conn.execute(
+                'DELETE FROM responses WHERE created_at < ?', (time.time() - self.ttl_seconds,)
+            )
+            removed += cursor.rowcount
+
+        if self.max_entries:
+            count = self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            excess = count - self.max_entries
+            if excess > 0:
+                cursor = self.conn.execute(
+                    'DELETE FROM responses WHERE key IN ('
+                    ' SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)',
+                    (excess,)
+                )
+                removed += cursor.rowcount
+
+        self.conn.commit()
+        if removed:
+            self.stats['evicted'] += removed
+            self.logger.info(f"Caché LLM: {removed} entradas desalojadas")
+        return removed
+
+    def get_stats(self) -> Dict:
+        """Estadísticas de la sesión más el tamaño actual de la caché."""
+        stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['mode'] = self.mode
+        if self.conn is not None:
+            entries, lifetime_hits = self.conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM responses'
+            ).fetchone()
+            stats['entries'] = entries
+            stats['lifetime_hits'] = lifetime_hits
+        return stats
+
+    def clear(self) -> None:
+        if self.conn is not None:
+            self.conn.execute('DELETE FROM responses')
+            self.conn.commit()
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
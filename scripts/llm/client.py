@@ -0,0 +1,552 @@
+"""
+Cliente LLM asíncrono con concurrencia acotada, rate limiting y reintentos.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Dict, Iterable, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from scripts.llm.budget import BudgetExceeded, TokenBudget, TokenCounter
+from scripts.llm.cache import ResponseCache
+from scripts.llm.providers import RETRYABLE_STATUS_CODES, get_adapter
+from scripts.llm.rate_limiter import RateLimiter
+from scripts.llm.streaming import StreamAbort
+
+DEFAULTS = {
+    'max_concurrency': 8,
+    'requests_per_minute': 500,
+    'tokens_per_minute': 150000,
+    'retry_attempts': 3,
+    'backoff_base_seconds': 1.0,
+    'backoff_max_seconds': 60.0,
+    'timeout_seconds': 120.0,
+}
+
+API_KEY_ENV_VARS = {
+    'openai': 'OPENAI_API_KEY',
+    'anthropic': 'ANTHROPIC_API_KEY',
+}
+
+
+class LLMClientError(Exception):
+    """Error definitivo de una llamada LLM (sin reintentos restantes o no reintentable)."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None,
+                 attempts: int = 0):
+        super().__init__(message)
+        self.status_code = status_code
+        self.attempts = attempts
+
+
+class RetryableError(LLMClientError):
+    """Error transitorio: 429, 5xx, timeouts o fallos de conexión."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message, status_code)
+        self.retry_after = retry_after
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación rápida: ~4 caracteres por token."""
+    return max(1, len(text) // 4)
+
+
+def estimate_request_tokens(request: Dict) -> int:
+    """Tokens de prompt estimados más el máximo de salida solicitado."""
+    prompt_chars = len(request.get('system') or '')
+    prompt_chars += sum(len(m.get('content', '')) for m in request.get('messages', []))
+    return max(1, prompt_chars // 4) + int(request.get('max_tokens') or 0)
+
+
+def resolve_api_key(provider: str, api_keys: Optional[Dict] = None) -> Optional[str]:
+    """Toma la key del config (si no es el placeholder) o de la variable de entorno."""
+    key = (api_keys or {}).get(provider)
+    if key and not key.startswith('YOUR_'):
+        return key
+    return os.environ.get(API_KEY_ENV_VARS.get(provider, ''))
+
+
+class AsyncLLMClient:
+    """
+    Cliente asíncrono para un proveedor LLM.
+
+    Configuración (sección `synthetic_generation` o equivalente):
+        provider, model, temperature, max_tokens_per_conversation,
+        retry_attempts, max_concurrency, requests_per_minute,
+        tokens_per_minute, backoff_base_seconds, backoff_max_seconds,
+        timeout_seconds, api_base_url, cache
+
+    Con `budget` (compartido por las etapas de una corrida) cada request
+    reserva su peor caso antes de enviarse y registra el uso reportado al
+    terminar; `stage` es la etiqueta con la que se contabiliza.
+    """
+
+    def __init__(self, config: Dict, api_key: Optional[str] = None,
+                 http_client: Optional[httpx.AsyncClient] = None,
+                 cache: Optional[ResponseCache] = None,
+                 budget: Optional[TokenBudget] = None, stage: str = 'llm'):
+        self.config = {**DEFAULTS, **config}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.provider = self.config.get('provider', 'openai')
+        self.model = self.config.get('model')
+        self.adapter = get_adapter(
+            self.provider, self.model, api_key=api_key,
+            base_url=self.config.get('api_base_url')
+        )
+
+        self.max_concurrency = int(self.config['max_concurrency'])
+        self.retry_attempts = int(self.config['retry_attempts'])
+        self.backoff_base = float(self.config['backoff_base_seconds'])
+        self.backoff_max = float(self.config['backoff_max_seconds'])
+
+        self.rate_limiter = RateLimiter(
+            requests_per_minute=self.config.get('requests_per_minute'),
+            tokens_per_minute=self.config.get('tokens_per_minute'),
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._http = http_client
+        self._owns_http = http_client is None
+
+        # La caché va delante de toda llamada; si no se inyecta se arma desde el config
+        self.cache = cache if cache is not None else ResponseCache.from_config(self.config.get('cache'))
+        self._owns_cache = cache is None
+
+        self.budget = budget
+        self.stage = stage
+        self.token_counter = TokenCounter(self.model)
+        self._budget_released = asyncio.Event()
+
+        self.stats = {
+            'requests': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'attempts': 0,
+            'retries': 0,
+            'rate_limited': 0,
+            'input_tokens': 0,
+            'output_tokens': 0,
+            'rate_limit_wait_seconds': 0.0,
+            'cache_hits': 0,
+            'streamed': 0,
+            'aborted': 0,
+            'budget_waits': 0,
+            'budget_rejected': 0,
+        }
+        self._started_at = None
+        self._finished_at = None
+        # Latencia de punta a punta por request (con reintentos y esperas)
+        self._latencies = deque(maxlen=100000)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _get_http(self) -> httpx.AsyncClient:
+        if self._http is None:
+            limits = httpx.Limits(max_connections=self.max_concurrency,
+                                  max_keepalive_connections=self.max_concurrency)
+            self._http = httpx.AsyncClient(
+                timeout=float(self.config['timeout_seconds']), limits=limits
+            )
+        return self._http
+
+    async def close(self) -> None:
+        if self._http is not None and self._owns_http:
+            await self._http.aclose()
+            self._http = None
+        if self.cache is not None and self._owns_cache:
+            self.cache.close()
+            self.cache = None
+
+    def _prepare(self, request: Dict) -> Dict:
+        """Completa el request con los valores por defecto del config."""
+        prepared = dict(request)
+        prepared.setdefault('temperature', self.config.get('temperature'))
+        limit = self.config.get('max_tokens_per_conversation')
+        prepared.setdefault('max_tokens', limit)
+        if limit and prepared['max_tokens'] and int(prepared['max_tokens']) > int(limit):
+            prepared['max_tokens'] = int(limit)
+        if self.config.get('seed') is not None:
+            prepared.setdefault('seed', self.config['seed'])
+        return prepared
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Backoff exponencial con "full jitter": uniforme en [0, base * 2^attempt],
+        acotado por backoff_max. Si el proveedor envía Retry-After se respeta
+        como mínimo.
+        """
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    @staticmethod
+    def _raise_for_status(response: httpx.Response) -> None:
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            retry_after = response.headers.get('retry-after')
+            try:
+                retry_after = float(retry_after) if retry_after is not None else None
+            except ValueError:
+                retry_after = None
+            raise RetryableError(
+                f"HTTP {response.status_code}: {response.text[:200]}",
+                status_code=response.status_code, retry_after=retry_after
+            )
+        if response.status_code >= 400:
+            raise LLMClientError(
+                f"HTTP {response.status_code}: {response.text[:200]}",
+                status_code=response.status_code
+            )
+
+    async def _send(self, request: Dict) -> Dict:
+        """Un único intento HTTP. Lanza RetryableError o LLMClientError."""
+        payload = self.adapter.build_payload(request)
+        try:
+            response = await self._get_http().post(
+                self.adapter.url, json=payload, headers=self.adapter.build_headers()
+            )
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            raise RetryableError(f"Error de transporte: {type(e).__name__}: {e}")
+
+        self._raise_for_status(response)
+        try:
+            return response.json()
+        except json.JSONDecodeError as e:
+            raise RetryableError(f"Respuesta no es JSON válido: {e}")
+
+    async def _send_stream(self, request: Dict, consumer, keep_text: bool) -> Tuple[Optional[str], Dict]:
+        """
+        Un intento en modo streaming (SSE). Cada fragmento de texto pasa al
+        consumidor apenas llega; si éste lanza StreamAbort se sale del
+        contexto del stream, lo que cierra la conexión y corta la generación.
+        """
+        payload = self.adapter.build_stream_payload(request)
+        usage = {'input_tokens': 0, 'output_tokens': 0}
+        parts = [] if keep_text else None
+        received = 0
+        consumer.reset()
+
+        try:
+            async with self._get_http().stream(
+                'POST', self.adapter.url, json=payload, headers=self.adapter.build_headers()
+            ) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    self._raise_for_status(response)
+
+                async for line in response.aiter_lines():
+                    if not line.startswith('data:'):
+                        continue
+                    data = line[5:].strip()
+                    if data == '[DONE]':
+                        break
+                    try:
+                        event = json.loads(data)
+                    except json.JSONDecodeError as e:
+                        raise RetryableError(f"Evento SSE no es JSON válido: {e}")
+                    if event.get('type') == 'error' or 'error' in event:
+                        raise RetryableError(f"Error en el stream: {str(event.get('error'))[:200]}")
+
+                    delta, event_usage = self.adapter.parse_stream_event(event)
+                    usage.update(event_usage)
+                    if not delta:
+                        continue
+                    received += len(delta)
+                    if parts is not None:
+                        parts.append(delta)
+                    try:
+                        consumer.feed(delta)
+                    except StreamAbort as e:
+                        # Sin usage final del proveedor: estimar lo recibido hasta el corte
+                        e.usage = {**usage, 'output_tokens': max(usage['output_tokens'],
+                                                                 received // 4)}
+                        raise
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            raise RetryableError(f"Error de transporte: {type(e).__name__}: {e}")
+
+        try:
+            consumer.close()
+        except StreamAbort as e:
+            e.usage = usage
+            raise
+        return (''.join(parts) if parts is not None else None), usage
+
+    async def _reserve_budget(self, request: Dict) -> Optional[Dict]:
+        """
+        Reserva el peor caso del request en el presupuesto de la corrida,
+        esperando a que se liquiden requests en vuelo si hace falta.
+        Lanza BudgetExceeded si la corrida ya no puede continuar.
+        """
+        if self.budget is None:
+            return None
+        input_tokens = self.token_counter.count_request(request)
+        max_output = int(request.get('max_tokens') or 0)
+        while True:
+            self._budget_released.clear()
+            try:
+                reservation = self.budget.reserve(self.stage, request.get('model', self.model),
+                                                  input_tokens, max_output)
+            except BudgetExceeded:
+                self.stats['budget_rejected'] += 1
+                raise
+            if reservation is not None:
+                return reservation
+            self.stats['budget_waits'] += 1
+            await self._budget_released.wait()
+
+    def _finish_request(self, started: float, reservation: Optional[Dict],
+                        usage: Optional[Dict]) -> None:
+        """Cierre común de un request enviado: latencia, reloj y presupuesto."""
+        self._finished_at = time.monotonic()
+        self._latencies.append(self._finished_at - started)
+        if reservation is not None:
+            self.budget.settle(reservation, usage)
+            self._budget_released.set()
+
+    async def complete(self, request: Dict) -> Dict:
+        """
+        Ejecuta un request con caché, rate limiting y reintentos.
+
+        Returns:
+            {'custom_id', 'text', 'usage', 'provider', 'model',
+             'attempts', 'latency_seconds', 'cached'}
+        """
+        return await self._execute(request)
+
+    async def stream(self, request: Dict, consumer) -> Dict:
+        """
+        Igual que complete() pero en streaming: el texto se entrega al
+        consumidor (ver scripts/llm/streaming.py) a medida que llega y no se
+        acumula salvo para la caché. Si el consumidor aborta, el resultado
+        lleva 'aborted' con el motivo y 'text' en None.
+        """
+        return await self._execute(request, consumer)
+
+    def _aborted_result(self, request: Dict, error: StreamAbort, attempts: int,
+                        cached: bool) -> Dict:
+        self.stats['aborted'] += 1
+        self.logger.info(f"{request.get('custom_id', '?')}: stream abortado - {error}")
+        return {
+            'custom_id': request.get('custom_id'),
+            'text': None,
+            'aborted': error.reason,
+            'usage': getattr(error, 'usage', None) or {'input_tokens': 0, 'output_tokens': 0},
+            'provider': self.provider,
+            'model': request.get('model', self.model),
+            'attempts': attempts,
+            'cached': cached,
+            'metadata': request.get('metadata', {}),
+        }
+
+    async def _execute(self, request: Dict, consumer=None) -> Dict:
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+        request = self._prepare(request)
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key, cached = self.cache.lookup(self.provider, self.model, request)
+            if cached is not None:
+                self.stats['cache_hits'] += 1
+                if consumer is not None:
+                    # Misma validación que en vivo, con el texto completo de una vez
+                    try:
+                        consumer.reset()
+                        consumer.feed(cached['text'] or '')
+                        consumer.close()
+                    except StreamAbort as e:
+                        return self._aborted_result(request, e, attempts=0, cached=True)
+                return {
+                    **cached,
+                    'custom_id': request.get('custom_id'),
+                    'attempts': 0,
+                    'latency_seconds': 0.0,
+                    'cached': True,
+                }
+
+        request_started = time.monotonic()
+        reservation = await self._reserve_budget(request)
+        estimated = self.rate_limiter.reservation(estimate_request_tokens(request))
+        self.stats['requests'] += 1
+
+        async with self._semaphore:
+            last_error = None
+            for attempt in range(self.retry_attempts + 1):
+                waited = await self.rate_limiter.acquire(estimated)
+                self.stats['rate_limit_wait_seconds'] += waited
+                self.stats['attempts'] += 1
+                if attempt > 0:
+                    self.stats['retries'] += 1
+
+                started = time.monotonic()
+                try:
+                    if consumer is None:
+                        text, usage = self.adapter.parse_response(await self._send(request))
+                    else:
+                        self.stats['streamed'] += 1
+                        text, usage = await self._send_stream(request, consumer,
+                                                              keep_text=cache_key is not None)
+                except StreamAbort as e:
+                    self.rate_limiter.settle(estimated, e.usage['input_tokens'] + e.usage['output_tokens'])
+                    self.stats['input_tokens'] += e.usage['input_tokens']
+                    self.stats['output_tokens'] += e.usage['output_tokens']
+                    self._finish_request(request_started, reservation, e.usage)
+                    return self._aborted_result(request, e, attempts=attempt + 1, cached=False)
+                except RetryableError as e:
+                    last_error = e
+                    # El request no consumió tokens: devolver la estimación
+                    self.rate_limiter.settle(estimated, 0)
+                    if e.status_code == 429:
+                        self.stats['rate_limited'] += 1
+                    if attempt >= self.retry_attempts:
+                        break
+                    delay = self.backoff_delay(attempt, e.retry_after)
+                    self.logger.warning(
+                        f"{request.get('custom_id', '?')}: {e} - reintento "
+                        f"{attempt + 1}/{self.retry_attempts} en {delay:.2f}s"
+                    )
+                    await asyncio.sleep(delay)
+                    continue
+                except LLMClientError as e:
+                    self.stats['failed'] += 1
+                    self._finish_request(request_started, reservation, None)
+                    e.attempts = attempt + 1
+                    raise
+
+                actual = usage['input_tokens'] + usage['output_tokens']
+                if actual:
+                    self.rate_limiter.settle(estimated, actual)
+
+                self.stats['succeeded'] += 1
+                self.stats['input_tokens'] += usage['input_tokens']
+                self.stats['output_tokens'] += usage['output_tokens']
+                self._finish_request(request_started, reservation, usage)
+
+                result = {
+                    'custom_id': request.get('custom_id'),
+                    'text': text,
+                    'usage': usage,
+                    'provider': self.provider,
+                    'model': request.get('model', self.model),
+                    'attempts': attempt + 1,
+                    'latency_seconds': time.monotonic() - started,
+                    'cached': False,
+                }
+                if cache_key is not None:
+                    self.cache.put(cache_key, {
+                        'text': text, 'usage': usage,
+                        'provider': result['provider'], 'model': result['model'],
+                    })
+                return result
+
+        self.stats['failed'] += 1
+        self._finish_request(request_started, reservation, None)
+        raise LLMClientError(
+            f"{request.get('custom_id', '?')}: agotados {self.retry_attempts} reintentos "
+            f"({last_error})",
+            status_code=getattr(last_error, 'status_code', None),
+            attempts=self.retry_attempts + 1
+        )
+
+    async def _complete_safe(self, request: Dict, consumer=None) -> Dict:
+        try:
+            return await self._execute(request, consumer)
+        except BudgetExceeded as e:
+            return {
+                'custom_id': request.get('custom_id'),
+                'text': None,
+                'error': str(e),
+                'budget_exceeded': True,
+                'attempts': 0,
+                'metadata': request.get('metadata', {}),
+            }
+        except LLMClientError as e:
+            return {
+                'custom_id': request.get('custom_id'),
+                'text': None,
+                'error': str(e),
+                'status_code': e.status_code,
+                'attempts': e.attempts,
+                'metadata': request.get('metadata', {}),
+            }
+
+    async def complete_many(self, requests: Iterable[Dict],
+                            consumer_factory: Optional[Callable[[Dict], object]] = None
+                            ) -> AsyncIterator[Dict]:
+        """
+        Procesa requests en paralelo (hasta max_concurrency en vuelo) y
+        entrega resultados a medida que terminan. El iterable se consume de
+        forma perezosa, así que puede ser un generador de 100k requests sin
+        materializarlo en memoria. Los errores definitivos se entregan como
+        resultados con la clave 'error'. Si el presupuesto de la corrida se
+        agota no se toman más requests del iterable.
+
+        Con `consumer_factory(request)` cada request va en streaming hacia el
+        consumidor que devuelve la factory (ver stream()).
+        """
+        iterator = iter(requests)
+        pending = set()
+        exhausted = False
+
+        def fill():
+            nonlocal exhausted
+            while not exhausted and len(pending) < self.max_concurrency:
+                if self.budget is not None and self.budget.stopped:
+                    exhausted = True
+                    return
+                try:
+                    request = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    return
+                consumer = consumer_factory(request) if consumer_factory else None
+                pending.add(asyncio.ensure_future(self._complete_safe(request, consumer)))
+
+        fill()
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                pending.discard(task)
+            fill()
+            for task in done:
+                yield task.result()
+
+    def get_stats(self) -> Dict:
+        """Métricas acumuladas, incluyendo throughput real vs límites configurados."""
+        stats = dict(self.stats)
+        elapsed = 0.0
+        if self._started_at is not None and self._finished_at is not None:
+            elapsed = self._finished_at - self._started_at
+        stats['elapsed_seconds'] = elapsed
+        if elapsed > 0:
+            stats['achieved_requests_per_minute'] = self.stats['attempts'] / elapsed * 60
+            stats['achieved_tokens_per_minute'] = (
+                (self.stats['input_tokens'] + self.stats['output_tokens']) / elapsed * 60
+            )
+        stats['configured_requests_per_minute'] = self.config.get('requests_per_minute')
+        stats['configured_tokens_per_minute'] = self.config.get('tokens_per_minute')
+        stats['retry_amplification'] = (
+            self.stats['attempts'] / self.stats['requests'] if self.stats['requests'] else 0.0
+        )
+        if self._latencies:
+            p50, p95, p99 = np.percentile(np.fromiter(self._latencies, dtype=float), [50, 95, 99])
+            stats.update({'latency_p50': float(p50), 'latency_p95': float(p95),
+                          'latency_p99': float(p99)})
+        if self.cache is not None:
+            stats['cache'] = self.cache.get_stats()
+        return stats
+
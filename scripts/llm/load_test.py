@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de las etapas LLM contra el servidor simulado.
+
+Uso:
+    python scripts/llm/load_test.py --stage generation --requests 500 \\
+        --concurrency 8,32 --latency-p50 0.8 --latency-p95 3 --rate-limit-rate 0.05
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+# Agregar el directorio raíz al path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from scripts.annotation.llm_annotator import LLMAnnotator
+from scripts.llm.mock_server import MockLLMServer, add_server_arguments, server_options
+from scripts.synthetic_generator import SyntheticGenerator
+
+STAGES = ('generation', 'annotation')
+
+# Sin límites del lado del cliente ni filtros aguas abajo: se mide la etapa
+# contra el proveedor. Todo se puede sobreescribir con `config_overrides`.
+LOAD_TEST_DEFAULTS = {
+    'provider': 'openai',
+    'model': 'gpt-4',
+    'temperature': 0.8,
+    'max_tokens_per_conversation': 800,
+    'retry_attempts': 3,
+    'requests_per_minute': None,
+    'tokens_per_minute': None,
+    'backoff_base_seconds': 0.05,
+    'backoff_max_seconds': 2.0,
+    'timeout_seconds': 60,
+    'cache': {'enabled': False},
+    'near_duplicates': {'enabled': False},
+    'streaming': {'enabled': False},
+}
+
+ANNOTATION_PROMPT = Path(__file__).parent.parent.parent / 'prompts' / 'llm_annotator_prompt.md'
+
+
+def load_test_messages(n: int) -> Iterator[Dict]:
+    """Mensajes de usuario para la etapa de anotación."""
+    texts = ['Hola, ¿cómo estás?', '¿Cuánto cuesta tu contenido?', 'Me encantas',
+             'No sé si confiar en esto', 'Me voy a dormir, chao']
+    for i in range(n):
+        yield {'message_id': f"lt-{i:06d}", 'text': f"{texts[i % len(texts)]} #{i}"}
+
+
+def stage_config(stage: str, base_url: str, concurrency: int,
+                 overrides: Optional[Dict] = None) -> Dict:
+    config = {**LOAD_TEST_DEFAULTS, 'api_base_url': base_url, 'max_concurrency': concurrency}
+    if stage == 'annotation':
+        config['prompt_path'] = str(ANNOTATION_PROMPT)
+    config.update(overrides or {})
+    return config
+
+
+def run_stage(stage: str, config: Dict, n_requests: int, work_dir: Path) -> Dict:
+    """Corre la etapa y devuelve su resultado (statistics + client)."""
+    if stage == 'generation':
+        config = {**config, 'n_conversations_to_generate': n_requests}
+        prompts = [{'prompt_id': f"load-{i}", 'user': f"Genera la conversación de carga {i}"}
+                   for i in range(min(n_requests, 50))]
+        return SyntheticGenerator(config, output_dir=str(work_dir)).generate(
+            prompts, work_dir / 'synthetic.jsonl')
+    return LLMAnnotator(config).annotate(load_test_messages(n_requests),
+                                         work_dir / 'annotations.json')
+
+
+def run_load_test(stage: str = 'generation', n_requests: int = 200, concurrency: int = 16,
+                  server: Optional[Dict] = None,
+                  config_overrides: Optional[Dict] = None) -> Dict:
+    """
+    Una corrida: levanta el servidor simulado con `server` (kwargs de
+    MockLLMServer), ejecuta la etapa con `n_requests` a `concurrency` y
+    devuelve las métricas.
+    """
+    if stage not in STAGES:
+        raise ValueError(f"Etapa desconocida: {stage}. Opciones: {STAGES}")
+    server_kwargs = {'varied_payloads': True, **(server or {})}
+
+    with MockLLMServer(**server_kwargs) as mock, \
+            tempfile.TemporaryDirectory(prefix='load_test_') as work_dir:
+        config = stage_config(stage, mock.base_url, concurrency, config_overrides)
+        started = time.monotonic()
+        result = run_stage(stage, config, n_requests, Path(work_dir))
+        wall_seconds = time.monotonic() - started
+        server_stats = dict(mock.stats)
+
+    client = result['client']
+    statistics = result['statistics']
+    completed = statistics.get('generated', statistics.get('annotated', 0))
+    tokens = client['input_tokens'] + client['output_tokens']
+    return {
+        'stage': stage,
+        'concurrency': concurrency,
+        'requests': n_requests,
+        'completed': completed,
+        'failed': statistics['failed_requests'],
+        'wall_seconds': wall_seconds,
+        'throughput_per_second': completed / wall_seconds if wall_seconds else 0.0,
+        'tokens_per_minute': tokens / wall_seconds * 60 if wall_seconds else 0.0,
+        'latency_p50': client.get('latency_p50'),
+        'latency_p95': client.get('latency_p95'),
+        'latency_p99': client.get('latency_p99'),
+        'retry_amplification': client['retry_amplification'],
+        'retries': client['retries'],
+        'rate_limited': client['rate_limited'],
+        'server_errors': server_stats['errors'],
+        'server_max_in_flight': server_stats['max_in_flight'],
+    }
+
+
+def format_reports(reports: List[Dict]) -> str:
+    """Tabla de texto con una fila por corrida."""
+    columns = [('stage', 'etapa', '{}'), ('concurrency', 'conc', '{}'),
+               ('completed', 'ok', '{}'), ('failed', 'fallas', '{}'),
+               ('throughput_per_second', 'req/s', '{:.1f}'),
+               ('latency_p50', 'p50 s', '{:.3f}'), ('latency_p95', 'p95 s', '{:.3f}'),
+               ('latency_p99', 'p99 s', '{:.3f}'),
+               ('retry_amplification', 'ampl.', '{:.2f}'),
+               ('server_max_in_flight', 'en vuelo', '{}')]
+    rows = [[title for _, title, _ in columns]]
+    for report in reports:
+        rows.append([fmt.format(report[key]) if report[key] is not None else '-'
+                     for key, _, fmt in columns])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return '\n'.join('  '.join(cell.rjust(width) for cell, width in zip(row, widths))
+                     for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga de las etapas LLM (sin red)')
+    parser.add_argument('--stage', choices=STAGES, default='generation')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', default='16',
+                        help='Una o más concurrencias objetivo separadas por coma')
+    parser.add_argument('--stream', action='store_true', help='Usar streaming')
+    parser.add_argument('--retry-attempts', type=int, default=LOAD_TEST_DEFAULTS['retry_attempts'])
+    parser.add_argument('--requests-per-minute', type=int, default=None)
+    parser.add_argument('--output', '-o', default=None, help='Guardar el reporte en JSON')
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    overrides = {'retry_attempts': args.retry_attempts,
+                 'requests_per_minute': args.requests_per_minute,
+                 'streaming': {'enabled': args.stream}}
+    # Respuestas siempre variadas: el payload fijo no pasa los filtros de las etapas
+    server = {**server_options(args), 'varied_payloads': True}
+    reports = []
+    for concurrency in (int(c) for c in args.concurrency.split(',')):
+        print(f"⏱️  {args.stage}: {args.requests} requests a concurrencia {concurrency}...")
+        reports.append(run_load_test(args.stage, args.requests, concurrency,
+                                     server=server, config_overrides=overrides))
+
+    print()
+    print(format_reports(reports))
+
+    if args.output:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump({'generated_at': datetime.now().isoformat(), 'runs': reports}, f, indent=2)
+        print(f"\n📄 Reporte: {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Servidor LLM simulado (formas OpenAI y Anthropic) para pruebas locales, con
+latencia y errores 429/500 configurables.
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+CANNED_CONVERSATION = {
+    'messages': [
+        {'author': 'user', 'text': 'Hola, ¿cómo estás?'},
+        {'author': 'nadia', 'text': '¡Hola! Muy bien, ¿y tú? 😊'},
+        {'author': 'user', 'text': 'Bien, aquí descansando del trabajo'},
+        {'author': 'nadia', 'text': 'Qué bueno, ¿a qué te dedicas?'},
+    ]
+}
+
+
+CANNED_ANNOTATION = {
+    'annotations': {
+        'primary_intent': 'SMALL_TALK',
+        'message_tone': 'FRIENDLY',
+        'safety_level': 'LEVEL_0_SAFE',
+        'confidence': 0.9,
+        'reasoning': 'Conversación casual sin intención transaccional',
+    },
+    'ideal_nadia_response': {
+        'text': 'Jaja qué lindo, cuéntame más de tu día 😊',
+        'strategy': 'Mantener la conversación ligera y personal',
+    },
+}
+
+# Piezas para armar respuestas variadas (y por lo tanto no casi-duplicadas)
+_USER_LINES = [
+    'Hola, ¿cómo estás?', 'Qué tal tu día', 'Acabo de salir del trabajo',
+    'Hoy fui al gimnasio', 'Estoy viendo una serie nueva', '¿De dónde eres?',
+    'Me gusta mucho tu estilo', 'Tengo un perro que se llama Max',
+    'Ayer fui a un concierto', '¿Qué música te gusta?', 'Estoy cocinando pasta',
+    'Mañana viajo a la playa', 'No pude dormir bien', 'Estoy aprendiendo guitarra',
+]
+_NADIA_LINES = [
+    '¡Hola! Muy bien, ¿y tú? 😊', 'Qué bueno, cuéntame más', 'Jaja me encanta eso',
+    '¿En serio? Qué interesante', 'Yo también, me pasa seguido', '¿Y qué tal estuvo?',
+    'Me alegra leerte', 'Suena increíble 😍', 'Ay qué lindo', 'Eso me da curiosidad',
+]
+_INTENTS = ['GREETING', 'SMALL_TALK', 'COMPLIMENT', 'PERSONAL_SHARE', 'RELATIONAL_QUESTION']
+_TONES = ['FRIENDLY', 'ENGAGED', 'SKEPTICAL']
+_SAFETY = ['LEVEL_0_SAFE', 'LEVEL_1_FLIRT_SAFE']
+
+
+def is_annotation_request(request: Dict) -> bool:
+    """Los prompts del anotador LLM empiezan con `message_id:`."""
+    messages = request.get('messages') or [{}]
+    return str(messages[-1].get('content', '')).startswith('message_id:')
+
+
+def varied_payload(request: Dict, rng: random.Random) -> Dict:
+    """Payload distinto en cada llamada y válido para el tipo de request."""
+    if is_annotation_request(request):
+        return {
+            'annotations': {
+                'primary_intent': rng.choice(_INTENTS),
+                'message_tone': rng.choice(_TONES),
+                'safety_level': rng.choice(_SAFETY),
+                'confidence': round(rng.uniform(0.6, 0.99), 2),
+                'reasoning': 'Anotación simulada',
+            },
+            'ideal_nadia_response': {'text': rng.choice(_NADIA_LINES), 'strategy': 'simulada'},
+        }
+    messages = []
+    for _ in range(rng.randint(2, 5)):
+        messages.append({'author': 'user', 'text': f"{rng.choice(_USER_LINES)} ({rng.randint(1, 10 ** 6)})"})
+        messages.append({'author': 'nadia', 'text': rng.choice(_NADIA_LINES)})
+    return {'messages': messages}
+
+
+def latency_sampler(spec: Dict, rng: random.Random) -> Callable[[], float]:
+    """
+    Muestreador de latencias a partir de una especificación:
+        {'type': 'fixed', 'seconds': 0.5}
+        {'type': 'uniform', 'low': 0.2, 'high': 1.0}
+        {'type': 'exponential', 'mean': 0.5}
+        {'type': 'lognormal', 'p50': 0.8, 'p95': 3.0}   # cola pesada típica de LLMs
+    `max` (opcional) acota cualquier distribución.
+    """
+    kind = spec.get('type', 'fixed')
+    if kind == 'fixed':
+        sample = lambda: float(spec['seconds'])
+    elif kind == 'uniform':
+        sample = lambda: rng.uniform(spec['low'], spec['high'])
+    elif kind == 'exponential':
+        sample = lambda: rng.expovariate(1.0 / spec['mean'])
+    elif kind == 'lognormal':
+        mu = math.log(spec['p50'])
+        sigma = (math.log(spec['p95']) - mu) / 1.6449  # z de p95
+        sample = lambda: rng.lognormvariate(mu, sigma)
+    else:
+        raise ValueError(f"Distribución de latencia desconocida: {kind}")
+
+    cap = spec.get('max')
+    return (lambda: min(sample(), cap)) if cap else sample
+
+
+def completion_body(path: str, request: Dict, text: str, response_id=0) -> Dict:
+    """Arma una respuesta con la forma del endpoint (OpenAI o Anthropic) para `text`."""
+    prompt_chars = sum(len(str(m.get('content', ''))) for m in request.get('messages', []))
+    prompt_chars += len(str(request.get('system', '')))
+    input_tokens = max(1, prompt_chars // 4)
+    output_tokens = max(1, len(text) // 4)
+
+    if path.endswith('/messages'):
+        return {
+            'id': f"msg_mock_{response_id}",
+            'type': 'message',
+            'role': 'assistant',
+            'model': request.get('model'),
+            'content': [{'type': 'text', 'text': text}],
+            'stop_reason': 'end_turn',
+            'usage': {'input_tokens': input_tokens, 'output_tokens': output_tokens},
+        }
+    return {
+        'id': f"chatcmpl-mock-{response_id}",
+        'object': 'chat.completion',
+        'model': request.get('model'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': text},
+            'finish_reason': 'stop',
+        }],
+        'usage': {
+            'prompt_tokens': input_tokens,
+            'completion_tokens': output_tokens,
+            'total_tokens': input_tokens + output_tokens,
+        },
+    }
+
+
+def stream_events(path: str, request: Dict, text: str, chunk_chars: int = 16,
+                  response_id=0) -> Iterator[Tuple[Optional[str], object, str]]:
+    """
+    Eventos SSE equivalentes a completion_body en modo streaming.
+    Produce (nombre de evento, data, fragmento de texto que contiene).
+    """
+    body = completion_body(path, request, text, response_id)
+    pieces = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)]
+
+    if path.endswith('/messages'):
+        usage = body['usage']
+        message = {**body, 'content': [], 'usage': {'input_tokens': usage['input_tokens'],
+                                                    'output_tokens': 1}}
+        yield 'message_start', {'type': 'message_start', 'message': message}, ''
+        yield 'content_block_start', {'type': 'content_block_start', 'index': 0,
+                                      'content_block': {'type': 'text', 'text': ''}}, ''
+        for piece in pieces:
+            yield 'content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                          'delta': {'type': 'text_delta', 'text': piece}}, piece
+        yield 'content_block_stop', {'type': 'content_block_stop', 'index': 0}, ''
+        yield 'message_delta', {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'},
+                                'usage': {'output_tokens': usage['output_tokens']}}, ''
+        yield 'message_stop', {'type': 'message_stop'}, ''
+        return
+
+    chunk = {'id': body['id'], 'object': 'chat.completion.chunk', 'model': body['model']}
+    for piece in pieces:
+        yield None, {**chunk, 'choices': [{'index': 0, 'delta': {'content': piece},
+                                           'finish_reason': None}]}, piece
+    yield None, {**chunk, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}, ''
+    if (request.get('stream_options') or {}).get('include_usage'):
+        yield None, {**chunk, 'choices': [], 'usage': body['usage']}, ''
+    yield None, '[DONE]', ''
+
+
+def scripted_profile(phases: List[Tuple[int, float, Optional[str]]]) -> Callable[[int], Tuple[float, Optional[str]]]:
+    """
+    Perfil por fases para MockLLMServer: [(n_requests, latencia, resultado), ...].
+    Cada fase cubre los siguientes n_requests; `resultado` fuerza 'ok',
+    'error' o 'rate_limited' (None = sorteo normal). La última fase se
+    mantiene indefinidamente.
+    """
+    def profile(request_number: int) -> Tuple[float, Optional[str]]:
+        remaining = request_number
+        for n_requests, latency, outcome in phases:
+            if remaining < n_requests:
+                return latency, outcome
+            remaining -= n_requests
+        return phases[-1][1], phases[-1][2]
+    return profile
+
+
+class _Server(ThreadingHTTPServer):
+    # El backlog por defecto (5) provoca resets con alta concurrencia
+    request_queue_size = 256
+    daemon_threads = True
+
+
+class MockLLMServer:
+    """
+    Servidor HTTP en un hilo de fondo.
+
+    Args:
+        latency_seconds: demora fija por request
+        latency_distribution: especificación para latency_sampler(); tiene
+            prioridad sobre latency_seconds
+        rate_limit_rate: probabilidad de responder 429
+        error_rate: probabilidad de responder 500
+        seed: semilla para que las fallas inyectadas sean reproducibles
+        stream_chunk_chars / stream_chunk_delay: tamaño y ritmo de los
+            fragmentos cuando el request pide `stream: true`
+        profile: función (n° de request) -> (latencia, resultado forzado o
+            None) que reemplaza latency_seconds; ver scripted_profile()
+        varied_payloads: si es True se ignora `payload` y cada respuesta se
+            arma con varied_payload()
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 latency_seconds: float = 0.0, rate_limit_rate: float = 0.0,
+                 error_rate: float = 0.0, seed: Optional[int] = None,
+                 payload: Optional[Dict] = None, stream_chunk_chars: int = 16,
+                 stream_chunk_delay: float = 0.0,
+                 profile: Optional[Callable[[int], Tuple[float, Optional[str]]]] = None,
+                 latency_distribution: Optional[Dict] = None, varied_payloads: bool = False):
+        self.latency_seconds = latency_seconds
+        self.profile = profile
+        self.varied_payloads = varied_payloads
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.payload = payload or CANNED_CONVERSATION
+        self.stream_chunk_chars = stream_chunk_chars
+        self.stream_chunk_delay = stream_chunk_delay
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sample_latency = None
+        if latency_distribution:
+            self._sample_latency = latency_sampler(latency_distribution, self.random)
+
+        self.stats = {'requests': 0, 'rate_limited': 0, 'errors': 0, 'succeeded': 0,
+                      'max_in_flight': 0, 'streamed': 0, 'stream_aborted': 0,
+                      'stream_chars_sent': 0}
+        self.request_times = []
+        self._in_flight = 0
+
+        self.httpd = _Server((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'MockLLMServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _enter(self) -> None:
+        with self._lock:
+            self._in_flight += 1
+            self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self._in_flight)
+
+    def _exit(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def _draw_outcome(self) -> Tuple[str, float]:
+        """Resultado del request y la demora a aplicar."""
+        with self._lock:
+            request_number = self.stats['requests']
+            self.stats['requests'] += 1
+            self.request_times.append(time.monotonic())
+            latency, forced = self.latency_seconds, None
+            if self.profile is not None:
+                latency, forced = self.profile(request_number)
+            elif self._sample_latency is not None:
+                latency = self._sample_latency()
+            return self._count_outcome(forced or self._roll()), latency
+
+    def _roll(self) -> str:
+        roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            return 'rate_limited'
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 'error'
+        return 'ok'
+
+    def _count_outcome(self, outcome: str) -> str:
+        self.stats[{'rate_limited': 'rate_limited', 'error': 'errors',
+                    'ok': 'succeeded'}[outcome]] += 1
+        return outcome
+
+    def _completion_text(self, request: Dict) -> str:
+        payload = self.payload
+        if self.varied_payloads:
+            with self._lock:
+                payload = varied_payload(request, self.random)
+        return json.dumps(payload, ensure_ascii=False)
+
+    def _completion_body(self, path: str, request: Dict) -> Dict:
+        return completion_body(path, request, self._completion_text(request),
+                               response_id=self.stats['requests'])
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += amount
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Cabeceras y cuerpo van en escrituras separadas: sin esto Nagle +
+            # delayed ACK agregan ~40ms a cada respuesta en localhost
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass  # Silenciar el log por request de http.server
+
+            def _send_json(self, status: int, body: Dict, headers: Optional[Dict] = None):
+                raw = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(raw)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def _send_stream(self, request: Dict):
+                # Sin Content-Length: el fin del stream lo marca el cierre de la conexión
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                server._count('streamed')
+
+                events = stream_events(self.path, request, server._completion_text(request),
+                                       chunk_chars=server.stream_chunk_chars,
+                                       response_id=server.stats['requests'])
+                try:
+                    for name, data, piece in events:
+                        raw = '' if name is None else f"event: {name}\n"
+                        raw += f"data: {data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)}\n\n"
+                        self.wfile.write(raw.encode('utf-8'))
+                        self.wfile.flush()
+                        if piece:
+                            server._count('stream_chars_sent', len(piece))
+                            if server.stream_chunk_delay:
+                                time.sleep(server.stream_chunk_delay)
+                except (BrokenPipeError, ConnectionResetError):
+                    # El cliente cortó el stream (early abort)
+                    server._count('stream_aborted')
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    request = json.loads(self.rfile.read(length) or b'{}')
+                except json.JSONDecodeError:
+                    self._send_json(400, {'error': {'message': 'invalid json'}})
+                    return
+
+                if self.path not in ('/v1/chat/completions', '/v1/messages'):
+                    self._send_json(404, {'error': {'message': f'unknown path {self.path}'}})
+                    return
+
+                server._enter()
+                try:
+                    outcome, latency = server._draw_outcome()
+                    if latency:
+                        time.sleep(latency)
+                finally:
+                    server._exit()
+
+                if outcome == 'rate_limited':
+                    self._send_json(429, {'error': {'message': 'rate limited'}},
+                                    headers={'Retry-After': '0'})
+                elif outcome == 'error':
+                    self._send_json(500, {'error': {'message': 'internal error'}})
+                elif request.get('stream'):
+                    self._send_stream(request)
+                else:
+                    self._send_json(200, server._completion_body(self.path, request))
+
+        return Handler
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    """Opciones del servidor simulado (compartidas con load_test.py)."""
+    parser.add_argument('--latency', type=float, default=0.0, help='Latencia fija (s)')
+    parser.add_argument('--latency-p50', type=float, help='Latencia lognormal: mediana (s)')
+    parser.add_argument('--latency-p95', type=float, help='Latencia lognormal: p95 (s)')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--stream-chunk-delay', type=float, default=0.0)
+    parser.add_argument('--varied-payloads', action='store_true',
+                        help='Respuestas distintas y válidas según el tipo de request')
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def server_options(args: argparse.Namespace) -> Dict:
+    """kwargs de MockLLMServer a partir de add_server_arguments()."""
+    options = {
+        'latency_seconds': args.latency,
+        'rate_limit_rate': args.rate_limit_rate,
+        'error_rate': args.error_rate,
+        'stream_chunk_delay': args.stream_chunk_delay,
+        'varied_payloads': args.varied_payloads,
+        'seed': args.seed,
+    }
+    if args.latency_p50:
+        options['latency_distribution'] = {
+            'type': 'lognormal', 'p50': args.latency_p50,
+            'p95': args.latency_p95 or args.latency_p50 * 3,
+        }
+    return options
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor LLM simulado')
+    parser.add_argument('--port', type=int, default=8089)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockLLMServer(port=args.port, **server_options(args))
+    print(f"🧪 Mock LLM escuchando en {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
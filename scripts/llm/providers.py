@@ -0,0 +1,180 @@
+"""
+Adaptadores de proveedores LLM: payloads HTTP y respuestas normalizadas.
+"""
+
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+
+DEFAULT_BASE_URLS = {
+    'openai': 'https://api.openai.com',
+    'anthropic': 'https://api.anthropic.com',
+}
+
+# Códigos HTTP que justifican reintentar (rate limit, sobrecarga, fallos transitorios)
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+class ProviderAdapter(ABC):
+    """Interfaz común para adaptadores de proveedor."""
+
+    name = 'base'
+    path = ''
+
+    def __init__(self, model: str, api_key: Optional[str] = None,
+                 base_url: Optional[str] = None):
+        self.model = model
+        self.api_key = api_key
+        self.base_url = (base_url or DEFAULT_BASE_URLS.get(self.name, '')).rstrip('/')
+
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}{self.path}"
+
+    @abstractmethod
+    def build_headers(self) -> Dict[str, str]:
+        """Headers HTTP del proveedor (autenticación, versión de API)."""
+
+    @abstractmethod
+    def build_payload(self, request: Dict) -> Dict:
+        """
+        Payload del proveedor para un request interno:
+            {'custom_id', 'system' (opcional), 'messages', 'max_tokens',
+             'temperature', 'seed' (opcional), 'metadata' (no se envía)}
+        """
+
+    @abstractmethod
+    def parse_response(self, data: Dict) -> Tuple[str, Dict[str, int]]:
+        """Devuelve (texto, usage) con usage = {'input_tokens', 'output_tokens'}."""
+
+    def build_stream_payload(self, request: Dict) -> Dict:
+        return {**self.build_payload(request), 'stream': True}
+
+    @abstractmethod
+    def parse_stream_event(self, event: Dict) -> Tuple[str, Dict[str, int]]:
+        """
+        Interpreta un evento SSE. Devuelve (fragmento de texto, usage parcial);
+        el usage solo trae las claves que el evento informa.
+        """
+
+
+class OpenAIAdapter(ProviderAdapter):
+    """Endpoint /v1/chat/completions de OpenAI."""
+
+    name = 'openai'
+    path = '/v1/chat/completions'
+
+    def build_headers(self) -> Dict[str, str]:
+        headers = {'Content-Type': 'application/json'}
+        if self.api_key:
+            headers['Authorization'] = f"Bearer {self.api_key}"
+        return headers
+
+    def build_payload(self, request: Dict) -> Dict:
+        messages = list(request.get('messages', []))
+        if request.get('system'):
+            messages = [{'role': 'system', 'content': request['system']}] + messages
+
+        payload = {
+            'model': request.get('model', self.model),
+            'messages': messages,
+            'max_tokens': request.get('max_tokens'),
+            'temperature': request.get('temperature'),
+        }
+        if request.get('seed') is not None:
+            payload['seed'] = request['seed']
+        return {k: v for k, v in payload.items() if v is not None}
+
+    def parse_response(self, data: Dict) -> Tuple[str, Dict[str, int]]:
+        choices = data.get('choices') or [{}]
+        text = (choices[0].get('message') or {}).get('content') or ''
+        usage = data.get('usage') or {}
+        return text, {
+            'input_tokens': int(usage.get('prompt_tokens', 0)),
+            'output_tokens': int(usage.get('completion_tokens', 0)),
+        }
+
+    def build_stream_payload(self, request: Dict) -> Dict:
+        # Sin include_usage OpenAI no informa tokens en modo streaming
+        return {**super().build_stream_payload(request), 'stream_options': {'include_usage': True}}
+
+    def parse_stream_event(self, event: Dict) -> Tuple[str, Dict[str, int]]:
+        choices = event.get('choices') or [{}]
+        text = (choices[0].get('delta') or {}).get('content') or ''
+        usage = event.get('usage')
+        if not usage:
+            return text, {}
+        return text, {
+            'input_tokens': int(usage.get('prompt_tokens', 0)),
+            'output_tokens': int(usage.get('completion_tokens', 0)),
+        }
+
+
+class AnthropicAdapter(ProviderAdapter):
+    """Endpoint /v1/messages de Anthropic."""
+
+    name = 'anthropic'
+    path = '/v1/messages'
+    api_version = '2023-06-01'
+
+    def build_headers(self) -> Dict[str, str]:
+        headers = {
+            'Content-Type': 'application/json',
+            'anthropic-version': self.api_version,
+        }
+        if self.api_key:
+            headers['x-api-key'] = self.api_key
+        return headers
+
+    def build_payload(self, request: Dict) -> Dict:
+        # Anthropic no acepta mensajes 'system' dentro de la lista
+        messages = [m for m in request.get('messages', []) if m.get('role') != 'system']
+        system_parts = [m['content'] for m in request.get('messages', []) if m.get('role') == 'system']
+        if request.get('system'):
+            system_parts.insert(0, request['system'])
+
+        payload = {
+            'model': request.get('model', self.model),
+            'messages': messages,
+            'max_tokens': request.get('max_tokens') or 1024,
+            'temperature': request.get('temperature'),
+        }
+        if system_parts:
+            payload['system'] = '\n\n'.join(system_parts)
+        return {k: v for k, v in payload.items() if v is not None}
+
+    def parse_response(self, data: Dict) -> Tuple[str, Dict[str, int]]:
+        text = ''.join(
+            block.get('text', '') for block in data.get('content', [])
+            if block.get('type') == 'text'
+        )
+        usage = data.get('usage') or {}
+        return text, {
+            'input_tokens': int(usage.get('input_tokens', 0)),
+            'output_tokens': int(usage.get('output_tokens', 0)),
+        }
+
+    def parse_stream_event(self, event: Dict) -> Tuple[str, Dict[str, int]]:
+        kind = event.get('type')
+        if kind == 'content_block_delta':
+            return (event.get('delta') or {}).get('text', ''), {}
+        if kind == 'message_start':
+            usage = (event.get('message') or {}).get('usage') or {}
+            return '', {'input_tokens': int(usage.get('input_tokens', 0))}
+        if kind == 'message_delta':
+            usage = event.get('usage') or {}
+            return '', {'output_tokens': int(usage.get('output_tokens', 0))}
+        return '', {}
+
+
+ADAPTERS = {
+    'openai': OpenAIAdapter,
+    'anthropic': AnthropicAdapter,
+}
+
+
+def get_adapter(provider: str, model: str, api_key: Optional[str] = None,
+                base_url: Optional[str] = None) -> ProviderAdapter:
+    """Instancia el adaptador correspondiente al proveedor configurado."""
+    if provider not in ADAPTERS:
+        raise ValueError(f"Proveedor no soportado: {provider}. Opciones: {list(ADAPTERS)}")
+    return ADAPTERS[provider](model=model, api_key=api_key, base_url=base_url)
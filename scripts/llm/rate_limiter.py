@@ -0,0 +1,121 @@
+"""
+Limitador de tasa tipo token bucket (requests/minuto y tokens/minuto) para llamadas LLM.
+"""
+
+import asyncio
+import time
+from typing import Callable, Optional
+
+
+class TokenBucket:
+    """
+    Bucket con capacidad fija y recarga continua a `rate_per_second`.
+
+    La capacidad define la ráfaga máxima permitida. Una solicitud mayor
+    que la capacidad se recorta a la capacidad para que nunca bloquee
+    indefinidamente.
+    """
+
+    def __init__(self, rate_per_second: float, capacity: float,
+                 clock: Callable[[], float] = time.monotonic):
+        if rate_per_second <= 0 or capacity <= 0:
+            raise ValueError("rate_per_second y capacity deben ser positivos")
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated_at = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Segundos hasta que haya saldo para `amount` (0 si ya lo hay)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        """Descuenta saldo. Puede quedar negativo al ajustar con uso real."""
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        """Devuelve saldo (p.ej. cuando el uso real fue menor que el estimado)."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """
+    Combina un bucket de requests/minuto y otro de tokens/minuto.
+
+    `burst_seconds` controla cuántos segundos de cuota pueden gastarse de
+    golpe; con el valor por defecto (1s) el tráfico queda prácticamente
+    uniforme.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None,
+                 burst_seconds: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.request_bucket = None
+        self.token_bucket = None
+
+        if requests_per_minute:
+            rate = requests_per_minute / 60.0
+            self.request_bucket = TokenBucket(rate, max(1.0, rate * burst_seconds), clock)
+        if tokens_per_minute:
+            rate = tokens_per_minute / 60.0
+            self.token_bucket = TokenBucket(rate, max(1.0, rate * burst_seconds), clock)
+
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """
+        Espera hasta tener cupo para un request de `tokens` tokens estimados.
+        Devuelve el tiempo total esperado (útil para métricas).
+        """
+        waited = 0.0
+        # El lock mantiene el orden de llegada: nadie se adelanta mientras
+        # el primero de la fila espera recarga.
+        async with self._lock:
+            while True:
+                wait = 0.0
+                if self.request_bucket:
+                    wait = max(wait, self.request_bucket.wait_time(1))
+                if self.token_bucket and tokens:
+                    wait = max(wait, self.token_bucket.wait_time(tokens))
+
+                if wait <= 0:
+                    if self.request_bucket:
+                        self.request_bucket.consume(1)
+                    if self.token_bucket and tokens:
+                        self.token_bucket.consume(tokens)
+                    return waited
+
+                await asyncio.sleep(wait)
+                waited += wait
+
+    def reservation(self, tokens: int) -> int:
+        """Tokens que realmente se descuentan al adquirir (recortados a la capacidad)."""
+        if not self.token_bucket:
+            return tokens
+        return int(min(tokens, self.token_bucket.capacity))
+
+    def settle(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Ajusta el bucket de tokens con el uso real reportado por el proveedor."""
+        if not self.token_bucket:
+            return
+        delta = actual_tokens - estimated_tokens
+        if delta > 0:
+            self.token_bucket.consume(delta)
+        elif delta < 0:
+            self.token_bucket.refund(-delta)
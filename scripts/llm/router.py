@@ -0,0 +1,332 @@
+"""
+Router de proveedores LLM por latencia, con circuit breakers y failover.
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from scripts.llm.budget import BudgetExceeded, TokenBudget
+from scripts.llm.cache import ResponseCache
+from scripts.llm.client import AsyncLLMClient, LLMClientError, resolve_api_key
+
+ROUTER_DEFAULTS = {
+    'enabled': False,
+    'routes': [],
+    'window': 200,                    # requests por ruta en la ventana de métricas
+    'min_samples': 5,                 # antes de esto la ruta usa la latencia de referencia
+    'explore_share': 0.05,            # probabilidad mínima repartida entre rutas sanas
+    'failure_threshold': 5,           # fallas consecutivas que abren el circuito
+    'error_rate_threshold': 0.5,      # o tasa de error en la ventana (con min_samples)
+    'cooldown_seconds': 30.0,
+    'max_failovers': 2,
+    'retry_attempts_per_route': 1,    # reintentos dentro de la ruta antes de pasar a otra
+    'seed': None,
+}
+
+# Claves de la etapa que no se copian a la configuración de cada ruta
+_STAGE_ONLY_KEYS = ('routing', 'batch', 'cache', 'budget')
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker clásico: cerrado mientras la ruta responde; abierto
+    tras `failure_threshold` fallas seguidas (o el umbral de tasa de
+    error), sin tráfico durante `cooldown_seconds`; luego semiabierto, con
+    un único request de prueba que lo cierra o lo vuelve a abrir.
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown_seconds: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.clock = clock
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._probing = False
+
+    def available(self) -> bool:
+        """Indica si la ruta puede recibir un request ahora (sin consumir la prueba)."""
+        if self.state == OPEN and self.clock() - self.opened_at >= self.cooldown_seconds:
+            self.state = HALF_OPEN
+            self._probing = False
+        return self.state == CLOSED or (self.state == HALF_OPEN and not self._probing)
+
+    def acquire(self) -> None:
+        """Marca el request de prueba de un circuito semiabierto como en curso."""
+        if self.state == HALF_OPEN:
+            self._probing = True
+
+    def reopens_in(self) -> float:
+        """Segundos hasta que un circuito abierto admite un request de prueba."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.cooldown_seconds - (self.clock() - self.opened_at))
+
+    def open(self) -> None:
+        self.state = OPEN
+        self.opened_at = self.clock()
+        self.times_opened += 1
+        self._probing = False
+
+    def release(self) -> None:
+        """Libera la prueba en curso sin cambiar el estado (el proveedor no respondió nada)."""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.open()
+
+
+class Route:
+    """Una ruta (proveedor + modelo) con su cliente, métricas y breaker."""
+
+    def __init__(self, name: str, client: AsyncLLMClient, weight: float,
+                 breaker: CircuitBreaker, window: int = 200):
+        self.name = name
+        self.client = client
+        self.weight = weight
+        self.breaker = breaker
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.routed = 0
+        self._started = {}
+        self._next_ticket = 0
+
+    @property
+    def samples(self) -> int:
+        return len(self.latencies)
+
+    def latency_percentiles(self):
+        """(p50, p95) de la ventana, o (None, None) sin muestras."""
+        if not self.latencies:
+            return None, None
+        p50, p95 = np.percentile(np.fromiter(self.latencies, dtype=float), [50, 95])
+        return float(p50), float(p95)
+
+    @property
+    def error_rate(self) -> float:
+        return 1.0 - sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def start(self) -> int:
+        """Registra un request en vuelo; devuelve el ticket para finish()."""
+        ticket = self._next_ticket
+        self._next_ticket += 1
+        self._started[ticket] = time.monotonic()
+        return ticket
+
+    def finish(self, ticket: int) -> float:
+        """Quita el request de los en vuelo y devuelve su duración."""
+        return time.monotonic() - self._started.pop(ticket)
+
+    def oldest_in_flight(self) -> float:
+        """Antigüedad del request en vuelo más viejo (0 si no hay)."""
+        if not self._started:
+            return 0.0
+        return time.monotonic() - min(self._started.values())
+
+    def record(self, ok: bool, latency: Optional[float]) -> None:
+        self.outcomes.append(ok)
+        if ok and latency is not None:
+            self.latencies.append(latency)
+
+
+class ProviderRouter(AsyncLLMClient):
+    """
+    Cliente con la misma interfaz que AsyncLLMClient (complete, stream,
+    complete_many, get_stats) que reparte los requests entre rutas.
+
+    La caché y el presupuesto se comparten entre rutas; cada ruta tiene su
+    propio rate limiter y concurrencia.
+    """
+
+    def __init__(self, config: Dict, api_key: Optional[str] = None,
+                 cache: Optional[ResponseCache] = None,
+                 budget: Optional[TokenBudget] = None, stage: str = 'llm',
+                 clock: Callable[[], float] = time.monotonic):
+        routing = {**ROUTER_DEFAULTS, **(config.get('routing') or {})}
+        if not routing['routes']:
+            raise ValueError("routing.routes está vacío: se necesita al menos una ruta")
+        super().__init__(config, api_key=api_key, cache=cache, budget=budget, stage=stage)
+        self.routing = routing
+        self.random = random.Random(routing['seed'])
+
+        base = {k: v for k, v in config.items() if k not in _STAGE_ONLY_KEYS}
+        base['retry_attempts'] = routing['retry_attempts_per_route']
+        self.routes = []
+        for route_config in routing['routes']:
+            route_config = {**base, **route_config}
+            provider = route_config['provider']
+            key = route_config.pop('api_key', None) or (
+                api_key if provider == self.provider else resolve_api_key(provider)
+            )
+            client = AsyncLLMClient(route_config, api_key=key, cache=self.cache,
+                                    budget=budget, stage=stage)
+            # Una sola señal de presupuesto liberado para todas las rutas: una
+            # ruta puede estar esperando reservas que tiene en vuelo otra
+            client._budget_released = self._budget_released
+            breaker = CircuitBreaker(int(routing['failure_threshold']),
+                                     float(routing['cooldown_seconds']), clock=clock)
+            name = route_config.get('name') or f"{provider}:{route_config.get('model')}"
+            self.routes.append(Route(name, client, float(route_config.get('weight', 1.0)),
+                                     breaker, window=int(routing['window'])))
+
+        self.max_concurrency = sum(route.client.max_concurrency for route in self.routes)
+        self.stats['failovers'] = 0
+        self.stats['circuit_waits'] = 0
+
+    async def close(self) -> None:
+        for route in self.routes:
+            await route.client.close()
+        await super().close()
+
+    def route_weights(self, routes: List[Route]) -> np.ndarray:
+        """
+        Probabilidad de elegir cada ruta: peso base × (1 - tasa de error)² /
+        latencia esperada (promedio de p50 y p95), mezclada con una parte
+        uniforme (`explore_share`) para seguir midiendo rutas relegadas.
+
+        La antigüedad del request en vuelo más viejo es una cota inferior de
+        la latencia: un proveedor que se cuelga pierde tráfico de inmediato,
+        sin esperar a que sus respuestas lentas entren en la ventana.
+        """
+        observed = [route for route in routes if route.samples >= self.routing['min_samples']]
+        expected = {}
+        for route in observed:
+            p50, p95 = route.latency_percentiles()
+            expected[route.name] = (p50 + p95) / 2
+        # Sin muestras suficientes una ruta se supone tan rápida como la mediana
+        reference = float(np.median(list(expected.values()))) if expected else 1.0
+
+        weights = np.array([
+            route.weight * (1.0 - route.error_rate) ** 2 /
+            max(expected.get(route.name, reference), route.oldest_in_flight(), 1e-3)
+            for route in routes
+        ])
+        if weights.sum() <= 0:
+            weights = np.ones(len(routes))
+        explore = float(self.routing['explore_share'])
+        return (1 - explore) * weights / weights.sum() + explore / len(routes)
+
+    def choose_route(self, exclude=()) -> Optional[Route]:
+        """Sortea una ruta entre las que tienen el circuito cerrado o en prueba."""
+        candidates = [route for route in self.routes
+                      if route.name not in exclude and route.breaker.available()]
+        if not candidates:
+            return None
+        route = self.random.choices(candidates, weights=self.route_weights(candidates))[0]
+        route.breaker.acquire()
+        return route
+
+    def _record_failure(self, route: Route, error: LLMClientError) -> None:
+        was_open = route.breaker.state == OPEN
+        route.record(False, None)
+        route.breaker.record_failure()
+        if (route.breaker.state == CLOSED and
+                len(route.outcomes) >= self.routing['min_samples'] and
+                route.error_rate >= self.routing['error_rate_threshold']):
+            route.breaker.open()
+        if route.breaker.state == OPEN and not was_open:
+            self.logger.warning(f"Circuito abierto para {route.name}: {error}")
+
+    async def _execute(self, request: Dict, consumer=None) -> Dict:
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+        self.stats['requests'] += 1
+        request_started = time.monotonic()
+
+        tried, last_error = set(), None
+        while len(tried) <= int(self.routing['max_failovers']):
+            route = self.choose_route(exclude=tried)
+            if route is None:
+                if tried:
+                    break
+                # Ningún circuito admite tráfico: esperar al primero que admita prueba
+                self.stats['circuit_waits'] += 1
+                await asyncio.sleep(max(min(r.breaker.reopens_in() for r in self.routes), 0.01))
+                continue
+
+            tried.add(route.name)
+            route.routed += 1
+            ticket = route.start()
+            try:
+                result = await route.client._execute(request, consumer)
+            except BudgetExceeded:
+                route.finish(ticket)
+                route.breaker.release()
+                raise
+            except LLMClientError as e:
+                route.finish(ticket)
+                last_error = e
+                self._record_failure(route, e)
+                if len(tried) < len(self.routes):
+                    self.stats['failovers'] += 1
+                continue
+
+            elapsed = route.finish(ticket)
+            if result.get('cached'):
+                # Respondido desde la caché: el proveedor no se contactó
+                route.breaker.release()
+            else:
+                # Un stream cortado no dice nada de la latencia del proveedor
+                route.record(True, None if result.get('aborted') else elapsed)
+                route.breaker.record_success()
+            self.stats['succeeded'] += 1
+            self._finish_request(request_started, None, None)
+            return {**result, 'route': route.name}
+
+        self.stats['failed'] += 1
+        self._finish_request(request_started, None, None)
+        raise LLMClientError(
+            f"{request.get('custom_id', '?')}: sin ruta disponible tras probar "
+            f"{sorted(tried) or 'ninguna'} ({last_error})",
+            status_code=getattr(last_error, 'status_code', None),
+            attempts=len(tried)
+        )
+
+    def get_stats(self) -> Dict:
+        """Métricas agregadas de todas las rutas más el detalle por ruta."""
+        for key in ('attempts', 'retries', 'rate_limited', 'input_tokens', 'output_tokens',
+                    'rate_limit_wait_seconds', 'cache_hits', 'streamed', 'aborted',
+                    'budget_waits', 'budget_rejected'):
+            self.stats[key] = sum(route.client.stats[key] for route in self.routes)
+        stats = super().get_stats()
+        stats['configured_requests_per_minute'] = None
+        stats['configured_tokens_per_minute'] = None
+
+        stats['routes'] = {}
+        for route in self.routes:
+            p50, p95 = route.latency_percentiles()
+            stats['routes'][route.name] = {
+                'routed': route.routed,
+                'succeeded': route.client.stats['succeeded'],
+                'failed': route.client.stats['failed'],
+                'latency_p50': p50,
+                'latency_p95': p95,
+                'error_rate': route.error_rate,
+                'circuit': route.breaker.state,
+                'times_opened': route.breaker.times_opened,
+            }
+        return stats
+
+
+def create_client(config: Dict, api_key: Optional[str] = None,
+                  budget: Optional[TokenBudget] = None, stage: str = 'llm') -> AsyncLLMClient:
+    """Cliente de la etapa: ProviderRouter si `routing.enabled`, si no AsyncLLMClient."""
+    if (config.get('routing') or {}).get('enabled'):
+        return ProviderRouter(config, api_key=api_key, budget=budget, stage=stage)
+    return AsyncLLMClient(config, api_key=api_key, budget=budget, stage=stage)
@@ -0,0 +1,318 @@
+"""
+Parseo incremental de respuestas LLM en streaming, con corte temprano (StreamAbort).
+"""
+
+import json
+import re
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from scripts.validation.llm_quality_checker import FORBIDDEN_PATTERNS
+
+# Rutas: tuplas de claves de objeto; '*' equivale a cualquier índice de arreglo
+CONVERSATION_RECORD_PATHS = [('messages', '*'), ('*',)]
+ANNOTATION_GUARDED_PATHS = [('ideal_nadia_response', 'text')]
+
+NADIA_AUTHORS = ('nadia', 'assistant')
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_NUMBER = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?\Z')
+_NUMBER_CHARS = frozenset('0123456789+-.eE')
+_KEYWORDS = ('true', 'false', 'null')
+_ESCAPES = frozenset('"\\/bfnrtu')
+_WHITESPACE = frozenset(' \t\r\n')
+
+
+class StreamAbort(Exception):
+    """La salida del modelo dejó de ser aceptable: se cancela el request."""
+
+    def __init__(self, reason: str, position: int = 0):
+        super().__init__(f"{reason} (carácter {position})")
+        self.reason = reason
+        self.position = position
+
+
+def path_matches(path: Tuple, pattern: Sequence) -> bool:
+    if len(path) != len(pattern):
+        return False
+    return all(
+        isinstance(key, int) if expected == '*' else key == expected
+        for key, expected in zip(path, pattern)
+    )
+
+
+def compile_patterns(patterns: Optional[Sequence] = None) -> List[Tuple]:
+    """Acepta [(regex, motivo)] o [regex]; por defecto las menciones prohibidas de Nadia."""
+    compiled = []
+    for item in (FORBIDDEN_PATTERNS if patterns is None else patterns):
+        pattern, issue = item if isinstance(item, (list, tuple)) else (item, f"Patrón prohibido: {item}")
+        compiled.append((re.compile(pattern), issue))
+    return compiled
+
+
+def find_forbidden(text: str, compiled_patterns: List[Tuple]) -> Optional[str]:
+    lowered = text.lower()
+    for pattern, issue in compiled_patterns:
+        if pattern.search(lowered):
+            return issue
+    return None
+
+
+class IncrementalJSONParser:
+    """
+    Validador JSON incremental que emite registros completos.
+
+    Args:
+        record_paths: rutas de los valores que se emiten como registros;
+            () emite la raíz completa
+        guarded_paths: rutas de strings que no pueden contener patrones prohibidos
+        forbidden_patterns: ver compile_patterns
+        record_check: callable(registro) -> motivo de rechazo o None
+        max_preamble_chars: texto tolerado antes del JSON (p. ej. "```json")
+    """
+
+    def __init__(self, record_paths: Sequence[Tuple] = ((),),
+                 guarded_paths: Sequence[Tuple] = (),
+                 forbidden_patterns: Optional[Sequence] = None,
+                 record_check: Optional[Callable[[Dict], Optional[str]]] = None,
+                 max_preamble_chars: int = 200):
+        self.record_paths = [tuple(p) for p in record_paths]
+        self.guarded_paths = [tuple(p) for p in guarded_paths]
+        self.patterns = compile_patterns(forbidden_patterns)
+        self.record_check = record_check
+        self.max_preamble_chars = max_preamble_chars
+        self.reset()
+
+    def reset(self) -> None:
+        self.records = []
+        self.position = 0
+        self.done = False
+        # Pila de contenedores abiertos: [tipo, estado, clave o índice actual]
+        self._stack = []
+        self._preamble = 0
+        self._mode = None
+        self._string_parts = []
+        self._string_is_key = False
+        self._string_path = ()
+        self._escape = False
+        self._literal = []
+        self._capture = None
+        self._capture_depth = 0
+        self._capture_start = 0
+        self._new_records = []
+
+    def _abort(self, reason: str, offset: int = 0):
+        raise StreamAbort(reason, self.position + offset)
+
+    def _path(self) -> Tuple:
+        return tuple(frame[2] for frame in self._stack)
+
+    def feed(self, chunk: str) -> List:
+        """Procesa un fragmento y devuelve los registros que se completaron en él."""
+        self._new_records = []
+        self._capture_start = 0
+        i, n = 0, len(chunk)
+
+        while i < n and not self.done:
+            if self._mode == 'string':
+                if self._escape:
+                    if chunk[i] not in _ESCAPES:
+                        self._abort('Escape inválido en string', i)
+                    self._string_parts.append(chunk[i])
+                    self._escape = False
+                    i += 1
+                    continue
+                match = _STRING_SPECIAL.search(chunk, i)
+                if match is None:
+                    self._string_parts.append(chunk[i:])
+                    i = n
+                    break
+                j = match.start()
+                self._string_parts.append(chunk[i:j])
+                if chunk[j] == '\\':
+                    self._string_parts.append('\\')
+                    self._escape = True
+                else:
+                    self._end_string(chunk, j)
+                i = j + 1
+                continue
+
+            ch = chunk[i]
+            if self._mode == 'literal':
+                if ch in _NUMBER_CHARS or ch.isalpha():
+                    self._literal.append(ch)
+                    self._check_literal_prefix(i)
+                    i += 1
+                    continue
+                self._end_literal(chunk, i)
+                continue
+
+            if ch in _WHITESPACE:
+                i += 1
+                continue
+
+            if not self._stack:
+                # Antes de la raíz: tolerar texto o fences hasta el límite
+                if ch in '{[':
+                    self._begin_value(chunk, i, ch)
+                else:
+                    self._preamble += 1
+                    if self._preamble > self.max_preamble_chars:
+                        self._abort('Texto antes del JSON excede el límite', i)
+                i += 1
+                continue
+
+            frame = self._stack[-1]
+            kind, state = frame[0], frame[1]
+            if kind == 'object':
+                if state in ('key_or_end', 'key') and ch == '"':
+                    self._mode = 'string'
+                    self._string_is_key = True
+                    self._string_parts = []
+                elif state in ('key_or_end', 'comma_or_end') and ch == '}':
+                    self._close_container(chunk, i)
+                elif state == 'colon' and ch == ':':
+                    frame[1] = 'value'
+                elif state == 'comma_or_end' and ch == ',':
+                    frame[1] = 'key'
+                elif state == 'value':
+                    self._begin_value(chunk, i, ch)
+                else:
+                    self._abort(f"Carácter inesperado {ch!r} en objeto", i)
+            else:
+                if state in ('value_or_end', 'comma_or_end') and ch == ']':
+                    self._close_container(chunk, i)
+                elif state == 'comma_or_end' and ch == ',':
+                    frame[1] = 'value'
+                elif state in ('value_or_end', 'value'):
+                    self._begin_value(chunk, i, ch)
+                else:
+                    self._abort(f"Carácter inesperado {ch!r} en arreglo", i)
+            i += 1
+
+        if self._capture is not None:
+            self._capture.append(chunk[self._capture_start:])
+        self.position += n
+        return self._new_records
+
+    def _begin_value(self, chunk: str, i: int, ch: str) -> None:
+        if self._stack and self._stack[-1][0] == 'array':
+            self._stack[-1][2] += 1
+        path = self._path()
+
+        if self._capture is None and any(path_matches(path, p) for p in self.record_paths):
+            self._capture = []
+            self._capture_start = i
+            self._capture_depth = len(self._stack)
+
+        if ch == '{':
+            self._stack.append(['object', 'key_or_end', None])
+        elif ch == '[':
+            self._stack.append(['array', 'value_or_end', -1])
+        elif ch == '"':
+            self._mode = 'string'
+            self._string_is_key = False
+            self._string_parts = []
+            self._string_path = path
+        elif ch == '-' or ch.isdigit() or ch in 'tfn':
+            self._mode = 'literal'
+            self._literal = [ch]
+        else:
+            self._abort(f"Carácter inesperado {ch!r} al inicio de un valor", i)
+
+    def _decode_string(self, i: int) -> str:
+        raw = ''.join(self._string_parts)
+        if '\\' not in raw:
+            return raw
+        try:
+            return json.loads(f'"{raw}"', strict=False)
+        except ValueError:
+            self._abort('Escape inválido en string', i)
+
+    def _end_string(self, chunk: str, j: int) -> None:
+        self._mode = None
+        if self._string_is_key:
+            frame = self._stack[-1]
+            frame[2] = self._decode_string(j)
+            frame[1] = 'colon'
+            return
+
+        if any(path_matches(self._string_path, p) for p in self.guarded_paths):
+            issue = find_forbidden(self._decode_string(j), self.patterns)
+            if issue:
+                self._abort(issue, j)
+        self._end_value(chunk, j + 1)
+
+    def _check_literal_prefix(self, i: int) -> None:
+        literal = ''.join(self._literal)
+        if literal[0] in 'tfn':
+            if not any(keyword.startswith(literal) for keyword in _KEYWORDS):
+                self._abort(f"Literal inválido {literal!r}", i)
+        elif not all(c in _NUMBER_CHARS for c in literal):
+            self._abort(f"Número inválido {literal!r}", i)
+
+    def _end_literal(self, chunk: str, i: int) -> None:
+        literal = ''.join(self._literal)
+        if literal not in _KEYWORDS and not _NUMBER.match(literal):
+            self._abort(f"Literal inválido {literal!r}", i)
+        self._mode = None
+        self._end_value(chunk, i)
+
+    def _close_container(self, chunk: str, i: int) -> None:
+        self._stack.pop()
+        self._end_value(chunk, i + 1)
+
+    def _end_value(self, chunk: str, end: int) -> None:
+        """Un valor terminó en chunk[:end]: emitir registro y avanzar el estado del padre."""
+        if self._capture is not None and len(self._stack) == self._capture_depth:
+            text = ''.join(self._capture) + chunk[self._capture_start:end]
+            self._capture = None
+            try:
+                record = json.loads(text, strict=False)
+            except ValueError as e:
+                self._abort(f"Registro inválido: {e}", end)
+            if self.record_check is not None:
+                reason = self.record_check(record)
+                if reason:
+                    self._abort(reason, end)
+            self.records.append(record)
+            self._new_records.append(record)
+
+        if self._stack:
+            self._stack[-1][1] = 'comma_or_end'
+        else:
+            self.done = True
+
+    def close(self) -> List:
+        """Fin del stream: la raíz tiene que haberse cerrado."""
+        if not self.done:
+            self._abort('Respuesta truncada: JSON incompleto')
+        return self.records
+
+
+def conversation_parser(forbidden_patterns: Optional[Sequence] = None,
+                        max_preamble_chars: int = 200) -> IncrementalJSONParser:
+    """Emite cada mensaje de la conversación; corta si un mensaje de Nadia es prohibido."""
+    patterns = compile_patterns(forbidden_patterns)
+
+    def check_message(message) -> Optional[str]:
+        if not isinstance(message, dict):
+            return 'Mensaje no es un objeto'
+        author = str(message.get('author') or message.get('role') or '').lower()
+        if author in NADIA_AUTHORS:
+            return find_forbidden(str(message.get('text') or message.get('content') or ''),
+                                  patterns)
+        return None
+
+    return IncrementalJSONParser(record_paths=CONVERSATION_RECORD_PATHS,
+                                 record_check=check_message,
+                                 forbidden_patterns=forbidden_patterns,
+                                 max_preamble_chars=max_preamble_chars)
+
+
+def annotation_parser(forbidden_patterns: Optional[Sequence] = None,
+                      max_preamble_chars: int = 200) -> IncrementalJSONParser:
+    """Emite la anotación completa; corta en cuanto la respuesta ideal cae en un patrón prohibido."""
+    return IncrementalJSONParser(record_paths=[()],
+                                 guarded_paths=ANNOTATION_GUARDED_PATHS,
+                                 forbidden_patterns=forbidden_patterns,
+                                 max_preamble_chars=max_preamble_chars)
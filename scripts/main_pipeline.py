@@ -21,12 +21,16 @@ from scripts.prompt_generator import PromptGenerator
 from scripts.synthetic_generator import SyntheticGenerator
 from scripts.quality_validator import QualityValidator
 from scripts.label_prep import LabelStudioPrep
+from scripts.llm.budget import TokenBudget
+from scripts.llm.client import resolve_api_key
 
 class SyntheticPipeline:
     def __init__(self, config_path: str):
         self.config = self._load_config(config_path)
         self.setup_logging()
         self.results = {}
+        # Presupuesto de tokens de toda la corrida, compartido por las etapas LLM
+        self.budget = TokenBudget.from_config(self.config.get('budget'))
         
     def _load_config(self, config_path: str) -> Dict:
         """Carga configuración del pipeline"""
@@ -106,16 +110,73 @@ class SyntheticPipeline:
         }
         
         return anonymized_data
-        
+
+    def run_pattern_analysis(self, anonymized_data):
+        """Ejecuta el análisis de patrones en streaming sobre el corpus anonimizado"""
+        analyzer = PatternAnalyzer(self.config['pattern_analysis'])
+        report = analyzer.analyze([self.results['anonymization']['output_file']])
+
+        self.results['pattern_analysis'] = {
+            'conversations_analyzed': report['statistics']['conversations_analyzed'],
+            'conversations_skipped': (report['statistics']['skipped_short'] +
+                                      report['statistics']['skipped_long']),
+            'output_dir': report['output_dir'],
+            'files': report['files']
+        }
+
+        return report
+
+    def run_prompt_generation(self, patterns):
+        """Arma los prompts por celda de la taxonomía con few-shot del pool etiquetado"""
+        generator = PromptGenerator(self.config, patterns=patterns)
+        prompts = generator.generate()
+
+        self.results['prompt_generation'] = {
+            'prompts_generated': len(prompts),
+            'example_pool_size': len(generator.pool),
+            'prompts_without_examples': generator.stats['prompts_without_examples'],
+        }
+
+        return prompts
+
+    def run_synthetic_generation(self, prompts):
+        """Ejecuta generación sintética contra el proveedor LLM configurado"""
+        generation_config = self.config['synthetic_generation']
+        api_key = resolve_api_key(generation_config['provider'], self.config.get('api_keys'))
+
+        generator = SyntheticGenerator(generation_config, api_key=api_key, budget=self.budget)
+        result = generator.generate(prompts)
+
+        self.results['synthetic_generation'] = {
+            'conversations_generated': result['statistics']['generated'],
+            'failed_requests': result['statistics']['failed_requests'],
+            'invalid_json': result['statistics']['invalid_json'],
+            'aborted_streams': result['statistics']['aborted'],
+            'near_duplicates_rejected': result['statistics']['near_duplicates'],
+            'budget_rejected': result['statistics']['budget_rejected'],
+            'mode': generation_config.get('mode', 'interactive'),
+            'retries': result['client'].get('retries', 0),
+            'achieved_requests_per_minute': result['client'].get('achieved_requests_per_minute'),
+            'output_file': result['output_file']
+        }
+        if 'routes' in result['client']:
+            self.results['synthetic_generation']['routes'] = result['client']['routes']
+        if 'scheduler' in result:
+            self.results['synthetic_generation']['quotas_satisfied'] = result['scheduler']['satisfied']
+            self.results['synthetic_generation']['quotas'] = result['scheduler']['quotas']
+
+        return result
+
     def generate_final_report(self):
         """Genera reporte ejecutivo"""
         report = {
             'pipeline_run': {
                 'version': self.config['pipeline']['version'],
                 'timestamp': datetime.now().isoformat(),
-                'status': 'completed'
+                'status': 'stopped_budget' if self.budget.stopped else 'completed'
             },
             'results': self.results,
+            'token_usage': self.budget.get_report(),
             'next_steps': [
                 'Review generated synthetic conversations',
                 'Import to Label Studio',
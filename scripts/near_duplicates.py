@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Índice de casi-duplicados (MinHash + LSH) para conversaciones sintéticas.
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Agregar el directorio raíz al path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.utils.sketches import stable_hashes
+
+DEFAULTS = {
+    'enabled': True,
+    'threshold': 0.8,
+    'num_perm': 128,
+    'shingle_size': 3,
+    'seed': 1,
+    'index_path': 'outputs/checkpoints/near_duplicates.npz',
+    'on_duplicate': 'reject',          # reject | regenerate
+    'max_regenerations': 2,
+    'merge_every': 20000,
+}
+
+# Parámetros que fijan las firmas y claves de banda guardadas en el .npz
+INDEX_PARAMS = ('threshold', 'num_perm', 'shingle_size', 'seed')
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD = re.compile(r'\w+')
+_B_BITS_COLLISION = 1 / 256  # probabilidad de coincidencia al azar con firmas de 8 bits
+
+
+def optimal_bands(threshold: float, num_perm: int, false_positive_weight: float = 0.1,
+                  false_negative_weight: float = 0.9) -> Tuple[int, int]:
+    """
+    Elige (bandas, filas) con bandas*filas <= num_perm minimizando el área
+    ponderada de falsos positivos + falsos negativos de la curva S de LSH.
+    Los falsos positivos pesan poco porque cada candidato se verifica con
+    la firma; un falso negativo es un duplicado que pasa.
+    """
+    grid = np.linspace(0, 1, 201)
+    below, above = grid[grid < threshold], grid[grid >= threshold]
+    best, best_error = (1, num_perm), float('inf')
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            fp = (1 - (1 - below ** rows) ** bands).mean() * threshold if below.size else 0.0
+            fn = ((1 - above ** rows) ** bands).mean() * (1 - threshold) if above.size else 0.0
+            error = false_positive_weight * fp + false_negative_weight * fn
+            if error < best_error:
+                best, best_error = (bands, rows), error
+    return best
+
+
+def conversation_text(record: Dict) -> str:
+    """Texto de la conversación (JSONL de SyntheticGenerator o lista de mensajes)."""
+    messages = record.get('messages', []) if isinstance(record, dict) else record
+    return '\n'.join(str(m.get('text') or m.get('content') or '') for m in messages
+                     if isinstance(m, dict))
+
+
+class MinHasher:
+    """Firmas MinHash de `num_perm` permutaciones sobre shingles de palabras."""
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 3, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, 1 << 61, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 1 << 61, size=num_perm, dtype=np.uint64)
+
+    def shingle_hashes(self, text: str) -> np.ndarray:
+        words = _WORD.findall(text.lower())
+        k = self.shingle_size
+        if len(words) < k:
+            shingles = {' '.join(words)} if words else set()
+        else:
+            shingles = {' '.join(words[i:i + k]) for i in range(len(words) - k + 1)}
+        return stable_hashes(shingles)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """Firma uint32 de longitud num_perm; None si el texto no tiene palabras."""
+        hashes = self.shingle_hashes(text)
+        if hashes.size == 0:
+            return None
+        # (a*x + b) mod p, truncado a 32 bits; el overflow de uint64 es intencional
+        permuted = (np.outer(hashes, self.a) + self.b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    """
+    Índice LSH persistente.
+
+    Uso típico:
+        index = NearDuplicateIndex.from_config(config['near_duplicates'])
+        match = index.check_and_add(conversation_id, texto)   # None si es nueva
+        index.save()
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, shingle_size: int = 3,
+                 seed: int = 1, path: Optional[str] = None, merge_every: int = 20000):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = seed
+        self.path = Path(path) if path else None
+        self.merge_every = merge_every
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.hasher = MinHasher(num_perm, shingle_size, seed)
+        self.bands, self.rows = optimal_bands(threshold, num_perm)
+        rng = np.random.RandomState(seed + 1)
+        self._row_multipliers = rng.randint(1, 1 << 62, size=self.rows, dtype=np.uint64) | np.uint64(1)
+        self._band_salts = rng.randint(0, 1 << 62, size=self.bands, dtype=np.uint64)
+
+        self.doc_ids = []
+        self._signatures = np.empty((0, num_perm), dtype=np.uint8)
+        self._sorted_keys = np.empty(0, dtype=np.uint64)
+        self._sorted_docs = np.empty(0, dtype=np.int32)
+        self._pending = {}
+        self._pending_docs = 0
+        self.stats = {'queries': 0, 'duplicates': 0, 'candidates_checked': 0}
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> Optional['NearDuplicateIndex']:
+        """
+        Arma el índice desde la sección `near_duplicates`; None si está
+        deshabilitado. Si `index_path` ya existe se reutiliza, siempre que los
+        parámetros de INDEX_PARAMS que fija la configuración coincidan con los
+        del índice guardado (ValueError si no).
+        """
+        if not config or not config.get('enabled', True):
+            return None
+        cfg = {**DEFAULTS, **config}
+        path = cfg.get('index_path')
+        if path and Path(path).exists():
+            index = cls.load(path)
+            mismatched = {key: (getattr(index, key), config[key]) for key in INDEX_PARAMS
+                          if key in config and config[key] != getattr(index, key)}
+            if mismatched:
+                details = ', '.join(f"{key}={saved} (config: {configured})"
+                                    for key, (saved, configured) in mismatched.items())
+                raise ValueError(f"El índice de casi-duplicados {path} se armó con otros "
+                                 f"parámetros: {details}. Bórralo o ajusta la configuración.")
+            index.merge_every = cfg['merge_every']
+            return index
+        return cls(threshold=cfg['threshold'], num_perm=cfg['num_perm'],
+                   shingle_size=cfg['shingle_size'], seed=cfg['seed'], path=path,
+                   merge_every=cfg['merge_every'])
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def band_keys(self, signature: np.ndarray) -> np.ndarray:
+        """Una clave uint64 por banda (incluye la banda, así conviven en un solo arreglo)."""
+        bands = signature[:self.bands * self.rows].astype(np.uint64).reshape(self.bands, self.rows)
+        return (bands * self._row_multipliers).sum(axis=1) ^ self._band_salts
+
+    def _candidates(self, keys: np.ndarray) -> np.ndarray:
+        found = []
+        if self._sorted_keys.size:
+            left = np.searchsorted(self._sorted_keys, keys, side='left')
+            right = np.searchsorted(self._sorted_keys, keys, side='right')
+            for lo, hi in zip(left[left < right], right[left < right]):
+                found.append(self._sorted_docs[lo:hi])
+        for key in keys.tolist():
+            if key in self._pending:
+                found.append(np.asarray(self._pending[key], dtype=np.int32))
+        if not found:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate(found))
+
+    def query(self, signature: np.ndarray) -> List[Tuple[str, float]]:
+        """Documentos indexados con Jaccard estimado >= threshold, de mayor a menor."""
+        self.stats['queries'] += 1
+        candidates = self._candidates(self.band_keys(signature))
+        if candidates.size == 0:
+            return []
+        self.stats['candidates_checked'] += int(candidates.size)
+
+        # Estimador b-bit: descontar las coincidencias por azar de 8 bits
+        matches = (self._signatures[candidates] == signature.astype(np.uint8)).mean(axis=1)
+        similarity = (matches - _B_BITS_COLLISION) / (1 - _B_BITS_COLLISION)
+        keep = similarity >= self.threshold
+        order = np.argsort(-similarity[keep])
+        return [(self.doc_ids[doc], float(sim))
+                for doc, sim in zip(candidates[keep][order], similarity[keep][order])]
+
+    def add(self, doc_id: str, signature: np.ndarray) -> None:
+        position = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        if position >= self._signatures.shape[0]:
+            grown = np.empty((max(1024, 2 * self._signatures.shape[0]), self.num_perm), dtype=np.uint8)
+            grown[:position] = self._signatures[:position]
+            self._signatures = grown
+        self._signatures[position] = signature.astype(np.uint8)
+
+        for key in self.band_keys(signature).tolist():
+            self._pending.setdefault(key, []).append(position)
+        self._pending_docs += 1
+        if self._pending_docs >= self.merge_every:
+            self.merge()
+
+    def merge(self) -> None:
+        """Fusiona el buffer de insertos en el arreglo ordenado."""
+        if not self._pending:
+            return
+        keys = np.fromiter(
+            (key for key, docs in self._pending.items() for _ in docs),
+            dtype=np.uint64
+        )
+        docs = np.fromiter(
+            (doc for docs in self._pending.values() for doc in docs), dtype=np.int32
+        )
+        all_keys = np.concatenate([self._sorted_keys, keys])
+        all_docs = np.concatenate([self._sorted_docs, docs])
+        # mergesort aprovecha que la parte existente ya está ordenada
+        order = np.argsort(all_keys, kind='mergesort')
+        self._sorted_keys, self._sorted_docs = all_keys[order], all_docs[order]
+        self._pending = {}
+        self._pending_docs = 0
+
+    def check_and_add(self, doc_id: str, text: str) -> Optional[Tuple[str, float]]:
+        """
+        Devuelve (id_existente, similitud) si `text` es casi-duplicado de algo
+        indexado; si no, lo agrega al índice y devuelve None.
+        """
+        signature = self.hasher.signature(text)
+        if signature is None:
+            return None
+        matches = self.query(signature)
+        if any(match_id == doc_id for match_id, _ in matches):
+            # El mismo documento reprocesado (p. ej. una corrida servida desde caché)
+            return None
+        if matches:
+            self.stats['duplicates'] += 1
+            return matches[0]
+        self.add(doc_id, signature)
+        return None
+
+    def save(self, path: Optional[str] = None) -> Path:
+        """Guarda el índice (.npz) de forma atómica."""
+        path = Path(path or self.path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.merge()
+        params = {'threshold': self.threshold, 'num_perm': self.num_perm,
+                  'shingle_size': self.shingle_size, 'seed': self.seed,
+                  'merge_every': self.merge_every}
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, params=np.array(json.dumps(params)),
+                     doc_ids=np.array(self.doc_ids, dtype=str),
+                     signatures=self._signatures[:len(self.doc_ids)],
+                     sorted_keys=self._sorted_keys, sorted_docs=self._sorted_docs)
+        os.replace(tmp_path, path)
+        self.path = path
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> 'NearDuplicateIndex':
+        with np.load(path) as data:
+            params = json.loads(str(data['params']))
+            index = cls(path=path, **params)
+            index.doc_ids = data['doc_ids'].tolist()
+            index._signatures = data['signatures'].copy()
+            index._sorted_keys = data['sorted_keys'].copy()
+            index._sorted_docs = data['sorted_docs'].copy()
+        return index
+
+    def get_stats(self) -> Dict:
+        return {**self.stats, 'indexed': len(self), 'bands': self.bands, 'rows': self.rows}
+
+
+def iter_records(paths: Iterable[Path]) -> Iterator[Dict]:
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def dedup_corpus(input_paths: Iterable[Path], output_path: Path,
+                 index: NearDuplicateIndex, report_path: Optional[Path] = None) -> Dict:
+    """
+    Pasada de deduplicación sobre JSONL existentes: conserva la primera
+    aparición de cada grupo de casi-duplicados y reporta los descartes.
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    kept = removed = 0
+    report = open(report_path, 'w', encoding='utf-8') if report_path else None
+    try:
+        with open(output_path, 'w', encoding='utf-8') as out:
+            for position, record in enumerate(iter_records(input_paths)):
+                doc_id = str(record.get('conversation_id', position))
+                match = index.check_and_add(doc_id, conversation_text(record))
+                if match is not None:
+                    removed += 1
+                    if report:
+                        report.write(json.dumps({'conversation_id': doc_id,
+                                                 'duplicate_of': match[0],
+                                                 'similarity': round(match[1], 4)}) + '\n')
+                    continue
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                kept += 1
+    finally:
+        if report:
+            report.close()
+    return {'kept': kept, 'removed': removed, 'output_file': str(output_path)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Deduplicación de conversaciones (MinHash-LSH)')
+    parser.add_argument('--input', '-i', nargs='+', required=True, help='Archivos JSONL')
+    parser.add_argument('--output', '-o', required=True, help='JSONL deduplicado')
+    parser.add_argument('--report', default=None, help='JSONL con los descartes')
+    parser.add_argument('--index', default=None,
+                        help='Índice .npz a usar y actualizar (p. ej. el de la generación)')
+    parser.add_argument('--threshold', type=float, default=DEFAULTS['threshold'])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.index and Path(args.index).exists():
+        index = NearDuplicateIndex.load(args.index)
+    else:
+        index = NearDuplicateIndex(threshold=args.threshold, path=args.index)
+    result = dedup_corpus([Path(p) for p in args.input], Path(args.output), index,
+                          Path(args.report) if args.report else None)
+    if args.index:
+        index.save()
+
+    print(f"✅ Conservadas {result['kept']} conversaciones, descartadas {result['removed']}")
+    print(f"📁 {result['output_file']}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -1,15 +1,213 @@
+#!/usr/bin/env python3
 """
-Módulo placeholder - TODO: Implementar
+Análisis de patrones del corpus anonimizado (Step 2 del pipeline), en streaming por shard.
+
+Uso:
+    python scripts/pattern_analyzer.py --input data/anonymized/ --workers 4
 """
+
+import argparse
+import json
 import logging
-from typing import Dict, List
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import repeat
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Agregar el directorio raíz al path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.patterns.clusters import CLUSTERING_DEFAULTS, ConversationClusterer
+from scripts.patterns.corpus import (conversation_messages, iter_conversations, load_taxonomy,
+                                     shard_paths)
+from scripts.patterns.intents import IntentStats
+from scripts.patterns.shape_stats import ShapeStats
+from scripts.patterns.temporal import TemporalFeatures
+from scripts.patterns.transitions import TransitionStats
+from scripts.patterns.vocabulary import VocabularyStats
+
+PATTERN_DEFAULTS = {
+    'min_conversation_length': 3,
+    'max_conversation_length': 50,
+    'vocabulary_size_limit': 10000,
+    'ngram_range': [1, 3],
+    'top_k_ngrams': 2000,
+    'count_min': {'epsilon': 0.0001, 'delta': 0.01, 'seed': 1},
+    'intent_detection_method': 'heuristic',
+    'workers': 1,
+    'file_pattern': '*.json*',
+    'output_dir': 'data/patterns',
+    'clustering': CLUSTERING_DEFAULTS,
+}
+
+# Acumuladores de la pasada: nombre -> constructor a partir de la config.
+# Cada uno implementa add(conversación), merge(otro), summary() y save(dir);
+# un constructor que devuelve None deja el acumulador desactivado.
+ACCUMULATORS = {
+    'vocabulary': VocabularyStats.from_config,
+    'shape': ShapeStats.from_config,
+    'intents': IntentStats.from_config,
+    'transitions': TransitionStats.from_config,
+    'temporal': TemporalFeatures.from_config,
+}
+
+
+def _analyze_shard(config: Dict, path: Path) -> Tuple[Dict, Dict]:
+    """Punto de entrada de los procesos worker."""
+    return PatternAnalyzer(config).analyze_conversations(iter_conversations(path))
 
-class PlaceholderClass:
-    def __init__(self, config: Dict):
-        self.config = config
+
+class PatternAnalyzer:
+    """
+    Orquesta la pasada de análisis sobre los shards del corpus anonimizado.
+    """
+
+    def __init__(self, config: Dict, output_dir: Union[str, Path, None] = None):
+        self.config = {**PATTERN_DEFAULTS, **(config or {})}
+        self.output_dir = Path(output_dir or self.config['output_dir'])
         self.logger = logging.getLogger(self.__class__.__name__)
-        
-    def process(self, data):
-        """TODO: Implementar procesamiento"""
-        self.logger.info(f"Procesando con {self.__class__.__name__}")
-        return data
+
+    def new_accumulators(self) -> Dict:
+        accumulators = {name: factory(self.config) for name, factory in ACCUMULATORS.items()}
+        return {name: acc for name, acc in accumulators.items() if acc is not None}
+
+    def skip_reason(self, conversation: Dict) -> Optional[str]:
+        """'skipped_short'/'skipped_long' si la conversación queda fuera de los límites."""
+        length = len(conversation_messages(conversation))
+        if length < self.config['min_conversation_length']:
+            return 'skipped_short'
+        high = self.config['max_conversation_length']
+        if high and length > high:
+            return 'skipped_long'
+        return None
+
+    def analyze_conversations(self, conversations: Iterable[Dict]) -> Tuple[Dict, Dict]:
+        """Pasada sobre un iterable de conversaciones: (acumuladores, estadísticas)."""
+        accumulators = self.new_accumulators()
+        stats = {'conversations_seen': 0, 'conversations_analyzed': 0,
+                 'skipped_short': 0, 'skipped_long': 0}
+
+        for conversation in conversations:
+            stats['conversations_seen'] += 1
+            skipped = self.skip_reason(conversation)
+            if skipped:
+                stats[skipped] += 1
+                continue
+            stats['conversations_analyzed'] += 1
+            for accumulator in accumulators.values():
+                accumulator.add(conversation)
+        return accumulators, stats
+
+    @staticmethod
+    def merge(results: Iterable[Tuple[Dict, Dict]]) -> Tuple[Dict, Dict]:
+        merged_accumulators, merged_stats = None, None
+        for accumulators, stats in results:
+            if merged_accumulators is None:
+                merged_accumulators, merged_stats = accumulators, dict(stats)
+                continue
+            for name, accumulator in accumulators.items():
+                merged_accumulators[name].merge(accumulator)
+            for key, value in stats.items():
+                merged_stats[key] += value
+        return merged_accumulators, merged_stats
+
+    def analyze(self, inputs: Sequence[Union[str, Path]]) -> Dict:
+        """Analiza archivos o directorios de conversaciones y escribe los artefactos."""
+        shards = shard_paths(inputs, self.config['file_pattern'])
+        if not shards:
+            raise ValueError(f"No hay conversaciones para analizar en {list(inputs)}")
+        workers = min(int(self.config.get('workers') or 1), len(shards))
+        self.logger.info(f"Analizando {len(shards)} shards con {workers} workers")
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                accumulators, stats = self.merge(
+                    executor.map(_analyze_shard, repeat(self.config), shards))
+        else:
+            accumulators, stats = self.merge(_analyze_shard(self.config, shard) for shard in shards)
+        stats['shards'] = len(shards)
+
+        clustering = {**CLUSTERING_DEFAULTS, **(self.config.get('clustering') or {})}
+        if clustering['enabled']:
+            accumulators['clusters'] = self.cluster(shards, clustering)
+        return self.save(accumulators, stats)
+
+    def iter_analyzed(self, shards: List[Path]) -> Iterator[Tuple[str, Dict]]:
+        """(conversation_id, conversación) de los shards, con los mismos filtros de largo."""
+        for shard in shards:
+            for i, conversation in enumerate(iter_conversations(shard)):
+                if self.skip_reason(conversation):
+                    continue
+                conversation_id = conversation.get('conversation_id') if isinstance(
+                    conversation, dict) else None
+                yield str(conversation_id or f"{shard.name}:{i}"), conversation
+
+    def cluster(self, shards: List[Path], clustering: Dict) -> ConversationClusterer:
+        """
+        Etapa de clustering: `epochs` pasadas de partial_fit y una de
+        asignación, en secuencia sobre los shards.
+        """
+        profiles = load_taxonomy(self.config.get('taxonomy_path'))['dimensions']['profile_id']
+        clusterer = ConversationClusterer.from_config(clustering, profiles=profiles)
+        for epoch in range(int(clustering['epochs'])):
+            seen = clusterer.fit(conversation for _, conversation in self.iter_analyzed(shards))
+            self.logger.info(f"Clustering: época {epoch + 1}, {seen} conversaciones")
+        clusterer.assign(self.iter_analyzed(shards))
+        return clusterer
+
+    def save(self, accumulators: Dict, stats: Dict) -> Dict:
+        files = {}
+        for accumulator in accumulators.values():
+            files.update(accumulator.save(self.output_dir))
+
+        report = {
+            'generated_at': datetime.now().isoformat(),
+            'statistics': stats,
+            'summaries': {name: acc.summary() for name, acc in accumulators.items()},
+            'files': files,
+        }
+        summary_path = self.output_dir / 'patterns_summary.json'
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        files['summary'] = str(summary_path)
+
+        self.logger.info(
+            f"Patrones: {stats['conversations_analyzed']}/{stats['conversations_seen']} "
+            f"conversaciones analizadas → {self.output_dir}"
+        )
+        return {**report, 'output_dir': str(self.output_dir)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Análisis de patrones del corpus anonimizado')
+    parser.add_argument('--input', '-i', nargs='+', default=['data/anonymized/'],
+                        help='Archivos o directorios (JSON/JSONL)')
+    parser.add_argument('--output-dir', '-o', default=None)
+    parser.add_argument('--config', default=None,
+                        help='Config del pipeline (usa la sección pattern_analysis)')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    config = {}
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = json.load(f).get('pattern_analysis', {})
+    if args.workers:
+        config['workers'] = args.workers
+
+    report = PatternAnalyzer(config, output_dir=args.output_dir).analyze(args.input)
+    stats = report['statistics']
+    print(f"\n✅ {stats['conversations_analyzed']} conversaciones analizadas "
+          f"({stats['skipped_short']} cortas, {stats['skipped_long']} largas omitidas)")
+    for name, path in report['files'].items():
+        print(f"   - {name}: {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
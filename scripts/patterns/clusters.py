@@ -0,0 +1,201 @@
+"""
+Clustering out-of-core de conversaciones para descubrir arquetipos de perfil.
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.feature_extraction.text import HashingVectorizer
+
+from scripts.patterns.corpus import conversation_messages, is_nadia, message_text, ngrams, tokenize
+
+CLUSTERING_DEFAULTS = {
+    'enabled': True,
+    'n_clusters': 12,
+    'n_features': 2 ** 18,
+    'ngram_range': [1, 2],
+    'batch_size': 4096,
+    'epochs': 1,
+    'n_representatives': 5,
+    'seed': 42,
+}
+
+
+def _documents_are_tokens(document):
+    return document
+
+
+def conversation_features(conversation: Dict, ngram_range: Sequence[int] = (1, 2)) -> List[str]:
+    """
+    Términos de una conversación. Los de Nadia llevan prefijo para que el
+    arquetipo lo defina sobre todo lo que escribe el usuario.
+    """
+    features = []
+    for message in conversation_messages(conversation):
+        tokens = tokenize(message_text(message))
+        prefix = 'n:' if is_nadia(message) else ''
+        for n in range(ngram_range[0], ngram_range[1] + 1):
+            features.extend(prefix + gram for gram in ngrams(tokens, n))
+    return features
+
+
+class ConversationClusterer:
+    """
+    Args:
+        n_clusters: cantidad de arquetipos
+        n_features: dimensión del espacio de hashing
+        ngram_range: n-gramas (dentro de cada mensaje) usados como términos
+        batch_size: conversaciones por llamada a partial_fit
+        n_representatives: conversaciones guardadas por cluster
+        seed: semilla de MiniBatchKMeans
+    """
+
+    def __init__(self, n_clusters: int = 12, n_features: int = 2 ** 18,
+                 ngram_range: Sequence[int] = (1, 2), batch_size: int = 4096,
+                 n_representatives: int = 5, seed: int = 42, profiles: Sequence[str] = ()):
+        self.n_clusters = n_clusters
+        self.ngram_range = (int(ngram_range[0]), int(ngram_range[1]))
+        self.batch_size = batch_size
+        self.n_representatives = n_representatives
+        self.profiles = list(profiles)
+        self.vectorizer = HashingVectorizer(n_features=n_features, analyzer=_documents_are_tokens,
+                                            alternate_sign=False, norm='l2')
+        self.kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size,
+                                      random_state=seed, n_init=1)
+        self.fitted = False
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._reset_assignments()
+
+    @classmethod
+    def from_config(cls, config: Dict, profiles: Sequence[str] = ()) -> 'ConversationClusterer':
+        config = {**CLUSTERING_DEFAULTS, **(config or {})}
+        return cls(n_clusters=config['n_clusters'], n_features=config['n_features'],
+                   ngram_range=config['ngram_range'], batch_size=config['batch_size'],
+                   n_representatives=config['n_representatives'], seed=config['seed'],
+                   profiles=profiles)
+
+    def _reset_assignments(self) -> None:
+        self.sizes = np.zeros(self.n_clusters, dtype=np.int64)
+        self.inertia = np.zeros(self.n_clusters, dtype=float)
+        self.profile_counts = np.zeros((self.n_clusters, len(self.profiles)), dtype=np.int64)
+        # Representantes: distancias e ids, ordenados de más cercano a más lejano
+        self.best_distances = np.full((self.n_clusters, self.n_representatives), np.inf)
+        self.best_ids = np.full((self.n_clusters, self.n_representatives), None, dtype=object)
+
+    def vectorize(self, conversations: Sequence[Dict]):
+        return self.vectorizer.transform(
+            conversation_features(conversation, self.ngram_range) for conversation in conversations)
+
+    def batches(self, conversations: Iterable[Dict]) -> Iterable[List[Dict]]:
+        batch = []
+        for conversation in conversations:
+            batch.append(conversation)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def fit(self, conversations: Iterable[Dict]) -> int:
+        """Una época de partial_fit; devuelve las conversaciones vistas."""
+        seen = 0
+        pending: List[Dict] = []
+        for batch in self.batches(conversations):
+            # El primer lote tiene que alcanzar para inicializar los centroides
+            pending.extend(batch)
+            if not self.fitted and len(pending) < self.n_clusters:
+                continue
+            self.kmeans.partial_fit(self.vectorize(pending))
+            self.fitted = True
+            seen += len(pending)
+            pending = []
+        if pending:
+            self.logger.warning(f"Solo {len(pending)} conversaciones para {self.n_clusters} "
+                                f"clusters: no se entrena el clustering")
+        return seen
+
+    def assign(self, conversations: Iterable[Tuple[str, Dict]]) -> None:
+        """Asigna (id, conversación) a su cluster y actualiza tamaños y representantes."""
+        if not self.fitted:
+            return
+        for batch in self.batches(conversations):
+            ids = np.array([conversation_id for conversation_id, _ in batch], dtype=object)
+            distances = self.kmeans.transform(self.vectorize([c for _, c in batch]))
+            labels = distances.argmin(axis=1)
+            distance = distances[np.arange(len(batch)), labels]
+
+            self.sizes += np.bincount(labels, minlength=self.n_clusters)
+            self.inertia += np.bincount(labels, weights=distance ** 2, minlength=self.n_clusters)
+            if self.profiles:
+                index = {profile: i for i, profile in enumerate(self.profiles)}
+                profile = np.array([index.get(c.get('profile_id') or
+                                              (c.get('metadata') or {}).get('profile_id'), -1)
+                                    for _, c in batch])
+                known = profile >= 0
+                self.profile_counts += np.bincount(
+                    labels[known] * len(self.profiles) + profile[known],
+                    minlength=self.profile_counts.size).reshape(self.profile_counts.shape)
+            self._update_representatives(labels, distance, ids)
+
+    def _update_representatives(self, labels: np.ndarray, distance: np.ndarray,
+                                ids: np.ndarray) -> None:
+        r = self.n_representatives
+        clusters = np.concatenate((np.repeat(np.arange(self.n_clusters), r), labels))
+        distances = np.concatenate((self.best_distances.ravel(), distance))
+        candidates = np.concatenate((self.best_ids.ravel(), ids))
+        order = np.lexsort((distances, clusters))
+        # Posición de cada candidato dentro de su cluster tras ordenar
+        sorted_clusters = clusters[order]
+        starts = np.searchsorted(sorted_clusters, np.arange(self.n_clusters))
+        rank = np.arange(order.size) - starts[sorted_clusters]
+        keep = order[rank < r]
+        self.best_distances[clusters[keep], rank[rank < r]] = distances[keep]
+        self.best_ids[clusters[keep], rank[rank < r]] = candidates[keep]
+
+    def clusters(self) -> List[Dict]:
+        total = max(int(self.sizes.sum()), 1)
+        result = []
+        for k in range(self.n_clusters):
+            found = np.isfinite(self.best_distances[k])
+            entry = {
+                'cluster': k,
+                'size': int(self.sizes[k]),
+                'share': round(self.sizes[k] / total, 4),
+                'mean_sq_distance': round(self.inertia[k] / self.sizes[k], 6)
+                if self.sizes[k] else None,
+                'representatives': [{'conversation_id': conversation_id,
+                                     'distance': round(float(distance), 6)}
+                                    for conversation_id, distance in
+                                    zip(self.best_ids[k][found], self.best_distances[k][found])],
+            }
+            if self.profiles:
+                entry['profile_counts'] = dict(zip(self.profiles,
+                                                   self.profile_counts[k].tolist()))
+            result.append(entry)
+        return result
+
+    def summary(self) -> Dict:
+        return {'fitted': self.fitted, 'n_clusters': self.n_clusters,
+                'conversations': int(self.sizes.sum()),
+                'largest_share': round(float(self.sizes.max() / max(self.sizes.sum(), 1)), 4)}
+
+    def save(self, output_dir: Path) -> Dict[str, str]:
+        if not self.fitted:
+            return {}
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        centroids_path = output_dir / 'cluster_centroids.npz'
+        np.savez_compressed(centroids_path,
+                            centroids=self.kmeans.cluster_centers_.astype(np.float32),
+                            n_features=self.vectorizer.n_features,
+                            ngram_range=np.array(self.ngram_range))
+        path = output_dir / 'clusters.json'
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({**self.summary(), 'n_features': self.vectorizer.n_features,
+                       'ngram_range': list(self.ngram_range), 'clusters': self.clusters()},
+                      f, indent=2, ensure_ascii=False)
+        return {'clusters': str(path), 'cluster_centroids': str(centroids_path)}
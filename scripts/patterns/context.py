@@ -0,0 +1,124 @@
+"""
+Contexto acotado de una conversación (ventana de turnos + resumen) para los
+prompts del anotador y del generador.
+"""
+
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from scripts.patterns.corpus import is_nadia, message_label, message_text
+
+CONTEXT_DEFAULTS = {
+    'window_turns': 6,
+    'max_turn_chars': 200,
+    'max_state_runs': 4,
+}
+
+STATE_DIMENSIONS = ('rapport_stage', 'customer_status')
+
+
+class ConversationContext:
+    """
+    Args:
+        window_turns: turnos que se muestran completos (los más recientes)
+        max_turn_chars: largo máximo de cada turno renderizado
+        max_state_runs: tramos del recorrido de estado que guarda el resumen
+        state: etiquetas a nivel conversación (p. ej. customer_status del registro)
+    """
+
+    def __init__(self, window_turns: int = 6, max_turn_chars: int = 200,
+                 max_state_runs: int = 4, state: Optional[Dict] = None):
+        self.max_turn_chars = max_turn_chars
+        # Cada turno: (línea renderizada, es de Nadia, etiquetas de estado del turno)
+        self.window: Deque[Tuple[str, bool, Dict]] = deque(maxlen=window_turns)
+        self.turns = 0
+        self.earlier = {'turns': 0, 'user': 0, 'nadia': 0}
+        self.state = {dimension: None for dimension in STATE_DIMENSIONS}
+        # Recorrido de estado previo a la ventana: tramos [etiqueta, turnos]
+        self.runs: Dict[str, Deque[List]] = {dimension: deque(maxlen=max_state_runs)
+                                             for dimension in STATE_DIMENSIONS}
+        self.omitted_runs = {dimension: 0 for dimension in STATE_DIMENSIONS}
+        self._summary: Optional[str] = None
+        for dimension, label in (state or {}).items():
+            if dimension in self.state and label:
+                self.state[dimension] = label
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict],
+                    state: Optional[Dict] = None) -> Optional['ConversationContext']:
+        """Contexto nuevo según la sección `context`; None si está deshabilitado."""
+        if config is None:
+            return None
+        config = {**CONTEXT_DEFAULTS, **config}
+        if int(config['window_turns']) <= 0:
+            return None
+        return cls(window_turns=int(config['window_turns']),
+                   max_turn_chars=int(config['max_turn_chars']),
+                   max_state_runs=int(config['max_state_runs']), state=state)
+
+    def __len__(self) -> int:
+        return self.turns
+
+    def render_turn(self, message: Dict) -> str:
+        text = ' '.join(message_text(message).split())
+        if len(text) > self.max_turn_chars:
+            text = text[:self.max_turn_chars - 1].rstrip() + '…'
+        return f"{'nadia' if is_nadia(message) else 'user'}: {text}"
+
+    def push(self, message: Dict) -> None:
+        """Agrega un turno; el que sale de la ventana pasa al resumen."""
+        labels = {}
+        for dimension in STATE_DIMENSIONS:
+            label = message_label(message, dimension)
+            if label:
+                labels[dimension] = label
+                self.state[dimension] = label
+        if len(self.window) == self.window.maxlen:
+            self._fold(*self.window[0])
+        self.window.append((self.render_turn(message), is_nadia(message), labels))
+        self.turns += 1
+
+    def _fold(self, line: str, nadia: bool, labels: Dict) -> None:
+        self.earlier['turns'] += 1
+        self.earlier['nadia' if nadia else 'user'] += 1
+        for dimension, label in labels.items():
+            runs = self.runs[dimension]
+            if runs and runs[-1][0] == label:
+                runs[-1][1] += 1
+                continue
+            if len(runs) == runs.maxlen:
+                self.omitted_runs[dimension] += 1
+            runs.append([label, 1])
+        self._summary = None
+
+    def summary(self) -> str:
+        """Resumen de los turnos fuera de la ventana ('' si no hay)."""
+        if not self.earlier['turns']:
+            return ''
+        if self._summary is None:
+            parts = [f"{self.earlier['turns']} turnos previos "
+                     f"({self.earlier['user']} usuario, {self.earlier['nadia']} Nadia)"]
+            for dimension in STATE_DIMENSIONS:
+                if self.runs[dimension]:
+                    path = ' → '.join(f"{label} ({turns})" for label, turns in self.runs[dimension])
+                    if self.omitted_runs[dimension]:
+                        path = '… → ' + path
+                    parts.append(f"{dimension}: {path}")
+            self._summary = '; '.join(parts)
+        return self._summary
+
+    def current_state(self) -> Dict:
+        return {dimension: label for dimension, label in self.state.items() if label}
+
+    def render(self) -> str:
+        """Resumen + estado vigente + ventana, listo para el prompt ('' si está vacío)."""
+        lines = []
+        summary = self.summary()
+        if summary:
+            lines.append(f"[Antes: {summary}]")
+        state = self.current_state()
+        if state:
+            lines.append('[Estado: ' + ', '.join(f"{dimension}={label}"
+                                                 for dimension, label in state.items()) + ']')
+        lines.extend(line for line, _, _ in self.window)
+        return '\n'.join(lines)
@@ -0,0 +1,158 @@
+"""
+Lectura en streaming del corpus anonimizado (JSONL, arreglos JSON o conversaciones sueltas).
+"""
+
+import json
+import re
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+# Marcadores del anonimizador ([EMAIL_REMOVED], ...) se conservan como un token
+_TOKEN = re.compile(r'\[[A-Z_]+\]|\w+')
+_WHITESPACE_OR_COMMA = re.compile(r'[\s,]*')
+# Pictogramas, símbolos, dingbats y banderas (incluye el rango de llm_quality_checker)
+EMOJI_RANGES = [(0x1F1E6, 0x1F1FF), (0x1F300, 0x1FAFF), (0x2600, 0x27BF), (0x2B50, 0x2B50)]
+EMOJI = re.compile('[' + ''.join(f"{chr(low)}-{chr(high)}" for low, high in EMOJI_RANGES) + ']')
+TIMESTAMP_FIELDS = ('timestamp', 'date', 'created_at', 'time')
+
+NADIA_AUTHORS = ('nadia', 'assistant', 'bot', 'model')
+DEFAULT_TAXONOMY_PATH = Path(__file__).parent.parent.parent / 'config' / 'taxonomy_v2.json'
+CHUNK_CHARS = 1 << 20
+
+
+def load_taxonomy(path: Union[str, Path, None] = None) -> Dict:
+    """Taxonomía de etiquetas (config/taxonomy_v2.json por defecto)."""
+    with open(path or DEFAULT_TAXONOMY_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def fsm_mask(states: Sequence[str], rules: Dict[str, Sequence[str]]) -> np.ndarray:
+    """Matriz booleana de una FSM de `transition_rules`; permanecer siempre vale."""
+    index = {state: i for i, state in enumerate(states)}
+    allowed = np.eye(len(states), dtype=bool)
+    for source, targets in rules.items():
+        if source.startswith('_'):
+            continue
+        for target in targets:
+            if source not in index or target not in index:
+                raise ValueError(f"Transición con etapa desconocida: {source} → {target}")
+            allowed[index[source], index[target]] = True
+    return allowed
+
+
+def iter_json_array(f, chunk_chars: int = CHUNK_CHARS) -> Iterator:
+    """Elementos de un arreglo JSON leídos por fragmentos."""
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_chars).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError("Se esperaba un arreglo JSON")
+    position, eof = 1, False
+    while True:
+        position = _WHITESPACE_OR_COMMA.match(buffer, position).end()
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            end = None
+        # Un valor que termina justo en el borde puede estar cortado
+        if end is None or (end == len(buffer) and not eof):
+            if eof:
+                raise ValueError(f"JSON truncado o inválido cerca del carácter {position}")
+            chunk = f.read(chunk_chars)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item
+        position = end
+
+
+def iter_conversations(path: Union[str, Path]) -> Iterator[Dict]:
+    """Conversaciones de un shard (JSONL, arreglo JSON o conversación suelta)."""
+    path = Path(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.suffix == '.jsonl':
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        head = f.read(1)
+        while head.isspace():
+            head = f.read(1)
+        f.seek(0)
+        if head == '[':
+            yield from iter_json_array(f)
+        else:
+            yield json.load(f)
+
+
+def shard_paths(inputs: Sequence[Union[str, Path]], pattern: str = '*.json*') -> List[Path]:
+    """Archivos a procesar: rutas sueltas o directorios expandidos con `pattern`."""
+    paths = []
+    for item in inputs:
+        item = Path(item)
+        paths.extend(sorted(item.glob(pattern)) if item.is_dir() else [item])
+    return paths
+
+
+def conversation_messages(conversation: Dict) -> List[Dict]:
+    messages = conversation.get('messages', []) if isinstance(conversation, dict) else conversation
+    return [m for m in messages if isinstance(m, dict)]
+
+
+def message_text(message: Dict) -> str:
+    return str(message.get('text') or message.get('content') or '')
+
+
+def is_nadia(message: Dict) -> bool:
+    author = message.get('author') or message.get('role') or message.get('sender') or ''
+    return str(author).lower() in NADIA_AUTHORS
+
+
+def message_timestamp(message: Dict):
+    for field in TIMESTAMP_FIELDS:
+        if message.get(field) is not None:
+            return message[field]
+    return None
+
+
+def message_label(message: Dict, dimension: str):
+    """Etiqueta de una dimensión: en el mensaje o en su bloque `annotations`."""
+    return message.get(dimension) or (message.get('annotations') or {}).get(dimension)
+
+
+def parse_timestamps(values: Sequence) -> np.ndarray:
+    """
+    Convierte timestamps crudos (ISO 8601 o epoch en segundos) a
+    datetime64[s] en UTC, en una sola llamada por lote. Lo que no se puede
+    interpretar queda como NaT.
+    """
+    values = list(values)
+    numeric = np.array([isinstance(v, (int, float)) and not isinstance(v, bool) for v in values],
+                       dtype=bool)
+    result = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[s]')
+    if numeric.any():
+        epochs = np.array([v for v, is_number in zip(values, numeric) if is_number], dtype=float)
+        result[numeric] = epochs.astype('int64').astype('datetime64[s]')
+    text = ~numeric
+    if text.any():
+        parsed = pd.to_datetime(pd.Series([v for v, is_number in zip(values, numeric)
+                                           if not is_number], dtype=object),
+                                utc=True, errors='coerce', format='ISO8601')
+        result[text] = parsed.dt.tz_localize(None).to_numpy(dtype='datetime64[s]')
+    return result
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokens en minúscula; los marcadores de PII quedan como un token."""
+    return [token if token.startswith('[') else token.lower() for token in _TOKEN.findall(text)]
+
+
+def ngrams(tokens: Sequence[str], n: int) -> Iterable[str]:
+    if n == 1:
+        return tokens
+    return (' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
@@ -0,0 +1,197 @@
+"""
+Detector heurístico de primary_intent (`intent_detection_method: heuristic`)
+compilado desde `intent_rules` de la taxonomía.
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from scripts.patterns.corpus import conversation_messages, is_nadia, load_taxonomy, message_text
+from scripts.utils.aho_corasick import AhoCorasick
+
+
+class IntentDetector:
+    """
+    Args:
+        rules: sección `intent_rules` de la taxonomía
+    """
+
+    def __init__(self, rules: Dict):
+        self.default_intent = rules.get('default_intent', 'SMALL_TALK')
+        self.default_confidence = float(rules.get('default_confidence', 0.3))
+        self.smoothing = float(rules.get('confidence_smoothing', 0.5))
+        multiplier = float(rules.get('phrase_weight_multiplier', 2.0))
+
+        self.intents = list(rules.get('priority') or rules['rules'].keys())
+        for intent in list(rules['rules']) + [self.default_intent]:
+            if intent not in self.intents:
+                self.intents.append(intent)
+        index = {intent: i for i, intent in enumerate(self.intents)}
+
+        # Un patrón por (texto, intención); si se repite se queda el mayor peso
+        entries = {}
+        for intent, rule in rules['rules'].items():
+            weight = float(rule.get('weight', 1.0))
+            for kind, pattern_weight in (('keywords', weight), ('phrases', weight * multiplier)):
+                for raw in rule.get(kind, []):
+                    key = (raw, index[intent])
+                    entries[key] = max(entries.get(key, 0.0), pattern_weight)
+
+        self.patterns = [raw for raw, _ in entries]
+        self.automaton = AhoCorasick.from_wildcards(self.patterns)
+        self.pattern_intent = np.array([i for _, i in entries], dtype=np.int64)
+        self.pattern_weight = np.array(list(entries.values()), dtype=float)
+
+        # Desempate: bono ínfimo decreciente según la prioridad
+        self._tiebreak = np.linspace(1e-6, 0, len(self.intents), endpoint=False)
+        self.overrides = [([index[i] for i in o['when_all']], index[o['intent']])
+                          for o in rules.get('overrides', [])]
+
+    @classmethod
+    def from_taxonomy(cls, path: Union[str, Path, None] = None) -> 'IntentDetector':
+        return cls(load_taxonomy(path)['intent_rules'])
+
+    def scores(self, texts: Sequence[str]) -> np.ndarray:
+        """Matriz mensajes x intenciones con la suma de pesos de patrones distintos."""
+        rows, pattern_ids = self.automaton.find_all(texts)
+        scores = np.zeros((len(texts), len(self.intents)), dtype=float)
+        if rows.size:
+            # Cada patrón cuenta una vez por mensaje aunque aparezca varias veces
+            pairs = np.unique(rows * len(self.patterns) + pattern_ids)
+            rows, pattern_ids = pairs // len(self.patterns), pairs % len(self.patterns)
+            np.add.at(scores, (rows, self.pattern_intent[pattern_ids]),
+                      self.pattern_weight[pattern_ids])
+        # Override: el puntaje de las intenciones combinadas pasa a la intención destino
+        for required, target in self.overrides:
+            fires = np.flatnonzero((scores[:, required] > 0).all(axis=1))
+            moved = scores[np.ix_(fires, required)].sum(axis=1)
+            scores[np.ix_(fires, required)] = 0.0
+            scores[fires, target] += moved
+        return scores
+
+    def classify(self, texts: Sequence[str]) -> Dict[str, np.ndarray]:
+        """
+        Clasifica un lote. Devuelve arreglos alineados con `texts`:
+        primary_intent (str), confidence (float) y matched (bool).
+        """
+        texts = [text or '' for text in texts]
+        scores = self.scores(texts)
+        best = np.argmax(scores + self._tiebreak, axis=1)
+        best_score = scores[np.arange(len(texts)), best]
+        total = scores.sum(axis=1)
+        matched = best_score > 0
+
+        intents = np.array(self.intents, dtype=object)[best]
+        intents[~matched] = self.default_intent
+        with np.errstate(invalid='ignore', divide='ignore'):
+            confidence = best_score / (total + self.smoothing)
+        confidence = np.where(matched, confidence, self.default_confidence)
+        return {'primary_intent': intents, 'confidence': np.round(confidence, 4),
+                'matched': matched}
+
+    def detect(self, text: str) -> Dict:
+        """Un mensaje: intención, confianza y patrones que coincidieron."""
+        result = self.classify([text])
+        _, pattern_ids = self.automaton.find_all([text or ''])
+        return {
+            'primary_intent': result['primary_intent'][0],
+            'confidence': float(result['confidence'][0]),
+            'matched_patterns': sorted({self.patterns[i] for i in pattern_ids.tolist()}),
+        }
+
+
+class IntentStats:
+    """
+    Acumulador del PatternAnalyzer: distribución de intenciones detectadas
+    en mensajes de usuario, en total y en el mensaje que abre la conversación.
+    """
+
+    def __init__(self, detector: IntentDetector, block_size: int = 20000,
+                 low_confidence: float = 0.5):
+        self.detector = detector
+        self.block_size = block_size
+        self.low_confidence = low_confidence
+        size = len(detector.intents)
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.opening_counts = np.zeros(size, dtype=np.int64)
+        self.confidence_sums = np.zeros(size, dtype=float)
+        self.stats = {'user_messages': 0, 'unmatched': 0, 'low_confidence': 0}
+        self._texts: List[str] = []
+        self._opening: List[bool] = []
+
+    @classmethod
+    def from_config(cls, config: Dict) -> Optional['IntentStats']:
+        if config.get('intent_detection_method', 'heuristic') != 'heuristic':
+            return None
+        return cls(IntentDetector.from_taxonomy(config.get('taxonomy_path')),
+                   low_confidence=config.get('intent_low_confidence', 0.5))
+
+    def add(self, conversation: Dict) -> None:
+        first = True
+        for message in conversation_messages(conversation):
+            if is_nadia(message):
+                continue
+            self._texts.append(message_text(message))
+            self._opening.append(first)
+            first = False
+        if len(self._texts) >= self.block_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._texts:
+            return
+        result = self.detector.classify(self._texts)
+        index = {intent: i for i, intent in enumerate(self.detector.intents)}
+        labels = np.array([index[i] for i in result['primary_intent']], dtype=np.int64)
+        size = len(self.detector.intents)
+        opening = np.array(self._opening, dtype=bool)
+
+        self.counts += np.bincount(labels, minlength=size)
+        self.opening_counts += np.bincount(labels[opening], minlength=size)
+        self.confidence_sums += np.bincount(labels, weights=result['confidence'], minlength=size)
+        self.stats['user_messages'] += len(self._texts)
+        self.stats['unmatched'] += int((~result['matched']).sum())
+        self.stats['low_confidence'] += int((result['confidence'] < self.low_confidence).sum())
+        self._texts, self._opening = [], []
+
+    def merge(self, other: 'IntentStats') -> 'IntentStats':
+        self._flush()
+        other._flush()
+        self.counts += other.counts
+        self.opening_counts += other.opening_counts
+        self.confidence_sums += other.confidence_sums
+        for key, value in other.stats.items():
+            self.stats[key] += value
+        return self
+
+    def distribution(self) -> Dict:
+        self._flush()
+        total = max(int(self.counts.sum()), 1)
+        openings = max(int(self.opening_counts.sum()), 1)
+        return {
+            intent: {
+                'count': int(self.counts[i]),
+                'share': round(self.counts[i] / total, 4),
+                'opening_share': round(self.opening_counts[i] / openings, 4),
+                'mean_confidence': round(self.confidence_sums[i] / self.counts[i], 4)
+                if self.counts[i] else None,
+            }
+            for i, intent in enumerate(self.detector.intents)
+        }
+
+    def summary(self) -> Dict:
+        distribution = self.distribution()
+        top = max(distribution, key=lambda intent: distribution[intent]['count'])
+        return {**self.stats, 'top_intent': top}
+
+    def save(self, output_dir: Path) -> Dict[str, str]:
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        path = output_dir / 'intent_distribution.json'
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({**self.stats, 'method': 'heuristic', 'intents': self.distribution()},
+                      f, indent=2)
+        return {'intent_distribution': str(path)}
@@ -0,0 +1,259 @@
+"""
+Estadísticas de forma de las conversaciones (fidelidad estadística), vectorizadas
+y mergeables entre shards.
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from scripts.patterns.corpus import (EMOJI_RANGES, conversation_messages, is_nadia, message_text,
+                                     message_timestamp, parse_timestamps)
+
+_WHITESPACE_CODES = np.array([ord(c) for c in ' \t\n\r\f\v\xa0'], dtype=np.uint32)
+_RATE_EDGES = np.linspace(0.0, 1.0, 11)
+_CHAR_EDGES = np.array([0, 5, 10, 20, 40, 80, 160, 320, 640, 1280, np.inf])
+_WORD_EDGES = np.array([0, 1, 2, 3, 5, 8, 13, 21, 34, 55, np.inf])
+_COUNT_EDGES = np.array([0, 1, 2, 3, 4, 5, 6, 8, 10, np.inf])
+# Segundos: de respuestas inmediatas a retomas después de semanas
+GAP_EDGES = np.array([0, 5, 15, 30, 60, 120, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600,
+                       12 * 3600, 86400, 3 * 86400, 7 * 86400, 30 * 86400, np.inf])
+
+
+class Distribution:
+    """Histograma de bordes fijos + conteo, suma, suma de cuadrados, mínimo y máximo."""
+
+    def __init__(self, edges: Sequence[float]):
+        self.edges = np.asarray(edges, dtype=float)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.n = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return
+        # searchsorted con side='right' pone cada valor en [borde_i, borde_i+1)
+        bins = np.clip(np.searchsorted(self.edges, values, side='right') - 1,
+                       0, len(self.counts) - 1)
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+        self.n += values.size
+        self.total += float(values.sum())
+        self.total_sq += float(np.square(values).sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other: 'Distribution') -> 'Distribution':
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Solo se combinan distribuciones con los mismos bordes")
+        self.counts += other.counts
+        self.n += other.n
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Cuantil aproximado: interpolación lineal dentro del bin (acotado por min/max)."""
+        if self.n == 0:
+            return None
+        cumulative = np.cumsum(self.counts)
+        target = q * self.n
+        i = min(int(np.searchsorted(cumulative, target, side='left')), len(self.counts) - 1)
+        low = max(self.edges[i], self.min)
+        high = min(self.edges[i + 1], self.max)
+        before = cumulative[i - 1] if i else 0
+        fraction = (target - before) / self.counts[i] if self.counts[i] else 0.0
+        return float(low + (high - low) * fraction)
+
+    def to_dict(self) -> Dict:
+        if self.n == 0:
+            return {'n': 0}
+        mean = self.total / self.n
+        variance = max(self.total_sq / self.n - mean ** 2, 0.0)
+        return {
+            'n': self.n,
+            'mean': round(mean, 4),
+            'std': round(float(np.sqrt(variance)), 4),
+            'min': self.min,
+            'max': self.max,
+            'p50': round(self.quantile(0.5), 4),
+            'p90': round(self.quantile(0.9), 4),
+            'edges': [e if np.isfinite(e) else None for e in self.edges.tolist()],
+            'counts': self.counts.tolist(),
+        }
+
+
+# métrica -> bordes del histograma
+METRICS = {
+    'turns': None,  # bordes enteros hasta max_conversation_length
+    'user_messages': None,
+    'nadia_messages': None,
+    'user_message_chars': _CHAR_EDGES,
+    'nadia_message_chars': _CHAR_EDGES,
+    'user_message_words': _WORD_EDGES,
+    'nadia_message_words': _WORD_EDGES,
+    'user_emojis_per_message': _COUNT_EDGES,
+    'nadia_emojis_per_message': _COUNT_EDGES,
+    'conversation_emoji_rate': _COUNT_EDGES,
+    'user_question_rate': _RATE_EDGES,
+    'sender_alternation_rate': _RATE_EDGES,
+    'user_response_gap_seconds': GAP_EDGES,
+    'nadia_response_gap_seconds': GAP_EDGES,
+}
+
+
+class ShapeStats:
+    """
+    Acumulador por shard de las estadísticas de forma.
+
+    Args:
+        max_conversation_length: último bin de los histogramas de turnos
+        block_size: conversaciones que se juntan antes de aplanar y vectorizar
+    """
+
+    def __init__(self, max_conversation_length: int = 50, block_size: int = 5000):
+        self.block_size = block_size
+        turn_edges = np.append(np.arange(0, max_conversation_length + 1), np.inf)
+        self.distributions = {name: Distribution(turn_edges if edges is None else edges)
+                              for name, edges in METRICS.items()}
+        self.stats = {'conversations': 0, 'messages': 0, 'messages_with_timestamp': 0}
+        self._block: List[List[Dict]] = []
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'ShapeStats':
+        return cls(max_conversation_length=config.get('max_conversation_length') or 50,
+                   block_size=config.get('shape_block_size', 5000))
+
+    def add(self, conversation: Dict) -> None:
+        self._block.append(conversation_messages(conversation))
+        if len(self._block) >= self.block_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._block:
+            block, self._block = self._block, []
+            self.add_columns(flatten(block))
+
+    def add_columns(self, columns: Dict[str, np.ndarray]) -> None:
+        """Actualiza todas las distribuciones a partir de un bloque aplanado."""
+        conv = columns['conversation']
+        nadia = columns['is_nadia']
+        n_conv = int(columns['n_conversations'])
+        if n_conv == 0:
+            return
+        d = self.distributions
+        self.stats['conversations'] += n_conv
+        self.stats['messages'] += conv.size
+
+        turns = np.bincount(conv, minlength=n_conv)
+        nadia_per_conv = np.bincount(conv, weights=nadia, minlength=n_conv)
+        d['turns'].add(turns)
+        d['nadia_messages'].add(nadia_per_conv)
+        d['user_messages'].add(turns - nadia_per_conv)
+
+        for author, mask in (('user', ~nadia), ('nadia', nadia)):
+            d[f"{author}_message_chars"].add(columns['chars'][mask])
+            d[f"{author}_message_words"].add(columns['words'][mask])
+            d[f"{author}_emojis_per_message"].add(columns['emojis'][mask])
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            emojis_per_conv = np.bincount(conv, weights=columns['emojis'], minlength=n_conv)
+            d['conversation_emoji_rate'].add(emojis_per_conv / turns)
+
+            user = ~nadia
+            user_questions = np.bincount(conv[user], weights=columns['is_question'][user],
+                                         minlength=n_conv)
+            d['user_question_rate'].add(user_questions / (turns - nadia_per_conv))
+
+            # Pares de mensajes consecutivos dentro de la misma conversación
+            same = conv[1:] == conv[:-1]
+            switch = same & (nadia[1:] != nadia[:-1])
+            switches = np.bincount(conv[1:][switch], minlength=n_conv)
+            d['sender_alternation_rate'].add(switches / (turns - 1))
+
+        timestamps = columns['timestamps']
+        valid = ~np.isnat(timestamps)
+        self.stats['messages_with_timestamp'] += int(valid.sum())
+        if valid.any():
+            gaps = (timestamps[1:] - timestamps[:-1]).astype('timedelta64[s]').astype(float)
+            responded = switch & valid[1:] & valid[:-1]
+            # Tiempo de respuesta de quien contesta: el mensaje [i+1] responde al [i]
+            d['nadia_response_gap_seconds'].add(gaps[responded & nadia[1:]])
+            d['user_response_gap_seconds'].add(gaps[responded & ~nadia[1:]])
+
+    def merge(self, other: 'ShapeStats') -> 'ShapeStats':
+        self._flush()
+        other._flush()
+        for name, distribution in self.distributions.items():
+            distribution.merge(other.distributions[name])
+        for key, value in other.stats.items():
+            self.stats[key] += value
+        return self
+
+    def summary(self) -> Dict:
+        self._flush()
+        means = {name: d.to_dict().get('mean') for name, d in self.distributions.items()
+                 if name in ('turns', 'user_message_chars', 'user_question_rate',
+                             'sender_alternation_rate', 'conversation_emoji_rate')}
+        return {**self.stats, 'means': means}
+
+    def save(self, output_dir: Path) -> Dict[str, str]:
+        self._flush()
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        path = output_dir / 'shape_stats.json'
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({**self.stats,
+                       'distributions': {name: d.to_dict()
+                                         for name, d in self.distributions.items()}},
+                      f, indent=1)
+        return {'shape_stats': str(path)}
+
+
+def flatten(conversations: Sequence[List[Dict]]) -> Dict[str, np.ndarray]:
+    """
+    Aplana un bloque de conversaciones (listas de mensajes) en columnas.
+    El texto del bloque se une en un solo arreglo de code points: emojis,
+    signos de pregunta e inicios de palabra se detectan con máscaras
+    vectorizadas y se asignan a su mensaje con searchsorted.
+    """
+    lengths = np.fromiter((len(messages) for messages in conversations), dtype=np.intp,
+                          count=len(conversations))
+    messages = [message for conversation in conversations for message in conversation]
+    texts = [message_text(message) for message in messages]
+
+    chars = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    # Cada mensaje ocupa [start, start + len) en el texto unido con '\n'
+    starts = np.concatenate(([0], np.cumsum(chars + 1)[:-1])).astype(np.int64)
+    codes = np.frombuffer('\n'.join(texts).encode('utf-32-le'), dtype=np.uint32)
+
+    emoji = np.zeros(codes.size, dtype=bool)
+    for low, high in EMOJI_RANGES:
+        emoji |= (codes >= low) & (codes <= high)
+    question = (codes == ord('?')) | (codes == ord('¿'))
+    space = np.isin(codes, _WHITESPACE_CODES)
+    # Inicio de palabra: no-espacio precedido por espacio (el separador es '\n')
+    word_start = ~space & np.concatenate(([True], space[:-1]))
+
+    def per_message(mask: np.ndarray) -> np.ndarray:
+        owners = np.searchsorted(starts, np.flatnonzero(mask), side='right') - 1
+        return np.bincount(owners, minlength=len(texts)).astype(np.int64)
+
+    return {
+        'n_conversations': len(conversations),
+        'conversation': np.repeat(np.arange(len(conversations)), lengths),
+        'is_nadia': np.fromiter((is_nadia(m) for m in messages), dtype=bool, count=len(messages)),
+        'chars': chars,
+        'words': per_message(word_start),
+        'emojis': per_message(emoji),
+        'is_question': per_message(question) > 0,
+        'timestamps': parse_timestamps(message_timestamp(m) for m in messages),
+    }
@@ -0,0 +1,228 @@
+"""
+Esqueletos de conversación: el plan de etiquetas turno a turno que se decide
+antes de llamar al LLM.
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+
+import numpy as np
+
+from scripts.patterns.corpus import fsm_mask, load_taxonomy
+
+SKELETON_DEFAULTS = {
+    'enabled': False,
+    'count': 1000,
+    'user_turns': None,
+    'stay_probability': 0.6,
+    'prior_weight': 5.0,
+    'transition_matrices': None,
+    'safety_weights': {'LEVEL_0_SAFE': 0.6, 'LEVEL_1_FLIRT_SAFE': 0.3, 'LEVEL_2_BORDERLINE': 0.1},
+    'block_size': 10000,
+    'seed': 42,
+}
+
+CHAIN_DIMENSIONS = ('rapport_stage', 'customer_status')
+EMISSION_DIMENSIONS = ('primary_intent', 'safety_level')
+
+
+def configured_matrix(allowed: np.ndarray, stay_probability: float = 0.6) -> np.ndarray:
+    """Matriz de la FSM: `stay_probability` en la diagonal, el resto repartido."""
+    eye = np.eye(len(allowed), dtype=bool)
+    moves = allowed & ~eye
+    n_moves = moves.sum(axis=1, keepdims=True)
+    stay = np.where(n_moves > 0, stay_probability, 1.0)
+    return np.where(eye, stay, np.where(moves, (1 - stay) / np.maximum(n_moves, 1), 0.0))
+
+
+def constrained_matrix(allowed: np.ndarray, prior: np.ndarray,
+                       counts: Optional[np.ndarray] = None, prior_weight: float = 5.0) -> np.ndarray:
+    """Conteos aprendidos + prior, con las transiciones inválidas en cero."""
+    weights = prior * prior_weight + (0 if counts is None else counts)
+    weights = np.where(allowed, weights, 0.0)
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def sample_rows(cdf: np.ndarray, rows: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    Un índice por elemento de `rows`, muestreado de la fila cdf[row]. Las
+    filas no necesitan estar normalizadas y las entradas con probabilidad
+    cero nunca salen.
+    """
+    u = rng.random(rows.size)
+    out = np.empty(rows.size, dtype=np.int64)
+    for row in np.unique(rows):
+        mask = rows == row
+        out[mask] = np.searchsorted(cdf[row], u[mask] * cdf[row, -1], side='right')
+    return out
+
+
+def sample_chain(matrix: np.ndarray, initial: np.ndarray, n: int, length: int,
+                 rng: np.random.Generator) -> np.ndarray:
+    """(n, length) estados de una cadena de Markov."""
+    states = np.empty((n, length), dtype=np.int64)
+    if length == 0:
+        return states
+    states[:, 0] = sample_rows(np.cumsum(initial)[None, :], np.zeros(n, dtype=np.int64), rng)
+    cdf = np.cumsum(matrix, axis=1)
+    for t in range(1, length):
+        states[:, t] = sample_rows(cdf, states[:, t - 1], rng)
+    return states
+
+
+class SkeletonSampler:
+    """
+    Args:
+        states: dimensión -> etiquetas (el orden define los códigos)
+        matrices: matriz de transición por dimensión de CHAIN_DIMENSIONS
+        allowed: transiciones permitidas por la FSM de cada cadena
+        initial: distribución inicial por cadena
+        emission: pesos (rapport_stage, primary_intent, safety_level) ya con
+            las combinaciones prohibidas en cero
+        seed: semilla del generador
+    """
+
+    def __init__(self, states: Dict[str, List[str]], matrices: Dict[str, np.ndarray],
+                 allowed: Dict[str, np.ndarray], initial: Dict[str, np.ndarray],
+                 emission: np.ndarray, seed: int = 42, block_size: int = 10000):
+        self.states = states
+        self.matrices = matrices
+        self.allowed = allowed
+        self.initial = initial
+        self.emission = emission
+        self.block_size = block_size
+        self.rng = np.random.default_rng(seed)
+        # CDF conjunta (intención, seguridad) por etapa, aplanada
+        self._emission_cdf = np.cumsum(emission.reshape(len(emission), -1), axis=1)
+        self._labels = {dimension: np.array(labels, dtype=object)
+                        for dimension, labels in states.items()}
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict] = None, taxonomy_path=None,
+                    learned: Optional[Dict] = None) -> 'SkeletonSampler':
+        """
+        Args:
+            config: sección `skeletons` (ver SKELETON_DEFAULTS)
+            learned: contenido de transition_matrices.json (None = solo la FSM)
+        """
+        config = {**SKELETON_DEFAULTS, **(config or {})}
+        taxonomy = load_taxonomy(taxonomy_path)
+        dimensions = taxonomy['dimensions']
+        rules = taxonomy.get('skeleton_rules', {})
+        states = {dimension: list(dimensions[dimension])
+                  for dimension in CHAIN_DIMENSIONS + EMISSION_DIMENSIONS + ('profile_id',)}
+        learned = (learned or {}).get('dimensions', {})
+
+        matrices, allowed, initial = {}, {}, {}
+        for dimension in CHAIN_DIMENSIONS:
+            labels = states[dimension]
+            allowed[dimension] = fsm_mask(labels, taxonomy['transition_rules'][dimension])
+            prior = configured_matrix(allowed[dimension], config['stay_probability'])
+            start = np.zeros(len(labels))
+            for label in rules.get('initial', {}).get(dimension) or labels:
+                start[labels.index(label)] = 1.0
+            start /= start.sum()
+
+            counts, initial_counts = cls._learned_counts(learned.get(dimension), labels)
+            matrices[dimension] = constrained_matrix(allowed[dimension], prior, counts,
+                                                     config['prior_weight'])
+            initial[dimension] = start * config['prior_weight'] + initial_counts
+            initial[dimension] /= initial[dimension].sum()
+
+        safety = np.array([config['safety_weights'].get(label, 0.0)
+                           for label in states['safety_level']], dtype=float)
+        emission = np.ones((len(states['rapport_stage']), len(states['primary_intent']), 1)) * \
+            safety[None, None, :]
+        for rule in rules.get('forbidden', []):
+            emission[cls._rule_index(rule, states)] = 0.0
+        if (emission.reshape(len(emission), -1).sum(axis=1) == 0).any():
+            raise ValueError("Alguna etapa de rapport no tiene combinaciones permitidas")
+        return cls(states, matrices, allowed, initial, emission, seed=config['seed'],
+                   block_size=config['block_size'])
+
+    @staticmethod
+    def _learned_counts(learned: Optional[Dict], labels: List[str]):
+        k = len(labels)
+        counts, initial_counts = np.zeros((k, k)), np.zeros(k)
+        if not learned:
+            return counts, initial_counts
+        # Las etapas del archivo se alinean por nombre con las de la taxonomía
+        position = np.array([labels.index(s) if s in labels else -1 for s in learned['states']])
+        known = position >= 0
+        observed = np.asarray(learned['transition_counts'], dtype=float)
+        counts[np.ix_(position[known], position[known])] = observed[np.ix_(known, known)]
+        initial_counts[position[known]] = np.asarray(learned['initial_counts'], dtype=float)[known]
+        return counts, initial_counts
+
+    @staticmethod
+    def _rule_index(rule: Dict, states: Dict[str, List[str]]):
+        """Índice (etapa, intención, seguridad) de las combinaciones de una regla."""
+        unknown = set(rule) - {'rapport_stage', 'primary_intent', 'safety_level'}
+        if unknown:
+            raise ValueError(f"Regla de esqueleto sobre dimensiones no soportadas: {sorted(unknown)}")
+        axes = []
+        for dimension in ('rapport_stage', 'primary_intent', 'safety_level'):
+            labels = rule.get(dimension)
+            axes.append([states[dimension].index(label) for label in labels]
+                        if labels else list(range(len(states[dimension]))))
+        return np.ix_(*axes)
+
+    @classmethod
+    def load_learned(cls, path: Union[str, Path, None]) -> Optional[Dict]:
+        if not path or not Path(path).exists():
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def sample(self, n: int, turns: int) -> Dict[str, np.ndarray]:
+        """Códigos (n, turns) por dimensión, más profile_id (n,)."""
+        codes = {dimension: sample_chain(self.matrices[dimension], self.initial[dimension],
+                                         n, turns, self.rng)
+                 for dimension in CHAIN_DIMENSIONS}
+        stage = codes['rapport_stage'].ravel()
+        joint = sample_rows(self._emission_cdf, stage, self.rng)
+        n_safety = len(self.states['safety_level'])
+        codes['primary_intent'] = (joint // n_safety).reshape(n, turns)
+        codes['safety_level'] = (joint % n_safety).reshape(n, turns)
+        codes['profile_id'] = self.rng.integers(len(self.states['profile_id']), size=n)
+        return codes
+
+    def valid(self, codes: Dict[str, np.ndarray]) -> np.ndarray:
+        """Máscara (n,) de esqueletos que respetan las FSM y las reglas prohibidas."""
+        stage = codes['rapport_stage']
+        ok = self.emission[stage, codes['primary_intent'], codes['safety_level']] > 0
+        ok = ok.all(axis=1)
+        for dimension in CHAIN_DIMENSIONS:
+            chain = codes[dimension]
+            ok &= self.allowed[dimension][chain[:, :-1], chain[:, 1:]].all(axis=1)
+        return ok
+
+    def skeletons(self, n: int, turns: int) -> Iterator[Dict]:
+        """Esqueletos como dicts, muestreados en bloques de `block_size`."""
+        produced = 0
+        while produced < n:
+            size = min(self.block_size, n - produced)
+            codes = self.sample(size, turns)
+            labels = {dimension: self._labels[dimension][codes[dimension]]
+                      for dimension in codes}
+            # Celda objetivo: intención dominante, etapa y estado finales, seguridad máxima
+            intent_counts = np.zeros((size, len(self.states['primary_intent'])), dtype=np.int64)
+            np.add.at(intent_counts, (np.repeat(np.arange(size), turns),
+                                      codes['primary_intent'].ravel()), 1)
+            dominant = self._labels['primary_intent'][intent_counts.argmax(axis=1)]
+            highest = self._labels['safety_level'][codes['safety_level'].max(axis=1)]
+            for i in range(size):
+                turn_labels = [{dimension: labels[dimension][i, t]
+                                for dimension in CHAIN_DIMENSIONS + EMISSION_DIMENSIONS}
+                               for t in range(turns)]
+                yield {
+                    'skeleton_id': f"sk{produced + i:06d}",
+                    'turns': turn_labels,
+                    'cell': {'profile_id': labels['profile_id'][i],
+                             'primary_intent': dominant[i],
+                             'rapport_stage': labels['rapport_stage'][i, -1],
+                             'customer_status': labels['customer_status'][i, -1],
+                             'safety_level': highest[i]},
+                }
+            produced += size
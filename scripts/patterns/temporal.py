@@ -0,0 +1,248 @@
+"""
+Features temporales por conversación (TEMPORAL_CONTEXT en docs/GUIDELINES.MD).
+"""
+
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from scripts.patterns.corpus import (conversation_messages, is_nadia, load_taxonomy, message_text,
+                                     message_timestamp, parse_timestamps)
+from scripts.utils.aho_corasick import AhoCorasick
+
+TEMPORAL_DEFAULTS = {
+    'session_gap_minutes': 30,
+    'resumption_gap_hours': 72,
+    'block_size': 5000,
+}
+
+FEATURE_COLUMNS = [
+    'messages', 'user_messages', 'timestamped_messages', 'first_message_at', 'last_message_at',
+    'duration_hours', 'days_active', 'sessions', 'resumptions', 'median_gap_minutes',
+    'max_gap_hours', 'cta_count', 'soft_rejections', 'hours_since_last_cta',
+    'days_active_since_last_cta', 'user_messages_after_last_cta',
+]
+
+
+class SignalDetector:
+    """
+    Detecta las señales de `signal_rules` (CTA, rechazo suave) con un solo
+    autómata; cada señal se restringe al autor que indica la regla.
+    """
+
+    def __init__(self, rules: Dict):
+        self.signals = [name for name in rules if not name.startswith('_')]
+        self.authors = {name: rules[name].get('author') for name in self.signals}
+        patterns, owners = [], []
+        for i, name in enumerate(self.signals):
+            patterns.extend(rules[name]['patterns'])
+            owners.extend([i] * len(rules[name]['patterns']))
+        self.automaton = AhoCorasick.from_wildcards(patterns)
+        self.owners = np.array(owners, dtype=np.int64)
+
+    @classmethod
+    def from_taxonomy(cls, path: Union[str, Path, None] = None) -> 'SignalDetector':
+        return cls(load_taxonomy(path).get('signal_rules', {}))
+
+    def detect(self, texts: Sequence[str], nadia: np.ndarray) -> Dict[str, np.ndarray]:
+        """Señal -> máscara booleana alineada con `texts`."""
+        rows, pattern_ids = self.automaton.find_all(texts)
+        found = {}
+        for i, name in enumerate(self.signals):
+            mask = np.zeros(len(texts), dtype=bool)
+            mask[rows[self.owners[pattern_ids] == i]] = True
+            author = self.authors[name]
+            if author == 'nadia':
+                mask &= nadia
+            elif author == 'user':
+                mask &= ~nadia
+            found[name] = mask
+        return found
+
+
+def conversation_key(conversation: Dict) -> Optional[str]:
+    """conversation_id, o el message_id del primer mensaje si no lo tiene."""
+    key = conversation.get('conversation_id') or conversation.get('id')
+    if key is None:
+        messages = conversation_messages(conversation)
+        key = messages[0].get('message_id') if messages else None
+    return None if key is None else str(key)
+
+
+def _per_conversation_days(conversation: np.ndarray, seconds: np.ndarray, n: int) -> np.ndarray:
+    """Días calendario (UTC) distintos por conversación."""
+    if conversation.size == 0:
+        return np.zeros(n, dtype=np.int64)
+    pairs = np.unique(np.stack((conversation, seconds // 86400), axis=1), axis=0)
+    return np.bincount(pairs[:, 0], minlength=n)
+
+
+def temporal_features(conversations: Sequence[Tuple[str, List[Dict]]],
+                      signals: Optional[SignalDetector] = None,
+                      session_gap_minutes: float = 30,
+                      resumption_gap_hours: float = 72) -> pd.DataFrame:
+    """
+    Tabla de features de un bloque de (conversation_id, mensajes). Las
+    features de tiempo usan solo los mensajes con timestamp válido.
+    """
+    n = len(conversations)
+    lengths = np.fromiter((len(messages) for _, messages in conversations), dtype=np.int64,
+                          count=n)
+    messages = [message for _, conversation in conversations for message in conversation]
+    conversation = np.repeat(np.arange(n), lengths)
+    position = np.arange(conversation.size)
+    nadia = np.fromiter((is_nadia(m) for m in messages), dtype=bool, count=len(messages))
+    timestamps = parse_timestamps(message_timestamp(m) for m in messages)
+    valid = ~np.isnat(timestamps)
+    seconds = timestamps.astype('int64')
+
+    found = signals.detect([message_text(m) for m in messages], nadia) if signals else {}
+    cta = found.get('cta', np.zeros(len(messages), dtype=bool))
+    soft = found.get('soft_rejection', np.zeros(len(messages), dtype=bool))
+
+    # Gaps entre mensajes consecutivos con timestamp de la misma conversación
+    tc, ts = conversation[valid], seconds[valid]
+    same = tc[1:] == tc[:-1]
+    gaps = (ts[1:] - ts[:-1])[same]
+    gap_owner = tc[1:][same]
+    timed = np.bincount(tc, minlength=n)
+    has_time = timed > 0
+
+    first = np.full(n, np.iinfo(np.int64).max)
+    last = np.full(n, np.iinfo(np.int64).min)
+    np.minimum.at(first, tc, ts)
+    np.maximum.at(last, tc, ts)
+    max_gap = np.zeros(n)
+    np.maximum.at(max_gap, gap_owner, gaps)
+    median_gap = pd.Series(gaps).groupby(gap_owner).median().reindex(range(n)).to_numpy()
+
+    session_gap = session_gap_minutes * 60
+    sessions = has_time.astype(np.int64) + np.bincount(gap_owner[gaps > session_gap], minlength=n)
+    resumptions = np.bincount(gap_owner[gaps >= resumption_gap_hours * 3600], minlength=n)
+
+    # Último CTA: posición (para contar mensajes) y timestamp (para el tiempo)
+    last_cta_position = np.full(n, -1)
+    np.maximum.at(last_cta_position, conversation[cta], position[cta])
+    has_cta = last_cta_position >= 0
+    after_cta = has_cta[conversation] & (position > last_cta_position[conversation])
+    user_after_cta = np.bincount(conversation[after_cta & ~nadia], minlength=n)
+    last_cta_time = np.full(n, np.iinfo(np.int64).min)
+    np.maximum.at(last_cta_time, conversation[cta & valid], seconds[cta & valid])
+    cta_timed = last_cta_time > np.iinfo(np.int64).min
+    active_after = valid & ~nadia & cta_timed[conversation] & \
+        (seconds > last_cta_time[conversation])
+
+    def hours(end: np.ndarray, start: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        # Los centinelas de las filas sin dato no entran en la resta
+        span = np.where(mask, end, 0) - np.where(mask, start, 0)
+        return np.where(mask, np.round(span / 3600, 4), np.nan)
+
+    table = pd.DataFrame({
+        'conversation_id': [key for key, _ in conversations],
+        'messages': lengths,
+        'user_messages': np.bincount(conversation[~nadia], minlength=n),
+        'timestamped_messages': timed,
+        'first_message_at': pd.to_datetime(np.where(has_time, first, 0), unit='s').where(has_time),
+        'last_message_at': pd.to_datetime(np.where(has_time, last, 0), unit='s').where(has_time),
+        'duration_hours': hours(last, first, has_time),
+        'days_active': _per_conversation_days(tc, ts, n),
+        'sessions': sessions,
+        'resumptions': resumptions,
+        'median_gap_minutes': np.round(median_gap / 60, 4),
+        'max_gap_hours': hours(max_gap, 0, timed > 1),
+        'cta_count': np.bincount(conversation[cta], minlength=n),
+        'soft_rejections': np.bincount(conversation[soft], minlength=n),
+        'hours_since_last_cta': hours(last, last_cta_time, cta_timed),
+        'days_active_since_last_cta': np.where(cta_timed, _per_conversation_days(
+            conversation[active_after], seconds[active_after], n), -1),
+        'user_messages_after_last_cta': np.where(has_cta, user_after_cta, -1),
+    })
+    return table.set_index('conversation_id')
+
+
+class TemporalFeatures:
+    """
+    Acumulador del PatternAnalyzer. Guarda la tabla por bloques; los shards
+    se combinan concatenando.
+
+    Args:
+        signals: detector de CTA / rechazos suaves (None = sin señales)
+        session_gap_minutes: silencio que abre una nueva sesión
+        resumption_gap_hours: silencio que cuenta como retoma (posible reset a ICE_BREAKER)
+        block_size: conversaciones que se juntan antes de calcular
+    """
+
+    def __init__(self, signals: Optional[SignalDetector] = None, session_gap_minutes: float = 30,
+                 resumption_gap_hours: float = 72, block_size: int = 5000):
+        self.signals = signals
+        self.session_gap_minutes = session_gap_minutes
+        self.resumption_gap_hours = resumption_gap_hours
+        self.block_size = block_size
+        self.stats = {'conversations': 0, 'without_id': 0}
+        self.tables: List[pd.DataFrame] = []
+        self._block: List[Tuple[str, List[Dict]]] = []
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'TemporalFeatures':
+        temporal = {**TEMPORAL_DEFAULTS, **(config.get('temporal') or {})}
+        return cls(SignalDetector.from_taxonomy(config.get('taxonomy_path')),
+                   session_gap_minutes=temporal['session_gap_minutes'],
+                   resumption_gap_hours=temporal['resumption_gap_hours'],
+                   block_size=temporal['block_size'])
+
+    def add(self, conversation: Dict) -> None:
+        self.stats['conversations'] += 1
+        key = conversation_key(conversation)
+        if key is None:
+            self.stats['without_id'] += 1
+            return
+        self._block.append((key, conversation_messages(conversation)))
+        if len(self._block) >= self.block_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._block:
+            block, self._block = self._block, []
+            self.tables.append(temporal_features(block, self.signals, self.session_gap_minutes,
+                                                 self.resumption_gap_hours))
+
+    def merge(self, other: 'TemporalFeatures') -> 'TemporalFeatures':
+        self._flush()
+        other._flush()
+        self.tables.extend(other.tables)
+        for key, value in other.stats.items():
+            self.stats[key] += value
+        return self
+
+    def table(self) -> pd.DataFrame:
+        self._flush()
+        if not self.tables:
+            return pd.DataFrame(columns=FEATURE_COLUMNS, index=pd.Index([], name='conversation_id'))
+        self.tables = [pd.concat(self.tables)]
+        return self.tables[0]
+
+    def summary(self) -> Dict:
+        table = self.table()
+        timed = table[table['timestamped_messages'] > 0]
+        return {
+            **self.stats,
+            'with_timestamps': int(len(timed)),
+            'resumed_share': round(float((timed['resumptions'] > 0).mean()), 4) if len(timed) else None,
+            'mean_sessions': round(float(timed['sessions'].mean()), 4) if len(timed) else None,
+            'with_cta': int((table['cta_count'] > 0).sum()),
+        }
+
+    def save(self, output_dir: Path) -> Dict[str, str]:
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        path = output_dir / 'temporal_features.csv'
+        self.table().to_csv(path, date_format='%Y-%m-%dT%H:%M:%SZ')
+        return {'temporal_features': str(path)}
+
+
+def load_temporal_features(path: Union[str, Path]) -> pd.DataFrame:
+    """Lee temporal_features.csv indexada por conversation_id, con fechas en UTC."""
+    return pd.read_csv(path, index_col='conversation_id', dtype={'conversation_id': str},
+                       parse_dates=['first_message_at', 'last_message_at'])
@@ -0,0 +1,201 @@
+"""
+Matrices de transición empíricas de rapport_stage y customer_status.
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List, Sequence, Union
+
+import numpy as np
+
+from scripts.patterns.corpus import (conversation_messages, load_taxonomy, message_label,
+                                     message_timestamp, parse_timestamps)
+from scripts.patterns.shape_stats import GAP_EDGES, Distribution
+
+TRANSITION_DIMENSIONS = ('rapport_stage', 'customer_status')
+DWELL_MESSAGE_EDGES = np.array([1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30, 50, np.inf])
+
+
+class TransitionCounts:
+    """Conteos de una dimensión (arreglos indexados por etapa)."""
+
+    def __init__(self, states: Sequence[str]):
+        self.states = list(states)
+        self.index = {state: i for i, state in enumerate(self.states)}
+        k = len(self.states)
+        self.transitions = np.zeros((k, k), dtype=np.int64)
+        self.initial = np.zeros(k, dtype=np.int64)
+        self.final = np.zeros(k, dtype=np.int64)
+        self.censored_runs = np.zeros(k, dtype=np.int64)
+        self.dwell_messages = [Distribution(DWELL_MESSAGE_EDGES) for _ in self.states]
+        self.dwell_seconds = [Distribution(GAP_EDGES) for _ in self.states]
+
+    def add_sequences(self, conversation: np.ndarray, state: np.ndarray,
+                      timestamps: np.ndarray) -> None:
+        """
+        Cuenta un bloque aplanado: un elemento por mensaje etiquetado, en
+        orden, con el índice de su conversación.
+        """
+        if state.size == 0:
+            return
+        k = len(self.states)
+        same = conversation[1:] == conversation[:-1]
+        first = np.concatenate(([True], ~same))
+        last = np.concatenate((~same, [True]))
+
+        pairs = state[:-1][same] * k + state[1:][same]
+        self.transitions += np.bincount(pairs, minlength=k * k).reshape(k, k)
+        self.initial += np.bincount(state[first], minlength=k)
+        self.final += np.bincount(state[last], minlength=k)
+
+        # Rachas: mensajes consecutivos de la misma conversación en la misma etapa
+        run_start = np.flatnonzero(first | np.concatenate(([True], state[1:] != state[:-1])))
+        run_length = np.diff(np.append(run_start, state.size))
+        run_state = state[run_start]
+        # Una racha termina en transición si la siguiente es de la misma conversación
+        completed = np.zeros(run_start.size, dtype=bool)
+        completed[:-1] = conversation[run_start[1:]] == conversation[run_start[:-1]]
+        self.censored_runs += np.bincount(run_state[~completed], minlength=k)
+
+        next_start = np.append(run_start[1:], 0)
+        seconds = (timestamps[next_start] - timestamps[run_start]).astype('timedelta64[s]')
+        timed = completed & ~np.isnat(seconds)
+        seconds = seconds.astype('int64').astype(float)
+        for s in np.unique(run_state[completed]):
+            in_state = run_state == s
+            self.dwell_messages[s].add(run_length[completed & in_state])
+            self.dwell_seconds[s].add(seconds[timed & in_state])
+
+    def merge(self, other: 'TransitionCounts') -> 'TransitionCounts':
+        if self.states != other.states:
+            raise ValueError("Solo se combinan conteos con las mismas etapas")
+        self.transitions += other.transitions
+        self.initial += other.initial
+        self.final += other.final
+        self.censored_runs += other.censored_runs
+        for mine, theirs in zip(self.dwell_messages + self.dwell_seconds,
+                                other.dwell_messages + other.dwell_seconds):
+            mine.merge(theirs)
+        return self
+
+    def matrix(self) -> np.ndarray:
+        """Matriz de Markov por filas; las etapas nunca observadas quedan en cero."""
+        totals = self.transitions.sum(axis=1, keepdims=True)
+        return np.divide(self.transitions, totals, out=np.zeros(self.transitions.shape),
+                         where=totals > 0)
+
+    def to_dict(self) -> Dict:
+        initial_total = max(int(self.initial.sum()), 1)
+        return {
+            'states': self.states,
+            'transition_counts': self.transitions.tolist(),
+            'transition_matrix': np.round(self.matrix(), 6).tolist(),
+            'initial_counts': self.initial.tolist(),
+            'initial_distribution': np.round(self.initial / initial_total, 6).tolist(),
+            'final_counts': self.final.tolist(),
+            'censored_runs': self.censored_runs.tolist(),
+            'dwell_messages': {state: self.dwell_messages[i].to_dict()
+                               for i, state in enumerate(self.states)},
+            'dwell_seconds': {state: self.dwell_seconds[i].to_dict()
+                              for i, state in enumerate(self.states)},
+        }
+
+
+class TransitionStats:
+    """
+    Acumulador del PatternAnalyzer para las dimensiones con FSM.
+
+    Args:
+        dimensions: dimensión -> etapas (el orden define los índices)
+        block_size: conversaciones que se juntan antes de contar
+    """
+
+    def __init__(self, dimensions: Dict[str, Sequence[str]], block_size: int = 5000):
+        self.block_size = block_size
+        self.counts = {dimension: TransitionCounts(states)
+                       for dimension, states in dimensions.items()}
+        self.stats = {'conversations': 0, 'conversations_labeled': 0, 'unknown_labels': 0}
+        self._block: List[List[Dict]] = []
+        self._conversation_labels: List[Dict] = []
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'TransitionStats':
+        taxonomy = load_taxonomy(config.get('taxonomy_path'))['dimensions']
+        dimensions = config.get('transition_dimensions') or TRANSITION_DIMENSIONS
+        return cls({dimension: taxonomy[dimension] for dimension in dimensions},
+                   block_size=config.get('transition_block_size', 5000))
+
+    def add(self, conversation: Dict) -> None:
+        self._block.append(conversation_messages(conversation))
+        self._conversation_labels.append(
+            {dimension: conversation.get(dimension) for dimension in self.counts}
+            if isinstance(conversation, dict) else {})
+        if len(self._block) >= self.block_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._block:
+            return
+        block, self._block = self._block, []
+        conversation_labels, self._conversation_labels = self._conversation_labels, []
+        labeled = np.zeros(len(block), dtype=bool)
+
+        for dimension, counts in self.counts.items():
+            conversation, state, timestamps = [], [], []
+            for i, messages in enumerate(block):
+                found = False
+                for message in messages:
+                    label = message_label(message, dimension)
+                    if label is None:
+                        continue
+                    if label not in counts.index:
+                        self.stats['unknown_labels'] += 1
+                        continue
+                    conversation.append(i)
+                    state.append(counts.index[label])
+                    timestamps.append(message_timestamp(message))
+                    found = True
+                # Etiqueta solo a nivel de conversación: etapa inicial sin transiciones
+                label = conversation_labels[i].get(dimension)
+                if not found and label in counts.index:
+                    conversation.append(i)
+                    state.append(counts.index[label])
+                    timestamps.append(None)
+            conversation = np.array(conversation, dtype=np.int64)
+            labeled[conversation] = True
+            counts.add_sequences(conversation, np.array(state, dtype=np.int64),
+                                 parse_timestamps(timestamps))
+
+        self.stats['conversations'] += len(block)
+        self.stats['conversations_labeled'] += int(labeled.sum())
+
+    def merge(self, other: 'TransitionStats') -> 'TransitionStats':
+        self._flush()
+        other._flush()
+        for dimension, counts in self.counts.items():
+            counts.merge(other.counts[dimension])
+        for key, value in other.stats.items():
+            self.stats[key] += value
+        return self
+
+    def matrix(self, dimension: str) -> np.ndarray:
+        self._flush()
+        return self.counts[dimension].matrix()
+
+    def summary(self) -> Dict:
+        self._flush()
+        return {**self.stats,
+                'transitions': {dimension: int(counts.transitions.sum())
+                                for dimension, counts in self.counts.items()}}
+
+    def save(self, output_dir: Union[str, Path]) -> Dict[str, str]:
+        self._flush()
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        path = output_dir / 'transition_matrices.json'
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({**self.stats,
+                       'dimensions': {dimension: counts.to_dict()
+                                      for dimension, counts in self.counts.items()}},
+                      f, indent=1)
+        return {'transition_matrices': str(path)}
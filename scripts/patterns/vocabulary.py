@@ -0,0 +1,115 @@
+"""
+Vocabulario y n-gramas del corpus con memoria acotada (Space-Saving + Count-Min).
+"""
+
+import json
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+from scripts.patterns.corpus import conversation_messages, message_text, ngrams, tokenize
+from scripts.utils.sketches import CountMinSketch, SpaceSaving
+
+
+class VocabularyStats:
+    """
+    Acumulador por shard.
+
+    Args:
+        vocabulary_size: capacidad del resumen de unigramas
+        ngram_range: (n mínimo, n máximo) de los n-gramas contados
+        top_k_ngrams: capacidad del resumen de cada orden n >= 2
+        epsilon, delta, seed: dimensionado y hashes del Count-Min sketch
+        flush_every: n-gramas distintos que se juntan antes de volcarlos al sketch
+    """
+
+    def __init__(self, vocabulary_size: int = 10000, ngram_range: Sequence[int] = (1, 3),
+                 top_k_ngrams: int = 2000, epsilon: float = 1e-4, delta: float = 0.01,
+                 seed: int = 1, flush_every: int = 200000):
+        self.ngram_range = (int(ngram_range[0]), int(ngram_range[1]))
+        self.vocabulary = SpaceSaving(vocabulary_size)
+        self.top_ngrams = {n: SpaceSaving(top_k_ngrams)
+                           for n in range(max(2, self.ngram_range[0]), self.ngram_range[1] + 1)}
+        self.sketch = CountMinSketch.from_error(epsilon, delta, seed)
+        self.flush_every = flush_every
+        self.stats = {'conversations': 0, 'messages': 0, 'tokens': 0}
+        self._pending = Counter()
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'VocabularyStats':
+        count_min = config.get('count_min') or {}
+        return cls(vocabulary_size=config.get('vocabulary_size_limit', 10000),
+                   ngram_range=config.get('ngram_range', (1, 3)),
+                   top_k_ngrams=config.get('top_k_ngrams', 2000),
+                   epsilon=count_min.get('epsilon', 1e-4),
+                   delta=count_min.get('delta', 0.01),
+                   seed=count_min.get('seed', 1))
+
+    def add(self, conversation: Dict) -> None:
+        self.stats['conversations'] += 1
+        for message in conversation_messages(conversation):
+            tokens = tokenize(message_text(message))
+            if not tokens:
+                continue
+            self.stats['messages'] += 1
+            self.stats['tokens'] += len(tokens)
+            self.vocabulary.update_many(tokens)
+            if self.ngram_range[0] <= 1:
+                self._pending.update(tokens)
+            # Los n-gramas no cruzan el límite entre mensajes
+            for n, summary in self.top_ngrams.items():
+                grams = list(ngrams(tokens, n))
+                summary.update_many(grams)
+                self._pending.update(grams)
+        if len(self._pending) >= self.flush_every:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._pending:
+            self.sketch.update_many(self._pending.keys(), self._pending.values())
+            self._pending = Counter()
+
+    def merge(self, other: 'VocabularyStats') -> 'VocabularyStats':
+        self._flush()
+        other._flush()
+        self.vocabulary.merge(other.vocabulary)
+        for n, summary in self.top_ngrams.items():
+            summary.merge(other.top_ngrams[n])
+        self.sketch.merge(other.sketch)
+        for key, value in other.stats.items():
+            self.stats[key] += value
+        return self
+
+    def estimate(self, ngram: str) -> int:
+        """Frecuencia estimada de cualquier n-grama (sobreestima en <= error_bound)."""
+        self._flush()
+        return self.sketch.estimate(' '.join(tokenize(ngram)))
+
+    def summary(self) -> Dict:
+        self._flush()
+        return {
+            **self.stats,
+            'vocabulary_size': len(self.vocabulary),
+            'vocabulary_capacity': self.vocabulary.capacity,
+            'ngram_range': list(self.ngram_range),
+            'count_min_error_bound': round(self.sketch.error_bound, 2),
+        }
+
+    def save(self, output_dir: Path, top_n: Optional[int] = None) -> Dict[str, str]:
+        """vocabulary.json, ngrams.json y el sketch (ngram_sketch.npz)."""
+        self._flush()
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        files = {
+            'vocabulary': output_dir / 'vocabulary.json',
+            'ngrams': output_dir / 'ngrams.json',
+            'ngram_sketch': output_dir / 'ngram_sketch.npz',
+        }
+        with open(files['vocabulary'], 'w', encoding='utf-8') as f:
+            json.dump({**self.summary(), **self.vocabulary.to_dict(top_n)}, f,
+                      indent=2, ensure_ascii=False)
+        with open(files['ngrams'], 'w', encoding='utf-8') as f:
+            json.dump({str(n): summary.to_dict(top_n) for n, summary in self.top_ngrams.items()},
+                      f, indent=2, ensure_ascii=False)
+        self.sketch.save(files['ngram_sketch'])
+        return {name: str(path) for name, path in files.items()}
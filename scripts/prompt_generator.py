@@ -1,15 +1,329 @@
+#!/usr/bin/env python3
 """
-Módulo placeholder - TODO: Implementar
+Generador de prompts para la generación sintética (Step 3 del pipeline): una
+celda objetivo de la taxonomía por prompt, con few-shot elegidos por BM25.
+
+Uso:
+    python scripts/prompt_generator.py --config config/pipeline_config.json --limit 5
 """
+
+import argparse
+import json
 import logging
-from typing import Dict, List
+import re
+import sys
+from functools import lru_cache
+from itertools import islice, product
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Agregar el directorio raíz al path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.patterns.context import CONTEXT_DEFAULTS, ConversationContext
+from scripts.patterns.corpus import (conversation_messages, is_nadia, iter_conversations,
+                                     load_taxonomy, message_label, message_text, shard_paths,
+                                     tokenize)
+from scripts.patterns.skeletons import SKELETON_DEFAULTS, SkeletonSampler
+from scripts.utils.bm25 import BM25Index
+
+PROMPT_DEFAULTS = {
+    'template_path': 'prompts/conversation_generation_prompt.md',
+    'example_pool': ['data/labeled/'],
+    'file_pattern': '*.json*',
+    'n_examples': 3,
+    'grid_dimensions': ['profile_id', 'primary_intent', 'message_tone', 'rapport_stage'],
+    'defaults': {'safety_level': 'LEVEL_0_SAFE'},
+    'label_weights': {'primary_intent': 3.0, 'rapport_stage': 2.0, 'message_tone': 1.5,
+                      'safety_level': 1.0, 'profile_id': 1.0},
+    'turns_per_conversation': 8,
+    'max_example_chars': 280,
+    'context': CONTEXT_DEFAULTS,
+    'skeletons': SKELETON_DEFAULTS,
+}
+
+LABEL_DIMENSIONS = ('primary_intent', 'message_tone', 'rapport_stage', 'safety_level',
+                    'profile_id', 'customer_status')
+SECTION_MARKER = '<!-- {} -->'
+FIELD = re.compile(r'\{([a-z_][a-z0-9_]*)\}')
+
+
+class CompiledTemplate:
+    """
+    Template con campos {nombre}, partido una sola vez en literales y campos.
+    Solo {identificador} es un campo, así que los bloques JSON del markdown
+    no necesitan escaparse.
+    """
+
+    def __init__(self, text: str):
+        pieces = FIELD.split(text)
+        # split con un grupo alterna literal, campo, literal, ...
+        self.parts: List[Tuple[str, Optional[str]]] = [
+            (pieces[i], pieces[i + 1] if i + 1 < len(pieces) else None)
+            for i in range(0, len(pieces), 2)]
+        self.fields = {field for _, field in self.parts if field}
+
+    def render(self, values: Dict) -> str:
+        missing = self.fields - values.keys()
+        if missing:
+            raise KeyError(f"Faltan campos del template: {sorted(missing)}")
+        return ''.join(literal + (str(values[field]) if field else '')
+                       for literal, field in self.parts)
+
+
+@lru_cache(maxsize=32)
+def _compile_sections(text: str) -> Dict[str, CompiledTemplate]:
+    sections = {}
+    for name in ('system', 'user'):
+        marker = SECTION_MARKER.format(name)
+        if marker in text:
+            body = text.split(marker, 1)[1]
+            # La sección termina donde empieza la siguiente
+            body = body.split('<!-- ', 1)[0]
+            sections[name] = CompiledTemplate(body.strip('\n'))
+    if 'user' not in sections:
+        sections['user'] = CompiledTemplate(text)
+    return sections
+
+
+def load_template(path: Union[str, Path]) -> Dict[str, CompiledTemplate]:
+    """Secciones compiladas (system/user) de un template; se cachean por contenido."""
+    return _compile_sections(Path(path).read_text(encoding='utf-8'))
+
+
+class ExamplePool:
+    """
+    Mensajes de usuario etiquetados indexados con BM25 (texto + etiquetas).
+
+    Args:
+        examples: dicts con 'example_id', 'text' y 'labels'
+    """
+
+    def __init__(self, examples: List[Dict], max_chars: int = 280):
+        self.examples = examples
+        self.max_chars = max_chars
+        self.index = BM25Index(tokenize(example['text']) + self.label_terms(example['labels'])
+                               for example in examples)
+        self._rendered: Dict[int, str] = {}
+
+    @staticmethod
+    def label_terms(labels: Dict) -> List[str]:
+        return [f"{dimension}={label}" for dimension, label in labels.items() if label]
+
+    @staticmethod
+    def examples_from_records(records: Iterable[Dict]) -> Iterator[Dict]:
+        """Conversaciones (mensajes de usuario etiquetados) o mensajes sueltos."""
+        for position, record in enumerate(records):
+            if not isinstance(record, dict):
+                continue
+            messages = conversation_messages(record) if 'messages' in record else [record]
+            conversation_id = record.get('conversation_id', position)
+            for i, message in enumerate(messages):
+                if is_nadia(message) or not message_text(message).strip():
+                    continue
+                labels = {dimension: message_label(message, dimension)
+                          for dimension in LABEL_DIMENSIONS}
+                for dimension in ('profile_id', 'customer_status'):
+                    labels[dimension] = labels[dimension] or record.get(dimension)
+                labels = {dimension: label for dimension, label in labels.items() if label}
+                if labels:
+                    yield {'example_id': str(message.get('message_id') or
+                                             f"{conversation_id}-{i:03d}"),
+                           'text': message_text(message), 'labels': labels}
+
+    @classmethod
+    def from_paths(cls, paths: Sequence[Union[str, Path]], pattern: str = '*.json*',
+                   max_chars: int = 280) -> 'ExamplePool':
+        existing = [path for path in paths if Path(path).exists()]
+        shards = shard_paths(existing, pattern) if existing else []
+        records = (record for shard in shards for record in iter_conversations(shard))
+        return cls(list(cls.examples_from_records(records)), max_chars=max_chars)
+
+    def __len__(self) -> int:
+        return len(self.examples)
 
-class PlaceholderClass:
-    def __init__(self, config: Dict):
-        self.config = config
+    def select(self, cell: Dict, k: int, label_weights: Dict[str, float],
+               query_text: str = '', text_weight: float = 0.5) -> List[int]:
+        """
+        Índices de los k ejemplos más relevantes para la celda. Un texto de
+        consulta opcional solo reordena: su puntaje se normaliza a
+        [0, text_weight] para que no le gane a una etiqueta coincidente.
+        """
+        if not self.examples or k <= 0:
+            return []
+        terms = {f"{dimension}={label}": label_weights.get(dimension, 1.0)
+                 for dimension, label in cell.items() if label}
+        if not query_text:
+            return [doc for doc, _ in self.index.top(terms, k)]
+        scores = self.index.scores(terms)
+        text_scores = self.index.scores({token: 1.0 for token in tokenize(query_text)})
+        if text_scores.max() > 0:
+            scores += text_weight * text_scores / text_scores.max()
+        return [doc for doc, _ in self.index.top_scores(scores, k)]
+
+    def render(self, example_index: int) -> str:
+        rendered = self._rendered.get(example_index)
+        if rendered is None:
+            example = self.examples[example_index]
+            text = example['text'].replace('\n', ' ')
+            if len(text) > self.max_chars:
+                text = text[:self.max_chars - 1].rstrip() + '…'
+            labels = ', '.join(f"{dimension}={label}"
+                               for dimension, label in example['labels'].items())
+            rendered = f"- \"{text}\" → {labels}"
+            self._rendered[example_index] = rendered
+        return rendered
+
+
+class PromptGenerator:
+    """
+    Arma los prompts de SyntheticGenerator a partir de la configuración del
+    pipeline (secciones `prompt_generation` y `synthetic_generation`).
+    """
+
+    def __init__(self, config: Dict, patterns: Optional[Dict] = None,
+                 pool: Optional[ExamplePool] = None):
+        self.config = {**PROMPT_DEFAULTS, **(config.get('prompt_generation') or {})}
+        self.batch_size = int((config.get('synthetic_generation') or {}).get('batch_size', 10))
         self.logger = logging.getLogger(self.__class__.__name__)
-        
-    def process(self, data):
-        """TODO: Implementar procesamiento"""
-        self.logger.info(f"Procesando con {self.__class__.__name__}")
-        return data
+        self.taxonomy = load_taxonomy(self.config.get('taxonomy_path'))['dimensions']
+        self.template = load_template(self.config['template_path'])
+        self.n_turns = self._turns(patterns)
+        self.skeleton_config = {**SKELETON_DEFAULTS, **(self.config['skeletons'] or {})}
+        self.sampler = self._sampler(patterns) if self.skeleton_config['enabled'] else None
+
+        if pool is None:
+            pool = ExamplePool.from_paths(self.config['example_pool'], self.config['file_pattern'],
+                                          max_chars=self.config['max_example_chars'])
+        self.pool = pool
+        self.stats = {'prompts': 0, 'examples_used': 0, 'prompts_without_examples': 0}
+        self.logger.info(f"Pool de ejemplos: {len(pool)} mensajes etiquetados")
+
+    def _turns(self, patterns: Optional[Dict]) -> int:
+        """Largo objetivo: el promedio observado en el corpus si hay análisis de patrones."""
+        observed = (((patterns or {}).get('summaries') or {}).get('shape') or {}) \
+            .get('means', {}).get('turns')
+        if observed:
+            return max(2, int(round(observed)))
+        return int(self.config['turns_per_conversation'])
+
+    def _sampler(self, patterns: Optional[Dict]) -> SkeletonSampler:
+        """Matrices aprendidas del análisis de patrones si existen; si no, solo la FSM."""
+        path = self.skeleton_config['transition_matrices'] or \
+            ((patterns or {}).get('files') or {}).get('transition_matrices')
+        learned = SkeletonSampler.load_learned(path)
+        self.logger.info(f"Esqueletos desde {'matrices aprendidas' if learned else 'la FSM'}")
+        return SkeletonSampler.from_config(self.skeleton_config, self.config.get('taxonomy_path'),
+                                           learned=learned)
+
+    def cells(self) -> Iterator[Dict]:
+        """Producto cartesiano (perezoso) de `grid_dimensions` + etiquetas por defecto."""
+        dimensions = self.config['grid_dimensions']
+        for labels in product(*(self.taxonomy[dimension] for dimension in dimensions)):
+            yield {**self.config['defaults'], **dict(zip(dimensions, labels))}
+
+    def build_context(self, messages: Iterable[Dict],
+                      state: Optional[Dict] = None) -> Optional[ConversationContext]:
+        """Contexto acotado (sección `context`) con los turnos ya escritos."""
+        context = ConversationContext.from_config(self.config['context'], state=state)
+        if context is not None:
+            for message in messages:
+                context.push(message)
+        return context
+
+    @staticmethod
+    def render_skeleton(skeleton: Dict) -> str:
+        lines = [f"{i}. " + ', '.join(f"{dimension}={label}" for dimension, label in turn.items())
+                 for i, turn in enumerate(skeleton['turns'], 1)]
+        return ('\nPlan por mensaje del usuario (respétalo en orden; Nadia responde entre '
+                'cada uno):\n' + '\n'.join(lines) + '\n')
+
+    def build_prompt(self, cell: Dict, query_text: str = '',
+                     context: Optional[ConversationContext] = None,
+                     skeleton: Optional[Dict] = None) -> Dict:
+        selected = self.pool.select(cell, int(self.config['n_examples']),
+                                    self.config['label_weights'], query_text)
+        self.stats['prompts'] += 1
+        self.stats['examples_used'] += len(selected)
+        if not selected:
+            self.stats['prompts_without_examples'] += 1
+
+        values = {dimension: '-' for dimension in LABEL_DIMENSIONS}
+        values.update(cell)
+        values['n_turns'] = 2 * len(skeleton['turns']) if skeleton else self.n_turns
+        values['skeleton'] = self.render_skeleton(skeleton) if skeleton else ''
+        values['examples'] = ('\n'.join(self.pool.render(i) for i in selected) or
+                              '(sin ejemplos disponibles)')
+        previous = context.render() if context is not None else ''
+        values['context'] = (f"\nConversación hasta ahora (continúala desde el último turno):\n"
+                             f"{previous}\n" if previous else '')
+        prompt = {
+            'prompt_id': '|'.join(str(cell[dimension]) for dimension in sorted(cell)),
+            'user': self.template['user'].render(values),
+            'metadata': {**cell,
+                         'example_ids': [self.pool.examples[i]['example_id'] for i in selected]},
+        }
+        if skeleton:
+            prompt['prompt_id'] += f"|{skeleton['skeleton_id']}"
+            prompt['metadata']['skeleton_id'] = skeleton['skeleton_id']
+            prompt['metadata']['skeleton'] = skeleton['turns']
+        if 'system' in self.template:
+            prompt['system'] = self.template['system'].render(values)
+        return prompt
+
+    def skeletons(self) -> Iterator[Dict]:
+        """`skeletons.count` esqueletos de `user_turns` (por defecto, la mitad de n_turns)."""
+        turns = self.skeleton_config['user_turns'] or max(1, (self.n_turns + 1) // 2)
+        return self.sampler.skeletons(int(self.skeleton_config['count']), int(turns))
+
+    def iter_prompts(self, cells: Optional[Iterable[Dict]] = None) -> Iterator[Dict]:
+        """Prompts por celda; sin celdas explícitas y con esqueletos, uno por esqueleto."""
+        if cells is None and self.sampler is not None:
+            for skeleton in self.skeletons():
+                yield self.build_prompt(skeleton['cell'], skeleton=skeleton)
+            return
+        for cell in (self.cells() if cells is None else cells):
+            yield self.build_prompt(cell)
+
+    def iter_batches(self, cells: Optional[Iterable[Dict]] = None) -> Iterator[List[Dict]]:
+        """Prompts en lotes de `synthetic_generation.batch_size`, generados a demanda."""
+        prompts = self.iter_prompts(cells)
+        while True:
+            batch = list(islice(prompts, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def generate(self, cells: Optional[Iterable[Dict]] = None) -> List[Dict]:
+        prompts = [prompt for batch in self.iter_batches(cells) for prompt in batch]
+        self.logger.info(f"{len(prompts)} prompts generados "
+                         f"({self.stats['prompts_without_examples']} sin ejemplos)")
+        return prompts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generación de prompts para conversaciones sintéticas')
+    parser.add_argument('--config', default='config/pipeline_config.json')
+    parser.add_argument('--output', '-o', default=None, help='JSONL de salida (stdout si se omite)')
+    parser.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    generator = PromptGenerator(config)
+    prompts = islice((p for batch in generator.iter_batches() for p in batch), args.limit)
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for prompt in prompts:
+            out.write(json.dumps(prompt, ensure_ascii=False) + '\n')
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -1,15 +1,365 @@
 """
-Módulo placeholder - TODO: Implementar
+Generador de conversaciones sintéticas.
+
+Envía los prompts de PromptGenerator al proveedor LLM configurado usando
+el cliente asíncrono (concurrencia acotada + rate limiting) y escribe las
+conversaciones resultantes en JSONL bajo data/synthetic/.
 """
+import asyncio
+import json
 import logging
-from typing import Dict, List
+import re
+import zlib
+from datetime import datetime
+from itertools import chain, cycle, islice
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from scripts.llm.batch import BatchJobRunner, BatchProvider
+from scripts.llm.budget import TokenBudget
+from scripts.llm.router import create_client
+from scripts.llm.streaming import IncrementalJSONParser, conversation_parser
+from scripts.generation_scheduler import QuotaScheduler
+from scripts.near_duplicates import DEFAULTS as NEAR_DUPLICATE_DEFAULTS
+from scripts.near_duplicates import NearDuplicateIndex, conversation_text
+
+
+class SyntheticGenerator:
+    """
+    Genera `n_conversations_to_generate` conversaciones a partir de prompts.
+
+    Cada prompt es un dict con:
+        'prompt_id': identificador del template/celda
+        'system': instrucciones de sistema (opcional)
+        'user': texto del prompt (o 'messages' ya armados)
+        'metadata': etiquetas objetivo para trazabilidad (opcional)
 
-class PlaceholderClass:
-    def __init__(self, config: Dict):
+    El presupuesto de tokens lo pasa el pipeline (compartido entre etapas);
+    si no, se arma desde la sección `budget` de este config.
+    """
+
+    STAGE = 'synthetic_generation'
+
+    def __init__(self, config: Dict, api_key: Optional[str] = None,
+                 output_dir: str = 'data/synthetic', budget: Optional[TokenBudget] = None):
         self.config = config
+        self.api_key = api_key
+        self.budget = budget if budget is not None else TokenBudget.from_config(config.get('budget'))
+        self.output_dir = Path(config.get('output_dir', output_dir))
         self.logger = logging.getLogger(self.__class__.__name__)
-        
-    def process(self, data):
-        """TODO: Implementar procesamiento"""
-        self.logger.info(f"Procesando con {self.__class__.__name__}")
-        return data
+
+        self.stats = {
+            'requested': 0,
+            'generated': 0,
+            'failed_requests': 0,
+            'invalid_json': 0,
+            'aborted': 0,
+            'near_duplicates': 0,
+            'regenerated': 0,
+            'budget_rejected': 0,
+        }
+
+        # Filtro de casi-duplicados (sección `near_duplicates`, opcional)
+        self.dedup = NearDuplicateIndex.from_config(config.get('near_duplicates'))
+        dedup_config = {**NEAR_DUPLICATE_DEFAULTS, **(config.get('near_duplicates') or {})}
+        self.regenerate_duplicates = dedup_config['on_duplicate'] == 'regenerate'
+        self.max_regenerations = int(dedup_config['max_regenerations'])
+        self._regenerations = []
+        self._prompts_by_id = {}
+
+        # Planificador por cuotas (sección `scheduler`); se arma en build_requests
+        self.scheduler = None
+        self._request_index = 0
+
+    @staticmethod
+    def _build_request(prompt: Dict, custom_id: str, seed: int,
+                       extra_metadata: Optional[Dict] = None) -> Dict:
+        prompt_id = prompt.get('prompt_id', 'prompt')
+        messages = prompt.get('messages') or [{'role': 'user', 'content': prompt['user']}]
+        return {
+            'custom_id': custom_id,
+            'system': prompt.get('system'),
+            'messages': messages,
+            'seed': seed,
+            'metadata': {'prompt_id': prompt_id, **prompt.get('metadata', {}),
+                         **(extra_metadata or {})},
+        }
+
+    def build_requests(self, prompts: List[Dict]) -> Iterator[Dict]:
+        """
+        Produce de forma perezosa un request por conversación. Si hay menos
+        prompts que conversaciones pedidas, los prompts se reutilizan en
+        ciclo (cada repetición lleva su propio custom_id).
+        """
+        self._prompts_by_id = {p.get('prompt_id', 'prompt'): p for p in prompts}
+        n_target = int(self.config.get('n_conversations_to_generate', len(prompts)))
+        base_seed = int(self.config.get('seed', 0))
+
+        scheduler_config = self.config.get('scheduler') or {}
+        if scheduler_config.get('enabled'):
+            # n_conversations_to_generate pasa a ser el presupuesto máximo
+            self.scheduler = QuotaScheduler(prompts, scheduler_config, max_requests=n_target)
+            self._request_index = 0
+            yield from self._scheduled_requests()
+            return
+
+        for index, prompt in enumerate(islice(cycle(prompts), n_target)):
+            # Seed por conversación: las repeticiones de un mismo prompt son
+            # muestras distintas, pero reproducibles (y cacheables) entre corridas
+            yield self._build_request(prompt, f"{prompt.get('prompt_id', 'prompt')}-{index:06d}",
+                                      base_seed + index)
+
+    def _scheduled_requests(self) -> Iterator[Dict]:
+        """Requests elegidos por el planificador hasta que pida pausar."""
+        base_seed = int(self.config.get('seed', 0))
+        while True:
+            prompt = self.scheduler.next_prompt()
+            if prompt is None:
+                return
+            index = self._request_index
+            self._request_index += 1
+            yield self._build_request(prompt, f"{prompt.get('prompt_id', 'prompt')}-{index:06d}",
+                                      base_seed + index)
+
+    def _regeneration_request(self, custom_id: str, metadata: Dict) -> Dict:
+        """Mismo prompt con otra seed para reemplazar un casi-duplicado."""
+        attempt = metadata.get('regeneration', 0) + 1
+        root_id = metadata.get('regenerated_from', custom_id)
+        new_id = f"{root_id}-r{attempt}"
+        prompt = self._prompts_by_id[metadata['prompt_id']]
+        return self._build_request(prompt, new_id, zlib.crc32(new_id.encode('utf-8')),
+                                   {'regeneration': attempt, 'regenerated_from': root_id})
+
+    def _is_near_duplicate(self, record: Dict, request_metadata: Dict) -> bool:
+        match = self.dedup.check_and_add(record['conversation_id'], conversation_text(record))
+        if match is None:
+            return False
+
+        self.stats['near_duplicates'] += 1
+        self.logger.debug(f"{record['conversation_id']}: casi-duplicado de {match[0]} "
+                          f"(jaccard≈{match[1]:.2f})")
+        # Con planificador no se regenera: el duplicado cuenta como rechazo y
+        # el planificador decide qué pedir en su lugar
+        if (self.regenerate_duplicates and self.scheduler is None and
+                request_metadata.get('regeneration', 0) < self.max_regenerations):
+            self._regenerations.append(
+                self._regeneration_request(record['conversation_id'], request_metadata)
+            )
+        return True
+
+    def _next_round(self, metadata_by_id: Dict) -> Optional[Iterator[Dict]]:
+        """
+        Requests de la siguiente ronda: regeneraciones pendientes o, con
+        planificador, lo que falte para las cuotas. None si no queda nada
+        o si se agotó el presupuesto.
+        """
+        if self.budget.stopped:
+            self._regenerations = []
+            return None
+        if not self._regenerations:
+            if self.scheduler is None or not self.scheduler.has_work():
+                return None
+            # Entre rondas no hay nada en vuelo: si el planificador no emite
+            # nada ahora, tampoco lo hará después
+            scheduled = self._scheduled_requests()
+            first = next(scheduled, None)
+            if first is None:
+                return None
+            return self._track(chain([first], scheduled), metadata_by_id)
+        regenerations, self._regenerations = self._regenerations, []
+        self.stats['regenerated'] += len(regenerations)
+        return self._track(iter(regenerations), metadata_by_id)
+
+    def _save_dedup_index(self) -> None:
+        if self.dedup is not None and self.dedup.path is not None:
+            self.dedup.save()
+
+    @staticmethod
+    def parse_conversation(text: str) -> Optional[Dict]:
+        """
+        Extrae el JSON de conversación de la respuesta del modelo. Tolera
+        bloques ```json ... ``` y texto alrededor del objeto.
+        """
+        if not text:
+            return None
+        candidates = [text]
+        fenced = re.search(r'```(?:json)?\s*(.*?)```', text, re.DOTALL)
+        if fenced:
+            candidates.append(fenced.group(1))
+        start, end = text.find('{'), text.rfind('}')
+        if 0 <= start < end:
+            candidates.append(text[start:end + 1])
+
+        for candidate in candidates:
+            try:
+                data = json.loads(candidate)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(data, list):
+                data = {'messages': data}
+            if isinstance(data, dict) and isinstance(data.get('messages'), list):
+                return data
+        return None
+
+    def _to_record(self, result: Dict, request_metadata: Dict,
+                   parser: Optional[IncrementalJSONParser] = None) -> Optional[Dict]:
+        if parser is not None:
+            # Streaming: los mensajes ya llegaron parseados y validados
+            conversation = {'messages': parser.records} if parser.records else None
+        else:
+            conversation = self.parse_conversation(result.get('text'))
+        if conversation is None:
+            self.stats['invalid_json'] += 1
+            self.logger.warning(f"{result['custom_id']}: respuesta sin JSON de conversación válido")
+            return None
+
+        messages = []
+        for position, message in enumerate(conversation['messages']):
+            messages.append({
+                'message_id': f"{result['custom_id']}-{position:03d}",
+                **message,
+            })
+
+        return {
+            'conversation_id': result['custom_id'],
+            'messages': messages,
+            'metadata': {
+                **request_metadata,
+                'provider': result.get('provider'),
+                'model': result.get('model'),
+                'usage': result.get('usage'),
+                'generated_at': datetime.now().isoformat(),
+            },
+        }
+
+    def _track(self, requests: Iterable[Dict], metadata_by_id: Dict) -> Iterator[Dict]:
+        """Registra la metadata de cada request mientras el cliente lo consume."""
+        for request in requests:
+            metadata_by_id[request['custom_id']] = request['metadata']
+            self.stats['requested'] += 1
+            yield request
+
+    def _accept(self, result: Dict, request_metadata: Dict,
+                parser: Optional[IncrementalJSONParser] = None) -> Optional[Dict]:
+        """Registro listo para escribir, o None si la salida se descarta."""
+        if result.get('budget_exceeded'):
+            self.stats['budget_rejected'] += 1
+            return None
+        if result.get('error'):
+            self.stats['failed_requests'] += 1
+            self.logger.error(f"{result['custom_id']}: {result['error']}")
+            return None
+        if result.get('aborted'):
+            self.stats['aborted'] += 1
+            return None
+
+        record = self._to_record(result, request_metadata, parser)
+        if record is None:
+            return None
+        if self.dedup is not None and self._is_near_duplicate(record, request_metadata):
+            return None
+        return record
+
+    def _write_result(self, result: Dict, metadata_by_id: Dict, f,
+                      parser: Optional[IncrementalJSONParser] = None) -> None:
+        request_metadata = metadata_by_id.pop(result['custom_id'], {})
+        record = self._accept(result, request_metadata, parser)
+        if self.scheduler is not None:
+            self.scheduler.observe(request_metadata.get('prompt_id'), record)
+        if record is None:
+            return
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.stats['generated'] += 1
+
+    def _result(self, output_path: Path, client_stats: Dict) -> Dict:
+        result = {
+            'output_file': str(output_path),
+            'statistics': dict(self.stats),
+            'client': client_stats,
+            'budget': self.budget.get_report(),
+        }
+        if self.scheduler is not None:
+            result['scheduler'] = self.scheduler.get_report()
+        return result
+
+    def _output_path(self, output_path: Optional[Path]) -> Path:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        if output_path is None:
+            output_path = self.output_dir / (
+                f"synthetic_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+            )
+        return Path(output_path)
+
+    async def generate_async(self, prompts: List[Dict],
+                             output_path: Optional[Path] = None) -> Dict:
+        """Genera conversaciones con requests interactivos y las escribe a medida que llegan."""
+        output_path = self._output_path(output_path)
+        metadata_by_id = {}
+        parsers = {}
+
+        streaming = self.config.get('streaming') or {}
+        consumer_factory = None
+        if streaming.get('enabled'):
+            def consumer_factory(request):
+                parser = conversation_parser(streaming.get('forbidden_patterns'),
+                                             streaming.get('max_preamble_chars', 200))
+                parsers[request['custom_id']] = parser
+                return parser
+
+        async with create_client(self.config, api_key=self.api_key,
+                                 budget=self.budget, stage=self.STAGE) as client:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                requests = self._track(self.build_requests(prompts), metadata_by_id)
+                while requests is not None:
+                    async for result in client.complete_many(requests, consumer_factory):
+                        self._write_result(result, metadata_by_id, f,
+                                           parsers.pop(result['custom_id'], None))
+                    requests = self._next_round(metadata_by_id)
+
+            client_stats = client.get_stats()
+        self._save_dedup_index()
+
+        self.logger.info(
+            f"Generadas {self.stats['generated']}/{self.stats['requested']} conversaciones "
+            f"({client_stats.get('achieved_requests_per_minute', 0):.0f} req/min, "
+            f"{client_stats['retries']} reintentos, {self.stats['aborted']} streams abortados, "
+            f"{self.stats['near_duplicates']} casi-duplicados, "
+            f"${self.budget.totals['cost_usd']:.2f})"
+        )
+        return self._result(output_path, client_stats)
+
+    def generate_batch(self, prompts: List[Dict], output_path: Optional[Path] = None,
+                       batch_provider: Optional[BatchProvider] = None) -> Dict:
+        """
+        Modo batch: escribe todos los requests en JSONL, los envía como job
+        offline, espera a que termine y procesa los resultados por custom_id.
+        """
+        output_path = self._output_path(output_path)
+        metadata_by_id = {}
+        runner = BatchJobRunner.from_config(self.config, api_key=self.api_key,
+                                            batch_provider=batch_provider,
+                                            budget=self.budget, stage=self.STAGE)
+
+        with runner, open(output_path, 'w', encoding='utf-8') as f:
+            requests = self._track(self.build_requests(prompts), metadata_by_id)
+            round_number = 0
+            while requests is not None:
+                name = output_path.stem if round_number == 0 else f"{output_path.stem}_r{round_number}"
+                for result in runner.run(requests, name=name):
+                    self._write_result(result, metadata_by_id, f)
+                requests = self._next_round(metadata_by_id)
+                round_number += 1
+            batch_stats = runner.get_stats()
+
+        self._save_dedup_index()
+        self.logger.info(
+            f"Generadas {self.stats['generated']}/{self.stats['requested']} conversaciones "
+            f"en {batch_stats['jobs']} job(s) batch"
+        )
+        return self._result(output_path, batch_stats)
+
+    def generate(self, prompts: List[Dict], output_path: Optional[Path] = None) -> Dict:
+        """Punto de entrada síncrono usado por el pipeline (`mode`: interactive | batch)."""
+        if self.config.get('mode', 'interactive') == 'batch':
+            return self.generate_batch(prompts, output_path)
+        return asyncio.run(self.generate_async(prompts, output_path))
@@ -0,0 +1,221 @@
+"""
+Autómata Aho-Corasick compilado a una tabla densa de transiciones, que
+recorre lotes de mensajes en paralelo con NumPy.
+"""
+
+import unicodedata
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+TABLE_SIZE = 0x20000  # cubre el plano básico y los emojis
+SEPARATOR = 0  # símbolo de los caracteres que no están en ningún patrón ni son letras
+OTHER_WORD = 1  # letras/dígitos que no aparecen en ningún patrón
+_CHUNK_CELLS = 1 << 21  # celdas (mensajes x pasos) por sub-lote
+
+
+@lru_cache(maxsize=1)
+def folded_codepoints() -> np.ndarray:
+    """Para cada code point: el de su forma plegada si es alfanumérico, -1 si no."""
+    folded = np.full(TABLE_SIZE, -1, dtype=np.int32)
+    for code in range(TABLE_SIZE):
+        char = chr(code)
+        if char.isalnum():
+            base = unicodedata.normalize('NFD', char.lower())[0]
+            folded[code] = ord(base) if base.isalnum() and ord(base) < TABLE_SIZE else code
+    return folded
+
+
+class AhoCorasick:
+    """
+    Args:
+        patterns: cadenas a buscar
+        prefix: por patrón, True si puede continuar la palabra a la derecha
+            (p. ej. "pag" para pago/pagar/pagas)
+    """
+
+    def __init__(self, patterns: Sequence[str], prefix: Optional[Sequence[bool]] = None):
+        self.patterns = list(patterns)
+        prefix = list(prefix) if prefix is not None else [False] * len(self.patterns)
+        folded = folded_codepoints()
+
+        # Alfabeto: formas plegadas de letras y símbolos literales de los patrones
+        alphabet = {}
+        for pattern in self.patterns:
+            for char in pattern:
+                code = ord(char)
+                key = int(folded[code]) if code < TABLE_SIZE and folded[code] >= 0 else code
+                if not char.isspace() and key not in alphabet:
+                    alphabet[key] = len(alphabet) + 2
+        self.n_symbols = len(alphabet) + 2
+
+        lookup = np.zeros(max(TABLE_SIZE, max(alphabet, default=0) + 1), dtype=np.int32)
+        for key, symbol in alphabet.items():
+            lookup[key] = symbol
+        codes = np.arange(TABLE_SIZE)
+        is_word = folded >= 0
+        letter_symbol = lookup[np.where(is_word, folded, 0)]
+        self._symbols = np.where(is_word, np.where(letter_symbol > 0, letter_symbol, OTHER_WORD),
+                                 lookup[codes]).astype(np.int32)
+        self._is_word = is_word
+
+        encoded = [self._encode_pattern(p) for p in self.patterns]
+        self.lengths = np.array([len(e) for e in encoded], dtype=np.int64)
+        if (self.lengths == 0).any():
+            empty = [p for p, e in zip(self.patterns, encoded) if not e]
+            raise ValueError(f"Patrones sin caracteres buscables: {empty}")
+        self.need_left = np.array([self._is_word[ord(p.strip()[0]) % TABLE_SIZE]
+                                   for p in self.patterns], dtype=bool)
+        self.need_right = np.array([self._is_word[ord(p.strip()[-1]) % TABLE_SIZE] and not pre
+                                    for p, pre in zip(self.patterns, prefix)], dtype=bool)
+        self._build(encoded)
+
+    @classmethod
+    def from_wildcards(cls, patterns: Sequence[str]) -> 'AhoCorasick':
+        """'pag*' busca el prefijo 'pag'; un '*' suelto es un asterisco literal."""
+        texts, prefix = [], []
+        for pattern in patterns:
+            wildcard = len(pattern) > 1 and pattern.endswith('*') and pattern[-2].isalnum()
+            texts.append(pattern[:-1] if wildcard else pattern)
+            prefix.append(wildcard)
+        return cls(texts, prefix=prefix)
+
+    def _encode_pattern(self, pattern: str) -> List[int]:
+        symbols = self.encode([pattern])[0]
+        return [int(s) for s in symbols]
+
+    def encode(self, texts: Sequence[str]) -> List[np.ndarray]:
+        """Símbolos de cada texto (separadores colapsados y recortados); útil para depurar."""
+        symbols, _, rows, lengths = self._encode_batch(texts)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        return [symbols[start:start + length] for start, length in zip(starts, lengths)]
+
+    def _encode_batch(self, texts: Sequence[str]) -> Tuple[np.ndarray, ...]:
+        """Símbolos planos del lote, con su flag de palabra, fila y largo por fila."""
+        n = len(texts)
+        # '\n' como separador final de cada texto: siempre mapea a SEPARATOR
+        codes = np.frombuffer(('\n'.join(texts) + '\n').encode('utf-32-le'), dtype=np.uint32)
+        codes = np.minimum(codes, TABLE_SIZE - 1)
+        symbols = self._symbols[codes]
+        words = self._is_word[codes]
+        text_lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=n)
+        rows = np.repeat(np.arange(n), text_lengths + 1)
+
+        # Colapsar rachas de separadores y quitar los iniciales de cada fila
+        separator = symbols == SEPARATOR
+        previous = np.concatenate(([True], separator[:-1]))
+        keep = ~(separator & previous)
+        symbols, words, rows = symbols[keep], words[keep], rows[keep]
+        # El separador final de cada fila no hace falta: el fin de fila ya es borde
+        last = np.concatenate((rows[1:] != rows[:-1], [True])) if rows.size else rows.astype(bool)
+        trailing = last & (symbols == SEPARATOR)
+        symbols, words, rows = symbols[~trailing], words[~trailing], rows[~trailing]
+        lengths = np.bincount(rows, minlength=n)
+        return symbols, words, rows, lengths
+
+    def _build(self, encoded: List[List[int]]) -> None:
+        goto: List[Dict[int, int]] = [{}]
+        outputs: List[List[int]] = [[]]
+        for pattern_id, symbols in enumerate(encoded):
+            state = 0
+            for symbol in symbols:
+                if symbol not in goto[state]:
+                    goto.append({})
+                    outputs.append([])
+                    goto[state][symbol] = len(goto) - 1
+                state = goto[state][symbol]
+            outputs[state].append(pattern_id)
+
+        n_states = len(goto)
+        delta = np.zeros((n_states, self.n_symbols), dtype=np.int32)
+        fail = [0] * n_states
+        # BFS: la fila de un estado hereda la de su enlace de falla
+        queue = list(goto[0].values())
+        for symbol, child in goto[0].items():
+            delta[0, symbol] = child
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            delta[state] = delta[fail[state]]
+            for symbol, child in goto[state].items():
+                fail[child] = int(delta[fail[state], symbol]) if state else 0
+                delta[state, symbol] = child
+                queue.append(child)
+
+        self.delta = delta
+        self.n_states = n_states
+        counts = np.array([len(o) for o in outputs], dtype=np.int64)
+        self._out_ptr = np.concatenate(([0], np.cumsum(counts)))
+        self._out_ids = np.array([p for o in outputs for p in o], dtype=np.int64)
+        self._has_output = counts > 0
+
+    def find_all(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Todas las coincidencias del lote: (fila del texto, id de patrón), una
+        entrada por ocurrencia.
+        """
+        symbols, words, rows, lengths = self._encode_batch(texts)
+        if not symbols.size or not self.patterns:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        row_start = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+        # Sub-lotes de textos de largo parecido para acotar el relleno: cada uno
+        # cumple largo máximo × filas <= _CHUNK_CELLS (los largos van en orden)
+        order = np.argsort(lengths, kind='stable')
+        sorted_lengths = np.maximum(lengths[order], 1)
+        found_rows, found_ids = [], []
+        begin = 0
+        while begin < len(order):
+            cells = sorted_lengths[begin:] * np.arange(1, len(order) - begin + 1)
+            end = begin + max(1, int(np.searchsorted(cells, _CHUNK_CELLS, side='right')))
+            chunk = order[begin:end]
+            begin = end
+            chunk_rows, chunk_ids = self._scan(chunk, symbols, words, row_start, lengths)
+            found_rows.append(chunk_rows)
+            found_ids.append(chunk_ids)
+        return np.concatenate(found_rows), np.concatenate(found_ids)
+
+    def _scan(self, chunk: np.ndarray, symbols: np.ndarray, words: np.ndarray,
+              row_start: np.ndarray, lengths: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        chunk_lengths = lengths[chunk]
+        width = int(chunk_lengths.max())
+        if width == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        n = len(chunk)
+        # Matrices paso x mensaje (cada paso es contiguo en memoria)
+        grid = np.full((width, n), SEPARATOR, dtype=np.int32)
+        word_grid = np.zeros((width + 1, n), dtype=bool)
+        columns = np.repeat(np.arange(n), chunk_lengths)
+        steps = np.arange(columns.size) - np.repeat(np.cumsum(chunk_lengths) - chunk_lengths,
+                                                    chunk_lengths)
+        source = np.repeat(row_start[chunk], chunk_lengths) + steps
+        grid[steps, columns] = symbols[source]
+        word_grid[steps, columns] = words[source]
+
+        states = np.empty((width, n), dtype=np.int32)
+        state = np.zeros(n, dtype=np.int32)
+        delta = self.delta
+        for t in range(width):
+            state = delta[state, grid[t]]
+            states[t] = state
+
+        hit_steps, hit_columns = np.nonzero(self._has_output[states])
+        if hit_steps.size == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        hit_states = states[hit_steps, hit_columns]
+        counts = self._out_ptr[hit_states + 1] - self._out_ptr[hit_states]
+        repeat = np.repeat(np.arange(hit_states.size), counts)
+        offsets = np.arange(repeat.size) - np.repeat(np.cumsum(counts) - counts, counts)
+        pattern_ids = self._out_ids[self._out_ptr[hit_states][repeat] + offsets]
+        ends = hit_steps[repeat]
+        columns = hit_columns[repeat]
+        starts = ends - self.lengths[pattern_ids] + 1
+
+        # Bordes de palabra: antes del inicio y después del final no hay letra
+        left_ok = (starts == 0) | ~word_grid[np.maximum(starts - 1, 0), columns]
+        right_ok = ~word_grid[ends + 1, columns]
+        valid = (left_ok | ~self.need_left[pattern_ids]) & (right_ok | ~self.need_right[pattern_ids])
+        return chunk[columns[valid]].astype(np.int64), pattern_ids[valid]
@@ -0,0 +1,79 @@
+"""
+Índice BM25 en memoria sobre una matriz dispersa de pesos.
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+
+class BM25Index:
+    """
+    Args:
+        documents: lista de tokens por documento
+        k1, b: parámetros de BM25
+    """
+
+    def __init__(self, documents: Iterable[Sequence[str]], k1: float = 1.2, b: float = 0.75):
+        self.vocabulary: Dict[str, int] = {}
+        rows, cols = [], []
+        lengths = []
+        for doc_id, tokens in enumerate(documents):
+            lengths.append(len(tokens))
+            for token in tokens:
+                term = self.vocabulary.setdefault(token, len(self.vocabulary))
+                rows.append(doc_id)
+                cols.append(term)
+        self.n_documents = len(lengths)
+        lengths = np.array(lengths, dtype=float)
+
+        # Frecuencias de término: los duplicados (doc, término) se suman al convertir
+        tf = sparse.coo_matrix((np.ones(len(rows)), (rows, cols)),
+                               shape=(self.n_documents, len(self.vocabulary))).tocsr()
+        tf.sum_duplicates()
+        df = np.diff(tf.tocsc().indptr)
+        self.idf = np.log1p((self.n_documents - df + 0.5) / (df + 0.5))
+
+        average = lengths.mean() if self.n_documents else 0.0
+        norm = k1 * (1 - b + b * lengths / average) if average else np.full(self.n_documents, k1)
+        doc_of_entry = np.repeat(np.arange(self.n_documents), np.diff(tf.indptr))
+        tf.data = self.idf[tf.indices] * tf.data * (k1 + 1) / (tf.data + norm[doc_of_entry])
+        self.weights = tf.tocsc()
+
+    def query_vector(self, terms: Dict[str, float]) -> Tuple[np.ndarray, np.ndarray]:
+        ids, weights = [], []
+        for term, weight in terms.items():
+            term_id = self.vocabulary.get(term)
+            if term_id is not None:
+                ids.append(term_id)
+                weights.append(weight)
+        return np.array(ids, dtype=np.int64), np.array(weights, dtype=float)
+
+    def scores(self, terms: Dict[str, float]) -> np.ndarray:
+        """Puntaje BM25 de todos los documentos para términos con peso de consulta."""
+        ids, weights = self.query_vector(terms)
+        if ids.size == 0:
+            return np.zeros(self.n_documents)
+        return np.asarray(self.weights[:, ids] @ weights).ravel()
+
+    def top(self, terms: Dict[str, float], k: int,
+            exclude: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Los k documentos de mayor puntaje (> 0), de mayor a menor."""
+        scores = self.scores(terms)
+        if exclude is not None and exclude.size:
+            scores[exclude] = 0.0
+        return self.top_scores(scores, k)
+
+    @staticmethod
+    def top_scores(scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """Los k índices de mayor puntaje (> 0) de un vector ya calculado."""
+        candidates = np.flatnonzero(scores > 0)
+        if candidates.size > k:
+            # Se conservan todos los empatados con el k-ésimo puntaje, para que
+            # el corte no dependa del orden interno de argpartition
+            kth = np.partition(scores[candidates], candidates.size - k)[candidates.size - k]
+            candidates = candidates[scores[candidates] >= kth]
+        # Orden estable: a igual puntaje gana el documento más antiguo del pool
+        order = candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+        return [(int(doc), float(scores[doc])) for doc in order]
@@ -0,0 +1,217 @@
+"""
+Sketches de frecuencia mergeables y con memoria acotada:
+Count-Min (frecuencia de cualquier ítem) y Space-Saving (heavy hitters).
+"""
+
+import hashlib
+import heapq
+import json
+import math
+import os
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+def stable_hashes(items: Iterable[str]) -> np.ndarray:
+    """blake2b de 64 bits de cada ítem (uint64); hash() de Python cambia entre procesos."""
+    digests = b''.join(hashlib.blake2b(item.encode('utf-8'), digest_size=8).digest()
+                       for item in items)
+    return np.frombuffer(digests, dtype='<u8').astype(np.uint64)
+
+
+class CountMinSketch:
+    """
+    Tabla depth x width de contadores. Cada fila usa un hash multiply-shift
+    independiente; la estimación es el mínimo de las filas.
+
+    Args:
+        width, depth: dimensiones de la tabla (ver from_error)
+        seed: semilla de los hashes; dos sketches solo se combinan si
+            comparten width, depth y seed
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 5, seed: int = 1):
+        self.width = int(width)
+        self.depth = int(depth)
+        self.seed = seed
+        rng = np.random.RandomState(seed)
+        # Multiplicadores impares para multiply-shift
+        self._a = rng.randint(1, 1 << 62, size=depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = rng.randint(0, 1 << 62, size=depth, dtype=np.uint64)
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    @classmethod
+    def from_error(cls, epsilon: float = 1e-4, delta: float = 0.01, seed: int = 1) -> 'CountMinSketch':
+        """Dimensiona la tabla para error <= epsilon * N con probabilidad 1 - delta."""
+        return cls(width=math.ceil(math.e / epsilon), depth=math.ceil(math.log(1 / delta)), seed=seed)
+
+    def _columns(self, hashes: np.ndarray) -> np.ndarray:
+        """Columna de cada ítem en cada fila: matriz depth x n."""
+        # El overflow de uint64 es intencional (aritmética mod 2^64)
+        with np.errstate(over='ignore'):
+            mixed = np.outer(self._a, hashes) + self._b[:, None]
+        return ((mixed >> np.uint64(32)) % np.uint64(self.width)).astype(np.intp)
+
+    def update_many(self, items: Iterable[str], counts: Optional[Iterable[int]] = None) -> None:
+        """Suma `counts` (1 por defecto) a cada ítem; vectorizado por lote."""
+        items = list(items)
+        if not items:
+            return
+        counts = np.ones(len(items), dtype=np.int64) if counts is None else \
+            np.asarray(list(counts), dtype=np.int64)
+        columns = self._columns(stable_hashes(items))
+        flat = (columns + (np.arange(self.depth, dtype=np.intp) * self.width)[:, None]).ravel()
+        weights = np.tile(counts, self.depth)
+        table = self.table.ravel()
+        if flat.size * 8 < table.size:
+            np.add.at(table, flat, weights)
+        else:
+            # Lotes grandes: un bincount denso es más rápido que add.at
+            table += np.bincount(flat, weights=weights, minlength=table.size).astype(np.int64)
+        self.total += int(counts.sum())
+
+    def update(self, item: str, count: int = 1) -> None:
+        self.update_many([item], [count])
+
+    def estimate_many(self, items: Iterable[str]) -> np.ndarray:
+        items = list(items)
+        if not items:
+            return np.zeros(0, dtype=np.int64)
+        columns = self._columns(stable_hashes(items))
+        return self.table[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+    def estimate(self, item: str) -> int:
+        return int(self.estimate_many([item])[0])
+
+    @property
+    def error_bound(self) -> float:
+        """Sobreestimación máxima esperada (e/width * N)."""
+        return math.e / self.width * self.total
+
+    def merge(self, other: 'CountMinSketch') -> 'CountMinSketch':
+        if (self.width, self.depth, self.seed) != (other.width, other.depth, other.seed):
+            raise ValueError("Solo se combinan sketches con el mismo width, depth y seed")
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    def save(self, path: str) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, params=np.array(json.dumps(
+                {'width': self.width, 'depth': self.depth, 'seed': self.seed, 'total': self.total})),
+                table=self.table)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> 'CountMinSketch':
+        with np.load(path) as data:
+            params = json.loads(str(data['params']))
+            sketch = cls(width=params['width'], depth=params['depth'], seed=params['seed'])
+            sketch.table = data['table'].copy()
+        sketch.total = params['total']
+        return sketch
+
+
+class SpaceSaving:
+    """
+    Resumen Space-Saving de capacidad k: ítem -> (conteo, error). El conteo
+    sobreestima la frecuencia real en a lo sumo `error` (<= N/k).
+
+    Las actualizaciones se acumulan en un Counter exacto y se vuelcan al
+    resumen cada `buffer_size` ítems distintos con el mismo merge que une
+    shards. Los conteos pueden diferir de actualizar de a uno, pero se
+    mantiene la cota de error de un resumen mergeable (<= N/k).
+    """
+
+    def __init__(self, capacity: int = 1000, buffer_size: Optional[int] = None):
+        self.capacity = int(capacity)
+        self.buffer_size = buffer_size or 4 * self.capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.total = 0
+        self._pending = Counter()
+
+    def update(self, item: str, count: int = 1) -> None:
+        self._pending[item] += count
+        self.total += count
+        if len(self._pending) >= self.buffer_size:
+            self._flush()
+
+    def update_many(self, items: Iterable[str]) -> None:
+        items = list(items)
+        self._pending.update(items)
+        self.total += len(items)
+        if len(self._pending) >= self.buffer_size:
+            self._flush()
+
+    @property
+    def _floor(self) -> int:
+        """Cota superior de la frecuencia de un ítem que no está en el resumen."""
+        return min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    def _combine(self, counts: Dict, errors: Dict, floor: int) -> None:
+        own_floor = self._floor
+        merged = {}
+        for item in self.counts.keys() | counts.keys():
+            merged[item] = (self.counts.get(item, own_floor) + counts.get(item, floor),
+                            self.errors.get(item, own_floor) + errors.get(item, floor))
+        if len(merged) > self.capacity:
+            merged = dict(heapq.nlargest(self.capacity, merged.items(), key=lambda kv: kv[1][0]))
+        self.counts = {item: c for item, (c, _) in merged.items()}
+        self.errors = {item: e for item, (_, e) in merged.items()}
+
+    def _flush(self) -> None:
+        if self._pending:
+            pending, self._pending = self._pending, Counter()
+            # El buffer es exacto: error 0 y frecuencia 0 para lo que no vio
+            self._combine(pending, {}, 0)
+
+    def merge(self, other: 'SpaceSaving') -> 'SpaceSaving':
+        self._flush()
+        other._flush()
+        self._combine(other.counts, other.errors, other._floor)
+        self.total += other.total
+        return self
+
+    def top(self, n: Optional[int] = None) -> List[Tuple[str, int, int]]:
+        """[(ítem, conteo, error)] de mayor a menor conteo."""
+        self._flush()
+        ranked = sorted(self.counts.items(), key=lambda kv: (-kv[1], kv[0]))
+        return [(item, count, self.errors[item]) for item, count in ranked[:n]]
+
+    def estimate(self, item: str) -> int:
+        self._flush()
+        return self.counts.get(item, self._floor)
+
+    def guaranteed(self, item: str) -> int:
+        """Cota inferior de la frecuencia real."""
+        self._flush()
+        return self.counts[item] - self.errors[item] if item in self.counts else 0
+
+    def __len__(self) -> int:
+        self._flush()
+        return len(self.counts)
+
+    def to_dict(self, n: Optional[int] = None) -> Dict:
+        return {
+            'capacity': self.capacity,
+            'total': self.total,
+            'items': [{'item': item, 'count': count, 'error': error}
+                      for item, count, error in self.top(n)],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'SpaceSaving':
+        summary = cls(capacity=data['capacity'])
+        summary.counts = {entry['item']: entry['count'] for entry in data['items']}
+        summary.errors = {entry['item']: entry['error'] for entry in data['items']}
+        summary.total = data['total']
+        return summary
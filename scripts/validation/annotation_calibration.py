@@ -1,9 +1,21 @@
 import json
 import random
+import sys
+from collections import Counter
 from datetime import datetime
+from pathlib import Path
 from typing import Dict, List, Tuple
 import hashlib
 
+import numpy as np
+
+# Agregar el directorio raíz al path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from scripts.validation.label_codec import LabelCodec
+
+CALIBRATION_DIMENSIONS = ['primary_intent', 'message_tone', 'safety_level']
+
 class AnnotatorCalibrationTool:
     """
     Herramienta para auto-calibración del anotador único en el proyecto Nadia.
@@ -13,6 +25,10 @@ class AnnotatorCalibrationTool:
     def __init__(self):
         self.control_bank = []
         self.annotation_history = {}
+        self.codec = LabelCodec.load()
+        # Etiquetas fuera de la taxonomía, por dimensión: no se funden en OTHER,
+        # cada una recibe un código a continuación de las categorías del codec
+        self.unknown_labels = {dim: [] for dim in CALIBRATION_DIMENSIONS}
         
     def create_control_bank(self, messages: List[Dict]) -> None:
         """
@@ -43,7 +59,7 @@ class AnnotatorCalibrationTool:
             
         # Guardar orden aleatorio para esta sesión
         order_hash = hashlib.md5(
-            ''.join([m['id'] for m in session_messages]).encode()
+            ''.join([str(m['id']) for m in session_messages]).encode()
         ).hexdigest()
         
         self.annotation_history[session_name] = {
@@ -67,6 +83,40 @@ class AnnotatorCalibrationTool:
         if session_name in self.annotation_history:
             self.annotation_history[session_name]['annotations'][message_id] = labels
     
+    def _encode(self, dim: str, label) -> int:
+        """Código del codec, o uno propio si la etiqueta no está en la taxonomía."""
+        unknown = Counter()
+        code = int(self.codec.encode(dim, [label], unknown)[0])
+        if not unknown:
+            return code
+        extra = self.unknown_labels[dim]
+        if label not in extra:
+            extra.append(label)
+        return len(self.codec.categories[dim]) + extra.index(label)
+    
+    def _decode(self, dim: str, code: int):
+        n_categories = len(self.codec.categories[dim])
+        if code < n_categories:
+            return self.codec.decode(dim, code)
+        return self.unknown_labels[dim][code - n_categories]
+    
+    def _common_codes(self, session1: str, session2: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """Mensajes comunes y sus matrices de códigos (mensaje × dimensión) en cada sesión."""
+        annotations1 = self.annotation_history[session1]['annotations']
+        annotations2 = self.annotation_history[session2]['annotations']
+        # Orden de anotación de la primera sesión: los ids pueden mezclar int y str
+        common_messages = [m for m in annotations1 if m in annotations2]
+        codes1 = self._codes([annotations1[m] for m in common_messages])
+        codes2 = self._codes([annotations2[m] for m in common_messages])
+        return common_messages, codes1, codes2
+    
+    def _codes(self, annotations: List[Dict[str, str]]) -> np.ndarray:
+        """Matriz de códigos mensaje × dimensión (-1 = sin etiqueta)."""
+        codes = np.empty((len(annotations), len(CALIBRATION_DIMENSIONS)), dtype=np.int16)
+        for col, dim in enumerate(CALIBRATION_DIMENSIONS):
+            codes[:, col] = [self._encode(dim, labels.get(dim)) for labels in annotations]
+        return codes
+    
     def calculate_intra_annotator_agreement(self, session1: str, 
                                            session2: str) -> Dict[str, float]:
         """
@@ -75,44 +125,25 @@ class AnnotatorCalibrationTool:
         if session1 not in self.annotation_history or session2 not in self.annotation_history:
             raise ValueError("Sesiones no encontradas")
         
-        annotations1 = self.annotation_history[session1]['annotations']
-        annotations2 = self.annotation_history[session2]['annotations']
-        
         # Encontrar mensajes comunes
-        common_messages = set(annotations1.keys()) & set(annotations2.keys())
+        common_messages, codes1, codes2 = self._common_codes(session1, session2)
         
         if not common_messages:
             return {}
         
-        # Calcular acuerdo por dimensión
-        dimensions = ['primary_intent', 'message_tone', 'safety_level']
+        # Calcular acuerdo por dimensión (solo donde ambas sesiones etiquetaron)
+        both = (codes1 >= 0) & (codes2 >= 0)
+        matches = (codes1 == codes2) & both
+        totals = both.sum(axis=0)
         agreement_scores = {}
         
-        for dim in dimensions:
-            matches = 0
-            total = 0
-            
-            for msg_id in common_messages:
-                if dim in annotations1[msg_id] and dim in annotations2[msg_id]:
-                    total += 1
-                    if annotations1[msg_id][dim] == annotations2[msg_id][dim]:
-                        matches += 1
-            
+        for dim, n_matches, total in zip(CALIBRATION_DIMENSIONS, matches.sum(axis=0), totals):
             if total > 0:
-                agreement_scores[dim] = matches / total
+                agreement_scores[dim] = float(n_matches / total)
         
         # Acuerdo general
-        all_matches = 0
-        all_total = 0
-        
-        for msg_id in common_messages:
-            for dim in dimensions:
-                if dim in annotations1[msg_id] and dim in annotations2[msg_id]:
-                    all_total += 1
-                    if annotations1[msg_id][dim] == annotations2[msg_id][dim]:
-                        all_matches += 1
-        
-        agreement_scores['overall'] = all_matches / all_total if all_total > 0 else 0
+        all_total = totals.sum()
+        agreement_scores['overall'] = float(matches.sum() / all_total) if all_total > 0 else 0
         
         return agreement_scores
     
@@ -122,38 +153,29 @@ class AnnotatorCalibrationTool:
         """
         inconsistencies = []
         
-        annotations1 = self.annotation_history[session1]['annotations']
-        annotations2 = self.annotation_history[session2]['annotations']
-        
-        common_messages = set(annotations1.keys()) & set(annotations2.keys())
+        common_messages, codes1, codes2 = self._common_codes(session1, session2)
+        texts = {msg['id']: msg['text'] for msg in self.control_bank}
+        differs = (codes1 != codes2) & (codes1 >= 0) & (codes2 >= 0)
         
-        for msg_id in common_messages:
+        for row in np.flatnonzero(differs.any(axis=1)):
+            msg_id = common_messages[row]
             msg_inconsistencies = {}
             
             # Buscar el texto original
-            original_text = None
-            for msg in self.control_bank:
-                if msg['id'] == msg_id:
-                    original_text = msg['text']
-                    break
+            original_text = texts.get(msg_id)
             
-            for dim in ['primary_intent', 'message_tone', 'safety_level']:
-                if dim in annotations1[msg_id] and dim in annotations2[msg_id]:
-                    label1 = annotations1[msg_id][dim]
-                    label2 = annotations2[msg_id][dim]
-                    
-                    if label1 != label2:
-                        msg_inconsistencies[dim] = {
-                            'session1': label1,
-                            'session2': label2
-                        }
+            for col in np.flatnonzero(differs[row]):
+                dim = CALIBRATION_DIMENSIONS[col]
+                msg_inconsistencies[dim] = {
+                    'session1': self._decode(dim, codes1[row, col]),
+                    'session2': self._decode(dim, codes2[row, col])
+                }
             
-            if msg_inconsistencies:
-                inconsistencies.append({
-                    'message_id': msg_id,
-                    'text': original_text,
-                    'disagreements': msg_inconsistencies
-                })
+            inconsistencies.append({
+                'message_id': msg_id,
+                'text': original_text,
+                'disagreements': msg_inconsistencies
+            })
         
         return inconsistencies
     
@@ -0,0 +1,171 @@
+"""
+Registro compartido de conflictos entre etiquetas (config/label_conflicts.yaml).
+"""
+
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from scripts.validation.label_codec import LabelCodec
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+DEFAULT_CONFLICT_RULES_PATH = Path(__file__).parent.parent.parent / 'config' / 'label_conflicts.yaml'
+
+
+@lru_cache(maxsize=16)
+def read_yaml(path: str) -> Dict:
+    """Archivo YAML de reglas (se lee una vez por ruta)."""
+    if yaml is None:
+        raise ImportError("pyyaml es necesario para leer las reglas de config/")
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+
+class ConflictHits:
+    """
+    Reglas cumplidas por fila.
+
+    Args:
+        registry: registro que produjo la matriz
+        matrix: CSR booleana (reglas, filas)
+        message_ids: ids por fila (cualquier secuencia indexable; no se copia)
+    """
+
+    def __init__(self, registry: 'ConflictRuleRegistry', matrix: sparse.csr_matrix,
+                 message_ids=None):
+        self.registry = registry
+        self.matrix = matrix
+        self._message_ids = message_ids
+
+    @property
+    def counts(self) -> np.ndarray:
+        """Filas que cumplen cada regla, en el orden del registro."""
+        return np.diff(self.matrix.indptr)
+
+    def count(self, code: str) -> int:
+        return int(self.counts[self.registry.index[code]])
+
+    def rows(self, code: str) -> np.ndarray:
+        """Índices de fila que cumplen la regla."""
+        i = self.registry.index[code]
+        return self.matrix.indices[self.matrix.indptr[i]:self.matrix.indptr[i + 1]]
+
+    def message_ids(self, code: str) -> List:
+        if self._message_ids is None:
+            raise ValueError("La tabla evaluada no tenía message_id")
+        return np.asarray(self._message_ids, dtype=object)[self.rows(code)].tolist()
+
+    def row_codes(self) -> List[List[str]]:
+        """Códigos de regla por fila, en el orden del registro."""
+        by_row = self.matrix.T.tocsr()
+        by_row.sort_indices()
+        codes = np.array(self.registry.codes, dtype=object)
+        return [codes[by_row.indices[start:end]].tolist()
+                for start, end in zip(by_row.indptr[:-1], by_row.indptr[1:])]
+
+    def dense(self) -> np.ndarray:
+        """Matriz (filas, reglas) densa, para lotes chicos."""
+        return self.matrix.T.toarray()
+
+
+class ConflictRuleRegistry:
+    """
+    Args:
+        rules: lista de reglas (`code`, `when`, `confidence_below`, `message`)
+        codec: codificación de la taxonomía contra la que se validan las etiquetas
+    """
+
+    def __init__(self, rules: Sequence[Dict], codec: Optional[LabelCodec] = None):
+        self.rules = list(rules)
+        self.codec = codec or LabelCodec.load()
+        self.codes = [rule['code'] for rule in self.rules]
+        if len(set(self.codes)) != len(self.codes):
+            raise ValueError("Los códigos de las reglas de conflicto deben ser únicos")
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.messages = {rule['code']: rule['message'] for rule in self.rules}
+
+        n_rules = len(self.rules)
+        self.dimensions = sorted({dimension for rule in self.rules for dimension in rule['when']})
+        self._lookup: Dict[str, np.ndarray] = {}
+        self._uses = np.zeros((n_rules, len(self.dimensions)), dtype=bool)
+        for d, dimension in enumerate(self.dimensions):
+            if dimension not in self.codec.categories:
+                raise ValueError(f"Dimensión desconocida en reglas de conflicto: {dimension}")
+            categories = self.codec.categories[dimension]
+            lookup = np.ones((n_rules, len(categories) + 1), dtype=bool)
+            for i, rule in enumerate(self.rules):
+                labels = rule['when'].get(dimension)
+                if labels is None:
+                    continue
+                unknown = set(labels) - set(categories)
+                if unknown:
+                    raise ValueError(f"Etiquetas desconocidas en {rule['code']}: {sorted(unknown)}")
+                lookup[i] = False
+                lookup[i, [categories.index(label) for label in labels]] = True
+                self._uses[i, d] = True
+            self._lookup[dimension] = lookup
+        self.thresholds = np.array([rule.get('confidence_below', np.inf) for rule in self.rules],
+                                   dtype=float)
+
+    @classmethod
+    def load(cls, path: Union[str, Path, None] = None,
+             codec: Optional[LabelCodec] = None) -> 'ConflictRuleRegistry':
+        return cls(read_yaml(str(path or DEFAULT_CONFLICT_RULES_PATH)).get('rules') or [], codec)
+
+    def evaluate(self, labels_df: pd.DataFrame, block_size: int = 1_000_000) -> ConflictHits:
+        """
+        Todas las reglas sobre una tabla de etiquetas (strings o Categoricals
+        del codec). Las reglas que miran una dimensión ausente no se cumplen.
+        """
+        columns = {dimension: self.codec.codes(labels_df, dimension)
+                   for dimension in self.dimensions if dimension in labels_df.columns}
+        if 'confidence' in labels_df.columns:
+            columns['confidence'] = labels_df['confidence'].fillna(1).to_numpy(dtype=float)
+        message_ids = labels_df['message_id'] if 'message_id' in labels_df.columns else None
+        return ConflictHits(self, self._sweep(columns, len(labels_df), block_size), message_ids)
+
+    def evaluate_records(self, labels: Sequence[Dict]) -> ConflictHits:
+        """Igual que evaluate, para una lista de dicts de etiquetas."""
+        columns = self.codec.encode_records(labels, self.dimensions, key=None)
+        columns['confidence'] = np.array([label.get('confidence', 1) for label in labels],
+                                         dtype=float)
+        return ConflictHits(self, self._sweep(columns, len(labels), len(labels) or 1))
+
+    def _sweep(self, columns: Dict[str, np.ndarray], n: int,
+               block_size: int) -> sparse.csr_matrix:
+        n_rules = len(self.rules)
+        present = np.array([dimension in columns for dimension in self.dimensions], dtype=bool)
+        # Reglas evaluables: todas sus dimensiones están en la tabla
+        active = ~(self._uses & ~present).any(axis=1)
+        has_confidence = 'confidence' in columns
+        if not has_confidence:
+            # Sin confianza se asume 1: los umbrales nunca se cumplen
+            active &= ~np.isfinite(self.thresholds)
+
+        rule_hits, row_hits = [], []
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            hit = np.repeat(active[:, None], stop - start, axis=1)
+            for dimension in self.dimensions:
+                if dimension in columns:
+                    hit &= self._lookup[dimension][:, columns[dimension][start:stop]]
+            if has_confidence:
+                hit &= columns['confidence'][None, start:stop] < self.thresholds[:, None]
+            rules, rows = np.nonzero(hit)
+            rule_hits.append(rules)
+            row_hits.append(rows + start)
+
+        rules = np.concatenate(rule_hits) if rule_hits else np.empty(0, dtype=np.int64)
+        rows = np.concatenate(row_hits) if row_hits else np.empty(0, dtype=np.int64)
+        matrix = sparse.csr_matrix((np.ones(len(rules), dtype=bool), (rules, rows)),
+                                   shape=(n_rules, n))
+        matrix.sort_indices()
+        return matrix
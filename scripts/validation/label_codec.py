@@ -0,0 +1,157 @@
+"""
+Codificación compartida de etiquetas de la taxonomía (config/taxonomy_v2.json)
+en códigos int8, con OTHER para etiquetas fuera de ella y -1 para "sin etiqueta".
+"""
+
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from scripts.patterns.corpus import load_taxonomy
+
+FALLBACK_LABEL = 'OTHER'
+RECORD_COLUMNS = ('message_id', 'conversation_id', 'timestamp', 'annotator')
+
+
+class LabelCodec:
+    """
+    Args:
+        dimensions: dimensión -> etiquetas (el orden define los códigos)
+    """
+
+    def __init__(self, dimensions: Dict[str, Sequence[str]]):
+        self.dimensions = {dimension: list(labels) for dimension, labels in dimensions.items()}
+        self.categories = {dimension: labels + ([] if FALLBACK_LABEL in labels else [FALLBACK_LABEL])
+                           for dimension, labels in self.dimensions.items()}
+        too_many = [dimension for dimension, labels in self.categories.items() if len(labels) > 127]
+        if too_many:
+            raise ValueError(f"Demasiadas etiquetas para int8 en: {too_many}")
+        self.dtypes = {dimension: pd.CategoricalDtype(labels)
+                       for dimension, labels in self.categories.items()}
+        self._index = {dimension: pd.Index(labels) for dimension, labels in self.categories.items()}
+        self._labels = {dimension: np.array(labels + [None], dtype=object)
+                        for dimension, labels in self.categories.items()}
+
+    @classmethod
+    def load(cls, taxonomy_path: Union[str, Path, None] = None) -> 'LabelCodec':
+        """Codec de la taxonomía (uno por ruta, compartido entre validadores)."""
+        return _load(str(taxonomy_path or ''))
+
+    def fallback_code(self, dimension: str) -> int:
+        return self.categories[dimension].index(FALLBACK_LABEL)
+
+    def encode(self, dimension: str, values, unknown: Optional[Counter] = None) -> np.ndarray:
+        """
+        Etiquetas -> códigos int8 (OTHER si no están en la taxonomía, -1 si
+        faltan). Las etiquetas fuera de la taxonomía se suman a `unknown`.
+        """
+        values = np.asarray(values, dtype=object)
+        codes = self._index[dimension].get_indexer(values)
+        outside = codes < 0
+        if outside.any():
+            outside &= ~pd.isna(values)
+            codes[outside] = self.fallback_code(dimension)
+            if unknown is not None:
+                unknown.update(values[outside].tolist())
+        return codes.astype(np.int8)
+
+    def decode(self, dimension: str, codes) -> np.ndarray:
+        """Códigos -> etiquetas (None para -1)."""
+        return self._labels[dimension][np.asarray(codes)]
+
+    def categorical(self, dimension: str, codes) -> pd.Categorical:
+        return pd.Categorical.from_codes(np.asarray(codes), dtype=self.dtypes[dimension])
+
+    def codes(self, frame: pd.DataFrame, dimension: str,
+              unknown: Optional[Counter] = None) -> np.ndarray:
+        """
+        Códigos de una columna; sin copia si ya está codificada (en ese caso
+        las etiquetas inválidas ya son OTHER y `unknown` no cambia).
+        """
+        column = frame[dimension]
+        if column.dtype == self.dtypes[dimension]:
+            return column.array.codes
+        return self.encode(dimension, column.to_numpy(), unknown)
+
+    def encode_frame(self, frame: pd.DataFrame,
+                     dimensions: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Copia del DataFrame con las columnas de etiquetas como Categoricals fijos."""
+        encoded = frame.copy(deep=False)
+        for dimension in dimensions or self.dimensions:
+            if dimension in encoded.columns:
+                encoded[dimension] = self.categorical(dimension, self.codes(frame, dimension))
+        return encoded
+
+    def encode_records(self, records: Sequence[Dict], dimensions: Optional[Iterable[str]] = None,
+                       key: Optional[str] = 'annotations',
+                       unknown: Optional[Dict[str, Counter]] = None) -> Dict[str, np.ndarray]:
+        """
+        Códigos por dimensión de una lista de ítems (etiquetas en item[key] o
+        en el ítem). `unknown`: dimensión -> Counter de etiquetas inválidas.
+        """
+        labels = [(record.get(key) or record) if key else record for record in records]
+        return {dimension: self.encode(dimension, [label.get(dimension) for label in labels],
+                                       (unknown or {}).get(dimension))
+                for dimension in dimensions or self.dimensions}
+
+    def frame_from_records(self, records: Iterable[Dict],
+                           dimensions: Optional[Iterable[str]] = None,
+                           key: Optional[str] = 'annotations',
+                           chunk_size: int = 100000) -> pd.DataFrame:
+        """
+        Tabla codificada a partir de ítems leídos en streaming: se codifica por
+        bloques, así que nunca hay más de `chunk_size` etiquetas como string.
+        """
+        dimensions = list(dimensions or self.dimensions)
+        chunks: Dict[str, List[np.ndarray]] = {dimension: [] for dimension in dimensions}
+        extra: Dict[str, List] = {column: [] for column in RECORD_COLUMNS}
+        batch: List[Dict] = []
+
+        def flush():
+            for dimension, codes in self.encode_records(batch, dimensions, key).items():
+                chunks[dimension].append(codes)
+            for column, values in extra.items():
+                values.extend(record.get(column) for record in batch)
+            batch.clear()
+
+        for record in records:
+            batch.append(record)
+            if len(batch) >= chunk_size:
+                flush()
+        if batch:
+            flush()
+
+        frame = pd.DataFrame({column: values for column, values in extra.items()
+                              if any(value is not None for value in values)})
+        for dimension in dimensions:
+            codes = (np.concatenate(chunks[dimension]) if chunks[dimension]
+                     else np.empty(0, dtype=np.int8))
+            frame[dimension] = self.categorical(dimension, codes)
+        return frame
+
+    def counts(self, dimension: str, codes) -> np.ndarray:
+        """Conteo por categoría (sin los -1)."""
+        codes = np.asarray(codes)
+        return np.bincount(codes[codes >= 0], minlength=len(self.categories[dimension]))
+
+    def count_dict(self, dimension: str, counts,
+                   unknown: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        """
+        {etiqueta: conteo} de las categorías presentes. Con `unknown`, las
+        etiquetas inválidas salen con su nombre en lugar de sumarse a OTHER.
+        """
+        counts = np.array(counts, dtype=np.int64)
+        if unknown:
+            counts[self.fallback_code(dimension)] -= sum(unknown.values())
+        result = {label: int(n) for label, n in zip(self.categories[dimension], counts) if n}
+        result.update({label: int(n) for label, n in (unknown or {}).items() if n})
+        return result
+
+
+@lru_cache(maxsize=8)
+def _load(path: str) -> LabelCodec:
+    return LabelCodec(load_taxonomy(path or None)['dimensions'])
@@ -1,8 +1,17 @@
+import sys
+from collections import Counter
+from itertools import combinations
+from pathlib import Path
+
 import pandas as pd
 import numpy as np
-from sklearn.metrics import cohen_kappa_score, confusion_matrix
-import matplotlib.pyplot as plt
-import seaborn as sns
+
+# Agregar el directorio raíz al path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from scripts.patterns.corpus import fsm_mask, iter_conversations, load_taxonomy
+from scripts.validation.conflict_rules import ConflictRuleRegistry
+from scripts.validation.label_codec import LabelCodec
 
 class LabelValidator:
     """
@@ -10,138 +19,244 @@ class LabelValidator:
     en el proyecto Nadia.
     """
     
-    def __init__(self):
-        self.dimensions = {
-            'profile_id': ['PROFILE_1_DIRECTO', 'PROFILE_2_HESITANTE', 'PROFILE_3_DECEPCIONADO'],
-            'customer_status': ['PROSPECT', 'LEAD_QUALIFIED', 'CUSTOMER', 'CHURNED'],
-            'primary_intent': [
-                'GREETING', 'TRANSACTIONAL_INQUIRY', 'RELATIONAL_QUESTION',
-                'HESITATION_OR_OBJECTION', 'NEGATIVE_FEEDBACK', 'SMALL_TALK',
-                'COMPLIMENT', 'PERSONAL_SHARE', 'FANTASY_ROLEPLAY',
-                'TECHNICAL_ISSUE', 'GOODBYE'
-            ],
-            'rapport_stage': ['ICE_BREAKER', 'RAPPORT_BUILDING', 'DEEP_EMOTION', 
-                            'HIGH_INTENT', 'CLOSING'],
-            'safety_level': ['LEVEL_0_SAFE', 'LEVEL_1_FLIRT_SAFE', 
-                           'LEVEL_2_BORDERLINE', 'LEVEL_3_INAPPROPRIATE']
-        }
+    def __init__(self, taxonomy_path=None, conflicts_path=None):
+        # Etiquetas de config/taxonomy_v2.json como códigos int8 (label_codec.py)
+        self.codec = LabelCodec.load(taxonomy_path)
+        self.dimensions = self.codec.dimensions
         
+        # FSM de docs/GUIDELINES.MD declaradas en config/taxonomy_v2.json
+        # (permanecer en la misma etapa siempre es válido)
+        taxonomy = load_taxonomy(taxonomy_path)
+        self.transition_rules = {dimension: rules for dimension, rules
+                                 in taxonomy.get('transition_rules', {}).items()
+                                 if not dimension.startswith('_')}
+        self.transition_states = {dimension: self.dimensions[dimension]
+                                  for dimension in self.transition_rules}
+        self.allowed_transitions = {dimension: fsm_mask(self.transition_states[dimension], rules)
+                                    for dimension, rules in self.transition_rules.items()}
+
         # Transiciones válidas para rapport_stage
-        self.valid_transitions = {
-            'ICE_BREAKER': ['RAPPORT_BUILDING', 'CLOSING'],
-            'RAPPORT_BUILDING': ['DEEP_EMOTION', 'HIGH_INTENT', 'CLOSING'],
-            'DEEP_EMOTION': ['HIGH_INTENT', 'RAPPORT_BUILDING'],
-            'HIGH_INTENT': ['CLOSING'],
-            'CLOSING': []  # Estado terminal
-        }
+        self.valid_transitions = self.transition_rules.get('rapport_stage', {})
+        
+        # Reglas de conflicto compartidas con LLMAnnotationQualityChecker
+        # (config/label_conflicts.yaml)
+        self.conflicts = ConflictRuleRegistry.load(conflicts_path, self.codec)
         
+    def load_labels(self, path):
+        """
+        Carga anotaciones (JSON/JSONL, ítems de LLMAnnotator o etiquetas planas)
+        como tabla codificada: una columna Categorical de categorías fijas por
+        dimensión, más message_id/conversation_id/timestamp/annotator si vienen.
+        """
+        return self.codec.frame_from_records(iter_conversations(path))
+    
     def validate_consistency(self, annotations_df, annotator_col='annotator'):
         """
-        Calcula métricas de consistencia entre anotadores.
+        Calcula métricas de acuerdo entre anotadores por dimensión.
+
+        Las etiquetas se pivotean a una matriz anotador × mensaje de códigos
+        del codec (-1 = sin etiqueta; las que no están en la taxonomía cuentan
+        como OTHER). Para cada par de
+        anotadores se arma la matriz de confusión con np.bincount sobre los
+        mensajes que etiquetaron ambos (Cohen's kappa), y para el pool
+        completo la tabla mensaje × categoría (Fleiss' kappa, con cantidad
+        variable de anotadores por mensaje).
+
+        Returns:
+            {dimensión: {'mean_kappa', 'min_kappa', 'samples', 'fleiss_kappa',
+                         'annotators', 'pairwise': [{'annotators', 'kappa', 'samples'}]}}
+            `samples` es la cantidad de mensajes con al menos dos anotadores.
+            Un kappa indefinido (todas las etiquetas iguales) queda en NaN y no
+            entra en los promedios.
         """
         results = {}
-        
-        # Agrupar por mensaje para comparar anotaciones
-        grouped = annotations_df.groupby('message_id')
-        
-        for dimension in self.dimensions.keys():
-            if dimension in annotations_df.columns:
-                # Calcular Cohen's Kappa para pares de anotadores
-                kappa_scores = []
-                
-                for msg_id, group in grouped:
-                    if len(group) >= 2:
-                        annotators = group[annotator_col].unique()
-                        if len(annotators) >= 2:
-                            ann1_labels = group[group[annotator_col] == annotators[0]][dimension].values
-                            ann2_labels = group[group[annotator_col] == annotators[1]][dimension].values
-                            
-                            if len(ann1_labels) > 0 and len(ann2_labels) > 0:
-                                kappa = cohen_kappa_score([ann1_labels[0]], [ann2_labels[0]])
-                                kappa_scores.append(kappa)
-                
-                results[dimension] = {
-                    'mean_kappa': np.mean(kappa_scores) if kappa_scores else 0,
-                    'min_kappa': np.min(kappa_scores) if kappa_scores else 0,
-                    'samples': len(kappa_scores)
-                }
-        
+
+        message_codes, _ = pd.factorize(annotations_df['message_id'])
+        annotator_codes, annotators = pd.factorize(annotations_df[annotator_col])
+        # Filas sin message_id o sin anotador (código -1) no entran al pivot:
+        # con índice -1 caerían en la última fila/columna de la matriz
+        keep = (message_codes >= 0) & (annotator_codes >= 0)
+        message_codes, annotator_codes = message_codes[keep], annotator_codes[keep]
+        n_messages = int(message_codes.max()) + 1 if len(message_codes) else 0
+
+        for dimension, labels in self.codec.categories.items():
+            if dimension not in annotations_df.columns:
+                continue
+            codes = self.codec.codes(annotations_df, dimension)[keep]
+            # Si un anotador repite un mensaje, cuenta su última etiqueta
+            matrix = np.full((len(annotators), n_messages), -1, dtype=np.int8)
+            matrix[annotator_codes, message_codes] = codes
+
+            pairwise = [
+                {'annotators': (annotators[a], annotators[b]), **self._cohen_kappa(
+                    matrix[a], matrix[b], len(labels))}
+                for a, b in combinations(range(len(annotators)), 2)
+            ]
+            kappas = np.array([pair['kappa'] for pair in pairwise if pair['samples']], dtype=float)
+            kappas = kappas[~np.isnan(kappas)]
+            fleiss, samples = self._fleiss_kappa(matrix, len(labels))
+
+            results[dimension] = {
+                'mean_kappa': float(kappas.mean()) if kappas.size else 0,
+                'min_kappa': float(kappas.min()) if kappas.size else 0,
+                'samples': samples,
+                'fleiss_kappa': fleiss,
+                'annotators': len(annotators),
+                'pairwise': pairwise,
+            }
+
         return results
+
+    @staticmethod
+    def _cohen_kappa(first, second, n_labels):
+        """Cohen's kappa de dos filas de códigos sobre los mensajes comunes."""
+        both = (first >= 0) & (second >= 0)
+        samples = int(both.sum())
+        if samples == 0:
+            return {'kappa': float('nan'), 'samples': 0}
+        confusion = np.bincount(first[both].astype(np.int64) * n_labels + second[both],
+                                minlength=n_labels * n_labels).reshape(n_labels, n_labels)
+        observed = np.trace(confusion) / samples
+        expected = confusion.sum(axis=1) @ confusion.sum(axis=0) / samples ** 2
+        kappa = (observed - expected) / (1 - expected) if expected < 1 else float('nan')
+        return {'kappa': float(kappa), 'samples': samples}
+
+    @staticmethod
+    def _fleiss_kappa(matrix, n_labels):
+        """Fleiss' kappa sobre los mensajes con al menos dos etiquetas."""
+        annotator_idx, message_idx = np.nonzero(matrix >= 0)
+        counts = np.bincount(message_idx * n_labels + matrix[annotator_idx, message_idx],
+                             minlength=matrix.shape[1] * n_labels).reshape(-1, n_labels)
+        raters = counts.sum(axis=1)
+        counts, raters = counts[raters >= 2], raters[raters >= 2]
+        if len(raters) == 0:
+            return float('nan'), 0
+        agreement = ((counts ** 2).sum(axis=1) - raters) / (raters * (raters - 1))
+        proportions = counts.sum(axis=0) / raters.sum()
+        expected = (proportions ** 2).sum()
+        if expected >= 1:
+            return float('nan'), len(raters)
+        return float((agreement.mean() - expected) / (1 - expected)), len(raters)
     
     def analyze_distribution(self, labels_df):
         """
         Analiza la distribución de etiquetas para identificar desbalances.
+        En una tabla sin codificar, las etiquetas fuera de la taxonomía
+        aparecen con su nombre (en una codificada ya son OTHER).
         """
         distributions = {}
         
         for dimension in self.dimensions.keys():
             if dimension in labels_df.columns:
-                dist = labels_df[dimension].value_counts(normalize=True).to_dict()
-                distributions[dimension] = dist
+                unknown = Counter()
+                counts = self.codec.counts(dimension, self.codec.codes(labels_df, dimension, unknown))
+                total = counts.sum()
+                distributions[dimension] = {label: float(n / total) for label, n
+                                            in self.codec.count_dict(dimension, counts, unknown).items()}
         
         return distributions
     
+    def validate_transitions(self, conversation_df, dimensions=None):
+        """
+        Valida las transiciones de cada FSM de la taxonomía en una pasada
+        vectorizada.
+
+        Las etapas se codifican como enteros y cada par de mensajes
+        etiquetados consecutivos se busca en la matriz booleana de
+        transiciones permitidas; la máscara de conversación descarta los
+        pares que cruzan de una conversación a la siguiente. Los mensajes sin
+        etiqueta (o con OTHER) no cortan la secuencia.
+
+        Args:
+            conversation_df: conversation_id, timestamp (opcional), message_id
+                (opcional) y una columna por dimensión
+            dimensions: FSM a validar (por defecto todas las presentes)
+
+        Returns:
+            DataFrame con una fila por transición inválida: dimension,
+            conversation_id, position (posición del mensaje de origen en la
+            conversación), message_id (mensaje de destino), from_state, to_state
+        """
+        columns = ['dimension', 'conversation_id', 'position', 'message_id',
+                   'from_state', 'to_state']
+        dimensions = [dimension for dimension in (dimensions or self.transition_rules)
+                      if dimension in conversation_df.columns]
+        if not dimensions or conversation_df.empty:
+            return pd.DataFrame(columns=columns)
+
+        # Ordenar por conversación y timestamp
+        order = ['conversation_id'] + (['timestamp'] if 'timestamp' in conversation_df else [])
+        sorted_df = conversation_df.sort_values(order, kind='stable')
+        conversations = sorted_df['conversation_id'].to_numpy()
+        conversation, _ = pd.factorize(conversations)
+        boundary = np.concatenate(([True], conversation[1:] != conversation[:-1]))
+        starts = np.flatnonzero(boundary)
+        position = np.arange(len(sorted_df)) - starts[np.cumsum(boundary) - 1]
+        message_ids = (sorted_df['message_id'].to_numpy() if 'message_id' in sorted_df
+                       else np.full(len(sorted_df), None, dtype=object))
+
+        tables = []
+        for dimension in dimensions:
+            states = self.transition_states[dimension]
+            codes = self.codec.codes(sorted_df, dimension)
+            rows = np.flatnonzero((codes >= 0) & (codes < len(states)))
+            codes = codes[rows]
+            same = conversation[rows[1:]] == conversation[rows[:-1]]
+            invalid = same & ~self.allowed_transitions[dimension][codes[:-1], codes[1:]]
+            source, target = rows[:-1][invalid], rows[1:][invalid]
+            tables.append(pd.DataFrame({
+                'dimension': dimension,
+                'conversation_id': conversations[source],
+                'position': position[source],
+                'message_id': message_ids[target],
+                'from_state': pd.Categorical.from_codes(codes[:-1][invalid], states),
+                'to_state': pd.Categorical.from_codes(codes[1:][invalid], states),
+            }, columns=columns))
+
+        violations = pd.concat(tables, ignore_index=True)
+        for column in ('dimension', 'from_state', 'to_state'):
+            violations[column] = violations[column].astype('category')
+        return violations
+
     def validate_rapport_transitions(self, conversation_df):
         """
         Valida que las transiciones de rapport_stage sean válidas según la FSM.
         """
-        invalid_transitions = []
-        
-        # Ordenar por conversación y timestamp
-        sorted_df = conversation_df.sort_values(['conversation_id', 'timestamp'])
-        
-        for conv_id, conv_data in sorted_df.groupby('conversation_id'):
-            stages = conv_data['rapport_stage'].tolist()
-            
-            for i in range(len(stages) - 1):
-                current = stages[i]
-                next_stage = stages[i + 1]
-                
-                if next_stage not in self.valid_transitions.get(current, []):
-                    invalid_transitions.append({
-                        'conversation_id': conv_id,
-                        'position': i,
-                        'invalid_transition': f"{current} → {next_stage}"
-                    })
-        
-        return invalid_transitions
+        violations = self.validate_transitions(conversation_df, ['rapport_stage'])
+        return [
+            {
+                'conversation_id': conv_id,
+                'position': int(position),
+                'invalid_transition': f"{current} → {next_stage}"
+            }
+            for conv_id, position, current, next_stage in zip(
+                violations['conversation_id'], violations['position'],
+                violations['from_state'], violations['to_state'])
+        ]
+    
+    def find_label_conflicts(self, labels_df):
+        """
+        Evalúa todas las reglas del registro en una pasada. Devuelve un
+        ConflictHits (matriz dispersa regla × fila) del que se sacan conteos
+        y message_ids solo cuando hacen falta.
+        """
+        return self.conflicts.evaluate(labels_df)
     
     def detect_label_conflicts(self, labels_df):
         """
         Detecta conflictos lógicos entre etiquetas
-        (ej: NEGATIVE_FEEDBACK con LEVEL_1_FLIRT_SAFE).
+        (ej: TRANSACTIONAL_INQUIRY con DEEP_EMOTION).
         """
-        conflicts = []
-        
-        # Reglas de conflicto
-        conflict_rules = [
-            {
-                'condition': (labels_df['primary_intent'] == 'NEGATIVE_FEEDBACK') & 
-                            (labels_df['safety_level'].isin(['LEVEL_1_FLIRT_SAFE', 'LEVEL_0_SAFE'])),
-                'description': 'NEGATIVE_FEEDBACK debería tener safety_level más alto'
-            },
-            {
-                'condition': (labels_df['primary_intent'] == 'TRANSACTIONAL_INQUIRY') & 
-                            (labels_df['rapport_stage'] == 'DEEP_EMOTION'),
-                'description': 'TRANSACTIONAL_INQUIRY es inconsistente con DEEP_EMOTION'
-            },
+        hits = self.find_label_conflicts(labels_df)
+        return [
             {
-                'condition': (labels_df['safety_level'] == 'LEVEL_3_INAPPROPRIATE') & 
-                            (labels_df['rapport_stage'].isin(['HIGH_INTENT', 'DEEP_EMOTION'])),
-                'description': 'Contenido inapropiado no debería tener rapport alto'
+                'code': code,
+                'rule': self.conflicts.messages[code],
+                'count': int(count),
+                'message_ids': hits.message_ids(code)
             }
+            for code, count in zip(self.conflicts.codes, hits.counts) if count > 0
         ]
-        
-        for rule in conflict_rules:
-            conflicting_rows = labels_df[rule['condition']]
-            if len(conflicting_rows) > 0:
-                conflicts.append({
-                    'rule': rule['description'],
-                    'count': len(conflicting_rows),
-                    'message_ids': conflicting_rows['message_id'].tolist()
-                })
-        
-        return conflicts
     
     def generate_quality_report(self, labels_df, output_file='label_quality_report.txt'):
         """
@@ -160,24 +275,29 @@ class LabelValidator:
         
         # 2. Conflictos
         report.append("\n\n2. CONFLICTOS DETECTADOS:")
-        conflicts = self.detect_label_conflicts(labels_df)
-        if conflicts:
-            for conflict in conflicts:
-                report.append(f"\n- {conflict['rule']}")
-                report.append(f"  Casos encontrados: {conflict['count']}")
+        hits = self.find_label_conflicts(labels_df)
+        if hits.counts.any():
+            for code, count in zip(self.conflicts.codes, hits.counts):
+                if count:
+                    report.append(f"\n- {self.conflicts.messages[code]}")
+                    report.append(f"  Casos encontrados: {count}")
         else:
             report.append("\nNo se detectaron conflictos lógicos ✓")
         
         # 3. Validación de transiciones (si aplica)
-        if 'rapport_stage' in labels_df.columns and 'conversation_id' in labels_df.columns:
-            report.append("\n\n3. VALIDACIÓN DE TRANSICIONES DE RAPPORT:")
-            invalid = self.validate_rapport_transitions(labels_df)
-            if invalid:
-                report.append(f"\nTransiciones inválidas encontradas: {len(invalid)}")
-                for trans in invalid[:5]:  # Mostrar solo las primeras 5
-                    report.append(f"  - {trans['invalid_transition']} en conversación {trans['conversation_id']}")
-            else:
-                report.append("\nTodas las transiciones son válidas ✓")
+        fsm_dimensions = [dim for dim in self.transition_rules if dim in labels_df.columns]
+        if fsm_dimensions and 'conversation_id' in labels_df.columns:
+            report.append("\n\n3. VALIDACIÓN DE TRANSICIONES (FSM):")
+            invalid = self.validate_transitions(labels_df, fsm_dimensions)
+            for dim in fsm_dimensions:
+                dim_invalid = invalid[invalid['dimension'] == dim]
+                if len(dim_invalid):
+                    report.append(f"\n{dim}: transiciones inválidas encontradas: {len(dim_invalid)}")
+                    for trans in dim_invalid.head(5).itertuples():  # Mostrar solo las primeras 5
+                        report.append(f"  - {trans.from_state} → {trans.to_state} "
+                                      f"en conversación {trans.conversation_id}")
+                else:
+                    report.append(f"\n{dim}: todas las transiciones son válidas ✓")
         
         # Guardar reporte
         with open(output_file, 'w', encoding='utf-8') as f:
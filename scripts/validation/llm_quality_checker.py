@@ -1,8 +1,27 @@
+import heapq
 import json
-import pandas as pd
-from typing import Dict, List, Tuple
-import re
+import sys
 from collections import Counter
+import pandas as pd
+import numpy as np
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Agregar el directorio raíz al path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from scripts.patterns.corpus import iter_conversations
+from scripts.validation.label_codec import LabelCodec
+from scripts.validation.safety_rules import SafetyRuleEngine
+
+# Menciones que Nadia nunca debe hacer (también las usa el parser en streaming);
+# la fuente es config/safety_rules.yaml
+FORBIDDEN_PATTERNS = SafetyRuleEngine.load().forbidden_patterns
+
+DISTRIBUTION_DIMENSIONS = ('primary_intent', 'message_tone', 'safety_level')
+# Etiquetas que siempre pasan por revisión humana
+SENSITIVE_SAFETY = ['LEVEL_2_BORDERLINE', 'LEVEL_3_INAPPROPRIATE']
+SENSITIVE_INTENTS = ['HESITATION_OR_OBJECTION', 'NEGATIVE_FEEDBACK']
 
 class LLMAnnotationQualityChecker:
     """
@@ -10,9 +29,11 @@ class LLMAnnotationQualityChecker:
     Identifica patrones problemáticos y casos que requieren revisión humana.
     """
     
-    def __init__(self):
+    def __init__(self, rules_path: Optional[str] = None):
         self.quality_issues = []
         self.statistics = {}
+        self.rules = SafetyRuleEngine.load(rules_path)
+        self.codec = LabelCodec.load()
         
     def load_annotations(self, json_file_path: str) -> List[Dict]:
         """Carga las anotaciones generadas por el LLM."""
@@ -21,74 +42,50 @@ class LLMAnnotationQualityChecker:
     
     def check_response_quality(self, response: Dict) -> List[str]:
         """Verifica la calidad de las respuestas generadas de Nadia."""
-        issues = []
-        text = response.get('text', '')
-        
-        # Verificar longitud
-        sentences = len(re.split(r'[.!?]+', text.strip()))
-        if sentences > 3:
-            issues.append("Respuesta muy larga (>3 oraciones)")
-        
-        # Contar emojis
-        emoji_count = len(re.findall(r'[😀-🙏🌀-🗿💀-🫶]', text))
-        if emoji_count > 2:
-            issues.append(f"Demasiados emojis ({emoji_count})")
-        
-        # Verificar menciones prohibidas
-        forbidden_patterns = [
-            (r'\$\d+', "Menciona precio específico"),
-            (r'fanvue|onlyfans', "Menciona plataforma explícitamente"),
-            (r'prometo|garantizo', "Hace promesas"),
-            (r'amor|cariño|bebé', "Demasiado íntimo para etapa inicial")
-        ]
-        
-        for pattern, issue in forbidden_patterns:
-            if re.search(pattern, text.lower()):
-                issues.append(issue)
-        
-        # Verificar tono
-        if text.endswith('?') and text.count('?') > 1:
-            issues.append("Demasiadas preguntas")
-            
-        return issues
+        return self._describe([{'ideal_nadia_response': response}], consistency=False)[0]
     
     def check_annotation_consistency(self, annotation: Dict) -> List[str]:
         """Verifica consistencia lógica entre etiquetas."""
-        issues = []
-        
-        intent = annotation.get('primary_intent', '')
-        tone = annotation.get('message_tone', '')
-        safety = annotation.get('safety_level', '')
-        
-        # Reglas de consistencia
-        if intent == 'NEGATIVE_FEEDBACK' and tone == 'FRIENDLY':
-            issues.append("Inconsistencia: NEGATIVE_FEEDBACK no debería ser FRIENDLY")
-            
-        if intent == 'COMPLIMENT' and tone == 'FRUSTRATED':
-            issues.append("Inconsistencia: COMPLIMENT no debería ser FRUSTRATED")
-            
-        if safety == 'LEVEL_3_INAPPROPRIATE' and tone in ['FRIENDLY', 'ENGAGED']:
-            issues.append("Inconsistencia: Contenido inapropiado con tono positivo")
-            
-        if intent == 'TRANSACTIONAL_INQUIRY' and annotation.get('confidence', 1) < 0.7:
-            issues.append("Baja confianza en pregunta transaccional")
-            
-        return issues
+        return self._describe([{'annotations': annotation}], response=False)[0]
+    
+    def check_batch(self, annotations: List[Dict]) -> List[List[str]]:
+        """
+        Códigos de problema (config/safety_rules.yaml) por anotación, evaluados
+        en una sola pasada sobre el lote.
+        """
+        return self.rules.check_batch(annotations)
+    
+    def _describe(self, annotations: List[Dict], consistency: bool = True,
+                  response: bool = True) -> List[List[str]]:
+        """Problemas por anotación con el mensaje legible de cada regla."""
+        hits, emojis = self.rules.evaluate(*self.rules.annotation_columns(annotations))
+        n_consistency = len(self.rules.consistency)
+        if not consistency:
+            hits[:, :n_consistency] = False
+        if not response:
+            hits[:, n_consistency:] = False
+        return [[self.rules.describe(code, emoji_count) for code in codes]
+                for codes, emoji_count in zip(self.rules.issue_codes(hits), emojis.tolist())]
     
     def analyze_distribution(self, annotations: List[Dict]) -> Dict:
         """Analiza la distribución de etiquetas para detectar sesgos."""
-        intent_counts = Counter()
-        tone_counts = Counter()
-        safety_counts = Counter()
-        
-        for item in annotations:
-            ann = item['annotations']
-            intent_counts[ann['primary_intent']] += 1
-            tone_counts[ann['message_tone']] += 1
-            safety_counts[ann['safety_level']] += 1
-        
-        total = len(annotations)
-        
+        return self.distribution_from_counts(*self.label_counts(annotations), len(annotations))
+    
+    def label_counts(self, annotations: List[Dict]) -> List[Dict[str, int]]:
+        """
+        Conteos por etiqueta de DISTRIBUTION_DIMENSIONS, sobre los códigos del
+        codec; las etiquetas fuera de la taxonomía se cuentan con su nombre.
+        """
+        unknown = {dimension: Counter() for dimension in DISTRIBUTION_DIMENSIONS}
+        codes = self.codec.encode_records(annotations, DISTRIBUTION_DIMENSIONS, unknown=unknown)
+        return [self.codec.count_dict(dimension, self.codec.counts(dimension, codes[dimension]),
+                                      unknown[dimension])
+                for dimension in DISTRIBUTION_DIMENSIONS]
+    
+    @staticmethod
+    def distribution_from_counts(intent_counts: Dict[str, int], tone_counts: Dict[str, int],
+                                 safety_counts: Dict[str, int], total: int) -> Dict:
+        """Distribuciones y anomalías a partir de conteos (sirve también en streaming)."""
         distributions = {
             'primary_intent': {k: v/total for k, v in intent_counts.items()},
             'message_tone': {k: v/total for k, v in tone_counts.items()},
@@ -118,9 +115,26 @@ class LLMAnnotationQualityChecker:
     
     def identify_review_candidates(self, annotations: List[Dict]) -> List[Dict]:
         """Identifica mensajes que requieren revisión humana prioritaria."""
+        review_needed = self.review_candidates_for(annotations)
+        
+        # Ordenar por número de problemas (más problemas primero)
+        review_needed.sort(key=lambda x: len(x['review_reasons']), reverse=True)
+        
+        return review_needed
+    
+    def review_candidates_for(self, annotations: List[Dict]) -> List[Dict]:
+        """Candidatos a revisión de un lote, en el orden de entrada."""
         review_needed = []
+        # Consistencia y respuesta: una sola pasada del motor de reglas
+        rule_issues = self._describe(annotations)
+        codes = self.codec.encode_records(annotations, ('primary_intent', 'safety_level'))
+        sensitive_safety = np.isin(codes['safety_level'],
+                                   self.codec.encode('safety_level', SENSITIVE_SAFETY))
+        sensitive_intent = np.isin(codes['primary_intent'],
+                                   self.codec.encode('primary_intent', SENSITIVE_INTENTS))
         
-        for item in annotations:
+        for item, issues, safety, intent in zip(annotations, rule_issues,
+                                                sensitive_safety.tolist(), sensitive_intent.tolist()):
             ann = item['annotations']
             response = item.get('ideal_nadia_response', {})
             
@@ -130,22 +144,15 @@ class LLMAnnotationQualityChecker:
             if ann.get('confidence', 1) < 0.8:
                 reasons.append(f"Baja confianza: {ann['confidence']}")
             
-            # Problemas de consistencia
-            consistency_issues = self.check_annotation_consistency(ann)
-            if consistency_issues:
-                reasons.extend(consistency_issues)
-            
-            # Problemas en respuesta
-            response_issues = self.check_response_quality(response)
-            if response_issues:
-                reasons.extend(response_issues)
+            # Problemas de consistencia y de la respuesta
+            reasons.extend(issues)
             
             # Casos de seguridad críticos
-            if ann['safety_level'] in ['LEVEL_2_BORDERLINE', 'LEVEL_3_INAPPROPRIATE']:
+            if safety:
                 reasons.append("Requiere revisión de seguridad")
             
             # Intenciones complejas
-            if ann['primary_intent'] in ['HESITATION_OR_OBJECTION', 'NEGATIVE_FEEDBACK']:
+            if intent:
                 reasons.append("Intención sensible que requiere validación")
             
             if reasons:
@@ -157,9 +164,6 @@ class LLMAnnotationQualityChecker:
                     'review_reasons': reasons
                 })
         
-        # Ordenar por número de problemas (más problemas primero)
-        review_needed.sort(key=lambda x: len(x['review_reasons']), reverse=True)
-        
         return review_needed
     
     def generate_review_report(self, annotations: List[Dict], 
@@ -167,14 +171,25 @@ class LLMAnnotationQualityChecker:
         """Genera un reporte markdown para revisión humana eficiente."""
         distribution_analysis = self.analyze_distribution(annotations)
         review_candidates = self.identify_review_candidates(annotations)
+        report = self.render_review_report(distribution_analysis, review_candidates[:20],
+                                           len(review_candidates), len(annotations))
         
+        # Guardar reporte
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(report)
+        
+        return report
+    
+    def render_review_report(self, distribution_analysis: Dict, top_candidates: List[Dict],
+                             n_review: int, total: int) -> str:
+        """Markdown del reporte a partir de distribuciones y los candidatos prioritarios."""
         report = []
         report.append("# Reporte de Revisión de Anotaciones LLM\n")
-        report.append(f"**Total de mensajes procesados**: {len(annotations)}\n")
+        report.append(f"**Total de mensajes procesados**: {total}\n")
         
         # Resumen ejecutivo
         report.append("## Resumen Ejecutivo\n")
-        report.append(f"- **Mensajes que requieren revisión**: {len(review_candidates)} ({len(review_candidates)/len(annotations)*100:.1f}%)")
+        report.append(f"- **Mensajes que requieren revisión**: {n_review} ({n_review/total*100:.1f}%)")
         
         if distribution_analysis['anomalies']:
             report.append("- **Anomalías detectadas**:")
@@ -198,7 +213,7 @@ class LLMAnnotationQualityChecker:
         
         # Agrupar por tipo de problema
         by_issue_type = {}
-        for candidate in review_candidates[:20]:  # Top 20
+        for candidate in top_candidates[:20]:  # Top 20
             for reason in candidate['review_reasons']:
                 issue_type = reason.split(':')[0]
                 if issue_type not in by_issue_type:
@@ -220,7 +235,7 @@ class LLMAnnotationQualityChecker:
         # Recomendaciones
         report.append("\n## Recomendaciones\n")
         
-        if len(review_candidates) / len(annotations) > 0.2:
+        if n_review / total > 0.2:
             report.append("1. **Alta tasa de revisión necesaria** - Considera refinar el prompt del LLM")
         
         if 'OTHER' in distribution_analysis['distributions']['primary_intent']:
@@ -232,10 +247,6 @@ class LLMAnnotationQualityChecker:
         if safety_dist.get('LEVEL_0_SAFE', 0) > 0.95:
             report.append("3. **Revisar clasificación de seguridad** - Posible sub-detección de contenido sensible")
         
-        # Guardar reporte
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(report))
-        
         return '\n'.join(report)
     
     def export_for_correction(self, review_candidates: List[Dict], 
@@ -243,22 +254,169 @@ class LLMAnnotationQualityChecker:
         """Exporta los casos problemáticos en formato fácil de corregir."""
         with open(output_file, 'w', encoding='utf-8') as f:
             for candidate in review_candidates:
-                # Formato simplificado para corrección rápida
-                correction_format = {
-                    'message_id': candidate['message_id'],
-                    'text': candidate['text'],
-                    'llm_annotations': candidate['annotations'],
-                    'llm_response': candidate['response'],
-                    'issues': candidate['review_reasons'],
-                    'human_corrections': {
-                        'primary_intent': None,
-                        'message_tone': None,
-                        'safety_level': None,
-                        'ideal_response': None,
-                        'notes': None
-                    }
-                }
-                f.write(json.dumps(correction_format, ensure_ascii=False) + '\n')
+                f.write(json.dumps(self.correction_record(candidate), ensure_ascii=False) + '\n')
+    
+    @staticmethod
+    def correction_record(candidate: Dict) -> Dict:
+        """Formato simplificado para corrección rápida."""
+        return {
+            'message_id': candidate['message_id'],
+            'text': candidate['text'],
+            'llm_annotations': candidate['annotations'],
+            'llm_response': candidate['response'],
+            'issues': candidate['review_reasons'],
+            'human_corrections': {
+                'primary_intent': None,
+                'message_tone': None,
+                'safety_level': None,
+                'ideal_response': None,
+                'notes': None
+            }
+        }
+
+
+def iter_annotations(path: str) -> Iterator[Dict]:
+    """
+    Anotaciones leídas en streaming: JSONL (una por línea) o el arreglo JSON
+    que escribe LLMAnnotator, decodificado elemento a elemento.
+    """
+    return iter_conversations(path)
+
+
+class StreamingReview:
+    """
+    Revisión de anotaciones en una sola pasada y con memoria acotada.
+    
+    - los conteos de distribución (y sus anomalías) se actualizan por ítem
+    - los candidatos se evalúan por lotes con el motor de reglas
+    - solo los `top_k` de mayor prioridad quedan en un heap para el reporte;
+      el resto va directo al archivo de corrección, en orden de llegada
+    - el reporte se reescribe cada `report_every` anotaciones (o al final)
+    
+    Args:
+        output_dir: donde se escriben review_report.md, for_correction.jsonl
+            y quick_stats.json (None = solo en memoria)
+        queue: ReviewQueue (scripts/validation/review_queue.py) donde además
+            se cargan los candidatos de cada lote
+    """
+    
+    def __init__(self, checker: Optional[LLMAnnotationQualityChecker] = None,
+                 output_dir: Optional[str] = None, top_k: int = 200,
+                 batch_size: int = 2000, report_every: Optional[int] = None,
+                 queue=None):
+        self.checker = checker or LLMAnnotationQualityChecker()
+        self.queue = queue
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.top_k = top_k
+        self.batch_size = batch_size
+        self.report_every = report_every
+        codec = self.checker.codec
+        # Conteos por código de cada dimensión (arreglos del tamaño de la taxonomía)
+        self.counts = {dimension: np.zeros(len(codec.categories[dimension]), dtype=np.int64)
+                       for dimension in DISTRIBUTION_DIMENSIONS}
+        # Etiquetas fuera de la taxonomía, con su nombre (en counts están dentro de OTHER)
+        self.unknown = {dimension: Counter() for dimension in DISTRIBUTION_DIMENSIONS}
+        self.total = 0
+        self.n_review = 0
+        self.reports_written = 0
+        self._heap: List[Tuple[int, int, Dict]] = []
+        self._pending: List[Dict] = []
+        self._corrections = None
+        self._next_report = report_every
+        if self.output_dir:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            self._corrections = open(self.output_dir / 'for_correction.jsonl', 'w',
+                                     encoding='utf-8')
+    
+    def add(self, item: Dict) -> None:
+        self._pending.append(item)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+    
+    def consume(self, items: Iterable[Dict]) -> Dict:
+        for item in items:
+            self.add(item)
+        return self.finish()
+    
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        codec = self.checker.codec
+        for dimension, codes in codec.encode_records(batch, DISTRIBUTION_DIMENSIONS,
+                                                     unknown=self.unknown).items():
+            self.counts[dimension] += codec.counts(dimension, codes)
+        
+        candidates = self.checker.review_candidates_for(batch)
+        if self.queue is not None:
+            flagged = {candidate['message_id'] for candidate in candidates}
+            self.queue.upsert(candidates, [item['message_id'] for item in batch
+                                           if item['message_id'] not in flagged])
+        for candidate in candidates:
+            # Menor prioridad primero; a igual prioridad sale el más reciente
+            entry = (len(candidate['review_reasons']), -self.n_review, candidate)
+            if len(self._heap) < self.top_k:
+                heapq.heappush(self._heap, entry)
+            elif entry[:2] > self._heap[0][:2]:
+                heapq.heapreplace(self._heap, entry)
+            if self._corrections is not None:
+                self._corrections.write(json.dumps(self.checker.correction_record(candidate),
+                                                   ensure_ascii=False) + '\n')
+            self.n_review += 1
+        self.total += len(batch)
+        
+        if self._next_report and self.total >= self._next_report:
+            self.write_report()
+            while self._next_report <= self.total:
+                self._next_report += self.report_every
+    
+    def top(self) -> List[Dict]:
+        """Candidatos prioritarios, del más problemático al menos (estable por llegada)."""
+        return [candidate for _, _, candidate in sorted(self._heap, key=lambda e: e[:2],
+                                                        reverse=True)]
+    
+    def distribution(self) -> Dict:
+        codec = self.checker.codec
+        return self.checker.distribution_from_counts(
+            *[codec.count_dict(dimension, self.counts[dimension], self.unknown[dimension])
+              for dimension in DISTRIBUTION_DIMENSIONS], self.total)
+    
+    def report(self) -> str:
+        return self.checker.render_review_report(self.distribution(), self.top(),
+                                                 self.n_review, self.total)
+    
+    def write_report(self) -> Optional[str]:
+        """Reescribe el reporte y las estadísticas con lo procesado hasta ahora."""
+        if self.output_dir is None or not self.total:
+            return None
+        if self._corrections is not None:
+            self._corrections.flush()
+        distribution = self.distribution()
+        report_path = self.output_dir / 'review_report.md'
+        report_path.write_text(self.checker.render_review_report(
+            distribution, self.top(), self.n_review, self.total), encoding='utf-8')
+        with open(self.output_dir / 'quick_stats.json', 'w') as f:
+            json.dump({
+                'total_messages': self.total,
+                'messages_needing_review': self.n_review,
+                'review_rate': self.n_review / self.total,
+                'distributions': distribution['distributions'],
+                'anomalies': distribution['anomalies']
+            }, f, indent=2)
+        self.reports_written += 1
+        return str(report_path)
+    
+    def finish(self) -> Dict:
+        self.flush()
+        report_path = self.write_report()
+        if self._corrections is not None:
+            self._corrections.close()
+            self._corrections = None
+        return {
+            'total_messages': self.total,
+            'messages_needing_review': self.n_review,
+            'report_file': report_path,
+        }
 
 
 # Script de ejemplo para procesar un batch
@@ -314,6 +472,19 @@ def process_llm_batch(input_file: str, output_dir: str = './review_output'):
     print(f"\n¡Proceso completado! Revisa los archivos en {output_dir}")
 
 
+def process_llm_stream(input_file: str, output_dir: str = './review_output',
+                       top_k: int = 200, report_every: Optional[int] = None) -> Dict:
+    """
+    Igual que process_llm_batch pero en una pasada y con memoria acotada
+    (JSONL o arreglo JSON de cualquier tamaño).
+    """
+    review = StreamingReview(output_dir=output_dir, top_k=top_k, report_every=report_every)
+    result = review.consume(iter_annotations(input_file))
+    print(f"✓ {result['total_messages']} anotaciones, "
+          f"{result['messages_needing_review']} para revisión → {output_dir}")
+    return result
+
+
 if __name__ == "__main__":
     # Ejemplo de uso
     process_llm_batch('llm_annotations_batch1.json', './review_batch1')
\ No newline at end of file
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Cola persistente de revisión humana (SQLite).
+
+Uso:
+    python scripts/validation/review_queue.py --db outputs/review_queue.sqlite ingest anotaciones.json
+    python scripts/validation/review_queue.py --db ... pop 20 -o para_revisar.jsonl
+    python scripts/validation/review_queue.py --db ... submit corregidos.jsonl
+    python scripts/validation/review_queue.py --db ... stats
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Agregar el directorio raíz al path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from scripts.validation.llm_quality_checker import LLMAnnotationQualityChecker, iter_annotations
+
+CORRECTION_FIELDS = ('primary_intent', 'message_tone', 'safety_level', 'ideal_response', 'notes')
+STATUSES = ('pending', 'in_review', 'done')
+
+
+class ReviewQueue:
+    """
+    Args:
+        path: archivo SQLite de la cola
+        checker: evalúa los motivos de revisión de cada anotación
+    """
+
+    def __init__(self, path: str = 'outputs/checkpoints/review_queue.sqlite',
+                 checker: Optional[LLMAnnotationQualityChecker] = None):
+        self.path = Path(path)
+        self.checker = checker
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS review_items ('
+            ' message_id TEXT PRIMARY KEY,'
+            ' priority INTEGER NOT NULL,'
+            ' status TEXT NOT NULL DEFAULT \'pending\','
+            ' record TEXT NOT NULL,'
+            ' human_corrections TEXT,'
+            ' reviewer TEXT,'
+            ' enqueued_at REAL NOT NULL,'
+            ' updated_at REAL NOT NULL)'
+        )
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_review_items_priority '
+            'ON review_items(status, priority DESC)'
+        )
+        self.conn.commit()
+
+    def upsert(self, candidates: Iterable[Dict], clean_ids: Iterable[str] = ()) -> Dict:
+        """
+        Agrega o actualiza candidatos (formato de identify_review_candidates).
+        Los ítems ya reclamados o revisados no se tocan; los pendientes cuyo
+        mensaje volvió a anotarse sin motivos (`clean_ids`) salen de la cola.
+        """
+        now = time.time()
+        rows = [(str(candidate['message_id']), len(candidate['review_reasons']),
+                 json.dumps(LLMAnnotationQualityChecker.correction_record(candidate),
+                            ensure_ascii=False), now, now)
+                for candidate in candidates]
+        before = self.conn.total_changes
+        self.conn.executemany(
+            'INSERT INTO review_items (message_id, priority, record, enqueued_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(message_id) DO UPDATE SET priority = excluded.priority, '
+            ' record = excluded.record, updated_at = excluded.updated_at '
+            'WHERE review_items.status = \'pending\'',
+            rows
+        )
+        upserted = self.conn.total_changes - before
+        cursor = self.conn.executemany(
+            'DELETE FROM review_items WHERE message_id = ? AND status = \'pending\'',
+            [(str(message_id),) for message_id in clean_ids]
+        )
+        removed = cursor.rowcount
+        self.conn.commit()
+        return {'upserted': upserted, 'skipped': len(rows) - upserted, 'removed': max(removed, 0)}
+
+    def add_annotations(self, annotations: Iterable[Dict], batch_size: int = 2000) -> Dict:
+        """Evalúa anotaciones (ítems de LLMAnnotator) por lotes y las carga en la cola."""
+        checker = self.checker or LLMAnnotationQualityChecker()
+        totals = {'annotations': 0, 'upserted': 0, 'skipped': 0, 'removed': 0}
+        batch: List[Dict] = []
+
+        def flush():
+            candidates = checker.review_candidates_for(batch)
+            flagged = {candidate['message_id'] for candidate in candidates}
+            result = self.upsert(candidates, [item['message_id'] for item in batch
+                                              if item['message_id'] not in flagged])
+            for key, value in result.items():
+                totals[key] += value
+            totals['annotations'] += len(batch)
+            batch.clear()
+
+        for item in annotations:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        return totals
+
+    def pop(self, n: int, reviewer: Optional[str] = None) -> List[Dict]:
+        """Reclama los n pendientes de mayor prioridad (quedan in_review)."""
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            rows = self.conn.execute(
+                'SELECT message_id, priority, record FROM review_items '
+                'WHERE status = \'pending\' ORDER BY priority DESC, rowid ASC LIMIT ?', (n,)
+            ).fetchall()
+            self.conn.executemany(
+                'UPDATE review_items SET status = \'in_review\', reviewer = ?, updated_at = ? '
+                'WHERE message_id = ?',
+                [(reviewer, time.time(), message_id) for message_id, _, _ in rows]
+            )
+        return [{**json.loads(record), 'priority': priority} for _, priority, record in rows]
+
+    def submit(self, message_id: str, human_corrections: Dict) -> bool:
+        """Guarda las correcciones humanas de un ítem; False si no está en la cola."""
+        unknown = set(human_corrections) - set(CORRECTION_FIELDS)
+        if unknown:
+            raise ValueError(f"Campos de corrección desconocidos: {sorted(unknown)}")
+        cursor = self.conn.execute(
+            'UPDATE review_items SET status = \'done\', human_corrections = ?, updated_at = ? '
+            'WHERE message_id = ?',
+            (json.dumps(human_corrections, ensure_ascii=False), time.time(), str(message_id))
+        )
+        self.conn.commit()
+        return cursor.rowcount > 0
+
+    def submit_records(self, records: Iterable[Dict]) -> Dict:
+        """Registros de export_for_correction/pop con `human_corrections` completadas."""
+        result = {'submitted': 0, 'unknown': 0, 'empty': 0}
+        for record in records:
+            corrections = {field: value for field, value in
+                           (record.get('human_corrections') or {}).items() if value is not None}
+            if not corrections:
+                result['empty'] += 1
+            elif self.submit(record['message_id'], corrections):
+                result['submitted'] += 1
+            else:
+                result['unknown'] += 1
+        return result
+
+    def requeue_stale(self, older_than_seconds: float) -> int:
+        """Devuelve a pending los ítems reclamados hace más de `older_than_seconds`."""
+        cursor = self.conn.execute(
+            'UPDATE review_items SET status = \'pending\', reviewer = NULL '
+            'WHERE status = \'in_review\' AND updated_at < ?',
+            (time.time() - older_than_seconds,)
+        )
+        self.conn.commit()
+        return cursor.rowcount
+
+    def corrections(self) -> Iterator[Dict]:
+        """Ítems revisados: registro del LLM + correcciones humanas."""
+        for record, corrections, reviewer in self.conn.execute(
+                'SELECT record, human_corrections, reviewer FROM review_items '
+                'WHERE status = \'done\' ORDER BY updated_at'):
+            yield {**json.loads(record), 'human_corrections': json.loads(corrections),
+                   'reviewer': reviewer}
+
+    def get_stats(self) -> Dict:
+        """Conteos por estado y pendientes por prioridad (resueltos desde el índice)."""
+        by_status = dict(self.conn.execute(
+            'SELECT status, COUNT(*) FROM review_items GROUP BY status').fetchall())
+        by_priority = self.conn.execute(
+            'SELECT priority, COUNT(*) FROM review_items WHERE status = \'pending\' '
+            'GROUP BY priority ORDER BY priority DESC').fetchall()
+        return {
+            **{status: by_status.get(status, 0) for status in STATUSES},
+            'total': sum(by_status.values()),
+            'pending_by_priority': {str(priority): count for priority, count in by_priority},
+        }
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cola de revisión humana de anotaciones LLM')
+    parser.add_argument('--db', default='outputs/checkpoints/review_queue.sqlite')
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest = commands.add_parser('ingest', help='Carga anotaciones (JSON/JSONL) en la cola')
+    ingest.add_argument('input')
+    pop = commands.add_parser('pop', help='Reclama los N ítems más prioritarios')
+    pop.add_argument('n', type=int)
+    pop.add_argument('--output', '-o', default=None, help='JSONL de salida (stdout si se omite)')
+    pop.add_argument('--reviewer', default=None)
+    submit = commands.add_parser('submit', help='Envía correcciones (JSONL con human_corrections)')
+    submit.add_argument('input')
+    commands.add_parser('stats')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    queue = ReviewQueue(args.db)
+    try:
+        if args.command == 'ingest':
+            result = queue.add_annotations(iter_annotations(args.input))
+        elif args.command == 'pop':
+            items = queue.pop(args.n, reviewer=args.reviewer)
+            out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+            try:
+                for item in items:
+                    out.write(json.dumps(item, ensure_ascii=False) + '\n')
+            finally:
+                if args.output:
+                    out.close()
+            result = {'popped': len(items)}
+        elif args.command == 'submit':
+            with open(args.input, 'r', encoding='utf-8') as f:
+                result = queue.submit_records(json.loads(line) for line in f if line.strip())
+        else:
+            result = queue.get_stats()
+        # Con pop a stdout, el resumen no se mezcla con los ítems
+        summary = sys.stderr if args.command == 'pop' and not args.output else sys.stdout
+        print(json.dumps(result, ensure_ascii=False), file=summary)
+    finally:
+        queue.close()
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,139 @@
+"""
+Motor de reglas de LLMAnnotationQualityChecker (config/safety_rules.yaml).
+"""
+
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from scripts.validation.conflict_rules import ConflictRuleRegistry, read_yaml
+
+DEFAULT_SAFETY_RULES_PATH = Path(__file__).parent.parent.parent / 'config' / 'safety_rules.yaml'
+
+
+def load_safety_rules(path: Union[str, Path, None] = None) -> Dict:
+    """Reglas de config/safety_rules.yaml (se leen una vez por ruta)."""
+    return read_yaml(str(path or DEFAULT_SAFETY_RULES_PATH))
+
+
+class SafetyRuleEngine:
+    """
+    Args:
+        rules: contenido de safety_rules.yaml
+        conflicts: registro de reglas de consistencia (por defecto, las de
+            `rules['consistency']`, si las hay)
+    """
+
+    def __init__(self, rules: Dict, conflicts: Optional[ConflictRuleRegistry] = None):
+        response = rules.get('response') or {}
+        self.length = response['length']
+        self.emojis = response['emojis']
+        self.questions = response['questions']
+        self.forbidden = list(response.get('forbidden') or [])
+        self.conflicts = conflicts or ConflictRuleRegistry(rules.get('consistency') or [])
+        self.consistency = self.conflicts.rules
+
+        self.forbidden_compiled = [re.compile(rule['pattern']) for rule in self.forbidden]
+        groups = [f"(?P<f{i}>{rule['pattern']})" for i, rule in enumerate(self.forbidden)]
+        groups.append(f"(?P<brk>{self.length['sentence_break']})")
+        groups.append(f"(?P<emo>{self.emojis['pattern']})")
+        self.scanner = re.compile('|'.join(groups))
+        self._forbidden_group = {f"f{i}": i for i in range(len(self.forbidden))}
+
+        # Columnas de la matriz de problemas, en el orden en que se reportan
+        self.codes = ([rule['code'] for rule in self.consistency] +
+                      [self.length['code'], self.emojis['code']] +
+                      [rule['code'] for rule in self.forbidden] + [self.questions['code']])
+        if len(set(self.codes)) != len(self.codes):
+            raise ValueError("Los códigos de las reglas de seguridad deben ser únicos")
+        self.messages = {rule['code']: rule['message']
+                         for rule in self.consistency + self.forbidden}
+        for rule in (self.length, self.emojis, self.questions):
+            self.messages[rule['code']] = rule['message']
+
+    @classmethod
+    def load(cls, path: Union[str, Path, None] = None,
+             conflicts_path: Union[str, Path, None] = None) -> 'SafetyRuleEngine':
+        return cls(load_safety_rules(path), ConflictRuleRegistry.load(conflicts_path))
+
+    @property
+    def forbidden_patterns(self) -> List[Tuple[str, str]]:
+        """[(regex, motivo)] en el formato que usa el parser en streaming."""
+        return [(rule['pattern'], rule['message']) for rule in self.forbidden]
+
+    def scan_responses(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Una pasada por texto. Devuelve la matriz (n, len(codes)) con las
+        columnas de respuesta completas y la cantidad de emojis por texto.
+        """
+        n = len(texts)
+        hits = np.zeros((n, len(self.codes)), dtype=bool)
+        breaks = np.zeros(n, dtype=np.int64)
+        emojis = np.zeros(n, dtype=np.int64)
+        questions = np.zeros(n, dtype=bool)
+        forbidden = np.zeros((n, len(self.forbidden)), dtype=bool)
+        scanner, group_index = self.scanner, self._forbidden_group
+        max_questions = self.questions['max']
+
+        for row, text in enumerate(texts):
+            lowered = text.lower()
+            n_breaks = n_emojis = 0
+            found = False
+            for match in scanner.finditer(lowered):
+                group = match.lastgroup
+                if group == 'brk':
+                    n_breaks += 1
+                elif group == 'emo':
+                    n_emojis += 1
+                else:
+                    forbidden[row, group_index[group]] = found = True
+            if found:
+                # Menciones que quedaron dentro de otra coincidencia
+                for i in np.flatnonzero(~forbidden[row]):
+                    forbidden[row, i] = self.forbidden_compiled[i].search(lowered) is not None
+            breaks[row] = n_breaks
+            emojis[row] = n_emojis
+            questions[row] = text.endswith('?') and text.count('?') > max_questions
+
+        base = len(self.consistency)
+        # re.split deja un fragmento más que cortes: n cortes = n + 1 oraciones
+        hits[:, base] = breaks + 1 > self.length['max_sentences']
+        hits[:, base + 1] = emojis > self.emojis['max']
+        hits[:, base + 2:base + 2 + len(self.forbidden)] = forbidden
+        hits[:, -1] = questions
+        return hits, emojis
+
+    def consistency_hits(self, labels: Sequence[Dict]) -> np.ndarray:
+        """Matriz (n, len(consistency)) de reglas de consistencia que se cumplen."""
+        return self.conflicts.evaluate_records(labels).dense()
+
+    def evaluate(self, labels: Sequence[Dict],
+                 texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Matriz completa de problemas (n, len(codes)) y emojis por texto."""
+        hits, emojis = self.scan_responses(texts)
+        hits[:, :len(self.consistency)] = self.consistency_hits(labels)
+        return hits, emojis
+
+    def issue_codes(self, hits: np.ndarray) -> List[List[str]]:
+        codes = np.array(self.codes, dtype=object)
+        rows, columns = np.nonzero(hits)
+        per_row = np.split(codes[columns], np.cumsum(np.bincount(rows, minlength=len(hits)))[:-1])
+        return [row.tolist() for row in per_row]
+
+    def describe(self, code: str, emoji_count: int = 0) -> str:
+        return self.messages[code].format(count=emoji_count)
+
+    @staticmethod
+    def annotation_columns(annotations: Sequence[Dict]) -> Tuple[List[Dict], List[str]]:
+        """Etiquetas y texto de la respuesta ideal de ítems como los escribe LLMAnnotator."""
+        labels = [item.get('annotations') or {} for item in annotations]
+        texts = [(item.get('ideal_nadia_response') or {}).get('text') or ''
+                 for item in annotations]
+        return labels, texts
+
+    def check_batch(self, annotations: Sequence[Dict]) -> List[List[str]]:
+        """Códigos de problema por anotación."""
+        hits, _ = self.evaluate(*self.annotation_columns(annotations))
+        return self.issue_codes(hits)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Shared factories for the LLM client tests
+"""
+
+
+def make_config(base_url=None, **overrides):
+    """Client config pointing at a local mock server, with fast retries and loose rate limits"""
+    config = {
+        'provider': 'openai',
+        'model': 'gpt-4',
+        'temperature': 0.8,
+        'max_tokens_per_conversation': 200,
+        'retry_attempts': 3,
+        'max_concurrency': 4,
+        'requests_per_minute': 6000,
+        'tokens_per_minute': 10_000_000,
+        'backoff_base_seconds': 0.01,
+        'backoff_max_seconds': 0.05,
+        'timeout_seconds': 10,
+    }
+    if base_url is not None:
+        config['api_base_url'] = base_url
+    config.update(overrides)
+    return config
+
+
+def make_requests(n):
+    return [
+        {'custom_id': f"req-{i}", 'messages': [{'role': 'user', 'content': f"Genera una conversación {i}"}]}
+        for i in range(n)
+    ]
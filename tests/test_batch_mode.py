@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Tests for offline batch-job mode using the local file-based provider
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.annotation.llm_annotator import LLMAnnotator
+from scripts.llm.batch import BatchJobRunner, BatchProvider, LocalBatchProvider
+from scripts.llm.providers import get_adapter
+from scripts.synthetic_generator import SyntheticGenerator
+from tests.conftest import make_config, make_requests
+
+
+def batch_config(tmp_path, **overrides):
+    batch = {'provider': 'local', 'poll_interval_seconds': 0.01, 'work_dir': str(tmp_path / 'batches')}
+    return make_config(mode='batch', n_conversations_to_generate=5, batch=batch, **overrides)
+
+
+class TestBatchJobRunner:
+    """Write, submit, poll and read back by custom_id"""
+
+    def test_results_are_matched_by_custom_id(self, tmp_path):
+        provider = LocalBatchProvider(tmp_path, responder=lambda cid, body: f"respuesta {cid}",
+                                      delay_seconds=0.05)
+        runner = BatchJobRunner(get_adapter('openai', 'gpt-4'), provider,
+                                config={'poll_interval_seconds': 0.01, 'work_dir': str(tmp_path)})
+        results = list(runner.run(make_requests(4), name='test'))
+
+        assert {r['custom_id']: r['text'] for r in results} == {
+            f"req-{i}": f"respuesta req-{i}" for i in range(4)
+        }
+        manifest = json.loads((tmp_path / 'test_part000_manifest.json').read_text())
+        assert manifest['state'] == 'completed' and manifest['requests'] == 4
+
+    def test_large_runs_are_split_into_files(self, tmp_path):
+        provider = LocalBatchProvider(tmp_path)
+        runner = BatchJobRunner(get_adapter('anthropic', 'claude-3'), provider,
+                                config={'poll_interval_seconds': 0.01, 'work_dir': str(tmp_path),
+                                        'max_requests_per_file': 2})
+        results = list(runner.run(make_requests(5)))
+
+        assert len(results) == 5
+        assert runner.get_stats()['jobs'] == 3
+        assert all(r['usage']['output_tokens'] > 0 for r in results)
+
+    def test_per_request_errors_are_reported(self, tmp_path):
+        def responder(custom_id, body):
+            if custom_id == 'req-1':
+                raise RuntimeError('bad request')
+            return 'ok'
+
+        runner = BatchJobRunner(get_adapter('openai', 'gpt-4'), LocalBatchProvider(tmp_path, responder),
+                                config={'poll_interval_seconds': 0.01, 'work_dir': str(tmp_path)})
+        results = {r['custom_id']: r for r in runner.run(make_requests(3))}
+
+        assert results['req-1']['error'] == 'bad request'
+        assert results['req-0']['text'] == 'ok'
+        assert runner.get_stats()['failed'] == 1
+
+    def test_runner_from_config_closes_what_it_built(self, tmp_path):
+        config = batch_config(tmp_path, cache={'path': str(tmp_path / 'cache.sqlite')})
+        provider = LocalBatchProvider(tmp_path / 'batches')
+        with BatchJobRunner.from_config(config, batch_provider=provider) as runner:
+            results = list(runner.run(make_requests(2)))
+            assert runner.cache.conn is not None
+
+        assert len(results) == 2
+        assert runner.cache.conn is None
+        assert runner.get_stats()['cache']['misses'] == 2
+
+    def test_batch_provider_is_abstract(self):
+        with pytest.raises(TypeError):
+            BatchProvider()
+
+
+class TestBatchStages:
+    """`mode: batch` for generation and annotation"""
+
+    def test_synthetic_generator_batch_mode(self, tmp_path):
+        generator = SyntheticGenerator(batch_config(tmp_path), output_dir=str(tmp_path))
+        result = generator.generate([{'prompt_id': 'greeting', 'user': 'Genera un saludo'}])
+
+        lines = Path(result['output_file']).read_text(encoding='utf-8').splitlines()
+        assert len(lines) == 5
+        assert result['client']['jobs'] == 1
+        assert json.loads(lines[0])['metadata']['prompt_id'] == 'greeting'
+
+    def test_batch_mode_uses_cache(self, tmp_path):
+        config = batch_config(tmp_path, cache={'path': str(tmp_path / 'cache.sqlite')})
+        prompts = [{'prompt_id': 'greeting', 'user': 'Genera un saludo'}]
+        SyntheticGenerator(config, output_dir=str(tmp_path)).generate(prompts)
+        rerun = SyntheticGenerator(config, output_dir=str(tmp_path)).generate(
+            prompts, output_path=tmp_path / 'rerun.jsonl')
+
+        assert rerun['client']['submitted'] == 0
+        assert rerun['client']['cache_hits'] == 5
+        assert rerun['statistics']['generated'] == 5
+
+    def test_annotator_batch_mode(self, tmp_path):
+        payload = json.dumps({
+            'annotations': {'primary_intent': 'COMPLIMENT', 'message_tone': 'ENGAGED',
+                            'safety_level': 'LEVEL_1_FLIRT_SAFE', 'confidence': 0.9},
+            'ideal_nadia_response': {'text': 'Ay, gracias 😊'},
+        })
+        provider = LocalBatchProvider(tmp_path / 'batches', responder=lambda cid, body: payload)
+        annotator = LLMAnnotator(batch_config(tmp_path, temperature=0.0))
+        messages = [{'message_id': f"m{i}", 'text': 'Eres hermosa'} for i in range(3)]
+        result = annotator.annotate_batch(messages, tmp_path / 'annotations.json',
+                                          batch_provider=provider)
+
+        annotations = json.loads((tmp_path / 'annotations.json').read_text(encoding='utf-8'))
+        assert result['statistics']['annotated'] == 3
+        assert {a['message_id'] for a in annotations} == {'m0', 'm1', 'm2'}
+        assert annotations[0]['original_text'] == 'Eres hermosa'
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Tests for the sliding-window conversation context used in annotator and generator prompts
+"""
+
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.annotation.llm_annotator import LLMAnnotator
+from scripts.patterns.context import ConversationContext
+from scripts.prompt_generator import ExamplePool, PromptGenerator
+
+STAGES = ['ICE_BREAKER', 'RAPPORT_BUILDING', 'HIGH_INTENT']
+
+
+def long_conversation(n_turns, conversation_id='c1'):
+    messages = []
+    for i in range(n_turns):
+        if i % 2:
+            messages.append({'message_id': f"{conversation_id}-{i}", 'author': 'nadia',
+                             'text': f"respuesta {i} 😊"})
+        else:
+            messages.append({'message_id': f"{conversation_id}-{i}", 'author': 'user',
+                             'text': f"mensaje   del usuario\n{i}",
+                             'annotations': {'rapport_stage': STAGES[min(i // 10, 2)],
+                                             'customer_status': 'PROSPECT'}})
+    return messages
+
+
+class TestConversationContext:
+    """Rolling window plus compact summary"""
+
+    def test_window_and_summary(self):
+        context = ConversationContext(window_turns=4)
+        assert context.render() == ''
+        for message in long_conversation(30):
+            context.push(message)
+
+        assert len(context) == 30
+        lines = context.render().split('\n')
+        assert lines[0] == ('[Antes: 26 turnos previos (13 usuario, 13 Nadia); '
+                            'rapport_stage: ICE_BREAKER (5) → RAPPORT_BUILDING (5) → '
+                            'HIGH_INTENT (3); customer_status: PROSPECT (13)]')
+        assert lines[1] == '[Estado: rapport_stage=HIGH_INTENT, customer_status=PROSPECT]'
+        assert lines[2:] == ['user: mensaje del usuario 26', 'nadia: respuesta 27 😊',
+                             'user: mensaje del usuario 28', 'nadia: respuesta 29 😊']
+
+    def test_prompt_size_does_not_grow_with_history(self):
+        context = ConversationContext(window_turns=6, max_turn_chars=40, max_state_runs=2)
+        sizes = []
+        for i in range(2000):
+            context.push({'author': 'user' if i % 2 == 0 else 'nadia', 'text': 'x' * 300,
+                          'rapport_stage': STAGES[(i // 7) % 3]})
+            sizes.append(len(context.render()))
+        assert max(sizes[100:]) - min(sizes[100:]) < 20
+        assert context.render().split('\n')[2] == 'user: ' + 'x' * 39 + '…'
+        assert 'rapport_stage: … → ' in context.summary()
+
+    def test_conversation_level_state_and_disabled_config(self):
+        context = ConversationContext.from_config({}, state={'customer_status': 'CURIOUS',
+                                                             'profile_id': 'PROFILE_1'})
+        assert context.current_state() == {'customer_status': 'CURIOUS'}
+        assert ConversationContext.from_config(None) is None
+        assert ConversationContext.from_config({'window_turns': 0}) is None
+
+
+class TestContextInPrompts:
+    """Annotator and generator prompts carry the bounded context"""
+
+    def test_annotator_requests_reset_per_conversation(self):
+        annotator = LLMAnnotator({'context': {'window_turns': 2}})
+        messages = [{'conversation_id': 'a', **m} for m in long_conversation(5, 'a')] + \
+                   [{'conversation_id': 'b', **m} for m in long_conversation(2, 'b')]
+        requests = list(annotator.build_requests(messages))
+
+        # Only user turns are annotated; Nadia's turns still feed the context
+        assert [r['custom_id'] for r in requests] == ['a-0', 'a-2', 'a-4', 'b-0']
+        first = requests[0]['messages'][0]['content']
+        assert 'Contexto previo' not in first
+        last_of_a = requests[2]['messages'][0]['content']
+        assert 'Contexto previo:\n[Antes: 2 turnos previos' in last_of_a
+        assert 'user: mensaje del usuario 2\nnadia: respuesta 3 😊' in last_of_a
+        assert 'Contexto previo' not in requests[3]['messages'][0]['content']
+
+        plain = list(LLMAnnotator({}).build_requests(messages))
+        assert all('Contexto previo' not in r['messages'][0]['content'] for r in plain)
+
+    def test_generator_continuation_prompt(self):
+        generator = PromptGenerator({'prompt_generation': {'context': {'window_turns': 3}}},
+                                    pool=ExamplePool([]))
+        cell = {'primary_intent': 'GREETING', 'rapport_stage': 'RAPPORT_BUILDING'}
+        assert 'Conversación hasta ahora' not in generator.build_prompt(cell)['user']
+
+        context = generator.build_context(long_conversation(40))
+        prompt = generator.build_prompt(cell, context=context)['user']
+        assert 'Conversación hasta ahora' in prompt
+        assert '[Antes: 37 turnos previos' in prompt
+        assert 'respuesta 39' in prompt and 'usuario 36' not in prompt
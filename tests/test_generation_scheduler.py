@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Tests for the quota-driven generation scheduler
+"""
+
+import json
+import sys
+from itertools import cycle
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.generation_scheduler import DEFAULT_QUOTAS, QuotaScheduler, extract_labels
+from scripts.llm.mock_server import MockLLMServer
+from scripts.synthetic_generator import SyntheticGenerator
+
+CELLS = {
+    'greeting': {'primary_intent': 'GREETING', 'safety_level': 'LEVEL_0_SAFE'},
+    'hello': {'primary_intent': 'GREETING', 'safety_level': 'LEVEL_0_SAFE'},
+    'compliment': {'primary_intent': 'COMPLIMENT', 'safety_level': 'LEVEL_1_FLIRT_SAFE'},
+    'explicit': {'primary_intent': 'FANTASY_ROLEPLAY', 'safety_level': 'LEVEL_3_INAPPROPRIATE'},
+}
+QUOTAS = [
+    {'dimension': 'primary_intent', 'max_share': 0.40},
+    {'dimension': 'safety_level', 'labels': ['LEVEL_3_INAPPROPRIATE'], 'min_count': 5},
+]
+CONFIG = {'dimensions': ['primary_intent', 'safety_level'], 'quotas': QUOTAS}
+
+
+def make_prompts(cells=CELLS):
+    return [{'prompt_id': name, 'user': name, 'metadata': dict(labels)}
+            for name, labels in cells.items()]
+
+
+def record_for(prompt, **overrides):
+    return {'messages': [], 'metadata': {**prompt['metadata'], **overrides}}
+
+
+def run_to_completion(scheduler, outcome):
+    """Issue everything the scheduler allows, then feed back outcomes, until it stops."""
+    while scheduler.has_work():
+        issued = []
+        while True:
+            prompt = scheduler.next_prompt()
+            if prompt is None:
+                break
+            issued.append(prompt)
+        for prompt in issued:
+            scheduler.observe(prompt['prompt_id'], outcome(prompt))
+
+
+class TestQuotaScheduler:
+    """Greedy quota filling with learned per-prompt yields"""
+
+    def test_meets_quotas_and_stops(self):
+        scheduler = QuotaScheduler(make_prompts(), CONFIG, max_requests=200)
+        run_to_completion(scheduler, record_for)
+
+        report = scheduler.get_report()
+        assert report['satisfied'] is True
+        assert all(quota['met'] for quota in report['quotas'])
+        assert report['distribution']['safety_level']['LEVEL_3_INAPPROPRIATE'] >= 5
+        assert report['requests_issued'] < 20
+
+    def test_flat_cycling_never_gets_there(self):
+        # Half the templates are GREETING: a flat cycle keeps it at 50% forever
+        flat = QuotaScheduler(make_prompts(), CONFIG)
+        for _, prompt in zip(range(200), cycle(make_prompts())):
+            flat.issued[flat.prompt_index[prompt['prompt_id']]] += 1
+            flat.observe(prompt['prompt_id'], record_for(prompt))
+        assert not flat.satisfied()
+
+        scheduled = QuotaScheduler(make_prompts(), CONFIG, max_requests=200)
+        run_to_completion(scheduled, record_for)
+        assert scheduled.satisfied()
+
+    def test_default_cap_leaves_safety_level_alone(self):
+        # LEVEL_0 is the expected majority; only single intents are capped at 40%
+        cells = {'greeting': CELLS['greeting'],
+                 'small_talk': {'primary_intent': 'SMALL_TALK', 'safety_level': 'LEVEL_0_SAFE'},
+                 'question': {'primary_intent': 'RELATIONAL_QUESTION',
+                              'safety_level': 'LEVEL_0_SAFE'},
+                 'explicit': CELLS['explicit']}
+        config = {'dimensions': ['primary_intent', 'safety_level'], 'quotas': DEFAULT_QUOTAS}
+        scheduler = QuotaScheduler(make_prompts(cells), config, max_requests=200)
+        run_to_completion(scheduler, record_for)
+
+        distribution = scheduler.get_report()['distribution']['safety_level']
+        assert scheduler.satisfied()
+        assert distribution['LEVEL_0_SAFE'] / sum(distribution.values()) > 0.4
+
+    def test_no_prompts_means_no_work(self):
+        scheduler = QuotaScheduler([], CONFIG, max_requests=200)
+        assert not scheduler.has_work()
+        assert scheduler.next_prompt() is None
+
+    def test_observed_labels_override_conditioning(self):
+        # The 'explicit' template only yields LEVEL_2; a second one actually delivers LEVEL_3
+        cells = {**CELLS, 'explicit_v2': CELLS['explicit']}
+
+        def outcome(prompt):
+            if prompt['prompt_id'] == 'explicit':
+                return record_for(prompt, safety_level='LEVEL_2_BORDERLINE')
+            return record_for(prompt)
+
+        scheduler = QuotaScheduler(make_prompts(cells), CONFIG, max_requests=200)
+        run_to_completion(scheduler, outcome)
+        by_prompt = scheduler.get_report()['requests_by_prompt']
+        assert scheduler.satisfied()
+        assert by_prompt['explicit_v2'] > by_prompt['explicit']
+
+    def test_in_flight_requests_pause_issuance(self):
+        scheduler = QuotaScheduler(make_prompts(), {**CONFIG, 'quotas': QUOTAS[1:]})
+        issued = [scheduler.next_prompt() for _ in range(5)]
+        assert all(p['prompt_id'] == 'explicit' for p in issued)
+        # Five LEVEL_3 requests in flight already cover the quota
+        assert scheduler.next_prompt() is None
+        scheduler.observe('explicit', None)
+        assert scheduler.next_prompt()['prompt_id'] == 'explicit'
+
+    def test_message_level_labels_take_precedence(self):
+        record = {
+            'messages': [{'author': 'user', 'primary_intent': 'GREETING'},
+                         {'author': 'nadia', 'primary_intent': 'IGNORED'},
+                         {'author': 'user', 'annotations': {'primary_intent': 'COMPLIMENT'}}],
+            'metadata': {'primary_intent': 'SMALL_TALK', 'profile_id': 'PROFILE_1_DIRECTO'},
+        }
+        labels = extract_labels(record, ['primary_intent', 'profile_id'])
+        assert labels == {'primary_intent': ['GREETING', 'COMPLIMENT'],
+                          'profile_id': ['PROFILE_1_DIRECTO']}
+
+
+class TestScheduledGeneration:
+    """SyntheticGenerator stops once the quotas are met"""
+
+    def test_generator_stops_at_quota(self, tmp_path):
+        with MockLLMServer() as server:
+            config = {'provider': 'openai', 'model': 'gpt-4', 'api_base_url': server.base_url,
+                      'max_concurrency': 2, 'n_conversations_to_generate': 100,
+                      'scheduler': {'enabled': True, **CONFIG}}
+            result = SyntheticGenerator(config, output_dir=str(tmp_path)).generate(make_prompts())
+
+        records = [json.loads(line) for line in
+                   Path(result['output_file']).read_text(encoding='utf-8').splitlines()]
+        assert result['scheduler']['satisfied'] is True
+        assert len(records) == result['statistics']['generated'] < 100
+        level_3 = [r for r in records if r['metadata']['safety_level'] == 'LEVEL_3_INAPPROPRIATE']
+        assert len(level_3) >= 5
+
+    def test_generator_without_prompts_terminates(self, tmp_path):
+        with MockLLMServer() as server:
+            config = {'provider': 'openai', 'model': 'gpt-4', 'api_base_url': server.base_url,
+                      'n_conversations_to_generate': 100,
+                      'scheduler': {'enabled': True, **CONFIG}}
+            result = SyntheticGenerator(config, output_dir=str(tmp_path)).generate([])
+
+        assert result['statistics']['requested'] == 0
+        assert result['scheduler']['satisfied'] is False
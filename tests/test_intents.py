@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Tests for the compiled heuristic intent detector
+"""
+
+import json
+import re
+import sys
+import time
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.patterns.intents import IntentDetector, IntentStats
+from scripts.utils import aho_corasick
+from scripts.utils.aho_corasick import AhoCorasick
+
+
+@pytest.fixture(scope='module')
+def detector():
+    return IntentDetector.from_taxonomy()
+
+
+def fold(text):
+    return ''.join(c for c in unicodedata.normalize('NFD', text.lower())
+                   if not unicodedata.combining(c))
+
+
+class TestIntentDetector:
+    """Decision-matrix cases from docs/GUIDELINES.MD"""
+
+    @pytest.mark.parametrize('text, intent', [
+        ("Hola hermosa, ¿cuánto cuesta?", 'TRANSACTIONAL_INQUIRY'),
+        ("No sé si eres real, pero me gustas", 'HESITATION_OR_OBJECTION'),
+        ("😍😍😍", 'COMPLIMENT'),
+        ("Ya vi que cobras, adiós", 'NEGATIVE_FEEDBACK'),
+        ("Hey otra vez", 'SMALL_TALK'),
+        ("El link que me mandaste no funciona", 'TECHNICAL_ISSUE'),
+        ("Buenos días", 'GREETING'),
+        ("Eres preciosa 😍", 'COMPLIMENT'),
+        ("no me carga la pagina", 'TECHNICAL_ISSUE'),
+        ("*te abrazo fuerte*", 'FANTASY_ROLEPLAY'),
+    ])
+    def test_guideline_examples(self, detector, text, intent):
+        assert detector.detect(text)['primary_intent'] == intent
+
+    def test_batch_matches_single_messages(self, detector):
+        texts = ["¿Cuánto cobras?", "", "asdf qwer", "Me voy a dormir, buenas noches",
+                 "Acabo de divorciarme", "¿Tienes novio?"]
+        batch = detector.classify(texts)
+        for i, text in enumerate(texts):
+            single = detector.detect(text)
+            assert batch['primary_intent'][i] == single['primary_intent']
+            assert batch['confidence'][i] == pytest.approx(single['confidence'])
+        assert batch['primary_intent'][2] == 'SMALL_TALK'
+        assert batch['confidence'][2] == detector.default_confidence
+        assert (batch['confidence'] <= 1).all()
+
+    def test_whole_words_and_prefixes(self, detector):
+        assert detector.detect("ya pagué")['matched_patterns'] == ['pague']
+        assert detector.detect("se apagó la luz")['matched_patterns'] == []
+        assert detector.detect("los precios")['matched_patterns'] == ['precios']
+        # Payment words are exact forms: no 'pagina' or 'preciosa'
+        assert detector.detect("la página")['matched_patterns'] == []
+        assert detector.detect("preciosa")['matched_patterns'] == ['preciosa']
+        assert detector.detect("¿me cobras?")['matched_patterns'] == ['cobr*']
+        assert detector.detect("hilo")['matched_patterns'] == []
+
+    def test_intent_stats_merge(self, detector, tmp_path):
+        conversations = [{'messages': [{'author': 'user', 'text': text},
+                                       {'author': 'nadia', 'text': 'jaja ok'}]}
+                         for text in ["hola", "¿cuánto cuesta?", "hola", "adiós"]]
+        left, right = IntentStats(detector), IntentStats(detector)
+        for conversation in conversations[:2]:
+            left.add(conversation)
+        for conversation in conversations[2:]:
+            right.add(conversation)
+
+        left.merge(right)
+        left.save(tmp_path)
+        saved = json.loads((tmp_path / 'intent_distribution.json').read_text(encoding='utf-8'))
+        assert saved['user_messages'] == 4
+        assert saved['intents']['GREETING']['count'] == 2
+        assert saved['intents']['GREETING']['opening_share'] == 0.5
+        assert left.summary()['top_intent'] == 'GREETING'
+
+
+class TestAhoCorasick:
+    """The lockstep automaton against a regex reference"""
+
+    def test_matches_regex_reference(self):
+        rng = np.random.default_rng(3)
+        patterns = ['he', 'she', 'hers', 'his', 'ño', 'año nuevo', '😍', 'x?', 'ab']
+        alphabet = list('heisrañoxb ') + ['😍', '?', ',', 'É']
+        texts = [''.join(rng.choice(alphabet, size=int(rng.integers(0, 40))))
+                 for _ in range(500)]
+        automaton = AhoCorasick(patterns)
+        rows, ids = automaton.find_all(texts)
+        found = set(zip(rows.tolist(), ids.tolist()))
+
+        expected = set()
+        for row, text in enumerate(texts):
+            folded = re.sub(r'[\s,]+', ' ', fold(text))
+            for pid, pattern in enumerate(patterns):
+                left = r'(?<!\w)' if pattern[0].isalnum() else ''
+                right = r'(?!\w)' if pattern[-1].isalnum() else ''
+                if re.search(left + re.escape(fold(pattern)) + right, folded):
+                    expected.add((row, pid))
+        assert found == expected
+
+    def test_long_outlier_gets_its_own_sub_batch(self, monkeypatch):
+        automaton = AhoCorasick(['hola', 'precio'])
+        texts = ['hola que tal'] * 20000 + ['precio ' * 800 + 'hola']
+        cells = []
+        scan = automaton._scan
+
+        def recording_scan(chunk, symbols, words, row_start, lengths):
+            cells.append(int(lengths[chunk].max()) * len(chunk))
+            return scan(chunk, symbols, words, row_start, lengths)
+
+        monkeypatch.setattr(automaton, '_scan', recording_scan)
+        rows, ids = automaton.find_all(texts)
+        assert max(cells) <= aho_corasick._CHUNK_CELLS
+        assert np.bincount(rows).tolist() == [1] * 20000 + [801]
+        assert (ids[rows == 20000] == 1).sum() == 800
+
+    def test_throughput(self, detector):
+        rng = np.random.default_rng(0)
+        words = ['hola', 'precio', 'eres', 'real', 'me', 'gustas', 'bonita', 'noche',
+                 'link', 'no', 'funciona', 'jaja', '😍', 'adiós', '¿cuánto', 'cuesta?']
+        texts = [' '.join(rng.choice(words, size=int(rng.integers(1, 15))))
+                 for _ in range(100000)]
+        detector.classify(texts[:100])
+        elapsed = []
+        for _ in range(3):
+            start = time.perf_counter()
+            result = detector.classify(texts)
+            elapsed.append(time.perf_counter() - start)
+        assert len(result['primary_intent']) == len(texts)
+        # 100k messages per second, best of three runs
+        assert len(texts) / min(elapsed) > 100000
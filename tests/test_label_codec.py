@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared taxonomy label codec and the validators that run on it
+"""
+
+import json
+import sys
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.patterns.corpus import load_taxonomy
+from scripts.validation.annotation_calibration import AnnotatorCalibrationTool
+from scripts.validation.label_codec import LabelCodec
+from scripts.validation.label_validator import LabelValidator
+from scripts.validation.llm_quality_checker import LLMAnnotationQualityChecker, StreamingReview
+
+INTENTS = ['GREETING', 'NEGATIVE_FEEDBACK', 'COMPLIMENT', 'OTHER', 'INVENTADA']
+TONES = ['FRIENDLY', 'FRUSTRATED', 'ENGAGED']
+SAFETY = ['LEVEL_0_SAFE', 'LEVEL_2_BORDERLINE', 'LEVEL_3_INAPPROPRIATE']
+
+
+def annotation_items(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{'message_id': f"m{i}", 'conversation_id': f"c{i // 4}",
+             'annotations': {'primary_intent': INTENTS[rng.integers(len(INTENTS))],
+                             'message_tone': TONES[rng.integers(len(TONES))],
+                             'safety_level': SAFETY[rng.integers(len(SAFETY))],
+                             'confidence': 0.9},
+             'ideal_nadia_response': {'text': 'hola'}}
+            for i in range(n)]
+
+
+class TestLabelCodec:
+    """Fixed int8 categories per taxonomy dimension"""
+
+    def test_codes_follow_taxonomy_order(self):
+        codec = LabelCodec.load()
+        taxonomy = load_taxonomy()['dimensions']
+        assert codec.dimensions == taxonomy
+        assert codec.categories['rapport_stage'] == taxonomy['rapport_stage'] + ['OTHER']
+        assert LabelCodec.load() is codec
+
+        codes = codec.encode('safety_level', ['LEVEL_1_FLIRT_SAFE', None, 'NUEVA', float('nan')])
+        assert codes.dtype == np.int8
+        assert codes.tolist() == [1, -1, 4, -1]
+        assert codec.decode('safety_level', codes).tolist() == \
+            ['LEVEL_1_FLIRT_SAFE', None, 'OTHER', None]
+
+        # Invalid labels can be tallied by name before they fall into OTHER
+        unknown = Counter()
+        codec.encode('primary_intent', ['Greeting', 'OTHER', 'Greeting', 'GREETING', None], unknown)
+        assert unknown == {'Greeting': 2}
+        counts = codec.counts('primary_intent',
+                              codec.encode('primary_intent', ['Greeting', 'OTHER', 'Greeting']))
+        assert codec.count_dict('primary_intent', counts) == {'OTHER': 3}
+        assert codec.count_dict('primary_intent', counts, unknown) == {'OTHER': 1, 'Greeting': 2}
+
+    def test_frames_share_categories_and_stay_small(self):
+        codec = LabelCodec.load()
+        n = 200_000
+        rng = np.random.default_rng(1)
+        stages = np.array(codec.dimensions['rapport_stage'], dtype=object)
+        raw = pd.DataFrame({'rapport_stage': stages[rng.integers(len(stages), size=n)]})
+        encoded = codec.encode_frame(raw)
+
+        assert encoded['rapport_stage'].dtype == codec.dtypes['rapport_stage']
+        assert encoded['rapport_stage'].memory_usage(deep=True, index=False) < 1.01 * n
+        assert raw['rapport_stage'].memory_usage(deep=True, index=False) > 20 * n
+        # Already-encoded columns are read without re-encoding
+        assert np.shares_memory(codec.codes(encoded, 'rapport_stage'),
+                                encoded['rapport_stage'].array.codes)
+        assert (encoded['rapport_stage'].astype(object) == raw['rapport_stage']).all()
+
+    def test_frame_from_records_in_chunks(self, tmp_path):
+        items = annotation_items(25)
+        path = tmp_path / 'annotations.jsonl'
+        path.write_text(''.join(json.dumps(item) + '\n' for item in items), encoding='utf-8')
+
+        frame = LabelValidator().load_labels(str(path))
+        small = LabelCodec.load().frame_from_records(items, chunk_size=4)
+        pd.testing.assert_frame_equal(frame, small)
+        assert frame['message_id'].tolist() == [item['message_id'] for item in items]
+        assert 'timestamp' not in frame
+        assert frame['primary_intent'].astype(object).tolist() == [
+            label if label != 'INVENTADA' else 'OTHER'
+            for label in (item['annotations']['primary_intent'] for item in items)]
+        assert frame['rapport_stage'].isna().all()
+
+
+class TestEncodedValidators:
+    """Validators give the same answers on encoded labels"""
+
+    def test_label_validator_distribution(self):
+        validator = LabelValidator()
+        raw = pd.DataFrame({'primary_intent': ['GREETING', 'GREETING', 'COMPLIMENT', None]})
+        expected = {'primary_intent': {'GREETING': 2 / 3, 'COMPLIMENT': 1 / 3}}
+        assert validator.analyze_distribution(raw) == expected
+        assert validator.analyze_distribution(validator.codec.encode_frame(raw)) == expected
+
+        bogus = pd.DataFrame({'primary_intent': ['GREETING', 'Greeting', 'OTHER', 'Greeting']})
+        assert validator.analyze_distribution(bogus) == \
+            {'primary_intent': {'GREETING': 0.25, 'Greeting': 0.5, 'OTHER': 0.25}}
+
+    def test_quality_checker_counts_and_streaming(self):
+        items = annotation_items(300, seed=2)
+        checker = LLMAnnotationQualityChecker()
+        analysis = checker.analyze_distribution(items)
+
+        tones = Counter(item['annotations']['message_tone'] for item in items)
+        assert analysis['distributions']['message_tone'] == \
+            {tone: n / 300 for tone, n in tones.items()}
+        # Labels outside the taxonomy are reported by name, not folded into OTHER
+        intents = Counter(item['annotations']['primary_intent'] for item in items)
+        assert analysis['distributions']['primary_intent'] == \
+            {intent: n / 300 for intent, n in intents.items()}
+        assert any('OTHER' in anomaly for anomaly in analysis['anomalies'])
+
+        review = StreamingReview(checker, batch_size=64)
+        review.consume(items)
+        assert review.distribution() == analysis
+        assert review.counts['safety_level'].dtype == np.int64
+        assert review.unknown['primary_intent'] == {'INVENTADA': intents['INVENTADA']}
+        assert '- INVENTADA: ' in review.report()
+
+        reasons = {c['message_id']: c['review_reasons']
+                   for c in checker.review_candidates_for(items)}
+        for item in items:
+            flagged = reasons.get(item['message_id'], [])
+            assert ("Requiere revisión de seguridad" in flagged) == \
+                (item['annotations']['safety_level'] != 'LEVEL_0_SAFE')
+            assert ("Intención sensible que requiere validación" in flagged) == \
+                (item['annotations']['primary_intent'] == 'NEGATIVE_FEEDBACK')
+
+    def test_calibration_agreement(self):
+        tool = AnnotatorCalibrationTool()
+        tool.create_control_bank([{'id': f"ctrl_{i}", 'text': f"texto {i}"} for i in range(4)])
+        for session in ('s1', 's2'):
+            tool.start_calibration_session(session)
+        labels = {'primary_intent': 'GREETING', 'message_tone': 'FRIENDLY',
+                  'safety_level': 'LEVEL_0_SAFE'}
+        for i in range(4):
+            tool.record_annotation('s1', f"ctrl_{i}", labels)
+        tool.record_annotation('s2', 'ctrl_0', labels)
+        tool.record_annotation('s2', 'ctrl_1', {**labels, 'message_tone': 'ENGAGED'})
+        tool.record_annotation('s2', 'ctrl_2', {'primary_intent': 'GREETING'})
+
+        agreement = tool.calculate_intra_annotator_agreement('s1', 's2')
+        assert agreement == {'primary_intent': 1.0, 'message_tone': 0.5,
+                             'safety_level': 1.0, 'overall': 6 / 7}
+        assert tool.identify_inconsistencies('s1', 's2') == [{
+            'message_id': 'ctrl_1', 'text': 'texto 1',
+            'disagreements': {'message_tone': {'session1': 'FRIENDLY', 'session2': 'ENGAGED'}}}]
+
+    def test_calibration_keeps_invalid_labels(self):
+        tool = AnnotatorCalibrationTool()
+        tool.create_control_bank([{'id': 'ctrl_0', 'text': 'hola'}, {'id': 'ctrl_1', 'text': 'ok'}])
+        for session in ('s1', 's2'):
+            tool.start_calibration_session(session)
+        tool.record_annotation('s1', 'ctrl_0', {'primary_intent': 'Greeting', 'message_tone': 'NEUTRAL'})
+        tool.record_annotation('s2', 'ctrl_0', {'primary_intent': 'Greeting', 'message_tone': 'CALM'})
+        tool.record_annotation('s1', 'ctrl_1', {'primary_intent': 'OTHER'})
+        tool.record_annotation('s2', 'ctrl_1', {'primary_intent': 'Greeting'})
+
+        # Two different invalid labels are a disagreement, not a shared OTHER
+        assert tool.calculate_intra_annotator_agreement('s1', 's2') == \
+            {'primary_intent': 0.5, 'message_tone': 0.0, 'overall': 1 / 3}
+        assert tool.identify_inconsistencies('s1', 's2') == [
+            {'message_id': 'ctrl_0', 'text': 'hola',
+             'disagreements': {'message_tone': {'session1': 'NEUTRAL', 'session2': 'CALM'}}},
+            {'message_id': 'ctrl_1', 'text': 'ok',
+             'disagreements': {'primary_intent': {'session1': 'OTHER', 'session2': 'Greeting'}}}]
+
+    def test_calibration_accepts_mixed_message_ids(self):
+        tool = AnnotatorCalibrationTool()
+        tool.create_control_bank([{'id': 7, 'text': 'hola'}, {'id': 'ctrl_1', 'text': 'ok'}])
+        for session in ('s1', 's2'):
+            tool.start_calibration_session(session)
+        greeting = {'primary_intent': 'GREETING'}
+        for message_id in (7, 'ctrl_1'):
+            tool.record_annotation('s1', message_id, greeting)
+        tool.record_annotation('s2', 'ctrl_1', greeting)
+        tool.record_annotation('s2', 7, {'primary_intent': 'PRICE_INQUIRY'})
+
+        # The public history keeps the label dicts as recorded
+        assert tool.annotation_history['s2']['annotations'][7] == {'primary_intent': 'PRICE_INQUIRY'}
+        assert tool.calculate_intra_annotator_agreement('s1', 's2') == \
+            {'primary_intent': 0.5, 'overall': 0.5}
+        assert [item['message_id'] for item in tool.identify_inconsistencies('s1', 's2')] == [7]
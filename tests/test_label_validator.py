@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Tests for LabelValidator agreement metrics, FSM transition validation and label conflicts
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.metrics import cohen_kappa_score
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.validation.conflict_rules import ConflictRuleRegistry
+from scripts.validation.label_validator import LabelValidator
+from scripts.validation.llm_quality_checker import LLMAnnotationQualityChecker
+
+INTENTS = ['GREETING', 'SMALL_TALK', 'COMPLIMENT', 'NEGATIVE_FEEDBACK']
+
+
+def annotations_frame(n_messages, annotators, agreement=0.7, seed=0, coverage=1.0):
+    """Each annotator copies a hidden gold label with probability `agreement`."""
+    rng = np.random.default_rng(seed)
+    gold = rng.integers(len(INTENTS), size=n_messages)
+    frames = []
+    for annotator in annotators:
+        labels = np.where(rng.random(n_messages) < agreement, gold,
+                          rng.integers(len(INTENTS), size=n_messages))
+        keep = rng.random(n_messages) < coverage
+        frames.append(pd.DataFrame({
+            'message_id': np.arange(n_messages)[keep],
+            'annotator': annotator,
+            'primary_intent': np.array(INTENTS, dtype=object)[labels[keep]],
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def reference_fleiss(table):
+    """Textbook Fleiss' kappa for a messages × categories table with a fixed rater count."""
+    n = table.sum(axis=1)[0]
+    p_j = table.sum(axis=0) / table.sum()
+    p_i = ((table ** 2).sum(axis=1) - n) / (n * (n - 1))
+    return (p_i.mean() - (p_j ** 2).sum()) / (1 - (p_j ** 2).sum())
+
+
+class TestValidateConsistency:
+    """Pairwise Cohen's and pool-wide Fleiss' kappa from the pivoted code matrix"""
+
+    def test_pairwise_kappa_matches_sklearn(self):
+        df = annotations_frame(500, ['ana', 'beto', 'llm'], coverage=0.8, seed=1)
+        result = LabelValidator().validate_consistency(df)['primary_intent']
+
+        pivot = df.pivot(index='message_id', columns='annotator', values='primary_intent')
+        assert len(result['pairwise']) == 3
+        for pair in result['pairwise']:
+            a, b = pair['annotators']
+            common = pivot[[a, b]].dropna()
+            assert pair['samples'] == len(common)
+            assert pair['kappa'] == pytest.approx(cohen_kappa_score(common[a], common[b]))
+        kappas = [pair['kappa'] for pair in result['pairwise']]
+        assert result['mean_kappa'] == pytest.approx(np.mean(kappas))
+        assert result['min_kappa'] == pytest.approx(np.min(kappas))
+        assert result['samples'] == int((pivot.notna().sum(axis=1) >= 2).sum())
+        assert result['annotators'] == 3
+
+    def test_fleiss_kappa_matches_reference(self):
+        df = annotations_frame(400, ['a', 'b', 'c', 'd'], seed=2)
+        result = LabelValidator().validate_consistency(df)['primary_intent']
+
+        table = pd.crosstab(df['message_id'], df['primary_intent']).to_numpy()
+        assert result['fleiss_kappa'] == pytest.approx(reference_fleiss(table))
+        assert 0.4 < result['fleiss_kappa'] < 0.8
+
+    def test_edge_cases(self):
+        df = pd.DataFrame({
+            'message_id': [1, 1, 2, 3, 3],
+            'annotator': ['a', 'b', 'a', 'a', 'b'],
+            'primary_intent': ['GREETING', 'GREETING', 'SMALL_TALK', 'GREETING', 'NO_EXISTE'],
+            'safety_level': ['LEVEL_0_SAFE'] * 5,
+        })
+        results = LabelValidator().validate_consistency(df)
+
+        # Labels outside the taxonomy count as OTHER, not as missing
+        assert results['primary_intent']['samples'] == 2
+        assert results['primary_intent']['pairwise'][0]['samples'] == 2
+        # A single category everywhere leaves kappa undefined
+        assert np.isnan(results['safety_level']['fleiss_kappa'])
+        assert results['safety_level']['mean_kappa'] == 0
+        assert 'rapport_stage' not in results
+
+    def test_rows_without_message_or_annotator_are_dropped(self):
+        df = pd.DataFrame({
+            'message_id': [1, 1, 2, 2, None, None],
+            'annotator': ['a', 'b', 'a', None, 'a', 'b'],
+            'primary_intent': ['GREETING', 'GREETING', 'SMALL_TALK', 'SMALL_TALK',
+                               'GREETING', 'COMPLIMENT'],
+        })
+        result = LabelValidator().validate_consistency(df)['primary_intent']
+        assert result['annotators'] == 2
+        assert result['samples'] == 1
+        assert result['pairwise'][0]['samples'] == 1
+
+    def test_one_million_annotations(self):
+        df = annotations_frame(200_000, [f"ann{i}" for i in range(5)], seed=3)
+        assert len(df) == 1_000_000
+
+        start = time.perf_counter()
+        result = LabelValidator().validate_consistency(df)['primary_intent']
+        elapsed = time.perf_counter() - start
+
+        assert len(result['pairwise']) == 10
+        assert result['samples'] == 200_000
+        assert elapsed < 10
+
+
+STAGES = ['ICE_BREAKER', 'RAPPORT_BUILDING', 'DEEP_EMOTION', 'HIGH_INTENT', 'CLOSING']
+
+
+def conversations_frame(n_conversations, length, seed=0):
+    rng = np.random.default_rng(seed)
+    n = n_conversations * length
+    return pd.DataFrame({
+        'message_id': np.arange(n),
+        'conversation_id': np.repeat(np.arange(n_conversations), length),
+        'timestamp': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.permutation(n), unit='s'),
+        'rapport_stage': np.array(STAGES, dtype=object)[rng.integers(len(STAGES), size=n)],
+    })
+
+
+def reference_violations(df, rules):
+    """Per-conversation loop over consecutive pairs, staying is always valid."""
+    found = set()
+    for conv_id, conv in df.sort_values(['conversation_id', 'timestamp']).groupby('conversation_id'):
+        stages = conv['rapport_stage'].tolist()
+        for i in range(len(stages) - 1):
+            if stages[i + 1] != stages[i] and stages[i + 1] not in rules[stages[i]]:
+                found.add((conv_id, i, stages[i], stages[i + 1]))
+    return found
+
+
+class TestValidateTransitions:
+    """Vectorized FSM validation for every machine declared in the taxonomy"""
+
+    def test_matches_reference_loop(self):
+        validator = LabelValidator()
+        df = conversations_frame(50, 12, seed=4)
+        violations = validator.validate_transitions(df)
+
+        assert set(violations['dimension']) == {'rapport_stage'}
+        found = set(zip(violations['conversation_id'], violations['position'],
+                        violations['from_state'], violations['to_state']))
+        assert found == reference_violations(df, validator.transition_rules['rapport_stage'])
+        assert violations['from_state'].dtype == 'category'
+
+        legacy = validator.validate_rapport_transitions(df)
+        assert len(legacy) == len(violations)
+        assert legacy[0]['invalid_transition'] == \
+            f"{violations['from_state'][0]} → {violations['to_state'][0]}"
+
+    def test_customer_status_and_boundaries(self):
+        df = pd.DataFrame({
+            'message_id': ['a1', 'a2', 'a3', 'a4', 'b1', 'b2'],
+            'conversation_id': ['a', 'a', 'a', 'a', 'b', 'b'],
+            'customer_status': ['PROSPECT', None, 'CUSTOMER', 'CHURNED', 'PROSPECT', 'PROSPECT'],
+            'rapport_stage': ['ICE_BREAKER', 'RAPPORT_BUILDING', 'DEEP_EMOTION', 'CLOSING',
+                              'ICE_BREAKER', 'ICE_BREAKER'],
+        })
+        violations = LabelValidator().validate_transitions(df)
+
+        # Unlabeled messages are skipped, conversation a → b is not a transition
+        assert violations[['dimension', 'conversation_id', 'position', 'message_id',
+                           'from_state', 'to_state']].astype(object).values.tolist() == [
+            ['customer_status', 'a', 0, 'a3', 'PROSPECT', 'CUSTOMER']]
+
+    def test_empty_and_report(self, tmp_path):
+        validator = LabelValidator()
+        assert validator.validate_transitions(pd.DataFrame({'conversation_id': []})).empty
+        df = conversations_frame(5, 6, seed=5)
+        df['primary_intent'] = 'GREETING'
+        df['safety_level'] = 'LEVEL_0_SAFE'
+        report = validator.generate_quality_report(df, output_file=str(tmp_path / 'report.txt'))
+        assert '3. VALIDACIÓN DE TRANSICIONES (FSM):' in report
+        assert 'rapport_stage: transiciones inválidas encontradas' in report
+
+    def test_one_million_messages(self):
+        df = conversations_frame(50_000, 20, seed=6)
+        start = time.perf_counter()
+        violations = LabelValidator().validate_transitions(df)
+        elapsed = time.perf_counter() - start
+
+        assert len(violations) > 0
+        assert elapsed < 10
+
+
+def labels_frame(n, seed=0):
+    rng = np.random.default_rng(seed)
+    pick = lambda labels: np.array(labels, dtype=object)[rng.integers(len(labels), size=n)]
+    return pd.DataFrame({
+        'message_id': np.array([f"m{i}" for i in range(n)], dtype=object),
+        'primary_intent': pick(['NEGATIVE_FEEDBACK', 'TRANSACTIONAL_INQUIRY', 'COMPLIMENT',
+                                'GREETING', None]),
+        'message_tone': pick(['FRIENDLY', 'FRUSTRATED', 'ENGAGED', 'SKEPTICAL']),
+        'safety_level': pick(['LEVEL_0_SAFE', 'LEVEL_1_FLIRT_SAFE', 'LEVEL_3_INAPPROPRIATE']),
+        'rapport_stage': pick(['ICE_BREAKER', 'DEEP_EMOTION', 'HIGH_INTENT']),
+        'confidence': rng.random(n),
+    })
+
+
+def reference_conflicts(df):
+    """The boolean masks the registry replaces (LabelValidator and the quality checker)."""
+    intent, tone, safety, stage = (df['primary_intent'], df['message_tone'],
+                                   df['safety_level'], df['rapport_stage'])
+    return {
+        'COMPLIMENT_FRUSTRATED': (intent == 'COMPLIMENT') & (tone == 'FRUSTRATED'),
+        'INAPPROPRIATE_POSITIVE_TONE': (safety == 'LEVEL_3_INAPPROPRIATE') &
+                                       tone.isin(['FRIENDLY', 'ENGAGED']),
+        'LOW_CONFIDENCE_TRANSACTIONAL': (intent == 'TRANSACTIONAL_INQUIRY') &
+                                        (df['confidence'] < 0.7),
+        'TRANSACTIONAL_DEEP_EMOTION': (intent == 'TRANSACTIONAL_INQUIRY') &
+                                      (stage == 'DEEP_EMOTION'),
+        'INAPPROPRIATE_HIGH_RAPPORT': (safety == 'LEVEL_3_INAPPROPRIATE') &
+                                      stage.isin(['HIGH_INTENT', 'DEEP_EMOTION']),
+    }
+
+
+class TestLabelConflicts:
+    """One conflict registry, evaluated in a single sweep into a sparse hit matrix"""
+
+    def test_matches_reference_masks(self):
+        validator = LabelValidator()
+        df = labels_frame(5000, seed=7)
+        expected = reference_conflicts(df)
+
+        for table in (df, validator.codec.encode_frame(df)):
+            hits = validator.find_label_conflicts(table)
+            assert hits.matrix.shape == (len(expected), len(df))
+            for code, mask in expected.items():
+                assert hits.count(code) == int(mask.sum())
+                assert hits.message_ids(code) == df.loc[mask, 'message_id'].tolist()
+
+        conflicts = validator.detect_label_conflicts(df)
+        assert [c['code'] for c in conflicts] == [c for c in expected if expected[c].any()]
+        assert conflicts[-1]['rule'] == 'Contenido inapropiado no debería tener rapport alto'
+
+    def test_both_tools_share_the_registry(self):
+        df = labels_frame(400, seed=8)
+        records = df.drop(columns='message_id').to_dict('records')
+        checker_hits = LLMAnnotationQualityChecker().rules.consistency_hits(records)
+        validator_hits = LabelValidator().find_label_conflicts(df).dense()
+        np.testing.assert_array_equal(checker_hits, validator_hits)
+
+        checker = LLMAnnotationQualityChecker()
+        issues = checker.check_annotation_consistency({'primary_intent': 'TRANSACTIONAL_INQUIRY',
+                                                       'rapport_stage': 'DEEP_EMOTION'})
+        assert issues == ['TRANSACTIONAL_INQUIRY es inconsistente con DEEP_EMOTION']
+
+    def test_guidelines_examples_are_not_conflicts(self):
+        # "No me gustas" (LEVEL_0_SAFE) and Case 5 (NEGATIVE_FEEDBACK, FRIENDLY or ENGAGED)
+        checker = LLMAnnotationQualityChecker()
+        for tone in ('FRIENDLY', 'ENGAGED'):
+            assert checker.check_annotation_consistency(
+                {'primary_intent': 'NEGATIVE_FEEDBACK', 'message_tone': tone,
+                 'safety_level': 'LEVEL_0_SAFE'}) == []
+
+    def test_missing_columns_and_bad_rules(self):
+        validator = LabelValidator()
+        df = labels_frame(300, seed=9).drop(columns=['rapport_stage', 'confidence'])
+        hits = validator.find_label_conflicts(df)
+        assert hits.count('TRANSACTIONAL_DEEP_EMOTION') == 0
+        assert hits.count('LOW_CONFIDENCE_TRANSACTIONAL') == 0
+        assert hits.count('COMPLIMENT_FRUSTRATED') > 0
+        assert [codes for codes in hits.row_codes() if codes]
+
+        with pytest.raises(ValueError):
+            ConflictRuleRegistry([{'code': 'X', 'when': {'primary_intent': ['NO_EXISTE']},
+                                   'message': 'x'}])
+        with pytest.raises(ValueError):
+            ConflictRuleRegistry([{'code': 'X', 'when': {'mood': ['HAPPY']}, 'message': 'x'}])
+
+    def test_one_million_rows(self):
+        validator = LabelValidator()
+        df = validator.codec.encode_frame(labels_frame(1_000_000, seed=10))
+        start = time.perf_counter()
+        hits = validator.find_label_conflicts(df)
+        elapsed = time.perf_counter() - start
+
+        assert hits.counts.sum() == hits.matrix.nnz
+        assert elapsed < 5
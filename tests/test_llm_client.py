@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Tests for the async LLM client and SyntheticGenerator
+Runs against the local mock provider - no network, no API cost
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.llm.client import AsyncLLMClient
+from scripts.llm.mock_server import MockLLMServer
+from scripts.llm.rate_limiter import RateLimiter, TokenBucket
+from scripts.synthetic_generator import SyntheticGenerator
+from tests.conftest import make_config, make_requests
+
+
+class TestTokenBucket:
+    """Token bucket refill and clamping"""
+
+    def test_refill_over_time(self):
+        now = [0.0]
+        bucket = TokenBucket(rate_per_second=10, capacity=10, clock=lambda: now[0])
+        bucket.consume(10)
+        assert bucket.wait_time(5) == pytest.approx(0.5)
+        now[0] = 0.5
+        assert bucket.wait_time(5) == 0
+
+    def test_oversized_request_is_clamped(self):
+        bucket = TokenBucket(rate_per_second=1, capacity=5, clock=lambda: 0.0)
+        assert bucket.wait_time(50) == 0
+
+    def test_settle_refunds_overestimate(self):
+        now = [0.0]
+        limiter = RateLimiter(tokens_per_minute=600, clock=lambda: now[0])
+        limiter.token_bucket.consume(10)
+        limiter.settle(estimated_tokens=10, actual_tokens=4)
+        assert limiter.token_bucket.tokens == pytest.approx(6)
+
+
+class TestAsyncLLMClient:
+    """Client behaviour against the mock provider"""
+
+    @pytest.mark.asyncio
+    async def test_requests_per_minute_is_respected(self):
+        rpm = 1200  # 20 req/s
+        n_requests = 30
+        with MockLLMServer() as server:
+            async with AsyncLLMClient(make_config(server.base_url, requests_per_minute=rpm,
+                                                  max_concurrency=8)) as client:
+                results = [r async for r in client.complete_many(make_requests(n_requests))]
+                stats = client.get_stats()
+
+        assert len(results) == n_requests
+        assert all(not r.get('error') for r in results)
+        # Burst of 1s worth (20 requests) + 10 paced at 20/s => >= ~0.5s
+        assert stats['elapsed_seconds'] >= 0.4
+        print(f"achieved {stats['achieved_requests_per_minute']:.0f} req/min vs configured {rpm}")
+
+    @pytest.mark.asyncio
+    async def test_tokens_per_minute_is_respected(self):
+        tpm = 30_000  # 500 tokens/s, 500-token burst
+        with MockLLMServer() as server:
+            config = make_config(server.base_url, tokens_per_minute=tpm,
+                                 max_tokens_per_conversation=100)
+            async with AsyncLLMClient(config) as client:
+                results = [r async for r in client.complete_many(make_requests(15))]
+                stats = client.get_stats()
+
+        assert all(not r.get('error') for r in results)
+        used = stats['input_tokens'] + stats['output_tokens']
+        elapsed = stats['elapsed_seconds']
+        # Actual usage can never exceed refill over the window plus the burst
+        assert used <= tpm / 60 * elapsed + 500
+        assert elapsed >= 0.5
+        print(f"achieved {stats['achieved_tokens_per_minute']:.0f} tok/min vs configured {tpm}")
+
+    @pytest.mark.asyncio
+    async def test_concurrency_cap(self):
+        with MockLLMServer(latency_seconds=0.05) as server:
+            async with AsyncLLMClient(make_config(server.base_url, max_concurrency=3)) as client:
+                results = [r async for r in client.complete_many(make_requests(12))]
+
+        assert len(results) == 12
+        assert server.stats['max_in_flight'] <= 3
+
+    @pytest.mark.asyncio
+    async def test_retries_on_429_and_500(self):
+        with MockLLMServer(rate_limit_rate=0.3, error_rate=0.1, seed=7) as server:
+            async with AsyncLLMClient(make_config(server.base_url, retry_attempts=8)) as client:
+                results = [r async for r in client.complete_many(make_requests(20))]
+                stats = client.get_stats()
+
+        assert all(not r.get('error') for r in results)
+        assert stats['retries'] > 0
+        assert stats['rate_limited'] == server.stats['rate_limited']
+        assert stats['retry_amplification'] > 1.0
+
+    @pytest.mark.asyncio
+    async def test_exhausted_retries_are_reported(self):
+        with MockLLMServer(rate_limit_rate=1.0) as server:
+            async with AsyncLLMClient(make_config(server.base_url, retry_attempts=2)) as client:
+                results = [r async for r in client.complete_many(make_requests(2))]
+
+        assert all(r['error'] for r in results)
+        assert all(r['attempts'] == 3 for r in results)
+
+    @pytest.mark.asyncio
+    async def test_anthropic_shape(self):
+        with MockLLMServer() as server:
+            config = make_config(server.base_url, provider='anthropic', model='claude-3')
+            async with AsyncLLMClient(config) as client:
+                result = await client.complete(make_requests(1)[0])
+
+        assert json.loads(result['text'])['messages']
+        assert result['usage']['output_tokens'] > 0
+
+    def test_backoff_is_bounded(self):
+        client = AsyncLLMClient(make_config('http://localhost', backoff_base_seconds=1,
+                                            backoff_max_seconds=4))
+        delays = [client.backoff_delay(attempt) for attempt in range(10) for _ in range(20)]
+        assert all(0 <= d <= 4 for d in delays)
+        assert client.backoff_delay(0, retry_after=2.5) >= 2.5
+
+
+class TestSyntheticGenerator:
+    """End-to-end generation into JSONL"""
+
+    def test_generate_writes_jsonl(self, tmp_path):
+        prompts = [
+            {'prompt_id': 'greeting', 'user': 'Genera un saludo', 'metadata': {'primary_intent': 'GREETING'}},
+            {'prompt_id': 'price', 'user': 'Genera una pregunta de precio'},
+        ]
+        with MockLLMServer() as server:
+            config = make_config(server.base_url, n_conversations_to_generate=5)
+            generator = SyntheticGenerator(config, output_dir=str(tmp_path))
+            result = generator.generate(prompts)
+
+        lines = Path(result['output_file']).read_text(encoding='utf-8').splitlines()
+        records = [json.loads(line) for line in lines]
+        assert len(records) == 5
+        assert result['statistics']['generated'] == 5
+        assert {r['metadata']['prompt_id'] for r in records} == {'greeting', 'price'}
+        assert records[0]['messages'][0]['message_id'].startswith(records[0]['conversation_id'])
+
+    def test_parse_conversation_tolerates_fences(self):
+        text = 'Aquí está:\n```json\n{"messages": [{"author": "user", "text": "hola"}]}\n```'
+        assert SyntheticGenerator.parse_conversation(text)['messages'][0]['text'] == 'hola'
+        assert SyntheticGenerator.parse_conversation('no json') is None
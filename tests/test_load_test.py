@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tests for the mock provider options and the LLM load-test harness
+"""
+
+import json
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.annotation.llm_annotator import LLMAnnotator
+from scripts.llm.load_test import format_reports, run_load_test
+from scripts.llm.mock_server import latency_sampler, varied_payload
+from scripts.synthetic_generator import SyntheticGenerator
+
+
+class TestMockProviderOptions:
+    """Latency distributions and varied payloads"""
+
+    def test_lognormal_sampler_matches_percentiles(self):
+        sample = latency_sampler({'type': 'lognormal', 'p50': 0.8, 'p95': 3.0}, random.Random(0))
+        draws = np.array([sample() for _ in range(20000)])
+        assert np.percentile(draws, 50) == pytest.approx(0.8, rel=0.05)
+        assert np.percentile(draws, 95) == pytest.approx(3.0, rel=0.1)
+
+    def test_sampler_cap_and_unknown_type(self):
+        sample = latency_sampler({'type': 'exponential', 'mean': 1.0, 'max': 0.5}, random.Random(0))
+        assert max(sample() for _ in range(1000)) <= 0.5
+        with pytest.raises(ValueError):
+            latency_sampler({'type': 'pareto'}, random.Random(0))
+
+    def test_varied_payloads_are_valid_for_each_stage(self):
+        rng = random.Random(1)
+        generation = {'messages': [{'role': 'user', 'content': 'Genera una conversación'}]}
+        annotation = {'messages': [{'role': 'user', 'content': 'message_id: m1\nMensaje: "hola"'}]}
+
+        conversations = [varied_payload(generation, rng) for _ in range(20)]
+        assert all(SyntheticGenerator.parse_conversation(json.dumps(c))
+                   for c in conversations)
+        assert len({json.dumps(c) for c in conversations}) == 20
+        assert LLMAnnotator.build_annotation(varied_payload(annotation, rng), 'm1') is not None
+
+
+class TestLoadTestHarness:
+    """End-to-end runs of the stages against the mock provider"""
+
+    def test_generation_run_reports_tail_latency_and_retries(self):
+        report = run_load_test('generation', n_requests=60, concurrency=8,
+                               server={'rate_limit_rate': 0.2, 'seed': 3,
+                                       'latency_distribution': {'type': 'uniform',
+                                                                'low': 0.001, 'high': 0.01}},
+                               config_overrides={'retry_attempts': 20,
+                                                 'backoff_base_seconds': 0.001})
+
+        assert report['completed'] == 60 and report['failed'] == 0
+        assert report['rate_limited'] > 0 and report['retry_amplification'] > 1
+        assert report['latency_p50'] <= report['latency_p95'] <= report['latency_p99']
+        assert report['server_max_in_flight'] <= 8
+        assert 'generation' in format_reports([report])
+
+    def test_annotation_run_with_streaming(self):
+        report = run_load_test('annotation', n_requests=30, concurrency=4,
+                               config_overrides={'streaming': {'enabled': True}})
+
+        assert report['completed'] == 30
+        assert report['throughput_per_second'] > 0 and report['tokens_per_minute'] > 0
+
+    def test_unknown_stage(self):
+        with pytest.raises(ValueError):
+            run_load_test('labeling')
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Tests for the MinHash-LSH near-duplicate index
+"""
+
+import json
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.llm.batch import LocalBatchProvider
+from scripts.llm.mock_server import MockLLMServer
+from scripts.near_duplicates import (MinHasher, NearDuplicateIndex, dedup_corpus,
+                                     optimal_bands)
+from scripts.synthetic_generator import SyntheticGenerator
+
+VOCABULARY = [f"palabra{i}" for i in range(2000)]
+
+
+def random_text(rng, n_words=60):
+    return ' '.join(rng.choice(VOCABULARY) for _ in range(n_words))
+
+
+def edit_words(text, positions):
+    words = text.split()
+    for position in positions:
+        words[position] = 'cambio'
+    return ' '.join(words)
+
+
+def conversation(text):
+    return json.dumps({'messages': [{'author': 'user', 'text': text},
+                                    {'author': 'nadia', 'text': 'Jaja qué lindo 😊'}]})
+
+
+class TestMinHash:
+    """Signature quality and band selection"""
+
+    def test_estimate_tracks_true_jaccard(self):
+        rng = random.Random(0)
+        hasher = MinHasher(num_perm=256)
+        a = random_text(rng, 100)
+        b = edit_words(a, range(0, 100, 10))
+        shingles_a = set(hasher.shingle_hashes(a).tolist())
+        shingles_b = set(hasher.shingle_hashes(b).tolist())
+        true_jaccard = len(shingles_a & shingles_b) / len(shingles_a | shingles_b)
+
+        estimate = (hasher.signature(a) == hasher.signature(b)).mean()
+        assert estimate == pytest.approx(true_jaccard, abs=0.08)
+
+    def test_band_threshold_sits_near_target(self):
+        bands, rows = optimal_bands(0.8, 128)
+        assert bands * rows <= 128
+        assert 0.6 < (1 / bands) ** (1 / rows) < 0.85
+
+
+class TestNearDuplicateIndex:
+    """Lookup, merge, persistence"""
+
+    @pytest.mark.parametrize('merge_every', [1, 1000])
+    def test_near_duplicate_is_found_before_and_after_merge(self, merge_every):
+        rng = random.Random(1)
+        index = NearDuplicateIndex(threshold=0.8, merge_every=merge_every)
+        texts = [random_text(rng) for _ in range(50)]
+        for i, text in enumerate(texts):
+            assert index.check_and_add(f"c{i}", text) is None
+
+        match = index.check_and_add('copy', edit_words(texts[7], [30]))
+        assert match is not None and match[0] == 'c7' and match[1] >= 0.8
+        assert index.check_and_add('fresh', random_text(rng)) is None
+        assert len(index) == 51
+
+    def test_same_document_is_not_its_own_duplicate(self):
+        index = NearDuplicateIndex()
+        text = random_text(random.Random(2))
+        index.check_and_add('c1', text)
+        assert index.check_and_add('c1', text) is None
+        assert len(index) == 1
+
+    def test_persists_across_runs(self, tmp_path):
+        rng = random.Random(3)
+        texts = [random_text(rng) for _ in range(20)]
+        index = NearDuplicateIndex(threshold=0.7, path=str(tmp_path / 'index.npz'))
+        for i, text in enumerate(texts):
+            index.check_and_add(f"c{i}", text)
+        index.save()
+
+        reloaded = NearDuplicateIndex.from_config({'index_path': str(tmp_path / 'index.npz')})
+        assert reloaded.threshold == 0.7 and len(reloaded) == 20
+        assert reloaded.check_and_add('again', texts[4])[0] == 'c4'
+
+        # Matching settings reuse the saved index; different ones are rejected
+        config = {'index_path': str(tmp_path / 'index.npz'), 'threshold': 0.7,
+                  'num_perm': 128, 'merge_every': 5}
+        assert len(NearDuplicateIndex.from_config(config)) == 20
+        assert NearDuplicateIndex.from_config(config).merge_every == 5
+        for key, value in (('threshold', 0.8), ('num_perm', 64), ('shingle_size', 2)):
+            with pytest.raises(ValueError, match=key):
+                NearDuplicateIndex.from_config({**config, key: value})
+
+    def test_dedup_corpus_keeps_first_occurrence(self, tmp_path):
+        rng = random.Random(4)
+        base = random_text(rng)
+        records = [{'conversation_id': 'a', 'messages': [{'text': base}]},
+                   {'conversation_id': 'b', 'messages': [{'text': random_text(rng)}]},
+                   {'conversation_id': 'c', 'messages': [{'text': edit_words(base, [5])}]}]
+        source = tmp_path / 'corpus.jsonl'
+        source.write_text(''.join(json.dumps(r) + '\n' for r in records), encoding='utf-8')
+
+        result = dedup_corpus([source], tmp_path / 'dedup.jsonl', NearDuplicateIndex(),
+                              report_path=tmp_path / 'report.jsonl')
+        assert result == {'kept': 2, 'removed': 1, 'output_file': str(tmp_path / 'dedup.jsonl')}
+        report = json.loads((tmp_path / 'report.jsonl').read_text(encoding='utf-8'))
+        assert report['conversation_id'] == 'c' and report['duplicate_of'] == 'a'
+
+
+class TestGeneratorDeduplication:
+    """SyntheticGenerator rejects or regenerates near-duplicates before writing"""
+
+    def test_duplicates_are_rejected(self, tmp_path):
+        # The mock returns the same conversation every time
+        with MockLLMServer() as server:
+            config = {'provider': 'openai', 'model': 'gpt-4', 'api_base_url': server.base_url,
+                      'n_conversations_to_generate': 5,
+                      'near_duplicates': {'index_path': str(tmp_path / 'index.npz')}}
+            result = SyntheticGenerator(config, output_dir=str(tmp_path)).generate(
+                [{'prompt_id': 'greeting', 'user': 'Genera un saludo'}])
+
+        lines = Path(result['output_file']).read_text(encoding='utf-8').splitlines()
+        assert len(lines) == 1
+        assert result['statistics']['near_duplicates'] == 4
+        assert (tmp_path / 'index.npz').exists()
+
+    def test_duplicates_are_regenerated(self, tmp_path):
+        rng = random.Random(5)
+        shared = random_text(rng)
+
+        def responder(custom_id, body):
+            # First round: identical conversations; regenerations come back different
+            return conversation(random_text(rng) if '-r' in custom_id else shared)
+
+        config = {'mode': 'batch', 'provider': 'openai', 'model': 'gpt-4',
+                  'n_conversations_to_generate': 3,
+                  'batch': {'poll_interval_seconds': 0.01, 'work_dir': str(tmp_path / 'batches')},
+                  'near_duplicates': {'on_duplicate': 'regenerate', 'index_path': None}}
+        generator = SyntheticGenerator(config, output_dir=str(tmp_path))
+        result = generator.generate_batch(
+            [{'prompt_id': 'greeting', 'user': 'Genera un saludo'}],
+            batch_provider=LocalBatchProvider(tmp_path / 'batches', responder))
+
+        records = [json.loads(line) for line in
+                   Path(result['output_file']).read_text(encoding='utf-8').splitlines()]
+        assert result['statistics']['generated'] == 3
+        assert result['statistics']['regenerated'] == 2
+        regenerated = [r for r in records if r['metadata'].get('regeneration')]
+        assert len(regenerated) == 2
+        assert all(r['conversation_id'].endswith('-r1') for r in regenerated)
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+Tests for the streaming pattern analyzer and its frequency sketches
+"""
+
+import io
+import json
+import sys
+from datetime import datetime, timezone
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.pattern_analyzer import PatternAnalyzer
+from scripts.patterns.clusters import ConversationClusterer
+from scripts.patterns.corpus import iter_conversations, iter_json_array, tokenize
+from scripts.patterns.shape_stats import Distribution, ShapeStats
+from scripts.patterns.temporal import SignalDetector, TemporalFeatures, load_temporal_features
+from scripts.patterns.transitions import TransitionStats
+from scripts.utils.sketches import CountMinSketch, SpaceSaving, stable_hashes
+
+WORDS = ['hola', 'precio', 'foto', 'bonita', 'noche', 'trabajo', 'cuánto', 'cuesta',
+         'eres', 'real', 'me', 'gustas', 'adiós', 'amor', 'link', 'pago']
+# Skewed like real text, so the head of the vocabulary is well separated
+WORD_P = 1 / np.arange(1, len(WORDS) + 1) ** 1.5
+WORD_P /= WORD_P.sum()
+
+
+def zipf_stream(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [f"w{int(x)}" for x in rng.zipf(1.3, n)]
+
+
+def make_conversations(n, seed=0):
+    rng = np.random.default_rng(seed)
+    conversations = []
+    for i in range(n):
+        messages = []
+        for turn in range(int(rng.integers(2, 8))):
+            words = rng.choice(WORDS, size=int(rng.integers(1, 8)), p=WORD_P)
+            messages.append({'author': 'user' if turn % 2 == 0 else 'nadia',
+                             'text': ' '.join(words)})
+        conversations.append({'conversation_id': f"c{i}", 'messages': messages})
+    return conversations
+
+
+def timed_conversations(n, seed=0):
+    """Conversations with timestamps, emojis, questions and repeated senders"""
+    rng = np.random.default_rng(seed)
+    conversations = []
+    for i in range(n):
+        t = 1_700_000_000 + int(rng.integers(0, 10 ** 6))
+        messages = []
+        for _ in range(int(rng.integers(1, 12))):
+            t += int(rng.exponential(300))
+            text = ' '.join(rng.choice(WORDS, size=int(rng.integers(0, 6))))
+            text += rng.choice(['', '?', ' 😊', ' 😍🔥'])
+            messages.append({'author': rng.choice(['user', 'nadia']), 'text': text,
+                             'timestamp': datetime.fromtimestamp(t, timezone.utc).isoformat()})
+        conversations.append({'messages': messages})
+    return conversations
+
+
+STAGES = ['ICE_BREAKER', 'RAPPORT_BUILDING', 'DEEP_EMOTION', 'HIGH_INTENT', 'CLOSING']
+
+
+def staged_conversations(n, seed=0):
+    """Conversations whose user messages carry rapport_stage labels"""
+    rng = np.random.default_rng(seed)
+    conversations = []
+    for _ in range(n):
+        t = 1_700_000_000 + int(rng.integers(0, 10 ** 6))
+        stage = int(rng.integers(0, 2))
+        messages = []
+        for turn in range(int(rng.integers(1, 15))):
+            t += int(rng.exponential(600))
+            message = {'author': 'user' if turn % 2 == 0 else 'nadia', 'text': 'hola',
+                       'timestamp': datetime.fromtimestamp(t, timezone.utc).isoformat()}
+            if message['author'] == 'user':
+                if rng.random() < 0.3:
+                    stage = min(stage + 1, len(STAGES) - 1)
+                message['annotations'] = {'rapport_stage': STAGES[stage]}
+            messages.append(message)
+        conversations.append({'messages': messages, 'customer_status': 'PROSPECT'})
+    return conversations
+
+
+class TestSketches:
+    """Count-Min and Space-Saving guarantees, including after merges"""
+
+    def test_stable_hashes_are_64_bit_and_collision_free(self):
+        items = [f"token_{i}" for i in range(200000)]
+        hashes = stable_hashes(items)
+        assert hashes.dtype == np.uint64
+        # 200k keys in 32 bits collide with probability ~99%; in 64 bits practically never
+        assert len(np.unique(hashes)) == len(items)
+        assert (hashes >> np.uint64(32)).any()
+        assert stable_hashes(['hola'])[0] == stable_hashes(['hola'])[0]
+
+    def test_count_min_never_underestimates(self):
+        items = zipf_stream(50000)
+        sketch = CountMinSketch.from_error(epsilon=1e-3, delta=0.01)
+        sketch.update_many(items[:10])
+        sketch.update_many(items[10:])
+        exact = Counter(items)
+
+        estimates = sketch.estimate_many(list(exact))
+        truth = np.array(list(exact.values()))
+        assert (estimates >= truth).all()
+        assert np.mean(estimates - truth <= sketch.error_bound) > 0.99
+
+    def test_count_min_merge_equals_single_pass(self, tmp_path):
+        items = zipf_stream(20000)
+        whole, left, right = (CountMinSketch(width=512, depth=4) for _ in range(3))
+        whole.update_many(items)
+        left.update_many(items[:7000])
+        right.update_many(items[7000:])
+        left.merge(right)
+        assert np.array_equal(whole.table, left.table) and whole.total == left.total
+
+        loaded = CountMinSketch.load(left.save(tmp_path / 'cms.npz'))
+        assert loaded.estimate('w1') == left.estimate('w1')
+        with pytest.raises(ValueError):
+            left.merge(CountMinSketch(width=512, depth=4, seed=2))
+
+    def test_space_saving_finds_heavy_hitters_across_shards(self):
+        items = zipf_stream(60000, seed=3)
+        exact = Counter(items)
+        shards = [SpaceSaving(capacity=50, buffer_size=20) for _ in range(3)]
+        for i, item in enumerate(items):
+            shards[i % 3].update(item)
+        merged = shards[0].merge(shards[1]).merge(shards[2])
+
+        assert merged.total == len(items)
+        # Every item above N/k is reported, and counts bracket the true frequency
+        reported = {item for item, _, _ in merged.top()}
+        assert {item for item, count in exact.items() if count > len(items) / 50} <= reported
+        for item, count, error in merged.top():
+            assert count - error <= exact[item] <= count
+        assert [item for item, _, _ in merged.top(3)] == [item for item, _ in exact.most_common(3)]
+
+
+class TestCorpusReader:
+    """Streaming decoding of anonymized shards"""
+
+    def test_json_array_is_decoded_in_small_chunks(self):
+        conversations = make_conversations(30)
+        text = json.dumps(conversations, indent=2, ensure_ascii=False)
+        assert list(iter_json_array(io.StringIO(text), chunk_chars=17)) == conversations
+        with pytest.raises(ValueError):
+            list(iter_json_array(io.StringIO(text[:-40]), chunk_chars=17))
+
+    def test_shard_formats(self, tmp_path):
+        conversations = make_conversations(5)
+        (tmp_path / 'a.json').write_text(json.dumps(conversations), encoding='utf-8')
+        (tmp_path / 'b.jsonl').write_text('\n'.join(json.dumps(c) for c in conversations),
+                                          encoding='utf-8')
+        (tmp_path / 'c.json').write_text(json.dumps(conversations[0]), encoding='utf-8')
+
+        assert list(iter_conversations(tmp_path / 'a.json')) == conversations
+        assert list(iter_conversations(tmp_path / 'b.jsonl')) == conversations
+        assert list(iter_conversations(tmp_path / 'c.json')) == conversations[:1]
+
+    def test_tokenize_keeps_pii_markers(self):
+        assert tokenize('Escríbeme a [EMAIL_REMOVED] ¡Hola!') == \
+            ['escríbeme', 'a', '[EMAIL_REMOVED]', 'hola']
+
+
+class TestPatternAnalyzer:
+    """End-to-end pass over sharded corpora"""
+
+    def write_shards(self, directory, conversations, n_shards):
+        directory.mkdir()
+        for shard in range(n_shards):
+            with open(directory / f"shard_{shard}.json", 'w', encoding='utf-8') as f:
+                json.dump(conversations[shard::n_shards], f, ensure_ascii=False)
+        return directory
+
+    def test_parallel_shards_match_a_single_pass(self, tmp_path):
+        conversations = make_conversations(300)
+        corpus = self.write_shards(tmp_path / 'corpus', conversations, 3)
+        config = {'vocabulary_size_limit': 8, 'top_k_ngrams': 5,
+                  'count_min': {'epsilon': 0.01, 'delta': 0.05}}
+
+        parallel = PatternAnalyzer({**config, 'workers': 3},
+                                   output_dir=tmp_path / 'parallel').analyze([corpus])
+        serial = PatternAnalyzer(config, output_dir=tmp_path / 'serial').analyze(
+            [corpus / f"shard_{i}.json" for i in range(3)])
+
+        assert parallel['statistics'] == serial['statistics']
+        assert parallel['statistics']['shards'] == 3
+        vocabulary = json.loads(Path(parallel['files']['vocabulary']).read_text(encoding='utf-8'))
+        exact = Counter(token for c in conversations if len(c['messages']) >= 3
+                        for m in c['messages'] for token in tokenize(m['text']))
+        assert vocabulary['tokens'] == sum(exact.values())
+        assert len(vocabulary['items']) == 8
+        assert [e['item'] for e in vocabulary['items'][:3]] == \
+            [item for item, _ in exact.most_common(3)]
+        for name in ('ngrams', 'ngram_sketch', 'shape_stats', 'intent_distribution',
+                     'transition_matrices', 'temporal_features', 'clusters', 'summary'):
+            assert Path(parallel['files'][name]).exists()
+
+        sketch = CountMinSketch.load(parallel['files']['ngram_sketch'])
+        assert sketch.estimate('hola') >= exact['hola']
+
+    def test_conversation_length_limits(self, tmp_path):
+        conversations = make_conversations(100, seed=5)
+        analyzer = PatternAnalyzer({'min_conversation_length': 3, 'max_conversation_length': 5},
+                                   output_dir=tmp_path)
+        _, stats = analyzer.analyze_conversations(conversations)
+        lengths = [len(c['messages']) for c in conversations]
+
+        assert stats['skipped_short'] == sum(n < 3 for n in lengths)
+        assert stats['skipped_long'] == sum(n > 5 for n in lengths)
+        assert stats['conversations_analyzed'] == sum(3 <= n <= 5 for n in lengths)
+
+
+class TestShapeStats:
+    """Vectorized shape statistics agree with a plain per-message loop"""
+
+    def test_matches_reference_loop(self):
+        conversations = timed_conversations(400)
+        stats = ShapeStats(max_conversation_length=20, block_size=64)
+        for conversation in conversations:
+            stats.add(conversation)
+        stats.summary()  # flushes the last partial block
+        distributions = {name: d.to_dict() for name, d in stats.distributions.items()}
+
+        turns, chars, questions, alternation, gaps = [], [], [], [], []
+        for conversation in conversations:
+            messages = conversation['messages']
+            authors = [m['author'] for m in messages]
+            turns.append(len(messages))
+            chars += [len(m['text']) for m in messages if m['author'] == 'user']
+            user = [m for m in messages if m['author'] == 'user']
+            if user:
+                questions.append(sum('?' in m['text'] for m in user) / len(user))
+            if len(messages) > 1:
+                alternation.append(sum(a != b for a, b in zip(authors, authors[1:])) /
+                                   (len(messages) - 1))
+            for previous, current in zip(messages, messages[1:]):
+                if current['author'] == 'nadia' and previous['author'] == 'user':
+                    gaps.append((datetime.fromisoformat(current['timestamp']) -
+                                 datetime.fromisoformat(previous['timestamp'])).total_seconds())
+
+        assert distributions['turns']['n'] == 400
+        assert distributions['turns']['mean'] == pytest.approx(np.mean(turns), abs=1e-4)
+        assert distributions['user_message_chars']['mean'] == pytest.approx(np.mean(chars), abs=1e-4)
+        assert distributions['user_question_rate']['mean'] == \
+            pytest.approx(np.mean(questions), abs=1e-4)
+        assert distributions['sender_alternation_rate']['mean'] == \
+            pytest.approx(np.mean(alternation), abs=1e-4)
+        assert distributions['nadia_response_gap_seconds']['n'] == len(gaps)
+        assert distributions['nadia_response_gap_seconds']['max'] == max(gaps)
+        assert sum(distributions['turns']['counts']) == 400
+
+    def test_shards_merge_into_the_same_artifact(self, tmp_path):
+        conversations = timed_conversations(200, seed=2)
+        whole, left, right = ShapeStats(), ShapeStats(block_size=7), ShapeStats(block_size=1000)
+        for i, conversation in enumerate(conversations):
+            whole.add(conversation)
+            (left if i % 2 else right).add(conversation)
+        left.merge(right)
+
+        saved = [json.loads(Path(s.save(tmp_path / name)['shape_stats']).read_text())
+                 for s, name in ((whole, 'whole'), (left, 'merged'))]
+        for name, distribution in saved[0]['distributions'].items():
+            assert distribution['counts'] == saved[1]['distributions'][name]['counts'], name
+
+    def test_distribution_quantiles(self):
+        distribution = Distribution(np.arange(0, 101, 10))
+        distribution.add(np.arange(100))
+        assert distribution.quantile(0.5) == pytest.approx(50, abs=1)
+        assert distribution.quantile(1.0) == pytest.approx(99)
+        with pytest.raises(ValueError):
+            distribution.merge(Distribution([0, 1]))
+
+
+class TestTransitionStats:
+    """Transition counts and dwell times match a per-conversation loop"""
+
+    def stats(self, block_size=5000):
+        return TransitionStats({'rapport_stage': STAGES,
+                                'customer_status': ['PROSPECT', 'CUSTOMER']},
+                               block_size=block_size)
+
+    def test_matches_reference_loop(self):
+        conversations = staged_conversations(300)
+        stats = self.stats(block_size=16)
+        for conversation in conversations:
+            stats.add(conversation)
+
+        counts = np.zeros((5, 5), dtype=int)
+        dwell = {stage: [] for stage in STAGES}
+        for conversation in conversations:
+            labeled = [(m['annotations']['rapport_stage'], m['timestamp'])
+                       for m in conversation['messages'] if 'annotations' in m]
+            for (a, _), (b, _) in zip(labeled, labeled[1:]):
+                counts[STAGES.index(a), STAGES.index(b)] += 1
+            run_start = 0
+            for i in range(1, len(labeled)):
+                if labeled[i][0] != labeled[i - 1][0]:
+                    dwell[labeled[run_start][0]].append(i - run_start)
+                    run_start = i
+
+        matrix = stats.matrix('rapport_stage')
+        assert (stats.counts['rapport_stage'].transitions == counts).all()
+        assert np.allclose(matrix[counts.sum(axis=1) > 0].sum(axis=1), 1)
+        for i, stage in enumerate(STAGES):
+            distribution = stats.counts['rapport_stage'].dwell_messages[i].to_dict()
+            assert distribution['n'] == len(dwell[stage])
+            if dwell[stage]:
+                assert distribution['mean'] == pytest.approx(np.mean(dwell[stage]), abs=1e-4)
+        # Conversation-level label only: one initial state, no transitions
+        summary = stats.summary()
+        assert summary['transitions']['customer_status'] == 0
+        assert stats.counts['customer_status'].initial[0] == 300
+
+    def test_shards_merge_into_the_same_artifact(self, tmp_path):
+        conversations = staged_conversations(200, seed=4)
+        whole, left, right = self.stats(), self.stats(block_size=3), self.stats(block_size=50)
+        for i, conversation in enumerate(conversations):
+            whole.add(conversation)
+            (left if i % 2 else right).add(conversation)
+        left.merge(right)
+
+        saved = [json.loads(Path(s.save(tmp_path / name)['transition_matrices']).read_text())
+                 for s, name in ((whole, 'whole'), (left, 'merged'))]
+        assert saved[0] == saved[1]
+        rapport = saved[0]['dimensions']['rapport_stage']
+        assert rapport['dwell_seconds']['ICE_BREAKER']['n'] > 0
+        assert sum(rapport['censored_runs']) == sum(rapport['final_counts'])
+
+
+ARCHETYPES = {
+    'PROFILE_1_DIRECTO': ['precio', 'link', 'cuanto', 'cuesta', 'pago', 'fanvue'],
+    'PROFILE_2_HESITANTE': ['real', 'seguro', 'dudas', 'confiar', 'pensar', 'quizas'],
+    'PROFILE_3_DECEPCIONADO': ['aburrido', 'robot', 'estafa', 'mismo', 'decepcion', 'falsa'],
+}
+
+
+def archetype_conversations(n, seed=0):
+    rng = np.random.default_rng(seed)
+    profiles = list(ARCHETYPES)
+    conversations = []
+    for i in range(n):
+        profile = profiles[i % 3]
+        messages = [{'author': 'user' if turn % 2 == 0 else 'nadia',
+                     'text': ' '.join(rng.choice(ARCHETYPES[profile] + ['hola', 'amor'], size=5))}
+                    for turn in range(4)]
+        conversations.append({'conversation_id': f"c{i}", 'profile_id': profile,
+                              'messages': messages})
+    return conversations
+
+
+class TestClustering:
+    """Out-of-core clustering stage"""
+
+    def test_recovers_archetypes_from_streamed_batches(self):
+        conversations = archetype_conversations(600)
+        clusterer = ConversationClusterer(n_clusters=3, n_features=2 ** 12, batch_size=64,
+                                          n_representatives=4,
+                                          profiles=list(ARCHETYPES))
+        clusterer.fit(conversations)
+        clusterer.assign((c['conversation_id'], c) for c in conversations)
+        clusters = clusterer.clusters()
+
+        assert sum(c['size'] for c in clusters) == 600
+        profile_of = {c['conversation_id']: c['profile_id'] for c in conversations}
+        for cluster in clusters:
+            # Each cluster is (almost) a single archetype
+            assert max(cluster['profile_counts'].values()) >= 0.95 * cluster['size']
+            dominant = max(cluster['profile_counts'], key=cluster['profile_counts'].get)
+            distances = [r['distance'] for r in cluster['representatives']]
+            assert len(distances) == 4 and distances == sorted(distances)
+            assert all(profile_of[r['conversation_id']] == dominant
+                       for r in cluster['representatives'])
+
+    def test_too_few_conversations_skips_clustering(self, tmp_path):
+        clusterer = ConversationClusterer(n_clusters=5, n_features=2 ** 10)
+        clusterer.fit(archetype_conversations(3))
+        assert not clusterer.fitted
+        assert clusterer.save(tmp_path) == {}
+
+
+def at(day, hour, minute=0):
+    return datetime(2024, 3, day, hour, minute, tzinfo=timezone.utc).isoformat()
+
+
+class TestTemporalFeatures:
+    """Per-conversation gaps, sessions, resumptions and CTA timing"""
+
+    def returning_user(self):
+        return {'conversation_id': 'resumed', 'messages': [
+            {'author': 'user', 'text': 'Hola', 'timestamp': at(1, 10)},
+            {'author': 'nadia', 'text': 'Hola amor, te dejo el link de mi Fanvue',
+             'timestamp': at(1, 10, 2)},
+            {'author': 'user', 'text': 'Tal vez después', 'timestamp': at(1, 10, 5)},
+            {'author': 'user', 'text': 'Hey', 'timestamp': at(1, 12)},
+            {'author': 'nadia', 'text': 'Hey! 😊'},
+            {'author': 'user', 'text': 'Hola otra vez, no tengo dinero ahora',
+             'timestamp': at(9, 20)},
+        ]}
+
+    def test_features_of_a_returning_user(self):
+        features = TemporalFeatures(SignalDetector.from_taxonomy(), session_gap_minutes=30,
+                                    resumption_gap_hours=72, block_size=2)
+        features.add(self.returning_user())
+        features.add({'conversation_id': 'untimed',
+                      'messages': [{'author': 'user', 'text': 'hola'}]})
+        features.add({'messages': []})
+        table = features.table()
+
+        row = table.loc['resumed']
+        assert row['messages'] == 6 and row['timestamped_messages'] == 5
+        assert row['sessions'] == 3
+        assert row['resumptions'] == 1
+        assert row['days_active'] == 2
+        assert row['max_gap_hours'] == pytest.approx((8 * 24 + 8))
+        assert row['cta_count'] == 1 and row['soft_rejections'] == 2
+        assert row['hours_since_last_cta'] == pytest.approx(8 * 24 + 10 - 2 / 60, abs=1e-3)
+        assert row['days_active_since_last_cta'] == 2
+        assert row['user_messages_after_last_cta'] == 3
+        untimed = table.loc['untimed']
+        assert untimed['sessions'] == 0 and np.isnan(untimed['duration_hours'])
+        assert untimed['days_active_since_last_cta'] == -1
+        assert features.stats == {'conversations': 3, 'without_id': 1}
+
+    def test_shards_merge_and_round_trip(self, tmp_path):
+        conversations = [{**c, 'conversation_id': f"c{i}"}
+                         for i, c in enumerate(timed_conversations(60, seed=6))]
+        whole, left, right = TemporalFeatures(), TemporalFeatures(block_size=4), TemporalFeatures()
+        for i, conversation in enumerate(conversations):
+            whole.add(conversation)
+            (left if i < 30 else right).add(conversation)
+        left.merge(right)
+
+        pd_testing = pytest.importorskip('pandas.testing')
+        pd_testing.assert_frame_equal(whole.table(), left.table())
+        loaded = load_temporal_features(left.save(tmp_path)['temporal_features'])
+        assert list(loaded.index) == [c['conversation_id'] for c in conversations]
+        assert (loaded['first_message_at'].notna() ==
+                (whole.table()['timestamped_messages'] > 0)).all()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Tests for template compilation, BM25 few-shot retrieval and skeleton planning in PromptGenerator
+"""
+
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.patterns.skeletons import SkeletonSampler
+from scripts.prompt_generator import CompiledTemplate, ExamplePool, PromptGenerator, load_template
+from scripts.utils.bm25 import BM25Index
+
+INTENTS = ['GREETING', 'TRANSACTIONAL_INQUIRY', 'HESITATION_OR_OBJECTION', 'COMPLIMENT']
+TONES = ['FRIENDLY', 'SKEPTICAL', 'ENGAGED']
+STAGES = ['ICE_BREAKER', 'RAPPORT_BUILDING', 'HIGH_INTENT']
+TEXTS = {'GREETING': 'hola que tal', 'TRANSACTIONAL_INQUIRY': 'cuanto cuesta tu contenido',
+         'HESITATION_OR_OBJECTION': 'no se si vale la pena', 'COMPLIMENT': 'eres preciosa'}
+
+
+def labeled_pool(n, seed=0):
+    rng = np.random.default_rng(seed)
+    records = []
+    for i in range(n):
+        intent = INTENTS[int(rng.integers(len(INTENTS)))]
+        records.append({'conversation_id': f"c{i}", 'profile_id': 'PROFILE_2_HESITANTE',
+                        'messages': [
+                            {'author': 'user', 'text': f"{TEXTS[intent]} {i}",
+                             'annotations': {'primary_intent': intent,
+                                             'message_tone': TONES[int(rng.integers(3))],
+                                             'rapport_stage': STAGES[int(rng.integers(3))]}},
+                            {'author': 'nadia', 'text': 'jeje 😊'}]})
+    return records
+
+
+class TestTemplates:
+    """Compiled templates"""
+
+    def test_fields_and_json_braces(self):
+        template = CompiledTemplate('{"messages": [{"author": "user"}]} -> {primary_intent} x{n}')
+        assert template.fields == {'primary_intent', 'n'}
+        assert template.render({'primary_intent': 'GREETING', 'n': 3}) == \
+            '{"messages": [{"author": "user"}]} -> GREETING x3'
+        with pytest.raises(KeyError):
+            template.render({'primary_intent': 'GREETING'})
+
+    def test_repository_template_sections(self):
+        sections = load_template('prompts/conversation_generation_prompt.md')
+        assert set(sections) == {'system', 'user'}
+        assert {'primary_intent', 'message_tone', 'rapport_stage', 'examples'} <= \
+            sections['user'].fields
+        assert load_template('prompts/conversation_generation_prompt.md') is sections
+
+
+class TestExampleRetrieval:
+    """BM25 over labels and text"""
+
+    def test_bm25_prefers_rare_matching_terms(self):
+        index = BM25Index([['a', 'b'], ['a', 'c'], ['a', 'b', 'c'], ['d']])
+        ranked = index.top({'c': 1.0, 'a': 1.0}, k=2)
+        assert [doc for doc, _ in ranked] == [1, 2]
+        assert index.top({'zzz': 1.0}, k=3) == []
+
+    def test_ties_at_the_cutoff_keep_the_oldest_documents(self):
+        scores = np.ones(1000)
+        scores[500] = 2.0
+        ranked = BM25Index.top_scores(scores, k=3)
+        assert ranked == [(500, 2.0), (0, 1.0), (1, 1.0)]
+
+    def test_selects_examples_from_the_target_cell(self):
+        pool = ExamplePool(list(ExamplePool.examples_from_records(labeled_pool(3000))))
+        assert len(pool) == 3000
+        weights = {'primary_intent': 3.0, 'rapport_stage': 2.0, 'message_tone': 1.5}
+        cell = {'primary_intent': 'HESITATION_OR_OBJECTION', 'message_tone': 'SKEPTICAL',
+                'rapport_stage': 'HIGH_INTENT'}
+
+        start = time.perf_counter()
+        for _ in range(50):
+            selected = pool.select(cell, 3, weights)
+        per_query = (time.perf_counter() - start) / 50
+        assert per_query < 0.05
+        for i in selected:
+            assert pool.examples[i]['labels'].items() >= cell.items()
+            assert pool.examples[i]['labels']['profile_id'] == 'PROFILE_2_HESITANTE'
+
+        # A text query only re-ranks: it cannot pull in an example from another cell
+        other = next(e for e in pool.examples if e['labels']['primary_intent'] != 'GREETING')
+        greeting = next(e for e in pool.examples if e['labels']['primary_intent'] == 'GREETING')
+        for example in (other, greeting):
+            number = example['text'].split()[-1]
+            hit = pool.select({'primary_intent': 'GREETING'}, 1, weights, query_text=number)
+            assert pool.examples[hit[0]]['labels']['primary_intent'] == 'GREETING'
+        assert pool.examples[hit[0]] is greeting
+
+
+class TestPromptGenerator:
+    """Lazy batched prompt stream"""
+
+    def generator(self, tmp_path, n_pool=200, batch_size=4):
+        pool_dir = tmp_path / 'labeled'
+        pool_dir.mkdir()
+        with open(pool_dir / 'pool.jsonl', 'w', encoding='utf-8') as f:
+            for record in labeled_pool(n_pool):
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        config = {'prompt_generation': {'example_pool': [str(pool_dir)],
+                                        'grid_dimensions': ['primary_intent', 'message_tone']},
+                  'synthetic_generation': {'batch_size': batch_size}}
+        return PromptGenerator(config, patterns={'summaries': {'shape': {'means': {'turns': 6.4}}}})
+
+    def test_batches_cover_the_grid(self, tmp_path):
+        generator = self.generator(tmp_path)
+        batches = generator.iter_batches()
+        first = next(batches)
+        assert len(first) == 4 and generator.stats['prompts'] == 4
+
+        prompts = first + [prompt for batch in batches for prompt in batch]
+        assert len(prompts) == 11 * 5
+        assert len({p['prompt_id'] for p in prompts}) == len(prompts)
+        prompt = next(p for p in prompts if p['metadata']['primary_intent'] == 'COMPLIMENT'
+                      and p['metadata']['message_tone'] == 'FRIENDLY')
+        assert 'mensajes' in prompt['user'] and '6 mensajes' in prompt['user']
+        assert 'eres preciosa' in prompt['user']
+        assert len(prompt['metadata']['example_ids']) == 3
+        assert prompt['metadata']['safety_level'] == 'LEVEL_0_SAFE'
+        assert prompt['system'].startswith('# Generador')
+
+    def test_missing_pool_still_produces_prompts(self, tmp_path):
+        config = {'prompt_generation': {'example_pool': [str(tmp_path / 'missing')],
+                                        'grid_dimensions': ['rapport_stage']}}
+        prompts = PromptGenerator(config).generate()
+        assert len(prompts) == 5
+        assert all('(sin ejemplos disponibles)' in p['user'] for p in prompts)
+
+
+class TestSkeletons:
+    """Markov skeleton sampling conditioned on the GUIDELINES FSMs"""
+
+    def test_bulk_samples_are_always_valid(self):
+        sampler = SkeletonSampler.from_config({'seed': 7})
+        start = time.perf_counter()
+        codes = sampler.sample(20000, 12)
+        assert time.perf_counter() - start < 2.0
+        assert codes['rapport_stage'].shape == (20000, 12)
+        assert sampler.valid(codes).all()
+        # Every skeleton starts at ICE_BREAKER and the chains actually move
+        assert (codes['rapport_stage'][:, 0] == 0).all()
+        assert len(np.unique(codes['rapport_stage'])) == 5
+        assert len(np.unique(codes['customer_status'])) == 5
+        # LEVEL_3_INAPPROPRIATE has no weight by default
+        assert codes['safety_level'].max() == 2
+
+        # "No me gustas" is LEVEL_0_SAFE with NEGATIVE_FEEDBACK (GUIDELINES)
+        intents = sampler.states['primary_intent']
+        negative = codes['primary_intent'] == intents.index('NEGATIVE_FEEDBACK')
+        assert (codes['safety_level'][negative] == 0).any()
+        # Forbidden combinations are never planned
+        transactional = codes['primary_intent'] == intents.index('TRANSACTIONAL_INQUIRY')
+        assert transactional.any()
+        deep_emotion = sampler.states['rapport_stage'].index('DEEP_EMOTION')
+        assert not (codes['rapport_stage'][transactional] == deep_emotion).any()
+
+        broken = {dimension: array.copy() for dimension, array in codes.items()}
+        broken['rapport_stage'][0, 1:] = 3  # ICE_BREAKER → HIGH_INTENT
+        assert not sampler.valid(broken)[0] and sampler.valid(broken)[1:].all()
+
+    def test_learned_counts_respect_the_fsm(self):
+        states = ['ICE_BREAKER', 'RAPPORT_BUILDING', 'DEEP_EMOTION', 'HIGH_INTENT', 'CLOSING']
+        counts = np.zeros((5, 5), dtype=int)
+        counts[0, 3] = 10000  # observed but invalid: must never be sampled
+        counts[0, 1] = 10000
+        learned = {'dimensions': {'rapport_stage': {
+            'states': states, 'transition_counts': counts.tolist(),
+            'initial_counts': [0, 1000, 0, 0, 0]}}}
+        sampler = SkeletonSampler.from_config({'prior_weight': 1.0}, learned=learned)
+
+        matrix = sampler.matrices['rapport_stage']
+        assert matrix[0, 3] == 0 and matrix[0, 1] > 0.99
+        assert np.allclose(matrix.sum(axis=1), 1)
+        codes = sampler.sample(5000, 6)
+        assert sampler.valid(codes).all()
+        assert (codes['rapport_stage'][:, 0] == 1).mean() > 0.99
+
+    def test_generator_plans_prompts_from_skeletons(self, tmp_path):
+        config = {'prompt_generation': {'skeletons': {'enabled': True, 'count': 25,
+                                                      'user_turns': 4}}}
+        generator = PromptGenerator(config, pool=ExamplePool([]))
+        prompts = generator.generate()
+
+        assert len(prompts) == 25
+        assert len({p['prompt_id'] for p in prompts}) == 25
+        prompt = prompts[0]
+        skeleton = prompt['metadata']['skeleton']
+        assert len(skeleton) == 4 and skeleton[0]['rapport_stage'] == 'ICE_BREAKER'
+        assert prompt['metadata']['rapport_stage'] == skeleton[-1]['rapport_stage']
+        assert 'Genera una conversación de 8 mensajes' in prompt['user']
+        assert f"4. rapport_stage={skeleton[3]['rapport_stage']}" in prompt['user']
+        json.dumps(prompts)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Tests for the latency-aware provider router and its circuit breakers
+Each provider is a local mock server with a scripted latency/failure profile
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.llm.budget import BudgetExceeded
+from scripts.llm.mock_server import MockLLMServer, scripted_profile
+from scripts.llm.router import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, ProviderRouter
+from scripts.synthetic_generator import SyntheticGenerator
+from tests.conftest import make_config, make_requests
+
+
+def routed_config(*servers, **routing):
+    routes = [{'name': name, 'provider': provider, 'model': model, 'api_base_url': server.base_url}
+              for name, provider, model, server in servers]
+    return make_config(max_concurrency=8, requests_per_minute=60000, backoff_max_seconds=0.02,
+                       routing={'enabled': True, 'routes': routes, 'seed': 0, **routing})
+
+
+async def run_all(router, n):
+    results = []
+    async with router:
+        async for result in router.complete_many(make_requests(n)):
+            results.append(result)
+    return results
+
+
+class TestCircuitBreaker:
+    """Closed -> open -> half-open -> closed"""
+
+    def test_state_machine(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=10, clock=lambda: now[0])
+        breaker.record_failure()
+        assert breaker.state == CLOSED
+        breaker.record_failure()
+        assert breaker.state == OPEN and not breaker.available()
+        assert breaker.reopens_in() == 10
+
+        now[0] = 10
+        assert breaker.available() and breaker.state == HALF_OPEN
+        breaker.acquire()
+        # Only one probe at a time while half-open
+        assert not breaker.available()
+        breaker.record_failure()
+        assert breaker.state == OPEN and breaker.times_opened == 2
+
+        now[0] = 20
+        assert breaker.available()
+        breaker.acquire()
+        # Releasing the probe leaves the circuit half-open for the next one
+        breaker.release()
+        assert breaker.state == HALF_OPEN and breaker.available()
+        breaker.acquire()
+        breaker.record_success()
+        assert breaker.state == CLOSED and breaker.available()
+
+
+class TestProviderRouter:
+    """Weighted routing, failover and circuit breaking against mock providers"""
+
+    @pytest.mark.asyncio
+    async def test_traffic_shifts_to_the_faster_provider(self):
+        with MockLLMServer(latency_seconds=0.002) as fast, \
+                MockLLMServer(profile=scripted_profile([(1000, 0.15, None)])) as slow:
+            router = ProviderRouter(routed_config(('fast', 'openai', 'gpt-4', fast),
+                                                  ('slow', 'anthropic', 'claude-3-haiku', slow)))
+            results = await run_all(router, 200)
+            stats = router.get_stats()
+
+        assert all(not r.get('error') for r in results)
+        routes = stats['routes']
+        assert routes['fast']['routed'] > 3 * routes['slow']['routed']
+        assert routes['slow']['latency_p50'] > routes['fast']['latency_p95']
+
+    @pytest.mark.asyncio
+    async def test_outage_fails_over_and_opens_the_circuit(self):
+        with MockLLMServer() as healthy, MockLLMServer(error_rate=1.0) as down:
+            router = ProviderRouter(routed_config(('healthy', 'openai', 'gpt-4', healthy),
+                                                  ('down', 'openai', 'gpt-4o', down),
+                                                  failure_threshold=3, cooldown_seconds=60))
+            async with router:
+                results = [r async for r in router.complete_many(make_requests(40))]
+                hits_while_closing = down.stats['requests']
+                results += [r async for r in router.complete_many(make_requests(40))]
+            stats = router.get_stats()
+
+        assert [r.get('error') for r in results] == [None] * 80
+        assert {r['route'] for r in results} == {'healthy'}
+        assert stats['failovers'] >= 3
+        assert stats['routes']['down']['circuit'] == OPEN
+        # Once open, the broken provider receives no more traffic
+        assert down.stats['requests'] == hits_while_closing
+
+    @pytest.mark.asyncio
+    async def test_half_open_probe_restores_a_recovered_provider(self):
+        now = [0.0]
+        with MockLLMServer() as primary, \
+                MockLLMServer(profile=scripted_profile([(2, 0.0, 'error'), (1, 0.0, 'ok')])) as flaky:
+            config = routed_config(('primary', 'openai', 'gpt-4', primary),
+                                   ('flaky', 'openai', 'gpt-4o', flaky),
+                                   failure_threshold=1, cooldown_seconds=5,
+                                   retry_attempts_per_route=0)
+            router = ProviderRouter(config, clock=lambda: now[0])
+            async with router:
+                flaky_route = router.routes[1]
+                while flaky_route.breaker.state != OPEN:
+                    await router.complete(make_requests(1)[0])
+                while flaky_route.breaker.state != CLOSED:
+                    # Each failed probe reopens the circuit for another cooldown
+                    now[0] += 5
+                    await router.complete(make_requests(1)[0])
+
+        assert flaky_route.breaker.times_opened >= 1
+        assert flaky.stats['succeeded'] >= 1
+
+    @pytest.mark.asyncio
+    async def test_cache_hits_and_budget_stops_do_not_close_the_circuit(self):
+        now = [0.0]
+        with MockLLMServer() as server:
+            router = ProviderRouter(routed_config(('only', 'openai', 'gpt-4', server),
+                                                  cooldown_seconds=5), clock=lambda: now[0])
+            route = router.routes[0]
+            route.breaker.open()
+            now[0] = 5
+
+            async def cached(request, consumer=None):
+                return {'custom_id': request['custom_id'], 'text': '{}', 'cached': True}
+
+            async def over_budget(request, consumer=None):
+                raise BudgetExceeded("sin presupuesto")
+
+            route.client._execute = cached
+            assert (await router._execute(make_requests(1)[0]))['cached']
+            assert route.breaker.state == HALF_OPEN and route.breaker.available()
+            assert len(route.outcomes) == 0
+
+            route.client._execute = over_budget
+            with pytest.raises(BudgetExceeded):
+                await router._execute(make_requests(1)[0])
+            assert route.breaker.state == HALF_OPEN and route.breaker.available()
+
+    @pytest.mark.asyncio
+    async def test_total_outage_returns_errors(self):
+        with MockLLMServer(error_rate=1.0) as a, MockLLMServer(error_rate=1.0) as b:
+            router = ProviderRouter(routed_config(('a', 'openai', 'gpt-4', a),
+                                                  ('b', 'openai', 'gpt-4o', b),
+                                                  cooldown_seconds=0.05))
+            results = await run_all(router, 4)
+        assert all('sin ruta disponible' in r['error'] for r in results)
+
+    def test_generator_spreads_over_providers(self, tmp_path):
+        with MockLLMServer() as openai, MockLLMServer() as anthropic:
+            config = routed_config(('openai', 'openai', 'gpt-4', openai),
+                                   ('anthropic', 'anthropic', 'claude-3-haiku', anthropic))
+            config['n_conversations_to_generate'] = 30
+            result = SyntheticGenerator(config, output_dir=str(tmp_path)).generate(
+                [{'prompt_id': 'greeting', 'user': 'Genera un saludo'}])
+
+        records = [json.loads(line) for line in
+                   Path(result['output_file']).read_text(encoding='utf-8').splitlines()]
+        assert len(records) == 30
+        assert {r['metadata']['provider'] for r in records} == {'openai', 'anthropic'}
+        assert result['budget']['requests'] == 30
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Tests for the persistent LLM response cache
+"""
+
+import json
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.annotation.llm_annotator import LLMAnnotator
+from scripts.llm.cache import ResponseCache, make_cache_key
+from scripts.llm.client import AsyncLLMClient
+from scripts.llm.mock_server import MockLLMServer
+
+ANNOTATION_PAYLOAD = {
+    'annotations': {
+        'primary_intent': 'GREETING',
+        'message_tone': 'FRIENDLY',
+        'safety_level': 'LEVEL_0_SAFE',
+        'confidence': 0.95,
+        'reasoning': 'Saludo simple',
+    },
+    'ideal_nadia_response': {'text': '¡Hola! 😊 ¿Cómo va tu día?', 'strategy': 'Abrir conversación'},
+}
+
+
+def request(content, temperature=0.0, seed=None):
+    return {'messages': [{'role': 'user', 'content': content}],
+            'temperature': temperature, 'seed': seed}
+
+
+class TestCacheKey:
+    """Key covers provider, model, generation parameters and normalized prompt"""
+
+    def test_whitespace_is_normalized(self):
+        a = make_cache_key('openai', 'gpt-4', request('Hola   mundo\n'))
+        b = make_cache_key('openai', 'gpt-4', request(' Hola mundo'))
+        assert a == b
+
+    @pytest.mark.parametrize('other', [
+        ('anthropic', 'gpt-4', request('Hola')),
+        ('openai', 'gpt-3.5', request('Hola')),
+        ('openai', 'gpt-4', request('Hola', temperature=0.7)),
+        ('openai', 'gpt-4', request('Hola', seed=3)),
+        ('openai', 'gpt-4', dict(request('Hola'), max_tokens=16)),
+        ('openai', 'gpt-4', request('Adiós')),
+    ])
+    def test_each_component_changes_key(self, other):
+        assert make_cache_key('openai', 'gpt-4', request('Hola')) != make_cache_key(*other)
+
+
+class TestResponseCache:
+    """Storage, eviction and modes"""
+
+    def test_roundtrip_and_stats(self, tmp_path):
+        cache = ResponseCache(tmp_path / 'cache.sqlite')
+        cache.put('k1', {'text': 'hola'})
+        assert cache.get('k1') == {'text': 'hola'}
+        assert cache.get('missing') is None
+        stats = cache.get_stats()
+        assert stats['hits'] == 1 and stats['misses'] == 1 and stats['entries'] == 1
+        assert stats['hit_rate'] == 0.5
+
+    def test_persists_across_instances(self, tmp_path):
+        ResponseCache(tmp_path / 'cache.sqlite').put('k1', {'text': 'hola'})
+        assert ResponseCache(tmp_path / 'cache.sqlite').get('k1') == {'text': 'hola'}
+
+    def test_ttl_expiry(self, tmp_path):
+        cache = ResponseCache(tmp_path / 'cache.sqlite', ttl_seconds=0.05)
+        cache.put('k1', {'text': 'hola'})
+        time.sleep(0.1)
+        assert cache.get('k1') is None
+        assert cache.evict() == 1
+
+    def test_size_eviction_is_lru(self, tmp_path):
+        cache = ResponseCache(tmp_path / 'cache.sqlite', max_entries=2)
+        cache.put('old', {'text': '1'})
+        time.sleep(0.01)
+        cache.put('mid', {'text': '2'})
+        time.sleep(0.01)
+        cache.get('old')  # refresh access
+        cache.put('new', {'text': '3'})
+        cache.evict()
+        assert cache.get('mid') is None
+        assert cache.get('old') is not None and cache.get('new') is not None
+
+    def test_deterministic_only_bypasses_sampling(self, tmp_path):
+        cache = ResponseCache(tmp_path / 'cache.sqlite', mode='deterministic_only')
+        key, _ = cache.lookup('openai', 'gpt-4', request('Hola', temperature=0.8))
+        assert key is None
+        key, _ = cache.lookup('openai', 'gpt-4', request('Hola', temperature=0.0))
+        assert key is not None
+        assert cache.get_stats()['bypassed'] == 1
+
+
+class TestCachedCalls:
+    """Cache sits in front of the client and the annotator"""
+
+    @pytest.mark.asyncio
+    async def test_second_call_is_served_from_cache(self, tmp_path):
+        with MockLLMServer() as server:
+            config = {'provider': 'openai', 'model': 'gpt-4', 'temperature': 0.0,
+                      'api_base_url': server.base_url,
+                      'cache': {'path': str(tmp_path / 'cache.sqlite')}}
+            for _ in range(2):
+                async with AsyncLLMClient(config) as client:
+                    result = await client.complete({'custom_id': 'a', **request('Hola')})
+
+        assert server.stats['requests'] == 1
+        assert result['cached'] is True
+        assert result['custom_id'] == 'a'
+
+    def test_annotator_rerun_hits_cache(self, tmp_path):
+        messages = [{'message_id': f"m{i}", 'text': f"Hola {i}"} for i in range(4)]
+        with MockLLMServer(payload=ANNOTATION_PAYLOAD) as server:
+            config = {'provider': 'openai', 'model': 'gpt-4', 'temperature': 0.0,
+                      'api_base_url': server.base_url,
+                      'cache': {'path': str(tmp_path / 'cache.sqlite')}}
+            first = LLMAnnotator(config).annotate(messages, tmp_path / 'first.json')
+            second = LLMAnnotator(config).annotate(messages, tmp_path / 'second.json')
+
+        assert server.stats['requests'] == 4
+        assert first['statistics']['annotated'] == 4
+        assert second['client']['cache_hits'] == 4
+        annotations = json.loads((tmp_path / 'second.json').read_text(encoding='utf-8'))
+        assert {a['message_id'] for a in annotations} == {'m0', 'm1', 'm2', 'm3'}
+        assert annotations[0]['annotations']['primary_intent'] == 'GREETING'
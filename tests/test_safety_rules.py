@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Tests for the YAML-driven safety rule engine, streaming review and review queue
+of LLMAnnotationQualityChecker
+"""
+
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.validation.llm_quality_checker import (FORBIDDEN_PATTERNS, LLMAnnotationQualityChecker,
+                                                    StreamingReview, iter_annotations)
+from scripts.validation.review_queue import ReviewQueue
+from scripts.validation.safety_rules import SafetyRuleEngine
+
+INTENTS = ['NEGATIVE_FEEDBACK', 'COMPLIMENT', 'TRANSACTIONAL_INQUIRY', 'GREETING']
+TONES = ['FRIENDLY', 'FRUSTRATED', 'ENGAGED', 'SKEPTICAL']
+SAFETY = ['LEVEL_0_SAFE', 'LEVEL_3_INAPPROPRIATE']
+PIECES = ['hola', 'amor', 'onlyfans', '$20', 'te prometo', '😊', '😊😍', '?', '!', '.', '...',
+          'cariño', 'bebé', 'jaja', 'fanvue.com', '$', ' ']
+
+
+def reference_response(text):
+    """The hand-written checks the engine replaces."""
+    issues = []
+    if len(re.split(r'[.!?]+', text.strip())) > 3:
+        issues.append("Respuesta muy larga (>3 oraciones)")
+    emoji_count = len(re.findall(r'[😀-🙏🌀-🗿💀-🫶]', text))
+    if emoji_count > 2:
+        issues.append(f"Demasiados emojis ({emoji_count})")
+    for pattern, issue in [(r'\$\d+', "Menciona precio específico"),
+                           (r'fanvue|onlyfans', "Menciona plataforma explícitamente"),
+                           (r'prometo|garantizo', "Hace promesas"),
+                           (r'amor|cariño|bebé', "Demasiado íntimo para etapa inicial")]:
+        if re.search(pattern, text.lower()):
+            issues.append(issue)
+    if text.endswith('?') and text.count('?') > 1:
+        issues.append("Demasiadas preguntas")
+    return issues
+
+
+def random_annotations(n, seed=0):
+    rng = np.random.default_rng(seed)
+    items = []
+    for i in range(n):
+        text = ' '.join(PIECES[j] for j in rng.integers(len(PIECES), size=rng.integers(0, 9)))
+        items.append({'message_id': f"m{i}",
+                      'annotations': {'primary_intent': INTENTS[rng.integers(4)],
+                                      'message_tone': TONES[rng.integers(4)],
+                                      'safety_level': SAFETY[rng.integers(2)],
+                                      'confidence': float(rng.random())},
+                      'ideal_nadia_response': {'text': text}})
+    return items
+
+
+def annotation(message_id, intent='GREETING', tone='FRIENDLY', safety='LEVEL_0_SAFE', text='Hola'):
+    return {'message_id': message_id,
+            'annotations': {'primary_intent': intent, 'message_tone': tone,
+                            'safety_level': safety},
+            'ideal_nadia_response': {'text': text}}
+
+
+class TestSafetyRuleEngine:
+    """Compiled scanner and vectorized consistency rules"""
+
+    def test_matches_the_hand_written_checks(self):
+        checker = LLMAnnotationQualityChecker()
+        for item in random_annotations(3000):
+            assert checker.check_response_quality(item['ideal_nadia_response']) == \
+                reference_response(item['ideal_nadia_response']['text'])
+
+    def test_overlapping_mentions_are_all_reported(self):
+        engine = SafetyRuleEngine({'response': {
+            'length': {'code': 'LONG', 'max_sentences': 3, 'sentence_break': '[.!?]+',
+                       'message': 'largo'},
+            'emojis': {'code': 'EMOJI', 'max': 2, 'pattern': '[😀-🙏]', 'message': '{count}'},
+            'questions': {'code': 'Q', 'max': 1, 'message': 'q'},
+            'forbidden': [{'code': 'A', 'pattern': 'amor eterno', 'message': 'a'},
+                          {'code': 'B', 'pattern': 'amor', 'message': 'b'},
+                          {'code': 'C', 'pattern': 'eterno', 'message': 'c'}]}})
+        assert engine.check_batch([{'ideal_nadia_response': {'text': 'Amor eterno'}}]) == \
+            [['A', 'B', 'C']]
+
+    def test_check_batch_returns_codes(self):
+        checker = LLMAnnotationQualityChecker()
+        items = [
+            {'annotations': {'primary_intent': 'COMPLIMENT', 'message_tone': 'FRUSTRATED'},
+             'ideal_nadia_response': {'text': 'Ay amor 😊😊😊 ¿seguro? ¿sí?'}},
+            {'annotations': {'primary_intent': 'TRANSACTIONAL_INQUIRY', 'confidence': 0.5,
+                             'safety_level': 'LEVEL_3_INAPPROPRIATE', 'message_tone': 'ENGAGED'},
+             'ideal_nadia_response': {'text': 'Mira mi fanvue'}},
+            {'annotations': {'primary_intent': 'GREETING', 'message_tone': 'FRIENDLY'},
+             'ideal_nadia_response': {'text': 'Hola 😊'}},
+            {'annotations': {}},
+        ]
+        assert checker.check_batch(items) == [
+            ['COMPLIMENT_FRUSTRATED', 'TOO_MANY_EMOJIS', 'TOO_INTIMATE', 'TOO_MANY_QUESTIONS'],
+            ['INAPPROPRIATE_POSITIVE_TONE', 'LOW_CONFIDENCE_TRANSACTIONAL', 'PLATFORM_MENTION'],
+            [],
+            [],
+        ]
+        assert checker.check_annotation_consistency(items[0]['annotations']) == \
+            ["Inconsistencia: COMPLIMENT no debería ser FRUSTRATED"]
+        assert 'Demasiados emojis (3)' in checker.check_response_quality(
+            items[0]['ideal_nadia_response'])
+
+    def test_streaming_patterns_come_from_the_rules_file(self):
+        assert ('fanvue|onlyfans', 'Menciona plataforma explícitamente') in FORBIDDEN_PATTERNS
+        assert len(FORBIDDEN_PATTERNS) == 4
+
+    def test_batch_throughput(self):
+        checker = LLMAnnotationQualityChecker()
+        items = random_annotations(20000, seed=1)
+        start = time.perf_counter()
+        codes = checker.check_batch(items)
+        elapsed = time.perf_counter() - start
+        assert len(codes) == 20000
+        assert elapsed < 2.0
+
+
+class TestStreamingReview:
+    """One-pass JSONL review with a bounded top-K heap"""
+
+    def test_matches_the_full_report(self, tmp_path):
+        items = random_annotations(6000, seed=3)
+        path = tmp_path / 'annotations.jsonl'
+        with open(path, 'w', encoding='utf-8') as f:
+            for item in items:
+                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+
+        review = StreamingReview(output_dir=tmp_path / 'review', top_k=50, batch_size=700,
+                                 report_every=2000)
+        result = review.consume(iter_annotations(str(path)))
+
+        checker = LLMAnnotationQualityChecker()
+        candidates = checker.identify_review_candidates(items)
+        expected = checker.generate_review_report(items, str(tmp_path / 'full.md'))
+        assert result['total_messages'] == 6000
+        assert result['messages_needing_review'] == len(candidates)
+        assert review.top() == candidates[:50]
+        assert (tmp_path / 'review' / 'review_report.md').read_text(encoding='utf-8') == expected
+        assert review.reports_written == 4
+
+        exported = [json.loads(line) for line in
+                    open(tmp_path / 'review' / 'for_correction.jsonl', encoding='utf-8')]
+        assert sorted(r['message_id'] for r in exported) == \
+            sorted(c['message_id'] for c in candidates)
+        stats = json.loads((tmp_path / 'review' / 'quick_stats.json').read_text())
+        assert stats['distributions'] == checker.analyze_distribution(items)['distributions']
+
+    def test_reads_annotator_json_arrays(self, tmp_path):
+        items = random_annotations(300, seed=4)
+        path = tmp_path / 'annotations.json'
+        path.write_text(json.dumps(items, ensure_ascii=False), encoding='utf-8')
+        review = StreamingReview(top_k=5)
+        assert review.consume(iter_annotations(str(path)))['total_messages'] == 300
+        assert len(review.top()) == 5
+
+
+class TestReviewQueue:
+    """Incremental upserts, prioritized pops and corrections flowing back"""
+
+    def test_pop_order_matches_the_full_sort(self, tmp_path):
+        items = random_annotations(4000, seed=5)
+        queue = ReviewQueue(tmp_path / 'queue.sqlite')
+        # Two ingests: the queue merges batches without re-sorting everything
+        queue.add_annotations(items[:2500], batch_size=600)
+        queue.add_annotations(items[2500:], batch_size=600)
+
+        expected = LLMAnnotationQualityChecker().identify_review_candidates(items)
+        stats = queue.get_stats()
+        assert stats['pending'] == stats['total'] == len(expected)
+        assert sum(stats['pending_by_priority'].values()) == len(expected)
+
+        popped = queue.pop(30, reviewer='ana') + queue.pop(30)
+        assert [item['message_id'] for item in popped] == \
+            [c['message_id'] for c in expected[:60]]
+        assert popped[0]['priority'] == len(expected[0]['review_reasons'])
+        assert popped[0]['human_corrections']['primary_intent'] is None
+        assert queue.get_stats()['in_review'] == 60
+        queue.close()
+
+    def test_reannotation_and_corrections(self, tmp_path):
+        path = tmp_path / 'queue.sqlite'
+        queue = ReviewQueue(path)
+        queue.add_annotations([annotation('m1', intent='NEGATIVE_FEEDBACK'),
+                               annotation('m2', safety='LEVEL_2_BORDERLINE'),
+                               annotation('m3')])
+        assert queue.get_stats()['pending'] == 2
+
+        # m1 is re-annotated clean and leaves the queue; m2 gains a reason
+        result = queue.add_annotations([annotation('m1'),
+                                        annotation('m2', safety='LEVEL_2_BORDERLINE',
+                                                   text='Te prometo amor')])
+        assert result['removed'] == 1
+        [item] = queue.pop(5)
+        assert item['message_id'] == 'm2' and item['priority'] == 3
+
+        # Claimed items are not overwritten by later batches
+        assert queue.add_annotations([annotation('m2', intent='NEGATIVE_FEEDBACK',
+                                                 safety='LEVEL_2_BORDERLINE')])['skipped'] == 1
+        item['human_corrections'].update({'safety_level': 'LEVEL_1_FLIRT_SAFE',
+                                          'notes': 'coqueteo'})
+        assert queue.submit_records([item]) == {'submitted': 1, 'unknown': 0, 'empty': 0}
+        assert not queue.submit('missing', {'notes': 'x'})
+        queue.close()
+
+        reopened = ReviewQueue(path)
+        [done] = list(reopened.corrections())
+        assert done['message_id'] == 'm2'
+        assert done['human_corrections'] == {'safety_level': 'LEVEL_1_FLIRT_SAFE',
+                                             'notes': 'coqueteo'}
+        assert reopened.get_stats() == {'pending': 0, 'in_review': 0, 'done': 1, 'total': 1,
+                                        'pending_by_priority': {}}
+        reopened.close()
+
+    def test_streaming_review_feeds_the_queue(self, tmp_path):
+        queue = ReviewQueue(tmp_path / 'queue.sqlite')
+        review = StreamingReview(top_k=10, batch_size=100, queue=queue)
+        result = review.consume(random_annotations(500, seed=6))
+        assert queue.get_stats()['pending'] == result['messages_needing_review']
+        assert [i['message_id'] for i in queue.pop(10)] == \
+            [c['message_id'] for c in review.top()]
+        queue.close()
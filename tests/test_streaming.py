@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Tests for incremental JSON parsing of streamed LLM responses and early abort
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.annotation.llm_annotator import LLMAnnotator
+from scripts.llm.client import AsyncLLMClient
+from scripts.llm.mock_server import CANNED_CONVERSATION, MockLLMServer
+from scripts.llm.streaming import (IncrementalJSONParser, StreamAbort, annotation_parser,
+                                   conversation_parser)
+from scripts.synthetic_generator import SyntheticGenerator
+from tests.conftest import make_config
+
+# Long reasoning after the offending response: everything past the price is wasted output
+FORBIDDEN_ANNOTATION = {
+    'ideal_nadia_response': {'text': 'Mi contenido cuesta $20, escríbeme 😊'},
+    'annotations': {'primary_intent': 'PRICE_INQUIRY', 'message_tone': 'CURIOUS',
+                    'safety_level': 'LEVEL_1_FLIRT_SAFE',
+                    'reasoning': 'Pregunta directa por precio. ' * 40},
+}
+
+
+def feed_in_chunks(parser, text, size):
+    emitted = []
+    for start in range(0, len(text), size):
+        emitted.append(parser.feed(text[start:start + size]))
+    return emitted
+
+
+def streaming_config(base_url, **overrides):
+    return make_config(base_url, temperature=0.0, retry_attempts=1,
+                       streaming={'enabled': True}, **overrides)
+
+
+class TestIncrementalJSONParser:
+    """Structure validation and record emission on partial input"""
+
+    @pytest.mark.parametrize('size', [1, 5, 64])
+    def test_records_are_emitted_before_the_response_ends(self, size):
+        text = '```json\n' + json.dumps(CANNED_CONVERSATION, ensure_ascii=False) + '\n```'
+        parser = conversation_parser()
+        emitted = feed_in_chunks(parser, text, size)
+
+        assert parser.close() == CANNED_CONVERSATION['messages']
+        # The first message is available long before the last chunk arrives
+        first_emission = next(i for i, records in enumerate(emitted) if records)
+        assert first_emission < len(emitted) // 2
+
+    def test_escapes_split_across_chunks(self):
+        parser = IncrementalJSONParser()
+        feed_in_chunks(parser, json.dumps({'text': 'dijo "hola" \\ adiós\n', 'n': [1.5e3, None]}), 1)
+        assert parser.close() == [{'text': 'dijo "hola" \\ adiós\n', 'n': [1500.0, None]}]
+
+    @pytest.mark.parametrize('text', [
+        '{"messages": [}',
+        '{"a" 1}',
+        '{"a": tru }',
+        '{"a": 1,, "b": 2}',
+        'Lo siento, no puedo generar esa conversación. ' * 10,
+    ])
+    def test_invalid_structure_aborts(self, text):
+        with pytest.raises(StreamAbort):
+            feed_in_chunks(IncrementalJSONParser(), text, 4)
+
+    def test_truncated_response_aborts_on_close(self):
+        parser = conversation_parser()
+        parser.feed('{"messages": [{"author": "user", "text": "Hola"}')
+        assert len(parser.records) == 1
+        with pytest.raises(StreamAbort, match='truncada'):
+            parser.close()
+
+    def test_forbidden_nadia_message_aborts(self):
+        parser = conversation_parser()
+        text = json.dumps({'messages': [
+            {'author': 'user', 'text': '¿Tienes onlyfans?'},
+            {'author': 'nadia', 'text': 'Sí, búscame en OnlyFans'},
+            {'author': 'user', 'text': 'ok'},
+        ]})
+        with pytest.raises(StreamAbort) as excinfo:
+            feed_in_chunks(parser, text, 8)
+        assert excinfo.value.reason == 'Menciona plataforma explícitamente'
+        assert len(parser.records) == 1
+
+    def test_guarded_field_aborts_as_soon_as_string_closes(self):
+        text = json.dumps(FORBIDDEN_ANNOTATION, ensure_ascii=False)
+        with pytest.raises(StreamAbort) as excinfo:
+            feed_in_chunks(annotation_parser(), text, 8)
+        assert excinfo.value.reason == 'Menciona precio específico'
+        assert excinfo.value.position < len(text) // 4
+
+
+class TestStreamingClient:
+    """Client streams SSE into the parser and cancels on abort"""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('provider', ['openai', 'anthropic'])
+    async def test_stream_feeds_parser_and_reports_usage(self, provider):
+        with MockLLMServer() as server:
+            async with AsyncLLMClient(streaming_config(server.base_url, provider=provider)) as client:
+                parser = conversation_parser()
+                result = await client.stream({'custom_id': 'c1', 'messages': [
+                    {'role': 'user', 'content': 'Genera una conversación'}]}, parser)
+
+        assert server.stats['streamed'] == 1
+        assert parser.records == CANNED_CONVERSATION['messages']
+        assert result['usage']['output_tokens'] > 0
+        assert not result.get('aborted')
+
+    @pytest.mark.asyncio
+    async def test_abort_cancels_the_request(self):
+        with MockLLMServer(payload=FORBIDDEN_ANNOTATION, stream_chunk_chars=8,
+                           stream_chunk_delay=0.005) as server:
+            async with AsyncLLMClient(streaming_config(server.base_url)) as client:
+                result = await client.stream({'custom_id': 'm1', 'messages': [
+                    {'role': 'user', 'content': 'Anota'}]}, annotation_parser())
+                stats = client.get_stats()
+
+        full_length = len(json.dumps(FORBIDDEN_ANNOTATION, ensure_ascii=False))
+        assert result['aborted'] == 'Menciona precio específico'
+        assert stats['aborted'] == 1 and stats['succeeded'] == 0
+        assert server.stats['stream_chars_sent'] < full_length / 2
+
+    def test_generator_streaming_matches_buffered_output(self, tmp_path):
+        prompts = [{'prompt_id': 'greeting', 'user': 'Genera un saludo'}]
+        with MockLLMServer() as server:
+            config = streaming_config(server.base_url, n_conversations_to_generate=6)
+            result = SyntheticGenerator(config, output_dir=str(tmp_path)).generate(prompts)
+
+        records = [json.loads(line) for line in
+                   Path(result['output_file']).read_text(encoding='utf-8').splitlines()]
+        assert result['statistics']['generated'] == 6
+        assert result['client']['streamed'] == 6
+        assert [m['text'] for m in records[0]['messages']] == \
+            [m['text'] for m in CANNED_CONVERSATION['messages']]
+
+    def test_annotator_skips_aborted_streams(self, tmp_path):
+        messages = [{'message_id': f"m{i}", 'text': '¿Cuánto cuesta?'} for i in range(3)]
+        with MockLLMServer(payload=FORBIDDEN_ANNOTATION) as server:
+            annotator = LLMAnnotator(streaming_config(server.base_url))
+            result = annotator.annotate(messages, tmp_path / 'annotations.json')
+
+        assert result['statistics']['aborted'] == 3
+        assert result['statistics']['annotated'] == 0
+        assert json.loads((tmp_path / 'annotations.json').read_text(encoding='utf-8')) == []
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Tests for token accounting and per-run budget ceilings
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.llm.batch import LocalBatchProvider
+from scripts.llm.budget import BudgetExceeded, TokenBudget, TokenCounter
+from scripts.llm.client import AsyncLLMClient
+from scripts.llm.mock_server import MockLLMServer
+from scripts.synthetic_generator import SyntheticGenerator
+from tests.conftest import make_config
+
+PROMPTS = [{'prompt_id': 'greeting', 'user': 'Genera un saludo'}]
+
+
+class TestTokenBudget:
+    """Reservations, settlement and cost"""
+
+    def test_cost_uses_longest_matching_price(self):
+        budget = TokenBudget(pricing={'my-model': {'input': 1.0, 'output': 2.0}})
+        assert budget.cost('gpt-4o-mini-2024-07-18', 1_000_000, 0) == pytest.approx(0.15)
+        assert budget.cost('gpt-4-0613', 1000, 1000) == pytest.approx(0.09)
+        assert budget.cost('my-model', 1_000_000, 1_000_000, batch=True) == pytest.approx(1.5)
+        assert budget.cost('unknown', 1000, 1000) == 0.0
+
+    def test_settle_records_reported_usage_per_stage_and_model(self):
+        budget = TokenBudget()
+        reservation = budget.reserve('annotation', 'gpt-4', 100, 500)
+        assert budget.reserved_tokens == 600
+        budget.settle(reservation, {'input_tokens': 120, 'output_tokens': 80})
+
+        report = budget.get_report()
+        assert budget.reserved_tokens == 0 and budget.in_flight == 0
+        assert report['total_tokens'] == 200
+        assert report['by_stage']['annotation']['gpt-4']['estimated_input_tokens'] == 100
+        assert report['cost_usd'] == pytest.approx(120 * 30e-6 + 80 * 60e-6)
+
+    def test_pauses_while_in_flight_then_stops(self):
+        budget = TokenBudget(max_run_tokens=1000)
+        first = budget.reserve('gen', 'gpt-4', 100, 500)
+        # The worst case of a second request does not fit next to the first one
+        assert budget.reserve('gen', 'gpt-4', 100, 500) is None
+        budget.settle(first, {'input_tokens': 100, 'output_tokens': 100})
+        second = budget.reserve('gen', 'gpt-4', 100, 500)
+        budget.settle(second, {'input_tokens': 100, 'output_tokens': 200})
+
+        with pytest.raises(BudgetExceeded):
+            budget.reserve('gen', 'gpt-4', 100, 500)
+        assert budget.stopped
+        with pytest.raises(BudgetExceeded):
+            budget.reserve('gen', 'gpt-4', 1, 1)
+
+    def test_cost_ceiling(self):
+        budget = TokenBudget(max_run_cost_usd=0.01)
+        with pytest.raises(BudgetExceeded, match='presupuesto agotado'):
+            budget.reserve('gen', 'gpt-4', 100, 800)
+
+    def test_local_counter_counts_every_message(self):
+        counter = TokenCounter('gpt-4')
+        single = counter.count_request({'messages': [{'role': 'user', 'content': 'Hola ' * 40}]})
+        double = counter.count_request({'system': 'Hola ' * 40,
+                                        'messages': [{'role': 'user', 'content': 'Hola ' * 40}]})
+        assert single > 20 and double > single
+
+
+class TestBudgetedRuns:
+    """Client and generator stop issuing requests once the budget is spent"""
+
+    @pytest.mark.asyncio
+    async def test_client_clamps_max_tokens(self):
+        with MockLLMServer() as server:
+            async with AsyncLLMClient(make_config(server.base_url),
+                                      budget=TokenBudget()) as client:
+                prepared = client._prepare({'messages': [], 'max_tokens': 5000})
+                result = await client.complete({'custom_id': 'c1', 'max_tokens': 5000, 'messages': [
+                    {'role': 'user', 'content': 'Genera una conversación'}]})
+
+        assert prepared['max_tokens'] == 200
+        assert client.budget.get_report()['by_stage']['llm']['gpt-4']['output_tokens'] == \
+            result['usage']['output_tokens']
+
+    def test_generator_stops_at_the_token_ceiling(self, tmp_path):
+        budget = TokenBudget(max_run_tokens=600)
+        with MockLLMServer() as server:
+            generator = SyntheticGenerator(make_config(server.base_url, n_conversations_to_generate=20),
+                                           output_dir=str(tmp_path), budget=budget)
+            result = generator.generate(PROMPTS)
+
+        report = result['budget']
+        assert report['stopped'] is True
+        assert report['total_tokens'] <= 600
+        assert 0 < result['statistics']['generated'] < 20
+        assert result['statistics']['budget_rejected'] >= 1
+        # Every request that went out was settled against the budget
+        assert report['requests'] == result['statistics']['generated']
+        assert report['by_stage']['synthetic_generation']['gpt-4']['cost_usd'] > 0
+
+    def test_batch_mode_flushes_then_stops(self, tmp_path):
+        config = make_config(mode='batch', n_conversations_to_generate=20,
+                             batch={'poll_interval_seconds': 0.01,
+                                    'work_dir': str(tmp_path / 'batches')})
+        budget = TokenBudget(max_run_tokens=1000)
+        generator = SyntheticGenerator(config, output_dir=str(tmp_path), budget=budget)
+        result = generator.generate_batch(PROMPTS,
+                                          batch_provider=LocalBatchProvider(tmp_path / 'batches'))
+
+        totals = budget.get_report()
+        assert budget.stopped
+        assert result['client']['jobs'] >= 2
+        assert totals['total_tokens'] <= 1000
+        # Batch results are priced at the batch discount
+        assert totals['cost_usd'] == pytest.approx(
+            budget.cost('gpt-4', totals['input_tokens'], totals['output_tokens'], batch=True))